@@ -33,7 +33,8 @@ from buildtool.util import (
     log_embedded_output,
 
     ensure_dir_exists,
-    write_to_path)
+    write_to_path,
+    FileLock)
 
 from buildtool.errors import (
     BuildtoolError,
@@ -59,7 +60,9 @@ from buildtool.subprocess_support import (
     start_subprocess,
     wait_subprocess,
     run_subprocess,
+    run_subprocesses,
     check_subprocess,
+    check_subprocesses,
     check_subprocess_sequence,
     run_subprocess_sequence,
     check_subprocesses_to_logfile,
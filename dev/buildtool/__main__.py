@@ -30,9 +30,14 @@ import logging
 import os
 import sys
 import time
-import yaml
 
 from buildtool.metrics import MetricsManager
+from buildtool.resource_support import ResourceLimits
+from buildtool.serialization_support import (
+    DocumentCache,
+    dump_yaml,
+    load_yaml)
+from buildtool.subprocess_support import QueryCache
 from buildtool import (
     add_parser_argument,
     maybe_log_exception,
@@ -49,6 +54,23 @@ STANDARD_LOG_LEVELS = {
 # This is so tests can disable it
 CHECK_HOME_FOR_CONFIG = True
 
+# The modules providing commands, without their "_commands" suffix.
+COMMAND_MODULE_NAMES = [
+    'apidocs',
+    'bom',
+    'changelog',
+    'container',
+    'debian',
+    'flow',
+    'halyard',
+    'image',
+    'rpm',
+    'source',
+    'spinnaker',
+    'inspection',
+    'spin',
+]
+
 
 def add_standard_parser_args(parser, defaults):
   """Init argparser with command-independent options.
@@ -96,7 +118,7 @@ def __load_defaults_from_path(path, visited=None):
   visited.append(path)
 
   with open(path, 'r') as f:
-    defaults = yaml.safe_load(f)
+    defaults = load_yaml(f)
 
     # Allow these files to be recursive
     # So that there can be some overall default file
@@ -145,6 +167,18 @@ def preprocess_args(args, default_home_path_filename='buildtool.yml'):
   return args, defaults
 
 
+def load_command_modules(names=None):
+  """Returns the command modules to pass to make_registry.
+
+  Args:
+    names: [list of string] The module names without their "_commands" suffix.
+       The default is COMMAND_MODULE_NAMES.
+  """
+  from importlib import import_module
+  return [import_module(name + '_commands')
+          for name in names or COMMAND_MODULE_NAMES]
+
+
 def make_registry(command_modules, parser, defaults):
   """Creates a command registry, adding command arguments to the parser.
 
@@ -212,6 +246,9 @@ def init_options_and_registry(args, command_modules):
   parser = argparse.ArgumentParser(prog='buildtool.sh')
   add_standard_parser_args(parser, defaults)
   MetricsManager.init_argument_parser(parser, defaults)
+  ResourceLimits.init_argument_parser(parser, defaults)
+  QueryCache.init_argument_parser(parser, defaults)
+  DocumentCache.init_argument_parser(parser, defaults)
 
   registry = make_registry(command_modules, parser, defaults)
   options = parser.parse_args(args)
@@ -229,22 +266,7 @@ def main():
 
   start_time = time.time()
 
-  from importlib import import_module
-  command_modules = [
-      import_module(name + '_commands') for name in [
-          'apidocs',
-          'bom',
-          'changelog',
-          'container',
-          'debian',
-          'halyard',
-          'image',
-          'rpm',
-          'source',
-          'spinnaker',
-          'inspection',
-          'spin',
-      ]]
+  command_modules = load_command_modules()
 
   GitRunner.stash_and_clear_auth_env_vars()
   options, command_registry = init_options_and_registry(
@@ -258,7 +280,7 @@ def main():
 
   logging.debug(
       'Running with options:\n   %s',
-      '\n   '.join(yaml.safe_dump(vars(options), default_flow_style=False)
+      '\n   '.join(dump_yaml(vars(options), default_flow_style=False)
                    .split('\n')))
 
   factory = command_registry.get(options.command)
@@ -267,6 +289,9 @@ def main():
     return -1
 
   MetricsManager.startup_metrics(options)
+  ResourceLimits.configure(options)
+  QueryCache.configure(options)
+  DocumentCache.configure(options)
   labels = {'command': options.command}
   success = False
   try:
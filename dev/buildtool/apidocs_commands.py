@@ -241,7 +241,9 @@ class BuildApiDocsFactory(RepositoryCommandFactory):
     super(BuildApiDocsFactory, self).__init__(
         BUILD_DOCS_COMMAND, BuildApiDocsCommand,
         'Build the Spinnaker API REST documentation.',
-        BomSourceCodeManager)
+        BomSourceCodeManager,
+        # The docs describe the whole release, not just rebuilt services.
+        use_rebuild_plan=False)
 
   def init_argparser(self, parser, defaults):
     """Implements CommandFactory interface."""
@@ -0,0 +1,205 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Answers whether build artifacts already exist from bulk listings.
+
+Commands that skip existing artifacts used to query for each repository
+from within the worker threads. Instead the command lists everything it
+might need when it starts and answers the individual questions from memory.
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+
+try:
+  from urllib2 import urlopen, Request, HTTPError
+except ImportError:
+  from urllib.request import urlopen, Request
+  from urllib.error import HTTPError
+
+from buildtool import check_subprocess
+from buildtool.resource_support import (
+    BINTRAY_HTTP,
+    limit_resource)
+
+
+# The kinds of artifacts indexed.
+GCR_CONTAINER = 'gcr-container'
+GCE_IMAGE = 'gce-image'
+DEBIAN = 'debian'
+
+
+class ArtifactExistenceIndex(object):
+  """Indexes the versions of artifacts that exist.
+
+  Each kind of artifact has a loader returning a dictionary of the
+  artifact names to the versions that exist. Kinds whose loader failed
+  are not indexed so callers should fall back to checking directly.
+  """
+
+  def __init__(self):
+    self.__lock = threading.Lock()
+    self.__loaders = {}
+    self.__index = {}
+
+  def add_loader(self, kind, loader):
+    """Register the function that lists the artifacts of the given kind.
+
+    Args:
+      kind: [string] The kind of artifact.
+      loader: [callable] Returns a dictionary of artifact name to the
+         list of versions of it that exist. Unversioned artifacts have
+         an empty list.
+    """
+    self.__loaders[kind] = loader
+
+  def refresh(self, kind=None):
+    """Reload the index to pick up newly published artifacts.
+
+    Args:
+      kind: [string] The kind to reload or None for all of them.
+    """
+    kinds = [kind] if kind else sorted(self.__loaders.keys())
+    for name in kinds:
+      try:
+        listing = self.__loaders[name]()
+      except Exception as ex:
+        logging.warning('Could not index %s artifacts: %s', name, ex)
+        with self.__lock:
+          self.__index.pop(name, None)
+        continue
+
+      entries = {key: set(versions) for key, versions in listing.items()}
+      logging.debug('Indexed %d %s artifacts', len(entries), name)
+      with self.__lock:
+        self.__index[name] = entries
+
+  def is_indexed(self, kind):
+    """Determine if the kind of artifact was indexed."""
+    with self.__lock:
+      return kind in self.__index
+
+  def has_artifact(self, kind, name, version=None):
+    """Determine if the artifact exists.
+
+    Args:
+      kind: [string] The kind of artifact.
+      name: [string] The name of the artifact.
+      version: [string] The version of the artifact, or None for any.
+
+    Returns:
+      True or False, or None if the kind of artifact is not indexed.
+    """
+    with self.__lock:
+      entries = self.__index.get(kind)
+      if entries is None:
+        return None
+      versions = entries.get(name)
+      if versions is None:
+        return False
+      return version is None or version in versions
+
+  def record_artifact(self, kind, name, version=None):
+    """Record an artifact that was just published."""
+    with self.__lock:
+      entries = self.__index.get(kind)
+      if entries is None:
+        return
+      versions = entries.setdefault(name, set())
+      if version is not None:
+        versions.add(version)
+
+
+def list_container_image_tags(registry, account=None):
+  """Returns a dictionary of the images in a registry to their tags.
+
+  Args:
+    registry: [string] The artifact registry containing the images.
+    account: [string] The account to list with if not the default.
+  """
+  command = ['gcloud', 'artifacts', 'docker', 'images', 'list', registry,
+             '--include-tags', '--format=json']
+  if account:
+    command.extend(['--account', account])
+  response = check_subprocess(' '.join(command), stderr=open(os.devnull, 'w'))
+
+  result = {}
+  for entry in json.JSONDecoder().decode(response or '[]'):
+    image = entry['package'][entry['package'].rfind('/') + 1:]
+    tags = entry.get('tags') or []
+    if not isinstance(tags, list):
+      # Older gcloud releases return a comma-separated string.
+      tags = [tag.strip() for tag in tags.split(',') if tag.strip()]
+    result.setdefault(image, []).extend(tags)
+  return result
+
+
+def list_gce_images(project, account=None, prefix='spinnaker-'):
+  """Returns a dictionary keyed by the names of the images in the project.
+
+  Args:
+    project: [string] The project owning the images.
+    account: [string] The account to list with if not the default.
+    prefix: [string] Only list images whose name has this prefix.
+  """
+  command = ['gcloud', 'compute', 'images', 'list', '--project', project,
+             '--filter', 'name~^' + prefix, '--quiet', '--format=json']
+  if account:
+    command.extend(['--account', account])
+  response = check_subprocess(' '.join(command), stderr=open(os.devnull, 'w'))
+  return {entry['name']: []
+          for entry in json.JSONDecoder().decode(response or '[]')}
+
+
+def list_bintray_package_versions(subject_repo, package_names, pool=None,
+                                  user=None, password=None):
+  """Returns a dictionary of the bintray packages to their versions.
+
+  Packages that do not exist are listed without any versions.
+
+  Args:
+    subject_repo: [string] The bintray "<subject>/<repository>".
+    package_names: [list of string] The packages to list.
+    pool: [ThreadPool] If provided, query the packages in parallel.
+    user: [string] The bintray user to authenticate with, if any.
+    password: [string] The bintray key for the user.
+  """
+  basic_auth = None
+  if user and password:
+    encoded_auth = base64.b64encode(
+        '{user}:{password}'.format(user=user, password=password)
+        .encode('utf-8'))
+    basic_auth = 'Basic ' + encoded_auth.decode('utf-8')
+
+  def query_versions(package_name):
+    url = 'https://api.bintray.com/packages/{path}/{package}'.format(
+        path=subject_repo, package=package_name)
+    request = Request(url)
+    if basic_auth:
+      request.add_header('Authorization', basic_auth)
+    try:
+      with limit_resource(BINTRAY_HTTP):
+        content = json.JSONDecoder().decode(
+            urlopen(request).read().decode('utf-8'))
+    except HTTPError as ex:
+      if ex.code == 404:
+        return package_name, []
+      raise
+    return package_name, content.get('versions') or []
+
+  mapper = pool.map if pool else map
+  return dict(mapper(query_versions, package_names))
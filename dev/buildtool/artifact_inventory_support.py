@@ -0,0 +1,287 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A SQLite inventory of the BOMs and the artifacts that exist.
+
+collect_bom_versions and collect_artifact_versions write what they find
+here, then audit_artifact_versions reads it back. This replaces handing
+off large nested yaml files, which were slow to write and even slower to
+load again.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+from buildtool import (
+    add_parser_argument,
+    ensure_dir_exists,
+    raise_and_log_error,
+    ConfigError)
+
+
+JAR = 'jar'
+DEBIAN = 'debian'
+CONTAINER = 'container'
+GCE_IMAGE = 'image'
+CONFIG = 'config'
+ARTIFACT_KINDS = [JAR, DEBIAN, CONTAINER, GCE_IMAGE, CONFIG]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS boms (
+    name TEXT PRIMARY KEY,
+    timestamp TEXT,
+    released INTEGER NOT NULL,
+    docker_registry TEXT,
+    debian_repository TEXT);
+
+CREATE TABLE IF NOT EXISTS bom_services (
+    bom TEXT NOT NULL REFERENCES boms(name),
+    service TEXT NOT NULL,
+    version TEXT NOT NULL,
+    commit_id TEXT NOT NULL,
+    buildnum TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS bom_services_build
+    ON bom_services(service, version, buildnum);
+
+CREATE TABLE IF NOT EXISTS collections (
+    kind TEXT PRIMARY KEY,
+    source TEXT,
+    collected_at TEXT);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    PRIMARY KEY (kind, name, version));
+"""
+
+
+class ArtifactInventory(object):
+  """The BOMs and artifacts found by the collect commands.
+
+  The inventory can be shared by threads, such as the concurrent
+  collectors in collect_artifact_versions.
+  """
+
+  DEFAULT_FILENAME = 'artifact_inventory.db'
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add parser arguments used to locate the ArtifactInventory."""
+    if hasattr(parser, 'added_artifact_inventory'):
+      return
+    parser.added_artifact_inventory = True
+    add_parser_argument(
+        parser, 'artifact_inventory_path', defaults, None,
+        help='The SQLite database shared by the collect and audit commands.'
+             ' The default is {filename} in the --output_dir.'.format(
+                 filename=ArtifactInventory.DEFAULT_FILENAME))
+    add_parser_argument(
+        parser, 'export_inventory_yaml', defaults, False, type=bool,
+        help='Also write what was collected into the inventory as yaml'
+             ' files in the command output directory for people to read.')
+
+  @staticmethod
+  def path_from_options(options):
+    """Returns the path to the inventory the options specify."""
+    return (options.artifact_inventory_path
+            or os.path.join(options.output_dir,
+                            ArtifactInventory.DEFAULT_FILENAME))
+
+  @property
+  def path(self):
+    return self.__path
+
+  def __init__(self, path):
+    """Constructor.
+
+    Args:
+      path: [path] The SQLite database file, which is created if needed.
+    """
+    self.__path = path
+    ensure_dir_exists(os.path.dirname(os.path.abspath(path)))
+    self.__lock = threading.RLock()
+    self.__db = sqlite3.connect(path, check_same_thread=False)
+    self.__db.executescript(_SCHEMA)
+    columns = [row[1] for row in
+               self.__db.execute('PRAGMA table_info(collections)')]
+    if 'collected_at' not in columns:
+      # Inventories written before collection times were recorded.
+      self.__db.execute('ALTER TABLE collections ADD COLUMN collected_at TEXT')
+
+  def close(self):
+    with self.__lock:
+      self.__db.close()
+
+  def __query(self, sql, params=()):
+    with self.__lock:
+      return self.__db.execute(sql, params).fetchall()
+
+  def replace_boms(self, service_map, is_released):
+    """Replace the BOMs in the inventory.
+
+    Args:
+      service_map: [dict] The service map collect_bom_versions builds. This
+         is keyed by service, then version, commit and build number whose
+         value is the list of info dicts about the BOMs using that build.
+      is_released: [callable] Given a BOM name, determine if it is released.
+    """
+    boms = {}
+    rows = []
+    for service, versions in service_map.items():
+      for version, commits in (versions or {}).items():
+        for commit, buildnums in commits.items():
+          for buildnum, info_list in buildnums.items():
+            for info in info_list:
+              name = info['bom_version']
+              boms[name] = (name, str(info.get('bom_timestamp')),
+                            1 if is_released(name) else 0,
+                            info.get('dockerRegistry'),
+                            info.get('debianRepository'))
+              rows.append((name, service, version, commit, str(buildnum)))
+
+    with self.__lock, self.__db:
+      self.__db.execute('DELETE FROM bom_services')
+      self.__db.execute('DELETE FROM boms')
+      self.__db.executemany('INSERT INTO boms VALUES (?, ?, ?, ?, ?)',
+                            boms.values())
+      self.__db.executemany('INSERT INTO bom_services VALUES (?, ?, ?, ?, ?)',
+                            rows)
+    logging.info('Recorded %d services in %d boms into %s',
+                 len(rows), len(boms), self.__path)
+
+  def bom_names(self):
+    """Returns the names of all the BOMs in the inventory."""
+    return [row[0] for row in
+            self.__query('SELECT name FROM boms ORDER BY name')]
+
+  def service_map(self, released):
+    """Returns the released or unreleased partition of the BOM service map.
+
+    A build is released if any released BOM uses it. The released partition
+    only lists the released BOMs using each build. The unreleased partition
+    only has the builds that no released BOM uses.
+    """
+    query = """
+        SELECT s.service, s.version, s.commit_id, s.buildnum, b.name,
+               b.timestamp, b.docker_registry, b.debian_repository
+        FROM bom_services s JOIN boms b ON s.bom = b.name
+        WHERE b.released = :released
+          AND (:released OR NOT EXISTS (
+              SELECT 1 FROM bom_services rs JOIN boms rb ON rs.bom = rb.name
+              WHERE rb.released AND rs.service = s.service
+                AND rs.version = s.version AND rs.commit_id = s.commit_id
+                AND rs.buildnum = s.buildnum))
+        ORDER BY b.timestamp, b.name"""
+
+    result = {}
+    for (service, version, commit, buildnum, name, timestamp,
+         docker_registry, debian_repository) in self.__query(
+             query, {'released': 1 if released else 0}):
+      info = {'bom_version': name, 'bom_timestamp': timestamp}
+      if docker_registry is not None:
+        info['dockerRegistry'] = docker_registry
+      if debian_repository is not None:
+        info['debianRepository'] = debian_repository
+      (result.setdefault(service, {}).setdefault(version, {})
+       .setdefault(commit, {}).setdefault(buildnum, []).append(info))
+    return result
+
+  def replace_artifacts(self, kind, source, version_map, collected_at=None):
+    """Replace the artifacts of a given kind in the inventory.
+
+    Args:
+      kind: [string] One of the ARTIFACT_KINDS.
+      source: [string] Where the artifacts were collected from.
+      version_map: [dict] The list of versions keyed by artifact name.
+      collected_at: [string] The UTC time the collection started as
+         YYYY-MM-DDTHH:MM:SSZ, if known.
+    """
+    rows = [(kind, name, version)
+            for name, versions in version_map.items()
+            for version in versions or []]
+    with self.__lock, self.__db:
+      self.__db.execute('DELETE FROM artifacts WHERE kind = ?', (kind,))
+      self.__db.execute(
+          'INSERT OR REPLACE INTO collections VALUES (?, ?, ?)',
+          (kind, source, collected_at))
+      self.__db.executemany('INSERT OR IGNORE INTO artifacts VALUES (?, ?, ?)',
+                            rows)
+    logging.info('Recorded %d %s versions from %s into %s',
+                 len(rows), kind, source, self.__path)
+
+  def artifact_versions(self, kind):
+    """Returns the list of versions of each artifact of the given kind.
+
+    Raises:
+      ConfigError if no artifacts of this kind were collected.
+    """
+    if not self.__query('SELECT source FROM collections WHERE kind = ?',
+                        (kind,)):
+      raise_and_log_error(ConfigError(
+          'No {kind} versions were collected into "{path}"'.format(
+              kind=kind, path=self.__path)))
+
+    result = {}
+    for name, version in self.__query(
+        'SELECT name, version FROM artifacts WHERE kind = ?'
+        ' ORDER BY name, version', (kind,)):
+      result.setdefault(name, []).append(version)
+    return result
+
+  def missing_versions(self, kind, name, other_kind, other_name):
+    """Returns the versions of an artifact that another artifact lacks."""
+    return [row[0] for row in self.__query(
+        'SELECT version FROM artifacts WHERE kind = ? AND name = ?'
+        ' EXCEPT SELECT version FROM artifacts WHERE kind = ? AND name = ?'
+        ' ORDER BY 1', (kind, name, other_kind, other_name))]
+
+  def last_collected(self, kind, source):
+    """Returns when the artifacts of a kind were last collected, or None.
+
+    This is None if they were collected from a different source or the
+    time was not recorded.
+    """
+    rows = self.__query(
+        'SELECT collected_at FROM collections WHERE kind = ? AND source = ?',
+        (kind, source))
+    return rows[0][0] if rows else None
+
+  def diff_artifacts(self, kind, version_map):
+    """Returns how the versions differ from those in the inventory.
+
+    Returns:
+      A dict with the 'added' and 'removed' versions keyed by artifact name,
+      or None if no artifacts of this kind were collected before.
+    """
+    if not self.__query('SELECT 1 FROM collections WHERE kind = ?', (kind,)):
+      return None
+    previous = {}
+    for name, version in self.__query(
+        'SELECT name, version FROM artifacts WHERE kind = ?', (kind,)):
+      previous.setdefault(name, set()).add(version)
+
+    added = {}
+    removed = {}
+    for name in set(previous.keys()) | set(version_map.keys()):
+      current = set(version_map.get(name) or [])
+      before = previous.get(name, set())
+      if current - before:
+        added[name] = sorted(current - before)
+      if before - current:
+        removed[name] = sorted(before - current)
+    return {'added': added, 'removed': removed}
@@ -0,0 +1,90 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Indexes for auditing artifacts against the BOMs referencing them.
+
+The audit checks every version of every artifact against the BOMs and
+every BOM against the artifacts. These are built once up front so each
+check is a hash or binary search lookup rather than a scan of the lists
+loaded from the collected yaml files.
+"""
+
+import bisect
+
+
+class VersionIndex(object):
+  """Indexes the versions of each artifact for constant time lookups."""
+
+  EMPTY = frozenset()
+
+  def __init__(self, artifact_versions):
+    """Constructor.
+
+    Args:
+      artifact_versions: [dict] The list of versions keyed by artifact name
+         as collected by collect_artifact_versions.
+    """
+    self.__versions = {
+        name: frozenset(versions or [])
+        for name, versions in (artifact_versions or {}).items()}
+
+  def __contains__(self, name):
+    return name in self.__versions
+
+  def get(self, name, default_name=None):
+    """Returns the set of versions of the named artifact.
+
+    Args:
+      name: [string] The name of the artifact.
+      default_name: [string] The artifact to use if there is no name.
+    """
+    versions = self.__versions.get(name)
+    if versions is None and default_name is not None:
+      versions = self.__versions.get(default_name)
+    return versions if versions is not None else self.EMPTY
+
+  def has_version(self, name, version):
+    """Determine if the named artifact has the version."""
+    return version in self.get(name)
+
+
+class BuildnumPrefixIndex(object):
+  """Indexes the build numbers of each service version in a bom service map.
+
+  The build numbers are sorted so finding whether any has a given prefix
+  is a binary search.
+  """
+
+  def __init__(self, service_map):
+    """Constructor.
+
+    Args:
+      service_map: [dict] The service map written by collect_bom_versions,
+         which is keyed by service, then version, commit and build number.
+    """
+    self.__buildnums = {}
+    for service, versions in (service_map or {}).items():
+      for version, commits in (versions or {}).items():
+        buildnums = set()
+        for buildnum_map in commits.values():
+          buildnums.update(str(buildnum) for buildnum in buildnum_map.keys())
+        self.__buildnums[(service, str(version))] = sorted(buildnums)
+
+  def has_prefix(self, service, version, prefix):
+    """Determine if the service version has a build number with the prefix."""
+    buildnums = self.__buildnums.get((service, version))
+    if not buildnums:
+      return False
+    index = bisect.bisect_left(buildnums, prefix)
+    return index < len(buildnums) and buildnums[index].startswith(prefix)
@@ -12,12 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Implements build_bom command for buildtool."""
+"""Implements build_bom and plan_bom_delta commands for buildtool."""
 
 import datetime
 import logging
 import os
-import yaml
 
 import buildtool.container_commands
 import buildtool.debian_commands
@@ -28,6 +27,8 @@ from buildtool import (
     SPINNAKER_BOM_REPOSITORY_NAMES,
 
     BranchSourceCodeManager,
+    CommandFactory,
+    CommandProcessor,
     RepositoryCommandFactory,
     RepositoryCommandProcessor,
 
@@ -38,6 +39,16 @@ from buildtool import (
     raise_and_log_error,
     write_to_path,
     ConfigError)
+from buildtool.bom_delta_support import (
+    REBUILD_PLAN_FILENAME,
+    plan_bom_delta)
+from buildtool.bom_store_support import (
+    BomStore,
+    retrieve_bom_version)
+from buildtool.serialization_support import (
+    DocumentCache,
+    dump_yaml,
+    load_yaml)
 
 
 def _determine_bom_path(command_processor):
@@ -136,7 +147,7 @@ class BomBuilder(object):
       logging.debug('Loading bom dependencies from %s',
                     self.__bom_dependencies_path)
       with open(self.__bom_dependencies_path, 'r') as stream:
-        dependencies = yaml.safe_load(stream.read())
+        dependencies = load_yaml(stream.read())
         logging.debug('Loaded %s', dependencies)
     else:
       dependencies = None
@@ -239,12 +250,12 @@ class BuildBomCommand(RepositoryCommandProcessor):
       check_path_exists(options.refresh_from_bom_path,
                         "refresh_from_bom_path")
       with open(options.refresh_from_bom_path, 'r') as stream:
-        base_bom = yaml.safe_load(stream.read())
+        base_bom = load_yaml(stream.read())
     elif options.refresh_from_bom_version:
       logging.debug('Using base bom version "%s"',
                     options.refresh_from_bom_version)
-      base_bom = HalRunner(options).retrieve_bom_version(
-          options.refresh_from_bom_version)
+      base_bom = retrieve_bom_version(
+          options, options.refresh_from_bom_version)
     else:
       base_bom = None
     if base_bom:
@@ -253,23 +264,43 @@ class BuildBomCommand(RepositoryCommandProcessor):
     self.__builder = BomBuilder(self.options, self.scm, self.metrics, base_bom=base_bom)
 
   def _do_repository(self, repository):
-    source_info = self.scm.refresh_source_info(
+    return repository, self.scm.refresh_source_info(
         repository, self.options.build_number)
+
+  def _do_postprocess_one(self, name, result):
+    """Add the repository to the bom as it finishes.
+
+    This runs in the command's thread so the builder is not shared
+    with the repository workers.
+    """
+    repository, source_info = result
     self.__builder.add_repository(repository, source_info)
 
   def _do_postprocess(self, _):
     """Construct BOM and write it to the configured path."""
-    bom = self.__builder.build()
+    bom = self.make_bom()
     if bom == self.__builder.base_bom:
       logging.info('Bom has not changed from version %s @ %s',
                    bom['version'], bom['timestamp'])
 
-    bom_text = yaml.safe_dump(bom, default_flow_style=False)
+    bom_text = dump_yaml(bom, default_flow_style=False)
 
     path = _determine_bom_path(self)
     write_to_path(bom_text, path)
     logging.info('Wrote bom to %s', path)
 
+    if self.__builder.base_bom:
+      plan = plan_bom_delta(self.__builder.base_bom, bom)
+      plan_path = os.path.join(self.get_output_dir(), REBUILD_PLAN_FILENAME)
+      DocumentCache.write(plan, plan_path)
+      logging.info('Wrote rebuild plan for %s to %s',
+                   ', '.join(plan['rebuild_repositories']) or 'nothing',
+                   plan_path)
+
+  def make_bom(self):
+    """Construct the BOM from the repositories finished so far."""
+    return self.__builder.build()
+
 
 class BuildBomCommandFactory(RepositoryCommandFactory):
   def __init__(self, **kwargs):
@@ -277,11 +308,14 @@ class BuildBomCommandFactory(RepositoryCommandFactory):
         'build_bom', BuildBomCommand, 'Build a BOM file.',
         BranchSourceCodeManager,
         source_repository_names=SPINNAKER_BOM_REPOSITORY_NAMES,
+        # build_bom looks at every repository to find what changed.
+        use_rebuild_plan=False,
         **kwargs)
 
   def init_argparser(self, parser, defaults):
     super(BuildBomCommandFactory, self).init_argparser(parser, defaults)
     HalRunner.add_parser_args(parser, defaults)
+    BomStore.add_parser_args(parser, defaults)
     buildtool.container_commands.add_bom_parser_args(parser, defaults)
     buildtool.debian_commands.add_bom_parser_args(parser, defaults)
 
@@ -318,5 +352,86 @@ class BuildBomCommandFactory(RepositoryCommandFactory):
              ' to come from a release branch.')
 
 
+class PlanBomDeltaCommand(CommandProcessor):
+  """Implements plan_bom_delta.
+
+  This writes the rebuild plan (see bom_delta_support) for going from
+  one BOM to another. Repository commands given the plan as their
+  --rebuild_plan_path only process the repositories it rebuilds.
+  """
+
+  def __init__(self, factory, options, **kwargs):
+    super(PlanBomDeltaCommand, self).__init__(factory, options, **kwargs)
+    for base_name in ['delta_base_bom', 'bom']:
+      path = getattr(options, base_name + '_path')
+      version = getattr(options, base_name + '_version')
+      if bool(path) == bool(version):
+        raise_and_log_error(ConfigError(
+            'Expected exactly one of --{name}_path or --{name}_version'
+            .format(name=base_name)))
+
+  def load_bom(self, path, version):
+    """Returns the BOM at the path or with the version."""
+    if path:
+      check_path_exists(path, 'plan_bom_delta')
+      return DocumentCache.load(path)
+    return retrieve_bom_version(self.options, version)
+
+  def _do_command(self):
+    """Implements CommandProcessor interface."""
+    options = self.options
+    base_bom = self.load_bom(options.delta_base_bom_path,
+                             options.delta_base_bom_version)
+    bom = self.load_bom(options.bom_path, options.bom_version)
+    plan = plan_bom_delta(base_bom, bom)
+
+    path = (options.rebuild_plan_path
+            or os.path.join(self.get_output_dir(), REBUILD_PLAN_FILENAME))
+    DocumentCache.write(plan, path)
+    if plan['rebuild_all']:
+      logging.info('Every repository needs rebuilding because'
+                   ' artifactSources %s changed.',
+                   ', '.join(plan['artifactSources']))
+    else:
+      logging.info('Repositories needing rebuilding: %s',
+                   ', '.join(plan['rebuild_repositories']) or 'none')
+    logging.info('Wrote rebuild plan from %s to %s into %s',
+                 plan['base_version'], plan['version'], path)
+    return plan
+
+
+class PlanBomDeltaFactory(CommandFactory):
+  def __init__(self, **kwargs):
+    super(PlanBomDeltaFactory, self).__init__(
+        'plan_bom_delta', PlanBomDeltaCommand,
+        'Determine which repositories need rebuilding between two BOMs.',
+        **kwargs)
+
+  def init_argparser(self, parser, defaults):
+    super(PlanBomDeltaFactory, self).init_argparser(parser, defaults)
+    HalRunner.add_parser_args(parser, defaults)
+    BomStore.add_parser_args(parser, defaults)
+
+    self.add_argument(
+        parser, 'delta_base_bom_path', defaults, None,
+        help='The path to the BOM being changed.')
+    self.add_argument(
+        parser, 'delta_base_bom_version', defaults, None,
+        help='Similar to delta_base_bom_path but using a version obtained'
+             ' from halyard.')
+    self.add_argument(
+        parser, 'bom_path', defaults, None,
+        help='The path to the new BOM.')
+    self.add_argument(
+        parser, 'bom_version', defaults, None,
+        help='Similar to bom_path but using a version obtained from halyard.')
+    self.add_argument(
+        parser, 'rebuild_plan_path', defaults, None,
+        help='The path to write the rebuild plan to. The default is {file}'
+             ' in the command output directory.'.format(
+                 file=REBUILD_PLAN_FILENAME))
+
+
 def register_commands(registry, subparsers, defaults):
   BuildBomCommandFactory().register(registry, subparsers, defaults)
+  PlanBomDeltaFactory().register(registry, subparsers, defaults)
@@ -0,0 +1,143 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Determines what needs rebuilding between two BOMs.
+
+The rebuild plan lists the services whose entries differ and the
+repositories that need to be built again for them. Repository commands
+given --rebuild_plan_path only process the repositories in the plan, so
+a patch release changing one service only builds that one repository.
+
+A plan looks like:
+  base_version: <the BOM being changed>
+  version: <the new BOM>
+  services:
+    <service>: {reason: <why>, from: <version>, to: <version>}
+  dependencies: [<dependencies whose entry changed>]
+  artifactSources: [<artifactSources keys that changed>]
+  rebuild_all: <whether every repository must be rebuilt>
+  rebuild_repositories: [<repositories to rebuild>]
+"""
+
+import logging
+
+from buildtool import (
+    check_path_exists,
+    raise_and_log_error,
+    ConfigError)
+from buildtool.serialization_support import DocumentCache
+
+
+REBUILD_PLAN_FILENAME = 'rebuild_plan.yml'
+
+# BOM services that are built from a differently named repository.
+SERVICE_REPOSITORY_NAMES = {
+    'monitoring-daemon': 'spinnaker-monitoring',
+    'monitoring-third-party': 'spinnaker-monitoring'
+}
+
+# BOM service entries that are not built from any repository.
+NON_REPOSITORY_SERVICES = ['defaultArtifact']
+
+# The artifactSources that only say where the source code is.
+# Every other source is where artifacts are published, so changing one
+# means every artifact needs to be published there again.
+SOURCE_CODE_ARTIFACT_SOURCES = ['gitPrefix']
+
+
+def _service_change_reason(before, after):
+  """Returns why a service entry changed, or None if it did not."""
+  if not after:
+    return 'removed'
+  if not before:
+    return 'added'
+  if before.get('commit') != after.get('commit'):
+    return 'different commit'
+  if before.get('version') != after.get('version'):
+    return 'different version'
+  if before.get('gitPrefix') != after.get('gitPrefix'):
+    return 'different gitPrefix'
+  return None
+
+
+def _changed_keys(before, after):
+  before = before or {}
+  after = after or {}
+  return sorted(key for key in set(before.keys()) | set(after.keys())
+                if before.get(key) != after.get(key))
+
+
+def plan_bom_delta(base_bom, bom):
+  """Returns the rebuild plan to go from the base_bom to the bom.
+
+  Args:
+    base_bom: [dict] The BOM being changed.
+    bom: [dict] The new BOM.
+  """
+  base_services = base_bom.get('services') or {}
+  services = bom.get('services') or {}
+  changes = {}
+  for name in sorted(set(base_services.keys()) | set(services.keys())):
+    before = base_services.get(name) or {}
+    after = services.get(name) or {}
+    reason = _service_change_reason(before, after)
+    if reason:
+      changes[name] = {'reason': reason,
+                       'from': before.get('version'),
+                       'to': after.get('version')}
+
+  changed_sources = _changed_keys(base_bom.get('artifactSources'),
+                                  bom.get('artifactSources'))
+  rebuild_all = any(key not in SOURCE_CODE_ARTIFACT_SOURCES
+                    for key in changed_sources)
+  rebuild_repositories = set(
+      SERVICE_REPOSITORY_NAMES.get(name, name)
+      for name, change in changes.items()
+      if change['reason'] != 'removed'
+      and name not in NON_REPOSITORY_SERVICES)
+
+  return {
+      'base_version': base_bom.get('version'),
+      'version': bom.get('version'),
+      'services': changes,
+      'dependencies': _changed_keys(base_bom.get('dependencies'),
+                                    bom.get('dependencies')),
+      'artifactSources': changed_sources,
+      'rebuild_all': rebuild_all,
+      'rebuild_repositories': sorted(rebuild_repositories)
+  }
+
+
+def load_rebuild_plan(path):
+  """Returns the rebuild plan written to the path."""
+  check_path_exists(path, why='rebuild_plan_path')
+  plan = DocumentCache.load(path)
+  if not isinstance(plan, dict) or 'rebuild_repositories' not in plan:
+    raise_and_log_error(
+        ConfigError('"{path}" is not a rebuild plan'.format(path=path)))
+  return plan
+
+
+def filter_planned_repositories(plan, source_repositories):
+  """Returns the source_repositories that the rebuild plan rebuilds."""
+  if plan.get('rebuild_all'):
+    return source_repositories
+  wanted = set(plan['rebuild_repositories'])
+  skipped = sorted(repository.name for repository in source_repositories
+                   if repository.name not in wanted)
+  if skipped:
+    logging.info('Skipping repositories unchanged since BOM %s: %s',
+                 plan.get('base_version'), ', '.join(skipped))
+  return [repository for repository in source_repositories
+          if repository.name in wanted]
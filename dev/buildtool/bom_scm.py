@@ -16,7 +16,6 @@
 
 import logging
 import os
-import yaml
 
 from buildtool import (
     SPINNAKER_RUNNABLE_REPOSITORY_NAMES,
@@ -30,6 +29,10 @@ from buildtool import (
     raise_and_log_error,
     ConfigError,
     UnexpectedError)
+from buildtool.bom_store_support import (
+    BomStore,
+    retrieve_bom_version)
+from buildtool.serialization_support import DocumentCache
 
 
 SPINNAKER_BOM_REPOSITORY_NAMES = list(SPINNAKER_RUNNABLE_REPOSITORY_NAMES)
@@ -58,6 +61,7 @@ class BomSourceCodeManager(SpinnakerSourceCodeManager):
     parser.added_bom_scm = True
     SpinnakerSourceCodeManager.add_parser_args(parser, defaults)
     HalRunner.add_parser_args(parser, defaults)
+    BomStore.add_parser_args(parser, defaults)
     add_parser_argument(
         parser, 'bom_path', defaults, None,
         help='Use the sources specified in the BOM path.')
@@ -69,9 +73,7 @@ class BomSourceCodeManager(SpinnakerSourceCodeManager):
   def bom_from_path(path):
     """Load a BOM from a file."""
     logging.debug('Loading bom from %s', path)
-    with open(path, 'r') as f:
-      bom_yaml_string = f.read()
-    return yaml.safe_load(bom_yaml_string)
+    return DocumentCache.load(path)
 
   @staticmethod
   def load_bom(options):
@@ -96,7 +98,7 @@ class BomSourceCodeManager(SpinnakerSourceCodeManager):
           UnexpectedError('Not reachable', cause='NotReachable'))
 
     logging.debug('Retrieving bom version %s', bom_version)
-    return HalRunner(options).retrieve_bom_version(bom_version)
+    return retrieve_bom_version(options, bom_version)
 
 
   @property
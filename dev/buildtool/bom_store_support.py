@@ -0,0 +1,261 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local copy of the BOMs in the halyard bucket.
+
+Each object in gs://<halyard_bom_bucket>/bom/ is fetched once per
+generation. The store keeps a manifest of the generation it has for each
+BOM, so syncing only lists the bucket then fetches what is new or changed.
+BOMs are kept as JSON, which is much faster to load than the YAML
+published in the bucket.
+"""
+
+import io
+import json
+import logging
+import os
+import threading
+
+from buildtool import (
+    add_parser_argument,
+    ensure_dir_exists,
+    exception_to_message,
+    raise_and_log_error,
+    run_subprocess,
+    run_subprocesses,
+    ConfigError,
+    ExecutionError,
+    HalRunner)
+from buildtool.serialization_support import load_yaml
+
+
+class BomStore(object):
+  """A local copy of the BOMs in the halyard bucket."""
+
+  MANIFEST_FILENAME = 'manifest.json'
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add parser arguments used to configure the BomStore."""
+    if hasattr(parser, 'added_bom_store'):
+      return
+    parser.added_bom_store = True
+    add_parser_argument(
+        parser, 'bom_store_dir', defaults, None,
+        help='If specified, keep a local copy of the halyard BOMs in this'
+             ' directory and read BOM versions from it rather than asking'
+             ' halyard for them.')
+
+  @staticmethod
+  def bom_name_from_url(url):
+    """Returns the name of the BOM at a gcs url, ignoring any generation."""
+    name = url.split('#', 1)[0]
+    return os.path.splitext(name[name.rfind('/') + 1:])[0]
+
+  @property
+  def url_prefix(self):
+    """The gcs url of the directory containing the BOMs."""
+    return self.__url_prefix
+
+  def __init__(self, store_dir, bucket=None):
+    """Constructor.
+
+    Args:
+      store_dir: [path] The directory containing the store.
+      bucket: [string] The bucket containing the BOMs.
+    """
+    self.__store_dir = store_dir
+    self.__url_prefix = 'gs://{bucket}/bom/'.format(
+        bucket=bucket or 'halconfig')
+    self.__lock = threading.Lock()
+    self.__manifest = {}
+    path = os.path.join(store_dir, self.MANIFEST_FILENAME)
+    if os.path.exists(path):
+      with io.open(path, 'r', encoding='utf-8') as stream:
+        manifest = json.load(stream)
+      if manifest.get('url_prefix') == self.__url_prefix:
+        self.__manifest = manifest['boms']
+      else:
+        logging.info('Ignoring BOM store %s for %s',
+                     store_dir, manifest.get('url_prefix'))
+
+  def __bom_path(self, name):
+    return os.path.join(self.__store_dir, 'boms', name + '.json')
+
+  def __save_manifest(self):
+    ensure_dir_exists(self.__store_dir)
+    path = os.path.join(self.__store_dir, self.MANIFEST_FILENAME)
+    with self.__lock:
+      text = json.dumps({'url_prefix': self.__url_prefix,
+                         'boms': self.__manifest},
+                        indent=0, sort_keys=True)
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as stream:
+      stream.write(text)
+    os.rename(path + '.tmp', path)
+
+  def __list_generations(self, url):
+    """Returns a dictionary of BOM name to its latest generation url."""
+    retcode, stdout = run_subprocess('gsutil ls -a ' + url)
+    if retcode != 0:
+      if 'matched no objects' in stdout:
+        return {}
+      raise_and_log_error(
+          ExecutionError('Could not list {url}: {error}'.format(
+              url=url, error=stdout), program='gsutil'))
+
+    result = {}
+    for line in stdout.split('\n'):
+      line = line.strip()
+      if not line.startswith(self.__url_prefix) or '.yml' not in line:
+        continue
+      base_url, _, generation = line.partition('#')
+      if not base_url.endswith('.yml'):
+        continue
+      name = self.bom_name_from_url(base_url)
+      entry = result.get(name)
+      if entry is None or int(generation or 0) > int(entry['generation'] or 0):
+        result[name] = {'url': base_url, 'generation': generation}
+    return result
+
+  def __fetch(self, listing):
+    """Fetch the listed BOMs that the store does not already have.
+
+    BOMs that could not be parsed are not fetched again until they change,
+    but ones that could not be fetched are retried.
+    """
+    def have(name, entry):
+      record = self.__manifest.get(name)
+      if record is None or record['generation'] != entry['generation']:
+        return False
+      if 'error' in record:
+        return not record.get('fetch_failed')
+      return os.path.exists(self.__bom_path(name))
+
+    with self.__lock:
+      wanted = [(name, entry) for name, entry in sorted(listing.items())
+                if not have(name, entry)]
+    if not wanted:
+      return []
+
+    logging.info('Fetching %d new or changed BOMs from %s',
+                 len(wanted), self.__url_prefix)
+    commands = []
+    for _, entry in wanted:
+      url = entry['url']
+      if entry['generation']:
+        url += '#' + entry['generation']
+      commands.append('gsutil cat ' + url)
+
+    ensure_dir_exists(os.path.join(self.__store_dir, 'boms'))
+    for (name, entry), (retcode, stdout) in zip(wanted,
+                                                run_subprocesses(commands)):
+      record = dict(entry)
+      bom = None
+      if retcode != 0:
+        record['error'] = stdout
+        record['fetch_failed'] = True
+      else:
+        try:
+          bom = load_yaml(stdout)
+          if not isinstance(bom, dict):
+            raise ValueError('Not a BOM')
+        except Exception as ex:
+          record['error'] = exception_to_message(ex)
+      if bom is not None and 'error' not in record:
+        record['timestamp'] = bom.get('timestamp')
+        path = self.__bom_path(name)
+        with io.open(path + '.tmp', 'w', encoding='utf-8') as stream:
+          stream.write(json.dumps(bom, separators=(',', ':')))
+        os.rename(path + '.tmp', path)
+      else:
+        logging.warning('Could not load BOM %s: %s', name, record['error'])
+      with self.__lock:
+        self.__manifest[name] = record
+    return [name for name, _ in wanted]
+
+  def sync(self, name_prefix=''):
+    """Bring the store up to date with the bucket.
+
+    Args:
+      name_prefix: [string] Only sync the BOMs whose names have this prefix.
+
+    Returns:
+      The names of the BOMs that were fetched.
+    """
+    listing = self.__list_generations(self.__url_prefix + name_prefix + '*')
+    with self.__lock:
+      for name in list(self.__manifest.keys()):
+        if name.startswith(name_prefix) and name not in listing:
+          logging.info('BOM %s was removed from %s', name, self.__url_prefix)
+          del self.__manifest[name]
+          if os.path.exists(self.__bom_path(name)):
+            os.remove(self.__bom_path(name))
+    fetched = self.__fetch(listing)
+    self.__save_manifest()
+    return fetched
+
+  def list_boms(self, name_prefix=''):
+    """Returns the sorted names of the BOMs in the store."""
+    with self.__lock:
+      return sorted(name for name in self.__manifest
+                    if name.startswith(name_prefix))
+
+  def url_for(self, name):
+    """Returns the gcs url that the named BOM came from."""
+    return self.__url_prefix + name + '.yml'
+
+  def get_error(self, name):
+    """Returns why the named BOM could not be loaded, or None."""
+    with self.__lock:
+      return self.__manifest.get(name, {}).get('error')
+
+  def load_bom(self, name):
+    """Returns the named BOM from the store or None if it is not there."""
+    if self.get_error(name):
+      return None
+    path = self.__bom_path(name)
+    if not os.path.exists(path):
+      return None
+    with io.open(path, 'r', encoding='utf-8') as stream:
+      return json.load(stream)
+
+  def get_bom(self, name):
+    """Returns the named BOM, first syncing it if it changed."""
+    listing = self.__list_generations(self.url_for(name))
+    if name not in listing:
+      return None
+    if self.__fetch(listing):
+      self.__save_manifest()
+    return self.load_bom(name)
+
+
+def retrieve_bom_version(options, version):
+  """Returns the specified BOM version as a dict.
+
+  This reads it through the BomStore if --bom_store_dir was given,
+  otherwise it asks halyard for it.
+  """
+  store_dir = getattr(options, 'bom_store_dir', None)
+  if not store_dir:
+    return HalRunner(options).retrieve_bom_version(version)
+
+  logging.info('Getting bom version %s from %s', version, store_dir)
+  store = BomStore(store_dir, getattr(options, 'halyard_bom_bucket', None))
+  bom = store.get_bom(version)
+  if bom is None:
+    raise_and_log_error(ConfigError(
+        'BOM version {version} is not in {url}: {error}'.format(
+            version=version, url=store.url_prefix,
+            error=store.get_error(version) or 'Not found')))
+  return bom
@@ -23,7 +23,6 @@ import os
 import re
 import shutil
 import textwrap
-import yaml
 
 try:
   from urllib2 import urlopen, HTTPError
@@ -56,6 +55,10 @@ from buildtool import (
     ensure_dir_exists,
     raise_and_log_error,
     write_to_path)
+from buildtool.bom_store_support import (
+    BomStore,
+    retrieve_bom_version)
+from buildtool.serialization_support import load_yaml
 
 
 BUILD_CHANGELOG_COMMAND = 'build_changelog'
@@ -302,13 +305,21 @@ class BuildChangelogCommand(RepositoryCommandProcessor):
 
     if options.relative_to_bom_path:
       with open(options.relative_to_bom_path, 'r') as stream:
-        self.__relative_bom = yaml.safe_load(stream.read())
+        self.__relative_bom = load_yaml(stream.read())
     elif options.relative_to_bom_version:
-      self.__relative_bom = HalRunner(options).retrieve_bom_version(
-          options.relative_to_bom_version)
+      self.__relative_bom = retrieve_bom_version(
+          options, options.relative_to_bom_version)
     else:
       self.__relative_bom = None
     super(BuildChangelogCommand, self).__init__(factory, options_copy, **kwargs)
+    self.__builder = ChangelogBuilder(
+        with_detail=options.include_changelog_details)
+    self.__repository_map = None
+
+  def _do_preprocess(self):
+    """Implements RepositoryCommandProcessor interface."""
+    self.__repository_map = {repository.name: repository
+                             for repository in self.source_repositories}
 
   def _do_repository(self, repository):
     """Collect the summary for the given repository."""
@@ -320,17 +331,14 @@ class BuildChangelogCommand(RepositoryCommandProcessor):
     return self.git.collect_repository_summary(repository.git_dir,
                                                base_commit_id=bom_commit)
 
-  def _do_postprocess(self, result_dict):
+  def _do_postprocess_one(self, name, result):
+    """Add the repository's summary to the changelog as it becomes ready."""
+    self.__builder.add_repository(self.__repository_map[name], result)
+
+  def _do_postprocess(self, _):
     """Construct changelog from the collected summary, then write it out."""
-    options = self.options
     path = os.path.join(self.get_output_dir(), 'changelog.md')
-
-    builder = ChangelogBuilder(with_detail=options.include_changelog_details)
-    repository_map = {repository.name: repository
-                      for repository in self.source_repositories}
-    for name, summary in result_dict.items():
-      builder.add_repository(repository_map[name], summary)
-    changelog_text = builder.build()
+    changelog_text = self.__builder.build()
     write_to_path(changelog_text, path)
     logging.info('Wrote changelog to %s', path)
 
@@ -355,6 +363,7 @@ class BuildChangelogFactory(RepositoryCommandFactory):
              ' in time sequence in the changelog.')
 
     HalRunner.add_parser_args(parser, defaults)
+    BomStore.add_parser_args(parser, defaults)
     self.add_argument(
         parser, 'relative_to_bom_path', defaults, None,
         help='If specified then produce the changelog relative to the'
@@ -372,7 +381,10 @@ class PublishChangelogFactory(RepositoryCommandFactory):
     super(PublishChangelogFactory, self).__init__(
         'publish_changelog', PublishChangelogCommand,
         'Publish Spinnaker version Changelog to spinnaker.github.io.',
-        BranchSourceCodeManager, **kwargs)
+        BranchSourceCodeManager,
+        # The rebuild plan only names BOM services.
+        use_rebuild_plan=False,
+        **kwargs)
 
   def init_argparser(self, parser, defaults):
     super(PublishChangelogFactory, self).init_argparser(
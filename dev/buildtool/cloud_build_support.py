@@ -0,0 +1,493 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs Google Cloud Build builds without a gcloud process for each one.
+
+A synchronous "gcloud builds submit" keeps a gcloud process streaming the
+build, and a thread waiting on it, for the whole build, which is often
+twenty minutes or more. The CloudBuildOrchestrator instead submits builds
+with --async and records their build ids in a state file. One poller
+thread tracks every build in flight, backing off while nothing changes.
+Whenever a build changes status it appends the build's new log output to
+the build's logfile, and it resolves the build once it reaches a terminal
+status. A build that can
+no longer be described, or is still running at the deadline, is resolved
+as failed so nothing waits on it forever.
+
+Each build holds a CLOUD_BUILD_SLOTS token from when it is submitted
+until it resolves, so --resource_limits bounds the builds in flight.
+
+When buildtool is restarted with the same state file, builds that are
+still in flight are re-attached to rather than submitted again, and
+builds that already succeeded are not repeated.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+
+from buildtool import (
+    add_parser_argument,
+    check_subprocesses_to_logfile,
+    ensure_dir_exists,
+    raise_and_log_error,
+    run_subprocess,
+    run_subprocesses,
+    ExecutionError)
+from buildtool.metrics import MetricsManager
+from buildtool.resource_support import (
+    CLOUD_BUILD_SLOTS,
+    ResourceLimits,
+    is_overload_output)
+from buildtool.serialization_support import DocumentCache
+
+
+# The status buildtool gives builds that it could no longer describe.
+LOST_STATUS = 'LOST'
+
+# The build statuses that a build does not leave.
+TERMINAL_STATUSES = ['SUCCESS', 'FAILURE', 'INTERNAL_ERROR', 'TIMEOUT',
+                     'CANCELLED', 'EXPIRED', LOST_STATUS]
+
+# All the statuses "gcloud builds describe" can report.
+KNOWN_STATUSES = TERMINAL_STATUSES + [
+    'STATUS_UNKNOWN', 'PENDING', 'QUEUED', 'WORKING']
+
+# Cloud Build ids are UUIDs.
+BUILD_ID_REGEX = re.compile(
+    r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+def make_build_key(command, cwd):
+  """Returns the key identifying the build a submit command makes."""
+  digest = hashlib.sha1(
+      '{0}\n{1}'.format(os.path.abspath(cwd or '.'), command).encode('utf-8'))
+  return digest.hexdigest()[:16]
+
+
+class CloudBuild(object):
+  """A build tracked by the CloudBuildOrchestrator."""
+
+  @property
+  def key(self):
+    return self.__key
+
+  @property
+  def record(self):
+    """The state of the build that is kept in the state file."""
+    return self.__record
+
+  @property
+  def build_id(self):
+    return self.__record['id']
+
+  @property
+  def status(self):
+    return self.__record['status']
+
+  @property
+  def finished(self):
+    return self.__record['status'] in TERMINAL_STATUSES
+
+  def __init__(self, key, record):
+    self.__key = key
+    self.__record = record
+    # Builds recorded before the deadline existed start it when resumed.
+    record.setdefault('submit_time', time.time())
+    self.poll_failures = 0
+    self.__lock = threading.Lock()
+    self.__limiter = None
+    self.__token = None
+    self.__done = threading.Event()
+    if self.finished:
+      self.__done.set()
+
+  def gcloud_command(self, verb):
+    """Returns the gcloud builds command doing something to the build."""
+    return 'gcloud builds {verb} {id} {flags}'.format(
+        verb=verb, id=self.build_id, flags=self.__record['gcloud_flags'])
+
+  @property
+  def holding(self):
+    """Whether the build holds a resource token."""
+    return self.__token is not None
+
+  def hold(self, limiter, token):
+    """Hold the limiter's token until the build resolves."""
+    with self.__lock:
+      if self.__token is None and not self.__done.is_set():
+        self.__limiter, self.__token = limiter, token
+        return
+    limiter.release(token)
+
+  def append_log(self, text):
+    """Append the new part of the build's log so far to the logfile."""
+    offset = self.__record['log_length']
+    if len(text) <= offset:
+      return
+    logfile = self.__record['logfile']
+    ensure_dir_exists(os.path.dirname(os.path.abspath(logfile)))
+    with io.open(logfile, 'a', encoding='utf-8') as stream:
+      stream.write(text[offset:])
+    self.__record['log_length'] = len(text)
+
+  def set_status(self, status):
+    """Returns whether the status changed."""
+    if status == self.__record['status']:
+      return False
+    logging.debug('Cloud build %s for %s is %s',
+                  self.build_id, self.__record['what'], status)
+    self.__record['status'] = status
+    return True
+
+  def resolve(self):
+    with self.__lock:
+      self.__done.set()
+      limiter, token = self.__limiter, self.__token
+      self.__limiter = self.__token = None
+    if limiter:
+      limiter.release(token)
+
+  def wait(self):
+    self.__done.wait()
+
+
+class CloudBuildOrchestrator(object):
+  """Submits builds to Google Cloud Build and tracks them to completion.
+
+  There is one orchestrator for each state file in the process, shared
+  by all the commands (e.g. within a flow) submitting builds.
+  """
+
+  __instances = {}
+  __instances_lock = threading.Lock()
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add parser arguments used to submit cloud builds."""
+    if hasattr(parser, 'added_cloud_build'):
+      return
+    parser.added_cloud_build = True
+    add_parser_argument(
+        parser, 'gcb_async', defaults, True, type=bool,
+        help='Submit Cloud Build builds with --async and track them from'
+             ' a single poller rather than waiting on each gcloud submit.')
+    add_parser_argument(
+        parser, 'gcb_state_path', defaults, None,
+        help='The file recording the Cloud Build builds that were submitted'
+             ' so a restarted buildtool can re-attach to them. The default'
+             ' is cloud_builds.yml in the --output_dir.')
+    add_parser_argument(
+        parser, 'gcb_poll_secs', defaults, 10, type=float,
+        help='How often to poll the builds in flight at first.')
+    add_parser_argument(
+        parser, 'gcb_max_poll_secs', defaults, 60, type=float,
+        help='Polling backs off to this interval while builds are unchanged.')
+    add_parser_argument(
+        parser, 'gcb_timeout_secs', defaults, 4 * 60 * 60, type=float,
+        help='Give up on a Cloud Build build that is still running this long'
+             ' after it was submitted.')
+
+  @staticmethod
+  def for_options(options):
+    """Returns the orchestrator for the state file the options specify."""
+    path = os.path.abspath(
+        options.gcb_state_path
+        or os.path.join(options.output_dir, 'cloud_builds.yml'))
+    with CloudBuildOrchestrator.__instances_lock:
+      orchestrator = CloudBuildOrchestrator.__instances.get(path)
+      if orchestrator is None:
+        orchestrator = CloudBuildOrchestrator(
+            path, poll_secs=options.gcb_poll_secs,
+            max_poll_secs=options.gcb_max_poll_secs,
+            timeout_secs=options.gcb_timeout_secs)
+        CloudBuildOrchestrator.__instances[path] = orchestrator
+    return orchestrator
+
+  @property
+  def state_path(self):
+    return self.__state_path
+
+  def __init__(self, state_path, poll_secs=10, max_poll_secs=60,
+               timeout_secs=4 * 60 * 60, max_poll_failures=5):
+    """Constructor.
+
+    Args:
+      state_path: [path] The file recording the submitted builds.
+         Builds in flight that it already records are polled right away.
+      poll_secs: [float] The initial polling interval.
+      max_poll_secs: [float] The longest polling interval.
+      timeout_secs: [float] How long after submitting a build to give up.
+      max_poll_failures: [int] Give up on a build that could not be
+         described this many times in a row.
+    """
+    self.__state_path = state_path
+    self.__poll_secs = poll_secs
+    self.__max_poll_secs = max(poll_secs, max_poll_secs)
+    self.__timeout_secs = timeout_secs
+    self.__max_poll_failures = max_poll_failures
+    self.__limiter = ResourceLimits.limiter(CLOUD_BUILD_SLOTS)
+    self.__condition = threading.Condition()
+    self.__builds = {}
+    self.__poller = None
+    self.__metrics = MetricsManager.singleton()
+
+    if os.path.exists(state_path):
+      for key, record in (DocumentCache.load(state_path) or {}).items():
+        self.__builds[key] = CloudBuild(key, record)
+    in_flight = [build for build in self.__builds.values()
+                 if not build.finished]
+    if in_flight:
+      logging.info('Re-attaching to %d cloud builds recorded in %s',
+                   len(in_flight), state_path)
+      with self.__condition:
+        self.__ensure_poller()
+
+  def run(self, what, logfile, command, cwd=None, project=None, account=None):
+    """Submit the build then wait for it to finish."""
+    return self.wait(self.submit(what, logfile, command, cwd=cwd,
+                                 project=project, account=account))
+
+  def submit(self, what, logfile, command, cwd=None,
+             project=None, account=None):
+    """Submit a build unless it is already in flight or succeeded.
+
+    Args:
+      what: [string] For logging purposes, what is being built.
+      logfile: [path] The file to write the build's log to.
+      command: [string] The "gcloud builds submit" command without --async.
+      cwd: [path] The directory to run the command in.
+      project: [string] The project running the build.
+      account: [string] The account to query the build with.
+
+    Returns:
+      The CloudBuild.
+    """
+    key = make_build_key(command, cwd)
+    with self.__condition:
+      build = self.__builds.get(key)
+      if build is not None and (not build.finished
+                                or build.status == 'SUCCESS'):
+        logging.info('Re-attaching to cloud build %s for %s (%s)',
+                     build.build_id, what, build.status)
+      else:
+        build = None
+    if build is not None:
+      if not build.finished and not build.holding:
+        # Builds resumed from the state file take a slot once claimed.
+        build.hold(self.__limiter, self.__limiter.take())
+      return build
+
+    token = self.__limiter.take()
+    try:
+      build_id = self.__submit_build(what, logfile, command, cwd, token)
+    except Exception:
+      self.__limiter.release(token)
+      raise
+
+    flags = ['--project=' + project] if project else []
+    flags.extend(['--account=' + account] if account else [])
+    build = CloudBuild(key, {
+        'id': build_id,
+        'what': what,
+        'logfile': logfile,
+        'gcloud_flags': ' '.join(flags),
+        'status': 'QUEUED',
+        'log_length': 0,
+        'submit_time': time.time()
+    })
+    build.hold(self.__limiter, token)
+    logging.info('Submitted %s as cloud build %s', what, build.build_id)
+    with self.__condition:
+      self.__builds[key] = build
+      self.__save_state()
+      self.__ensure_poller()
+      self.__condition.notify_all()
+    return build
+
+  def __submit_build(self, what, logfile, command, cwd, token):
+    """Run the submit command and return the new build's id."""
+    logging.info('Submitting %s to cloud build, logging to %s', what, logfile)
+    ensure_dir_exists(os.path.dirname(os.path.abspath(logfile)))
+    with io.open(logfile, 'w', encoding='utf-8') as stream:
+      # Only the id is written to stdout. Anything else gcloud has to say
+      # goes to stderr, which is logged. The caller is already holding the
+      # resource token for the build.
+      retcode, stdout = run_subprocess(
+          command + ' --async --format=value(id)', cwd=cwd,
+          stderr=stream, resource_class=None)
+      stream.write(stdout + u'\n')
+
+    build_id = stdout.strip()
+    if retcode == 0 and BUILD_ID_REGEX.match(build_id):
+      return build_id
+
+    with io.open(logfile, 'r', encoding='utf-8') as stream:
+      if retcode != 0 and is_overload_output(stream.read()):
+        token.mark_overloaded()
+    raise_and_log_error(
+        ExecutionError('Could not submit cloud build for ' + what,
+                       program='gcloud'),
+        'Could not submit {what}{problem}. See {logfile}'.format(
+            what=what, logfile=logfile,
+            problem=('' if retcode else
+                     ': {0!r} is not a build id'.format(build_id))))
+
+  def wait(self, build):
+    """Wait for the build to finish.
+
+    Raises:
+      ExecutionError if the build did not succeed.
+    """
+    build.wait()
+    if build.status != 'SUCCESS':
+      raise_and_log_error(
+          ExecutionError(
+              'Cloud build {id} for {what} finished with {status}'.format(
+                  id=build.build_id, what=build.record['what'],
+                  status=build.status),
+              program='gcloud'),
+          'Cloud build {id} failed. See {logfile}'.format(
+              id=build.build_id, logfile=build.record['logfile']))
+    return build
+
+  def __save_state(self):
+    """Record the builds. Called with the condition held."""
+    DocumentCache.write(
+        {key: build.record for key, build in self.__builds.items()},
+        self.__state_path)
+
+  def __ensure_poller(self):
+    """Start the poller if needed. Called with the condition held."""
+    if self.__poller is None:
+      self.__poller = threading.Thread(
+          name='CloudBuildPoller', target=self.__poll_forever)
+      self.__poller.daemon = True
+      self.__poller.start()
+
+  def __poll_forever(self):
+    delay = self.__poll_secs
+    while True:
+      with self.__condition:
+        in_flight = [build for build in self.__builds.values()
+                     if not build.finished]
+        if not in_flight:
+          self.__condition.wait()
+          delay = self.__poll_secs
+          continue
+
+      try:
+        changed = self.poll(in_flight)
+      except Exception as ex:  # pylint: disable=broad-except
+        logging.error('Failed to poll cloud builds: %s', ex)
+        changed = False
+
+      delay = (self.__poll_secs if changed
+               else min(delay * 2, self.__max_poll_secs))
+      with self.__condition:
+        self.__condition.wait(delay)
+
+  def poll(self, builds):
+    """Update the status and logs of the builds.
+
+    Builds past the deadline are cancelled and resolved with TIMEOUT.
+    Builds that could not be described max_poll_failures times in a row
+    are resolved with LOST_STATUS.
+
+    Returns:
+      True if any build changed status.
+    """
+    deadline = time.time() - self.__timeout_secs
+    expired = [build for build in builds
+               if build.record['submit_time'] < deadline]
+    builds = [build for build in builds if build not in expired]
+    if expired:
+      # Best effort. The build is given up on either way.
+      run_subprocesses([build.gcloud_command('cancel') for build in expired],
+                       stderr=subprocess.PIPE)
+
+    # gcloud reports notices on stderr so keep it out of the results.
+    results = run_subprocesses(
+        [build.gcloud_command('describe') + ' --format=value(status)'
+         for build in builds],
+        stderr=subprocess.PIPE)
+
+    statuses = {}
+    with self.__condition:
+      for build in expired:
+        logging.error('Giving up on cloud build %s for %s after %d seconds',
+                      build.build_id, build.record['what'],
+                      self.__timeout_secs)
+        statuses[build] = 'TIMEOUT'
+      for build, (retcode, stdout) in zip(builds, results):
+        status = stdout.strip()
+        if retcode != 0 or status not in KNOWN_STATUSES:
+          build.poll_failures += 1
+          logging.warning('Could not get the status of cloud build %s: %s',
+                          build.build_id, stdout)
+          if build.poll_failures >= self.__max_poll_failures:
+            logging.error('Giving up on cloud build %s for %s after failing'
+                          ' to get its status %d times',
+                          build.build_id, build.record['what'],
+                          build.poll_failures)
+            statuses[build] = LOST_STATUS
+          continue
+        build.poll_failures = 0
+        statuses[build] = status
+
+    # Only fetch the logs of builds that changed status. The whole log is
+    # fetched each time, so doing it on every poll would cost quadratically
+    # in the length of the build. Fetching after the status means a
+    # finished build's log is complete.
+    logged = [build for build, status in statuses.items()
+              if status != build.status]
+    logs = run_subprocesses(
+        [build.gcloud_command('log') for build in logged],
+        stderr=subprocess.PIPE)
+    finished = [build for build, status in statuses.items()
+                if status in TERMINAL_STATUSES]
+
+    changed = False
+    with self.__condition:
+      for build, (retcode, log_text) in zip(logged, logs):
+        if retcode == 0:
+          build.append_log(log_text)
+      for build, status in statuses.items():
+        changed = build.set_status(status) or changed
+      self.__save_state()
+    for build in finished:
+      logging.info('Cloud build %s for %s finished with %s',
+                   build.build_id, build.record['what'], build.status)
+      self.__metrics.inc_counter('CloudBuildFinished',
+                                 {'status': build.status})
+      build.resolve()
+    return changed
+
+
+def run_cloud_build(options, what, logfile, command, cwd=None):
+  """Run a "gcloud builds submit" command, writing its log to the logfile.
+
+  With --gcb_async the build is submitted and tracked by the
+  CloudBuildOrchestrator. Otherwise the command is run as is.
+  """
+  if not getattr(options, 'gcb_async', False):
+    return check_subprocesses_to_logfile(what, logfile, [command], cwd=cwd)
+  return CloudBuildOrchestrator.for_options(options).run(
+      what, logfile, command, cwd=cwd,
+      project=options.gcb_project, account=options.gcb_service_account)
@@ -18,6 +18,7 @@ import os
 import logging
 
 # pylint: disable=relative-import
+from buildtool.context_support import bind_context_labels
 from buildtool.metrics import MetricsManager
 from buildtool import (
     add_parser_argument,
@@ -136,10 +137,11 @@ class CommandProcessor(object):
     logging.debug('Running command=%s...', self.name)
     try:
       metric_labels = self.determine_metric_labels()
-      result = self.metrics.track_and_time_call(
-          'RunCommand',
-          metric_labels, self.metrics.default_determine_outcome_labels,
-          self._do_command)
+      with bind_context_labels(command=self.name):
+        result = self.metrics.track_and_time_call(
+            'RunCommand',
+            metric_labels, self.metrics.default_determine_outcome_labels,
+            self._do_command)
       logging.debug('Finished command=%s', self.name)
       return result
     except Exception as ex:
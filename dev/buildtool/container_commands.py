@@ -27,9 +27,15 @@ from buildtool import (
   GradleCommandFactory,
   GradleCommandProcessor,
 
-  check_subprocesses_to_logfile,
   run_subprocess
 )
+from buildtool.artifact_index_support import (
+  GCR_CONTAINER,
+  ArtifactExistenceIndex,
+  list_container_image_tags)
+from buildtool.cloud_build_support import (
+  CloudBuildOrchestrator,
+  run_cloud_build)
 
 
 class BuildContainerCommand(GradleCommandProcessor):
@@ -41,6 +47,17 @@ class BuildContainerCommand(GradleCommandProcessor):
     super(BuildContainerCommand, self).__init__(
         factory, options_copy,
         source_repository_names=source_repository_names, **kwargs)
+    self.__artifact_index = ArtifactExistenceIndex()
+
+  def _do_preprocess(self):
+    """Lists the existing images once rather than for each repository."""
+    options = self.options
+    if options.artifact_registry:
+      self.__artifact_index.add_loader(
+          GCR_CONTAINER,
+          lambda: list_container_image_tags(
+              options.artifact_registry, account=options.gcb_service_account))
+      self.__artifact_index.refresh()
 
   def _do_can_skip_repository(self, repository):
     image_name = self.scm.repository_name_to_service_name(repository.name)
@@ -48,7 +65,11 @@ class BuildContainerCommand(GradleCommandProcessor):
 
     for variant in ('slim', 'ubuntu'):
       tag = "{version}-{variant}".format(version=version, variant=variant)
-      if not self.__gcb_image_exists(image_name, tag):
+      exists = self.__artifact_index.has_artifact(
+          GCR_CONTAINER, image_name, tag)
+      if exists is None:
+        exists = self.__gcb_image_exists(image_name, tag)
+      if not exists:
         return False
 
     labels = {'repository': repository.name, 'artifact': 'gcr-container'}
@@ -104,8 +125,8 @@ class BuildContainerCommand(GradleCommandProcessor):
     labels = {'repository': repository.name}
     self.metrics.time_call(
         'GcrBuild', labels, self.metrics.default_determine_outcome_labels,
-        check_subprocesses_to_logfile,
-        name + ' container build', logfile, [command], cwd=repository.git_dir)
+        run_cloud_build, options,
+        name + ' container build', logfile, command, cwd=repository.git_dir)
 
 class BuildContainerFactory(GradleCommandFactory):
   @staticmethod
@@ -132,6 +153,7 @@ class BuildContainerFactory(GradleCommandFactory):
     self.add_argument(
         parser, 'gcb_service_account', defaults, None,
         help='Google Service Account when using the GCP Container Builder.')
+    CloudBuildOrchestrator.add_parser_args(parser, defaults)
 
 
 def add_bom_parser_args(parser, defaults):
@@ -149,7 +171,9 @@ def register_commands(registry, subparsers, defaults):
       'build_halyard_containers', BuildContainerCommand,
       'Build one or more service containers from the local git repository.',
       BranchSourceCodeManager,
-      source_repository_names=[SPINNAKER_HALYARD_REPOSITORY_NAME])
+      source_repository_names=[SPINNAKER_HALYARD_REPOSITORY_NAME],
+      # The rebuild plan only names BOM services.
+      use_rebuild_plan=False)
 
   build_bom_containers_factory.register(registry, subparsers, defaults)
   build_hal_containers_factory.register(registry, subparsers, defaults)
@@ -0,0 +1,53 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tracks what the current thread is working on for attributing metrics.
+
+Low level helpers such as run_subprocess do not know which command or
+repository they are running on behalf of. Commands bind these labels to
+the thread doing the work so that the helpers can look them up.
+
+The labels are per thread because a process can run several commands
+(run_flow) and repositories at once. Threads do not inherit the labels
+so each thread working on something binds its own.
+"""
+
+import contextlib
+import threading
+
+
+_THREAD_STATE = threading.local()
+
+
+def context_labels():
+  """Returns a dictionary of the labels bound to the current thread."""
+  result = {}
+  for labels in getattr(_THREAD_STATE, 'stack', []):
+    result.update(labels)
+  return result
+
+
+@contextlib.contextmanager
+def bind_context_labels(**labels):
+  """Bind the labels to the current thread within the context.
+
+  Nested contexts add to or override the labels of the outer ones.
+  """
+  if not hasattr(_THREAD_STATE, 'stack'):
+    _THREAD_STATE.stack = []
+  _THREAD_STATE.stack.append(labels)
+  try:
+    yield
+  finally:
+    _THREAD_STATE.stack.pop()
@@ -16,7 +16,7 @@
 
 import os
 import re
-from threading import Semaphore
+from multiprocessing.pool import ThreadPool
 
 from buildtool import (
     BomSourceCodeManager,
@@ -25,9 +25,14 @@ from buildtool import (
     GradleCommandFactory,
 
     check_options_set,
-    check_subprocesses_to_logfile,
     raise_and_log_error,
     ConfigError)
+from buildtool.cloud_build_support import (
+    CloudBuildOrchestrator,
+    run_cloud_build)
+from buildtool.resource_support import (
+    BINTRAY_HTTP,
+    ResourceLimits)
 
 
 NON_DEBIAN_BOM_REPOSITORIES = ['spin']
@@ -37,7 +42,6 @@ class BuildDebianCommand(GradleCommandProcessor):
   def __init__(self, factory, options, **kwargs):
     options.github_disable_upstream_push = True
     super(BuildDebianCommand, self).__init__(factory, options, **kwargs)
-    self.__semaphore = Semaphore(options.max_local_builds)
 
     if not os.environ.get('BINTRAY_KEY'):
       raise_and_log_error(ConfigError('Expected BINTRAY_KEY set.'))
@@ -47,6 +51,17 @@ class BuildDebianCommand(GradleCommandProcessor):
         options, ['bintray_org', 'bintray_jar_repository',
                   'bintray_debian_repository', 'bintray_publish_wait_secs'])
 
+  def _do_preprocess(self):
+    """Lists the existing debians once rather than for each repository."""
+    repositories = [repository for repository in self.source_repositories
+                    if repository.name not in NON_DEBIAN_BOM_REPOSITORIES]
+    pool = ThreadPool(ResourceLimits.limiter(BINTRAY_HTTP).limit)
+    try:
+      self.gradle.index_debians_on_bintray(repositories, pool=pool)
+    finally:
+      pool.close()
+      pool.join()
+
   def _do_can_skip_repository(self, repository):
     if repository.name in NON_DEBIAN_BOM_REPOSITORIES:
       return True
@@ -85,8 +100,8 @@ class BuildDebianCommand(GradleCommandProcessor):
     labels = {'repository': repository.name}
     self.metrics.time_call(
         'DebBuild', labels, self.metrics.default_determine_outcome_labels,
-        check_subprocesses_to_logfile,
-        repository.name + ' deb build', logfile, [command], cwd=repository.git_dir)
+        run_cloud_build, options,
+        repository.name + ' deb build', logfile, command, cwd=repository.git_dir)
 
 
 class BuildDebianFactory(GradleCommandFactory):
@@ -109,6 +124,7 @@ class BuildDebianFactory(GradleCommandFactory):
     self.add_argument(
         parser, 'gcb_service_account', defaults, None,
         help='Google Service Account when using the GCP Container Builder.')
+    CloudBuildOrchestrator.add_parser_args(parser, defaults)
 
 
 def add_bom_parser_args(parser, defaults):
@@ -46,7 +46,8 @@ function run_build_flow() {
       $EXTRA_BOM_COMMAND_ARGS --git_branch $BOM_BRANCH
   start_command_unless NO_DEBIANS "build_debians" \
       $EXTRA_BOM_COMMAND_ARGS --git_branch $BOM_BRANCH
-  # Every buildtool command re-clones all the git repositories it needs. We'll
+  # Every buildtool command re-clones all the git repositories it needs
+  # (through the --git_mirror_dir objects, if configured). We'll
   # just reuse the ones that build_bom already checked out...
   start_spinrel publish_profiles \
       --bom "$UNBUILT_BOM_PATH" \
@@ -147,6 +148,10 @@ function process_args() {
           PARENT_INVOCATION_ID=$1
           shift
           ;;
+        --git_mirror_dir)
+          BUILDTOOL_ARGS="$BUILDTOOL_ARGS --git_mirror_dir=$1"
+          shift
+          ;;
 
         *)
           >&2 echo "Unexpeced argument '$key'"
@@ -0,0 +1,402 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Implements the run_flow command.
+
+A flow runs several buildtool commands within this process. The flow is a
+graph of steps declared in a YAML file (see flow_build.yml) where each step
+runs a command once the steps it requires have finished.
+
+Steps marked "per_repository" do not need to wait for all of a required
+step to finish. Each repository starts as soon as every required step has
+finished that repository, so (for example) a container can be built as
+soon as its BOM entry is known. The step runs its command again for the
+remaining repositories once the required steps have finished entirely.
+
+A step that "writes_bom" (i.e. build_bom) rewrites a BOM with each
+repository it finishes.
+Steps that take their "bom_from" that step use that file as their --bom_path.
+"""
+
+import argparse
+import copy
+import logging
+import os
+import threading
+import time
+
+from buildtool import (
+    CommandFactory,
+    CommandProcessor,
+    ConfigError,
+    ExecutionError,
+    check_path_exists,
+    raise_and_log_error,
+    write_to_path)
+from buildtool.serialization_support import (
+    dump_yaml,
+    load_yaml)
+
+
+DEFAULT_FLOW_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'flow_build.yml')
+
+_STEP_KEYS = frozenset(['command', 'requires', 'per_repository',
+                        'writes_bom', 'bom_from', 'options'])
+
+
+class FlowStep(object):
+  """A step in the flow declaration."""
+  # pylint: disable=too-few-public-methods
+
+  def __init__(self, name, spec):
+    spec = spec or {}
+    unknown = set(spec.keys()) - _STEP_KEYS
+    if unknown:
+      raise_and_log_error(ConfigError(
+          'Flow step "{name}" has unknown attributes {unknown}'.format(
+              name=name, unknown=sorted(unknown))))
+    self.name = name
+    self.command = spec.get('command', name)
+    self.requires = list(spec.get('requires') or [])
+    self.per_repository = bool(spec.get('per_repository', False))
+    self.writes_bom = bool(spec.get('writes_bom', False))
+    self.bom_from = spec.get('bom_from')
+    self.options = dict(spec.get('options') or {})
+
+    if self.writes_bom and self.per_repository:
+      raise_and_log_error(ConfigError(
+          'Flow step "{name}" cannot both write a bom'
+          ' and be per_repository.'.format(name=name)))
+    if self.bom_from and self.bom_from not in self.requires:
+      raise_and_log_error(ConfigError(
+          'Flow step "{name}" must require "{bom_from}"'
+          ' to take its bom from it.'.format(
+              name=name, bom_from=self.bom_from)))
+
+
+def load_flow(path):
+  """Returns the dictionary of FlowStep declared in the file, keyed by name.
+
+  Raises:
+    ConfigError if the declaration is not valid.
+  """
+  check_path_exists(path, why='flow declaration')
+  with open(path, 'r') as stream:
+    spec = load_yaml(stream) or {}
+  steps = {name: FlowStep(name, step_spec)
+           for name, step_spec in (spec.get('steps') or {}).items()}
+
+  for step in steps.values():
+    for name in step.requires:
+      if name not in steps:
+        raise_and_log_error(ConfigError(
+            'Flow step "{step}" requires unknown step "{name}"'.format(
+                step=step.name, name=name)))
+    if step.bom_from and not steps[step.bom_from].writes_bom:
+      raise_and_log_error(ConfigError(
+          'Flow step "{step}" takes its bom from "{name}"'
+          ' which does not write one.'.format(
+              step=step.name, name=step.bom_from)))
+
+  # Make sure the steps can be ordered.
+  ordered = set()
+  remaining = sorted(steps.keys())
+  while remaining:
+    ready = [name for name in remaining
+             if all(required in ordered for required in steps[name].requires)]
+    if not ready:
+      raise_and_log_error(ConfigError(
+          'Flow steps {names} have circular requirements.'.format(
+              names=remaining)))
+    ordered.update(ready)
+    remaining = [name for name in remaining if name not in ordered]
+  return steps
+
+
+class _StepState(object):
+  """Tracks the progress of a step while the flow is running."""
+  # pylint: disable=too-few-public-methods
+
+  WAITING = 'waiting'
+  RUNNING = 'running'
+  SUCCEEDED = 'succeeded'
+  FAILED = 'failed'
+  SKIPPED = 'skipped'
+  BLOCKED = 'blocked'
+
+  def __init__(self, step):
+    self.step = step
+    self.status = self.WAITING
+    self.started_repositories = set()
+    self.finished_repositories = set()
+    self.running_tasks = 0
+    self.remainder_started = False
+    self.errors = []
+    self.start_time = None
+    self.end_time = None
+
+  @property
+  def done(self):
+    return self.status in (self.SUCCEEDED, self.SKIPPED)
+
+  @property
+  def finished(self):
+    return self.status in (self.SUCCEEDED, self.SKIPPED,
+                           self.FAILED, self.BLOCKED)
+
+
+class RunFlowCommand(CommandProcessor):
+  """Runs the commands in a flow declaration."""
+
+  def __init__(self, factory, options, registry, defaults):
+    super(RunFlowCommand, self).__init__(factory, options)
+    self.__registry = registry
+    self.__defaults = defaults
+    self.__steps = load_flow(options.flow_path or DEFAULT_FLOW_PATH)
+
+    for step in self.__steps.values():
+      if step.command not in registry:
+        raise_and_log_error(ConfigError(
+            'Flow step "{name}" has unknown command "{command}"'.format(
+                name=step.name, command=step.command)))
+    skip = [name for name in (options.flow_skip_steps or '').split(',')
+            if name]
+    for name in skip:
+      if name not in self.__steps:
+        raise_and_log_error(ConfigError(
+            'Unknown flow step "{name}" in --flow_skip_steps'.format(
+                name=name)))
+
+    self.__max_repository_tasks = max(
+        1, 1 if options.one_at_a_time else options.flow_max_repository_tasks)
+    self.__condition = threading.Condition()
+    self.__states = {name: _StepState(step)
+                     for name, step in self.__steps.items()}
+    for name in skip:
+      self.__states[name].status = _StepState.SKIPPED
+
+  def bom_path_for_step(self, name):
+    """The path the step writing a bom writes its bom to."""
+    return os.path.join(self.get_output_dir(), name + '-bom.yml')
+
+  def make_step_options(self, step, only_repositories=None,
+                        exclude_repositories=None):
+    """Returns the options to run the step's command with.
+
+    These are the flow's options plus the defaults for the command's own
+    arguments, then the step's declared options.
+
+    Returns:
+      None if only_repositories was given but none of them are allowed
+      by the step's options.
+    """
+    factory = self.__registry[step.command]
+    defaults = dict(self.__defaults)
+    defaults.update({key: value for key, value in vars(self.options).items()
+                     if value is not None})
+    defaults.update(step.options)
+
+    parser = argparse.ArgumentParser(prog=step.command)
+    factory.init_argparser(parser, defaults)
+    options = copy.copy(self.options)
+    vars(options).update(vars(parser.parse_args([])))
+    vars(options).update(step.options)
+    options.command = step.command
+
+    bom_state = self.__states.get(step.bom_from)
+    if bom_state and not bom_state.status == _StepState.SKIPPED:
+      options.bom_path = self.bom_path_for_step(step.bom_from)
+      options.bom_version = None
+
+    if only_repositories is not None:
+      configured = getattr(options, 'only_repositories', None)
+      if configured:
+        allowed = configured.split(',')
+        only_repositories = [name for name in only_repositories
+                             if name in allowed]
+      if not only_repositories:
+        return None
+      options.only_repositories = ','.join(only_repositories)
+    if exclude_repositories:
+      configured = getattr(options, 'exclude_repositories', None)
+      options.exclude_repositories = ','.join(
+          sorted(set((configured or '').split(',') + exclude_repositories)
+                 - set([''])))
+    return options
+
+  def _do_command(self):
+    """Implements CommandProcessor interface."""
+    logging.info('Running flow steps %s', sorted(self.__steps.keys()))
+    with self.__condition:
+      while True:
+        self.__start_ready_work()
+        if all(state.finished for state in self.__states.values()):
+          break
+        self.__condition.wait()
+
+    for name in sorted(self.__states.keys()):
+      state = self.__states[name]
+      if state.start_time is not None:
+        logging.info('Flow step %s %s after %.1fs', name, state.status,
+                     state.end_time - state.start_time)
+      else:
+        logging.info('Flow step %s %s', name, state.status)
+
+    failed = sorted(name for name, state in self.__states.items()
+                    if state.status in (_StepState.FAILED, _StepState.BLOCKED))
+    if failed:
+      raise_and_log_error(ExecutionError(
+          'Flow steps did not complete: {names}'.format(
+              names=', '.join(failed))))
+    return {name: state.status for name, state in self.__states.items()}
+
+  def __start_ready_work(self):
+    """Start whatever can run now. Called with the condition held."""
+    for name in sorted(self.__states.keys()):
+      state = self.__states[name]
+      if state.status not in (_StepState.WAITING, _StepState.RUNNING):
+        continue
+      required = [self.__states[required_name]
+                  for required_name in state.step.requires]
+      if any(required_state.status in (_StepState.FAILED, _StepState.BLOCKED)
+             for required_state in required):
+        if state.status == _StepState.WAITING:
+          logging.error('Not running flow step %s because a requirement'
+                        ' failed.', name)
+          state.status = _StepState.BLOCKED
+        elif state.running_tasks == 0:
+          state.status = _StepState.FAILED
+          state.end_time = time.time()
+        if state.finished:
+          self.__condition.notify_all()
+        continue
+
+      if state.step.per_repository and not state.errors:
+        self.__start_ready_repositories(state, required)
+
+      if (not state.remainder_started and not state.errors
+          and all(required_state.done for required_state in required)):
+        state.remainder_started = True
+        exclude = sorted(state.started_repositories)
+        self.__start_task(
+            state, self.make_step_options(state.step,
+                                          exclude_repositories=exclude))
+
+      if state.status == _StepState.RUNNING and state.running_tasks == 0:
+        if state.errors:
+          state.status = _StepState.FAILED
+          state.end_time = time.time()
+        elif state.remainder_started:
+          state.status = _StepState.SUCCEEDED
+          state.end_time = time.time()
+          logging.info('Finished flow step %s', name)
+
+      if state.finished:
+        self.__condition.notify_all()
+
+  def __start_ready_repositories(self, state, required):
+    """Start repositories that every required step has finished."""
+    if not required:
+      return
+    candidates = set.union(
+        *[required_state.finished_repositories for required_state in required])
+    for repository_name in sorted(candidates - state.started_repositories):
+      if state.running_tasks >= self.__max_repository_tasks:
+        return
+      if all(required_state.done
+             or repository_name in required_state.finished_repositories
+             for required_state in required):
+        state.started_repositories.add(repository_name)
+        options = self.make_step_options(
+            state.step, only_repositories=[repository_name])
+        if options is not None:
+          self.__start_task(state, options)
+
+  def __start_task(self, state, options):
+    """Run the step's command with the options in another thread."""
+    if state.status == _StepState.WAITING:
+      logging.info('Starting flow step %s', state.step.name)
+      state.status = _StepState.RUNNING
+      state.start_time = time.time()
+    state.running_tasks += 1
+    thread = threading.Thread(
+        name='{0}.{1}'.format(state.step.name, state.running_tasks),
+        target=self.__run_task, args=[state, options])
+    thread.daemon = True
+    thread.start()
+
+  def __run_task(self, state, options):
+    """Runs the step's command. This is called in its own thread."""
+    step = state.step
+    error = None
+    try:
+      command = self.__registry[step.command].make_command(options)
+      if hasattr(command, 'add_repository_listener'):
+        command.add_repository_listener(
+            lambda name, result: self.__repository_finished(
+                state, command, name))
+      command()
+    except Exception as ex:  # pylint: disable=broad-except
+      logging.error('Flow step %s failed: %s', step.name, ex)
+      error = ex
+
+    with self.__condition:
+      state.running_tasks -= 1
+      if error is not None:
+        state.errors.append(error)
+      self.__condition.notify_all()
+
+  def __repository_finished(self, state, command, name):
+    """Called from a step's command as it finishes each repository."""
+    if state.step.writes_bom:
+      # Write before announcing so dependent steps see the repository.
+      # Replace the file atomically since other steps may be reading it.
+      path = self.bom_path_for_step(state.step.name)
+      write_to_path(dump_yaml(command.make_bom(),
+                              default_flow_style=False),
+                    path + '.tmp')
+      os.rename(path + '.tmp', path)
+    with self.__condition:
+      state.finished_repositories.add(name)
+      self.__condition.notify_all()
+
+
+class RunFlowFactory(CommandFactory):
+  """Creates the run_flow command."""
+
+  def __init__(self, registry, defaults):
+    super(RunFlowFactory, self).__init__(
+        'run_flow', RunFlowCommand,
+        'Run the steps declared in a flow file within a single process.',
+        registry, defaults)
+
+  def init_argparser(self, parser, defaults):
+    super(RunFlowFactory, self).init_argparser(parser, defaults)
+    self.add_argument(
+        parser, 'flow_path', defaults, None,
+        help='The YAML file declaring the flow to run.'
+             ' The default is the flow_build.yml next to this program.')
+    self.add_argument(
+        parser, 'flow_skip_steps', defaults, None,
+        help='A comma-separated list of steps to treat as already done.')
+    self.add_argument(
+        parser, 'flow_max_repository_tasks', defaults, 8, type=int,
+        help='The number of repositories that a per_repository step'
+             ' works on at the same time before its requirements finish.')
+
+
+def register_commands(registry, subparsers, defaults):
+  """Registers all the commands for this module."""
+  RunFlowFactory(registry, defaults).register(registry, subparsers, defaults)
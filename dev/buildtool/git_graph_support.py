@@ -0,0 +1,399 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Maintains an index of a repository's commit graph.
+
+Determining the version of a repository asks about the relationship between
+the current commit and the version tags. Old repositories have thousands of
+tags and each question otherwise needs to walk the history again.
+
+CommitGraphIndex records the parents of each commit along with its
+generation number (one more than the largest generation of its parents)
+so walks can stop as soon as they are below the commit they are looking for.
+The index is saved to a file so it can be reused by later commands and only
+needs to learn about commits that are new since it was last saved.
+"""
+
+import fnmatch
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+
+from buildtool import (
+    ensure_dir_exists,
+    FileLock)
+
+
+# The tags that newest_ancestor_tag considers, as a "git describe --match".
+VERSION_TAG_PATTERN = 'version-*'
+
+# The number of candidate tags newest_ancestor_tag chooses between,
+# as with the "git describe --candidates" default.
+DESCRIBE_CANDIDATES = 10
+
+# Bump this when the persisted format changes to discard older files.
+_INDEX_FORMAT_VERSION = 1
+
+
+class _AncestorWalk(object):
+  """The ancestors of a commit, discovered in generation order as needed.
+
+  Questions about a commit's ancestors can be answered by walking back only
+  as far as the generation of the commit asked about. The walk resumes
+  from where it stopped so asking many questions costs a single walk.
+  """
+
+  def __init__(self, entry_func, commit_id):
+    self.__entry = entry_func
+    self.__visited = set([commit_id])
+    self.__frontier = [(-entry_func(commit_id)[0], commit_id)]
+    self.__best = {}  # commit_id -> best_common_ancestor(commit_id)
+
+  def contains(self, commit_id):
+    """Determine if commit_id is the walk's commit or one of its ancestors."""
+    entry = self.__entry
+    floor = entry(commit_id)[0]
+    frontier = self.__frontier
+    visited = self.__visited
+    while frontier and -frontier[0][0] >= floor:
+      _, current = heapq.heappop(frontier)
+      for parent in entry(current)[2]:
+        if parent not in visited:
+          visited.add(parent)
+          heapq.heappush(frontier, (-entry(parent)[0], parent))
+    return commit_id in visited
+
+  def best_common_ancestor(self, commit_id):
+    """Returns the walk's ancestor with the largest generation that is
+    also an ancestor of commit_id, or None if they have no history in common.
+
+    The answer for each commit visited along the way is remembered so that
+    asking about other commits sharing that history is cheap.
+    """
+    entry = self.__entry
+    best = self.__best
+    pending = [commit_id]
+    while pending:
+      current = pending[-1]
+      if current in best:
+        pending.pop()
+        continue
+      if self.contains(current):
+        best[current] = current
+        pending.pop()
+        continue
+      parents = entry(current)[2]
+      missing = [parent for parent in parents if parent not in best]
+      if missing:
+        pending.extend(missing)
+        continue
+      pending.pop()
+      found = [best[parent] for parent in parents if best[parent] is not None]
+      best[current] = (max(found, key=lambda found_id: entry(found_id)[:2])
+                       if found else None)
+    return best[commit_id]
+
+
+class CommitGraphIndex(object):
+  """Answers the GitQuerySession graph queries from an in-memory index.
+
+  The index learns about commits through the session. It notices when the
+  session's refs change (e.g. after a fetch) and adds any new commits then.
+  """
+
+  @property
+  def session(self):
+    """The GitQuerySession the index reads commits through."""
+    return self.__session
+
+  @property
+  def path(self):
+    """The file the index is persisted to, or None if it is in-memory only."""
+    return self.__path
+
+  @property
+  def commit_count(self):
+    """The number of commits currently indexed."""
+    return len(self.__commits)
+
+  def __init__(self, session, path=None):
+    """Constructor.
+
+    Args:
+      session: [GitQuerySession] For reading refs and commits.
+      path: [path] If not None then load and save the index to this file.
+    """
+    self.__session = session
+    self.__path = path
+    self.__lock = threading.RLock()
+    self.__commits = {}  # commit_id -> (generation, timestamp, parent ids)
+    self.__merge_bases = {}
+    self.__last_walk = None  # (commit_id, _AncestorWalk)
+    self.__indexed_refs = None
+    self.__tags = {}  # tag name -> commit id
+    self.__annotated_tags = set()
+    self.__unsaved = False
+    if path and os.path.exists(path):
+      self.__commits = self.__read_file(path)
+      logging.debug('Loaded %d commits from %s', len(self.__commits), path)
+
+  def __read_file(self, path):
+    """Returns the commits recorded in the file, or {} if not usable."""
+    try:
+      with open(path, 'r') as stream:
+        data = json.load(stream)
+    except (IOError, ValueError) as ex:
+      logging.warning('Ignoring unreadable commit graph %s: %s', path, ex)
+      return {}
+    if data.get('version') != _INDEX_FORMAT_VERSION:
+      return {}
+    return {commit_id: (entry[0], entry[1], tuple(entry[2]))
+            for commit_id, entry in data.get('commits', {}).items()}
+
+  def update(self):
+    """Index the commits referenced by the repository's current refs.
+
+    This is cheap when the refs have not changed since the last update.
+    """
+    refs = self.__session.refs()
+    with self.__lock:
+      if refs is self.__indexed_refs:
+        return
+      tags = {}
+      annotated = set()
+      for name, entry in refs.items():
+        self.__add_commit(entry[1])
+        if name.startswith('refs/tags/'):
+          tags[name[len('refs/tags/'):]] = entry[1]
+          if entry[0] != entry[1]:
+            annotated.add(name[len('refs/tags/'):])
+      self.__tags = tags
+      self.__annotated_tags = annotated
+      self.__indexed_refs = refs
+
+      # The generations computed in a shallow repository are only meaningful
+      # within that repository so are not shared with others.
+      if (self.__unsaved and self.__path
+          and not self.__session.shallow_commits):
+        self.save()
+
+  def __add_commit(self, commit_id):
+    """Index the commit and all its ancestors that are not yet indexed."""
+    commits = self.__commits
+    if commit_id in commits:
+      return
+
+    # Walk depth first so parents get their generations before children.
+    pending = [commit_id]
+    parents_of = {}
+    while pending:
+      current = pending[-1]
+      if current in commits:
+        pending.pop()
+        continue
+      info = parents_of.get(current)
+      if info is None:
+        timestamp, parents = self.__session.commit_info(current)
+        info = parents_of[current] = (timestamp, parents)
+        missing = [parent for parent in parents if parent not in commits]
+        if missing:
+          pending.extend(missing)
+          continue
+      pending.pop()
+      timestamp, parents = info
+      generation = 1 + max([commits[parent][0] for parent in parents] or [0])
+      commits[current] = (generation, timestamp, parents)
+      self.__unsaved = True
+
+  def save(self):
+    """Write the index to its path, merging with what is already there.
+
+    Other processes may be sharing the file so it is written under a lock
+    and replaced atomically.
+    """
+    with self.__lock:
+      ensure_dir_exists(os.path.dirname(self.__path))
+      with FileLock(self.__path + '.lock'):
+        commits = (self.__read_file(self.__path)
+                   if os.path.exists(self.__path) else {})
+        commits.update(self.__commits)
+        tmp_path = self.__path + '.tmp'
+        with open(tmp_path, 'w') as stream:
+          json.dump({'version': _INDEX_FORMAT_VERSION,
+                     'commits': {commit_id: [entry[0], entry[1],
+                                             list(entry[2])]
+                                 for commit_id, entry in commits.items()}},
+                    stream, separators=(',', ':'))
+        os.rename(tmp_path, self.__path)
+        self.__unsaved = False
+      logging.debug('Saved %d commits to %s', len(commits), self.__path)
+
+  def __entry(self, commit_id):
+    """Returns the (generation, timestamp, parents) for the commit."""
+    entry = self.__commits.get(commit_id)
+    if entry is None:
+      with self.__lock:
+        self.__add_commit(commit_id)
+        entry = self.__commits[commit_id]
+    return entry
+
+  def __resolve(self, revision):
+    """Returns the indexed commit id for the revision."""
+    if revision in self.__commits:
+      return revision
+    self.update()
+    commit_id = self.__session.resolve_commit(revision) or revision
+    self.__entry(commit_id)
+    return commit_id
+
+  def __ancestors(self, commit_id):
+    """Returns the _AncestorWalk for the commit.
+
+    The most recent walk is kept because callers tend to ask about the same
+    commit repeatedly (e.g. its merge base with each of many tags).
+    """
+    with self.__lock:
+      if self.__last_walk is None or self.__last_walk[0] != commit_id:
+        self.__last_walk = (commit_id, _AncestorWalk(self.__entry, commit_id))
+      return self.__last_walk[1]
+
+  def resolve_commit(self, revision):
+    """Returns the commit id for the revision or None if not known."""
+    return self.__session.resolve_commit(revision)
+
+  def lookup_ref(self, ref):
+    """Returns the object id that the fully qualified ref names, or None."""
+    return self.__session.lookup_ref(ref)
+
+  def tag_commits(self):
+    """Returns a dictionary of tag name to the commit id it tags."""
+    self.update()
+    return self.__tags
+
+  def merge_base(self, first, second):
+    """Returns the best common ancestor of the two commits, or None.
+
+    This is the common ancestor with the largest generation.
+    """
+    first = self.__resolve(first)
+    second = self.__resolve(second)
+    key = (first, second)
+    if key in self.__merge_bases:
+      return self.__merge_bases[key]
+
+    result = self.__ancestors(first).best_common_ancestor(second)
+    with self.__lock:
+      self.__merge_bases[key] = result
+    return result
+
+  def is_ancestor(self, ancestor, descendant):
+    """Determine if ancestor is reachable from descendant."""
+    ancestor = self.__resolve(ancestor)
+    return self.__ancestors(self.__resolve(descendant)).contains(ancestor)
+
+  def __reaches(self, tip, target, floor, unreachable):
+    """Determine if target is reachable from tip.
+
+    Args:
+      floor: [int] The generation of target. Nothing below it can reach it.
+      unreachable: [set] Commits known not to reach target. If target is not
+         reachable then everything visited is added to it.
+    """
+    visited = set()
+    pending = [tip]
+    while pending:
+      current = pending.pop()
+      if current == target:
+        return True
+      if current in visited or current in unreachable:
+        continue
+      visited.add(current)
+      for parent in self.__entry(current)[2]:
+        if self.__entry(parent)[0] >= floor:
+          pending.append(parent)
+    unreachable.update(visited)
+    return False
+
+  def remote_branches_containing(self, commit_id):
+    """Returns the list of remote branch names containing the commit."""
+    commit_id = self.__resolve(commit_id)
+    floor = self.__entry(commit_id)[0]
+    unreachable = set()
+    prefix = 'refs/remotes/'
+    result = []
+    for name, entry in sorted(self.__session.refs().items()):
+      if not name.startswith(prefix) or name.endswith('/HEAD'):
+        continue
+      if self.__reaches(entry[1], commit_id, floor, unreachable):
+        result.append(name[len(prefix):])
+    return result
+
+  def newest_ancestor_tag(self, commit_id):
+    """Returns the nearest version tag in the commit's history, or None.
+
+    This gives the same answer as the GitQuerySession, which asks
+    "git describe --abbrev=0 --tags --match version-*", by following the
+    same search. Commits are visited newest committer date first. The
+    first DESCRIBE_CANDIDATES tagged commits found are the candidates and
+    the one with the fewest visited commits outside its own history wins.
+    """
+    commit_id = self.__resolve(commit_id)
+    self.update()
+
+    # Like git, each commit is named by one tag, preferring annotated tags.
+    names = {}  # commit id -> (tag, annotated)
+    for tag in sorted(self.__tags.keys()):
+      if not fnmatch.fnmatchcase(tag, VERSION_TAG_PATTERN):
+        continue
+      annotated = tag in self.__annotated_tags
+      tag_commit = self.__tags[tag]
+      if tag_commit not in names or annotated and not names[tag_commit][1]:
+        names[tag_commit] = (tag, annotated)
+    if commit_id in names:
+      return names[commit_id][0]
+
+    entry = self.__entry
+    order = itertools.count()  # Commits with the same date are first-in.
+    flags = {commit_id: 0}  # The candidates each visited commit belongs to.
+    queue = [(-entry(commit_id)[1], next(order), commit_id)]
+    candidates = []  # [depth, found order, tag, flag]
+    annotated_count = 0
+    seen_count = 0
+    while queue:
+      _, _, current = heapq.heappop(queue)
+      seen_count += 1
+      name = names.get(current)
+      if name is not None:
+        if len(candidates) == DESCRIBE_CANDIDATES:
+          break
+        flag = 1 << len(candidates)
+        candidates.append([seen_count - 1, len(candidates), name[0], flag])
+        flags[current] |= flag
+        annotated_count += 1 if name[1] else 0
+      current_flags = flags[current]
+      for candidate in candidates:
+        if not current_flags & candidate[3]:
+          candidate[0] += 1
+      if annotated_count and not queue:
+        break
+      for parent in entry(current)[2]:
+        if parent not in flags:
+          flags[parent] = 0
+          heapq.heappush(queue, (-entry(parent)[1], next(order), parent))
+        flags[parent] |= current_flags
+
+    return min(candidates)[2] if candidates else None
@@ -0,0 +1,247 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Maintains bare mirrors of git origins shared by buildtool invocations.
+
+Each buildtool command clones its own copies of the repositories it needs
+to avoid racing with other commands. Without help this means every command
+downloads the entire history of every repository. The mirror store keeps
+one bare repository per origin. Clones reference the mirror's objects
+through git alternates so only objects newer than the mirror cross the
+network, and the mirror itself is refreshed with a single fetch.
+
+The store is shared across processes so mutations are guarded by a file
+lock next to each mirror.
+"""
+
+import logging
+import os
+import re
+import shutil
+import time
+
+from buildtool import (
+    add_parser_argument,
+    ensure_dir_exists,
+    FileLock)
+from buildtool.metrics import MetricsManager
+
+
+class GitMirrorCache(object):
+  """Manages the bare mirror repositories under a root directory."""
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add parser options used by GitMirrorCache."""
+    if hasattr(parser, 'added_git_mirror'):
+      return
+    parser.added_git_mirror = True
+
+    add_parser_argument(
+        parser, 'git_mirror_dir', defaults, None,
+        help='If set, keep a bare mirror of each origin in this directory'
+             ' and clone through it so objects are only downloaded once.'
+             ' The directory can be shared by concurrent buildtool processes.')
+    add_parser_argument(
+        parser, 'git_mirror_refresh_secs', defaults, 300, type=int,
+        help='Do not refresh a mirror that was fetched more recently than'
+             ' this many seconds ago. Clones still get their refs from the'
+             ' origin itself so this only affects how much they download.')
+
+  @property
+  def root_dir(self):
+    """The directory containing all the mirrors."""
+    return self.__root_dir
+
+  def __init__(self, options, git):
+    """Constructor.
+
+    Args:
+      options: [Namespace] Configured with add_parser_args.
+      git: [GitRunner] Used to run the git commands with authentication.
+    """
+    self.__root_dir = os.path.abspath(options.git_mirror_dir)
+    self.__refresh_secs = options.git_mirror_refresh_secs
+    self.__git = git
+
+  def determine_mirror_path(self, pull_url):
+    """Returns the path to the mirror for the given origin url."""
+    normalized = self.__git.normalize_repo_url(pull_url)
+    if isinstance(normalized, tuple):
+      parts = list(normalized)
+    else:
+      parts = ['local'] + [part for part in normalized.split('/') if part]
+    parts = [re.sub(r'[^\w.-]', '_', part) for part in parts]
+    return os.path.join(self.__root_dir, *parts) + '.git'
+
+  def ensure_mirror(self, pull_url):
+    """Make sure a mirror of pull_url exists and is reasonably current.
+
+    Returns:
+      The path to the mirror or None if the mirror could not be maintained.
+      Failures are not fatal because the mirror is only an optimization.
+    """
+    mirror_path = self.determine_mirror_path(pull_url)
+    labels = {'repository': os.path.basename(mirror_path)[:-len('.git')]}
+    try:
+      with FileLock(mirror_path + '.lock'):
+        if not os.path.exists(mirror_path):
+          action = 'create'
+          func = self.__create_mirror
+        elif self.__is_stale(mirror_path):
+          action = 'refresh'
+          func = self.__refresh_mirror
+        else:
+          return mirror_path
+
+        labels['action'] = action
+        metrics = MetricsManager.singleton()
+        metrics.time_call(
+            'GitMirrorUpdate', labels,
+            metrics.default_determine_outcome_labels,
+            func, pull_url, mirror_path)
+        return mirror_path
+    except Exception as ex:
+      logging.warning('Not using git mirror for %s: %s', pull_url, ex)
+      return None
+
+  def reference_args(self, pull_url):
+    """Returns additional git clone arguments to borrow from the mirror."""
+    mirror_path = self.ensure_mirror(pull_url)
+    if not mirror_path:
+      return ''
+    return ' --reference-if-able "{path}"'.format(path=mirror_path)
+
+  def attach(self, git_dir, pull_url):
+    """Make an existing repository borrow objects from the mirror.
+
+    This is for repositories that were not cloned through the mirror,
+    or to freshen the mirror before a repository is refreshed from origin.
+    """
+    mirror_path = self.ensure_mirror(pull_url)
+    if not mirror_path:
+      return
+    objects_dir = os.path.join(mirror_path, 'objects')
+    alternates_path = self.__git.check_run(
+        git_dir, 'rev-parse --git-path objects/info/alternates')
+    if not os.path.isabs(alternates_path):
+      alternates_path = os.path.join(git_dir, alternates_path)
+
+    existing = []
+    if os.path.exists(alternates_path):
+      with open(alternates_path, 'r') as stream:
+        existing = [line.strip() for line in stream.readlines()]
+    if objects_dir in existing:
+      return
+
+    logging.debug('Attaching %s to mirror %s', git_dir, mirror_path)
+    ensure_dir_exists(os.path.dirname(alternates_path))
+    with open(alternates_path, 'a') as stream:
+      stream.write(objects_dir + '\n')
+
+  def record_clone_savings(self, name, git_dir, pull_url):
+    """Report what a clone made from the mirror saved over a direct clone."""
+    mirror_path = self.determine_mirror_path(pull_url)
+    if not os.path.exists(mirror_path):
+      return
+    try:
+      mirror_bytes = self.__count_pack_bytes(mirror_path)
+      own_bytes = self.__count_pack_bytes(git_dir)
+      bytes_per_sec = self.__git.run_git(
+          mirror_path, 'config --get buildtool.bytespersec')[1]
+    except Exception as ex:
+      logging.warning('Could not determine mirror savings for %s: %s',
+                      git_dir, ex)
+      return
+
+    saved_bytes = max(0, mirror_bytes - own_bytes)
+    labels = {'repository': name}
+    metrics = MetricsManager.singleton()
+    metrics.inc_counter('GitMirrorBytesSaved', labels, amount=saved_bytes)
+    if bytes_per_sec and float(bytes_per_sec) > 0:
+      saved_secs = saved_bytes / float(bytes_per_sec)
+      metrics.inc_counter('GitMirrorSecondsSaved', labels, amount=saved_secs)
+    logging.debug('Cloning %s through mirror saved %d bytes', name, saved_bytes)
+
+  def __is_stale(self, mirror_path):
+    """Determine if the mirror should be fetched again."""
+    stamp_path = os.path.join(mirror_path, 'FETCH_HEAD')
+    if not os.path.exists(stamp_path):
+      return True
+    return time.time() - os.path.getmtime(stamp_path) >= self.__refresh_secs
+
+  def __create_mirror(self, pull_url, mirror_path):
+    """Create a new mirror at mirror_path.
+
+    This is not a "clone --mirror" because we only want the branches and tags.
+    Hosted origins publish other refs (e.g. pull requests) that we never use.
+    The mirror is assembled in a temporary directory then renamed so other
+    processes never see a partial mirror.
+    """
+    logging.info('Creating git mirror of %s in %s', pull_url, mirror_path)
+    tmp_path = mirror_path + '.tmp'
+    if os.path.exists(tmp_path):
+      shutil.rmtree(tmp_path)
+    ensure_dir_exists(tmp_path)
+
+    git = self.__git
+    try:
+      git.check_run_sequence(tmp_path, [
+          'init --bare -q',
+          'remote add origin ' + pull_url,
+          'config --replace-all remote.origin.fetch'
+          ' "+refs/heads/*:refs/heads/*"',
+          'config --add remote.origin.fetch "+refs/tags/*:refs/tags/*"',
+          # Clones borrow objects through alternates so the mirror
+          # must never discard objects, even if they become unreachable.
+          'config gc.pruneExpire never',
+          'config gc.reflogExpireUnreachable never'])
+      self.__fetch(tmp_path)
+      os.rename(tmp_path, mirror_path)
+    except Exception:
+      shutil.rmtree(tmp_path, ignore_errors=True)
+      raise
+
+  def __refresh_mirror(self, pull_url, mirror_path):
+    """Fetch new objects into the existing mirror."""
+    logging.debug('Refreshing git mirror of %s in %s', pull_url, mirror_path)
+    self.__fetch(mirror_path)
+
+  def __fetch(self, mirror_path):
+    """Fetch the mirror and remember the observed network throughput.
+
+    The throughput is used to estimate the time that clones save.
+    """
+    before_bytes = self.__count_pack_bytes(mirror_path)
+    start_time = time.time()
+    self.__git.check_run(mirror_path, 'fetch --prune --tags -q origin')
+    secs = time.time() - start_time
+    fetched_bytes = self.__count_pack_bytes(mirror_path) - before_bytes
+
+    # Tiny fetches are dominated by latency so do not reflect throughput.
+    if fetched_bytes > 1024 * 1024 and secs > 0:
+      self.__git.check_run(
+          mirror_path, 'config buildtool.bytespersec {0}'.format(
+              int(fetched_bytes / secs)))
+
+  def __count_pack_bytes(self, git_dir):
+    """Returns the number of bytes in git_dir's own object store."""
+    text = self.__git.check_run(git_dir, 'count-objects -v')
+    values = {}
+    for line in text.split('\n'):
+      key, _, value = line.partition(':')
+      values[key.strip()] = value.strip()
+    kib = int(values.get('size', 0)) + int(values.get('size-pack', 0))
+    return kib * 1024
+
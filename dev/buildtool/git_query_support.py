@@ -0,0 +1,411 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Answers read-only questions about the commit graph of a local repository.
+
+Analyzing a repository asks many small questions (what commit is this ref,
+where do these two commits meet, which branches contain this commit).
+Asking git each of these as a separate command costs a process per question.
+GitQuerySession instead keeps a pair of "git cat-file" processes open for
+the repository and answers the graph questions in python from the commit
+objects it reads through them.
+
+GitCommandQueries answers the same questions with individual git commands.
+It is the original behavior and serves as the baseline to compare against.
+"""
+
+import heapq
+import logging
+import os
+import subprocess
+import threading
+
+from buildtool import (
+    raise_and_log_error,
+    ExecutionError,
+    UnexpectedError)
+
+
+# Flags used when painting the graph to find merge bases.
+_PARENT1 = 0x1
+_PARENT2 = 0x2
+_STALE = 0x4
+_RESULT = 0x8
+
+
+def read_shallow_commits(git_dir):
+  """Returns the set of commits whose parents were not fetched into git_dir.
+
+  This is empty unless git_dir is a shallow clone.
+  """
+  for path in [os.path.join(git_dir, '.git', 'shallow'),
+               os.path.join(git_dir, 'shallow')]:
+    if os.path.exists(path):
+      with open(path, 'r') as stream:
+        return set(line.strip() for line in stream if line.strip())
+  return set()
+
+
+class GitCommandQueries(object):
+  """Implements the repository queries by running a git command for each."""
+
+  def __init__(self, git, git_dir):
+    """Constructor.
+
+    Args:
+      git: [GitRunner] For running the git commands.
+      git_dir: [path] The local repository to query.
+    """
+    self.__git = git
+    self.__git_dir = git_dir
+
+  def resolve_commit(self, revision):
+    """Returns the commit id for the revision or None if not known."""
+    retcode, stdout = self.__git.run_git(
+        self.__git_dir, 'rev-list -n 1 ' + revision)
+    return stdout if retcode == 0 else None
+
+  def lookup_ref(self, ref):
+    """Returns the object id that the fully qualified ref names, or None."""
+    retcode, stdout = self.__git.run_git(
+        self.__git_dir, 'show-ref --verify ' + ref)
+    return stdout.split(' ')[0] if retcode == 0 else None
+
+  def remote_branches_containing(self, commit_id):
+    """Returns the list of remote branch names containing the commit."""
+    text = self.__git.check_run(
+        self.__git_dir, 'branch -r --contains {id}'.format(id=commit_id))
+    return [line.strip() for line in text.split('\n') if line.strip()]
+
+  def newest_ancestor_tag(self, commit_id):
+    """Returns the most recent version tag in the commit's history, or None."""
+    retcode, stdout = self.__git.run_git(
+        self.__git_dir,
+        'describe --abbrev=0 --tags --match version-* ' + commit_id)
+    return stdout if retcode == 0 else None
+
+  def merge_base(self, first, second):
+    """Returns the best common ancestor of the two commits."""
+    return self.__git.check_run(
+        self.__git_dir, 'merge-base {first} {second}'.format(
+            first=first, second=second))
+
+
+class GitQuerySession(object):
+  """Implements the repository queries using long lived git processes.
+
+  There is a "cat-file --batch-check" process for resolving names to
+  object ids and a "cat-file --batch" process for reading commit objects.
+  Commits never change so what is learned about them is remembered for the
+  life of the session. Refs do change, so the ref listing is discarded
+  whenever invalidate_refs is called. In a shallow repository the commits
+  at the shallow boundary are treated as if they had no parents. Sessions
+  should be discarded once the boundary changes (e.g. by deepening).
+
+  Sessions are thread-safe though queries are serialized.
+  """
+
+  @property
+  def git_dir(self):
+    """The repository this session is querying."""
+    return self.__git_dir
+
+  def __init__(self, git_dir):
+    self.__git_dir = git_dir
+    self.__lock = threading.RLock()
+    self.__batch_check = None
+    self.__batch = None
+    self.__refs = None
+    self.__refs_fingerprint_value = None
+    self.__commits = {}  # commit_id -> (committer timestamp, parent ids)
+    self.__merge_bases = {}  # (commit_id, commit_id) -> commit_id
+    self.__shallow_commits = read_shallow_commits(git_dir)
+    self.__spawn_count = 0
+
+  @property
+  def shallow_commits(self):
+    """The commits whose parents are not in the repository."""
+    return self.__shallow_commits
+
+  @property
+  def spawn_count(self):
+    """The number of git processes this session has started."""
+    return self.__spawn_count
+
+  def close(self):
+    """Terminate the git processes."""
+    with self.__lock:
+      for process in [self.__batch_check, self.__batch]:
+        if process is None:
+          continue
+        try:
+          process.stdin.close()
+          process.wait()
+        except (IOError, OSError):
+          pass
+        process.stdout.close()
+        process.stderr.close()
+      self.__batch_check = None
+      self.__batch = None
+
+  def invalidate_refs(self):
+    """Forget the refs because the repository may have been modified."""
+    with self.__lock:
+      self.__refs = None
+
+  def __start(self, args):
+    """Start a long lived git process in the session's repository."""
+    cmd = ['git', '-C', self.__git_dir] + args
+    logging.debug('Starting git query session process %s', ' '.join(cmd))
+    self.__spawn_count += 1
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            close_fds=True)
+
+  def __request(self, which, name):
+    """Write a request line to a batch process and read the header back."""
+    process = getattr(self, '_GitQuerySession__' + which)
+    if process is None:
+      args = ['cat-file', '--batch' if which == 'batch' else '--batch-check']
+      process = self.__start(args)
+      setattr(self, '_GitQuerySession__' + which, process)
+
+    try:
+      process.stdin.write(name.encode('utf-8') + b'\n')
+      process.stdin.flush()
+      header = process.stdout.readline().decode('utf-8').rstrip('\n')
+    except (IOError, OSError) as ex:
+      setattr(self, '_GitQuerySession__' + which, None)
+      raise_and_log_error(
+          ExecutionError('git cat-file in {dir} failed: {ex}'.format(
+              dir=self.__git_dir, ex=ex), program='git'))
+    if not header:
+      setattr(self, '_GitQuerySession__' + which, None)
+      raise_and_log_error(
+          ExecutionError('git cat-file in {dir} exited unexpectedly'.format(
+              dir=self.__git_dir), program='git'))
+    return process, header
+
+  def resolve_commit(self, revision):
+    """Returns the commit id for the revision or None if not known."""
+    with self.__lock:
+      _, header = self.__request('batch_check', revision + '^{commit}')
+    parts = header.split(' ')
+    if len(parts) != 3 or parts[1] != 'commit':
+      return None
+    return parts[0]
+
+  def __refs_fingerprint(self):
+    """Returns a value that changes whenever the repository's refs change.
+
+    This notices changes made by git commands run outside the GitRunner
+    (e.g. by build tools tagging the repository) without asking git.
+    Ref updates replace files so the inode identifies their version.
+    """
+    common_dir = os.path.join(self.__git_dir, '.git')
+    if not os.path.isdir(common_dir):
+      common_dir = self.__git_dir
+    if not os.path.isdir(os.path.join(common_dir, 'refs')):
+      return None  # Unknown layout so rely on invalidate_refs.
+
+    paths = [os.path.join(common_dir, 'packed-refs')]
+    for dir_path, _, file_names in os.walk(os.path.join(common_dir, 'refs')):
+      paths.extend(os.path.join(dir_path, name) for name in file_names)
+
+    fingerprint = []
+    for path in paths:
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue  # Does not exist or was removed while we were looking.
+      fingerprint.append((path, stat.st_ino, stat.st_mtime, stat.st_size))
+    return tuple(fingerprint)
+
+  def refs(self):
+    """Returns a dictionary of ref name to (object id, peeled commit id)."""
+    with self.__lock:
+      fingerprint = self.__refs_fingerprint()
+      if fingerprint != self.__refs_fingerprint_value:
+        self.__refs = None
+      if self.__refs is None:
+        self.__spawn_count += 1
+        process = subprocess.Popen(
+            ['git', '-C', self.__git_dir, 'for-each-ref',
+             '--format=%(objectname) %(*objectname) %(refname)'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+        stdout, stderr = process.communicate()
+        if process.returncode:
+          raise_and_log_error(
+              ExecutionError('git for-each-ref in {dir} failed: {err}'.format(
+                  dir=self.__git_dir, err=stderr.decode('utf-8')),
+                             program='git'))
+        refs = {}
+        for line in stdout.decode('utf-8').split('\n'):
+          if not line:
+            continue
+          object_id, peeled_id, name = line.split(' ', 2)
+          refs[name] = (object_id, peeled_id or object_id)
+        self.__refs = refs
+        self.__refs_fingerprint_value = fingerprint
+      return self.__refs
+
+  def lookup_ref(self, ref):
+    """Returns the object id that the fully qualified ref names, or None."""
+    entry = self.refs().get(ref)
+    return entry[0] if entry else None
+
+  def newest_ancestor_tag(self, commit_id):
+    """Returns the most recent version tag in the commit's history, or None."""
+    self.__spawn_count += 1
+    process = subprocess.Popen(
+        ['git', '-C', self.__git_dir, 'describe', '--abbrev=0', '--tags',
+         '--match', 'version-*', commit_id],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+    stdout, _ = process.communicate()
+    return stdout.decode('utf-8').strip() if process.returncode == 0 else None
+
+  def commit_info(self, commit_id):
+    """Returns (committer timestamp, parent commit ids) for the commit."""
+    info = self.__commits.get(commit_id)
+    if info is not None:
+      return info
+
+    with self.__lock:
+      process, header = self.__request('batch', commit_id)
+      parts = header.split(' ')
+      if len(parts) != 3:
+        raise_and_log_error(
+            UnexpectedError('Unknown commit {id} in {dir}: {header}'.format(
+                id=commit_id, dir=self.__git_dir, header=header)))
+      content = process.stdout.read(int(parts[2]) + 1)
+
+    parents = []
+    timestamp = 0
+    for line in content.split(b'\n'):
+      if not line:
+        break  # end of headers
+      if line.startswith(b'parent '):
+        parents.append(line[7:].decode('ascii'))
+      elif line.startswith(b'committer '):
+        timestamp = int(line.rsplit(b' ', 2)[1])
+    if commit_id in self.__shallow_commits:
+      parents = []
+    info = (timestamp, tuple(parents))
+    with self.__lock:
+      self.__commits[commit_id] = info
+    return info
+
+  def merge_base(self, first, second):
+    """Returns the best common ancestor of the two commits, or None.
+
+    This paints the commits reachable from each side in committer date
+    order, the same strategy that "git merge-base" uses, and stops once
+    everything left to visit is known to be below a common ancestor.
+    """
+    first = self.resolve_commit(first) or first
+    second = self.resolve_commit(second) or second
+    if first == second:
+      return first
+    key = (first, second)
+    if key in self.__merge_bases:
+      return self.__merge_bases[key]
+
+    commit_info = self.commit_info
+    flags = {first: _PARENT1, second: _PARENT2}
+    queue = []
+    queued = {}  # Number of entries for each commit in the queue.
+    for commit_id in (first, second):
+      heapq.heappush(queue, (-commit_info(commit_id)[0], commit_id))
+      queued[commit_id] = 1
+    non_stale = len(queue)
+
+    results = []
+    while non_stale:
+      _, commit_id = heapq.heappop(queue)
+      queued[commit_id] -= 1
+      commit_flags = flags[commit_id] & (_PARENT1 | _PARENT2 | _STALE)
+      if not commit_flags & _STALE:
+        non_stale -= 1
+      if commit_flags == (_PARENT1 | _PARENT2):
+        if not flags[commit_id] & _RESULT:
+          flags[commit_id] |= _RESULT
+          results.append(commit_id)
+        commit_flags |= _STALE
+
+      for parent in commit_info(commit_id)[1]:
+        parent_flags = flags.get(parent, 0)
+        if parent_flags & commit_flags == commit_flags:
+          continue
+        if commit_flags & _STALE and not parent_flags & _STALE:
+          # Entries already queued for the parent are stale now too.
+          non_stale -= queued.get(parent, 0)
+        flags[parent] = parent_flags | commit_flags
+        heapq.heappush(queue, (-commit_info(parent)[0], parent))
+        queued[parent] = queued.get(parent, 0) + 1
+        if not commit_flags & _STALE:
+          non_stale += 1
+
+    # A result reached again from another result is not a best ancestor.
+    best = [commit_id for commit_id in results
+            if not flags[commit_id] & _STALE]
+    if len(best) > 1:
+      best = self.__remove_redundant(best)
+    result = best[0] if best else None
+    with self.__lock:
+      self.__merge_bases[key] = result
+    return result
+
+  def __remove_redundant(self, candidates):
+    """Returns the candidates that are not ancestors of another candidate.
+
+    Painting stops once only stale commits remain, which can be before the
+    staleness of a later result reaches an earlier one when their committer
+    dates tie. Like "git merge-base" we check the candidates explicitly.
+    The walk does not stop at older committer dates since those are not
+    reliable with clock skew or rebased history.
+    """
+    commit_info = self.commit_info
+    redundant = set()
+    # The ancestors of a commit already visited were already checked,
+    # so each commit is visited at most once across all the candidates.
+    visited = set()
+    for commit_id in candidates:
+      if commit_id in redundant:
+        continue
+      pending = list(commit_info(commit_id)[1])
+      while pending:
+        ancestor = pending.pop()
+        if ancestor in visited:
+          continue
+        visited.add(ancestor)
+        if ancestor in candidates:
+          redundant.add(ancestor)
+        pending.extend(commit_info(ancestor)[1])
+    return [commit_id for commit_id in candidates
+            if commit_id not in redundant]
+
+  def is_ancestor(self, ancestor, descendant):
+    """Determine if ancestor is reachable from descendant."""
+    return self.merge_base(ancestor, descendant) == ancestor
+
+  def remote_branches_containing(self, commit_id):
+    """Returns the list of remote branch names containing the commit."""
+    prefix = 'refs/remotes/'
+    result = []
+    for name, entry in sorted(self.refs().items()):
+      if not name.startswith(prefix) or name.endswith('/HEAD'):
+        continue
+      if self.is_ancestor(commit_id, entry[1]):
+        result.append(name[len(prefix):])
+    return result
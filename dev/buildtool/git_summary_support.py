@@ -0,0 +1,180 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remembers repository summaries across buildtool commands.
+
+Several commands summarize the same repositories at the same commits.
+A summary is entirely determined by the commit being summarized, the
+optional base commit, the refs used to find the previous version, and the
+rules used to classify commit messages. RepositorySummaryCache stores each
+summary under a hash of these so it can be reused without running git.
+
+The refs are read directly from the repository's files for the same
+reason. Repositories whose layout is not understood are simply not cached.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from buildtool import ensure_dir_exists
+from buildtool.metrics import MetricsManager
+
+
+# Bump this when the stored format or the way summaries are computed changes.
+_CACHE_FORMAT_VERSION = 1
+
+
+def read_git_refs(git_dir):
+  """Returns a dictionary of ref name to object id without running git.
+
+  Returns:
+    None if git_dir is not a repository laid out the way we expect.
+  """
+  common_dir = os.path.join(git_dir, '.git')
+  if not os.path.isdir(os.path.join(common_dir, 'refs')):
+    return None
+
+  refs = {}
+  packed_path = os.path.join(common_dir, 'packed-refs')
+  if os.path.exists(packed_path):
+    with open(packed_path, 'r') as stream:
+      for line in stream:
+        if line.startswith('#') or line.startswith('^'):
+          continue  # header or peeled id of the previous tag
+        parts = line.split()
+        if len(parts) == 2:
+          refs[parts[1]] = parts[0]
+
+  # Loose refs take precedence over packed ones.
+  for dir_path, _, file_names in os.walk(os.path.join(common_dir, 'refs')):
+    for name in file_names:
+      path = os.path.join(dir_path, name)
+      with open(path, 'r') as stream:
+        value = stream.read().strip()
+      if value.startswith('ref:'):
+        continue  # symbolic refs (e.g. origin/HEAD) do not add information
+      refs[os.path.relpath(path, common_dir).replace(os.sep, '/')] = value
+  return refs
+
+
+def read_git_head(git_dir, refs):
+  """Returns the commit id of HEAD without running git, or None if unknown.
+
+  Args:
+    refs: [dict] The refs returned by read_git_refs.
+  """
+  try:
+    with open(os.path.join(git_dir, '.git', 'HEAD'), 'r') as stream:
+      value = stream.read().strip()
+  except IOError:
+    return None
+  if value.startswith('ref:'):
+    return refs.get(value[len('ref:'):].strip())
+  return value or None
+
+
+class RepositorySummaryCache(object):
+  """Stores repository summaries in a directory shared by commands.
+
+  Entries are dictionaries in the form of RepositorySummary.to_dict.
+  """
+
+  @property
+  def cache_dir(self):
+    """The directory holding the cache entries."""
+    return self.__cache_dir
+
+  def __init__(self, cache_dir, classifiers):
+    """Constructor.
+
+    Args:
+      cache_dir: [path] The directory to keep the entries in.
+      classifiers: [list of re] The regular expressions that determine
+         the summaries (e.g. how commit messages affect the version).
+         Entries made with different expressions are not used.
+    """
+    self.__cache_dir = cache_dir
+    digest = hashlib.sha1()
+    digest.update(str(_CACHE_FORMAT_VERSION).encode('utf-8'))
+    for regex in classifiers:
+      digest.update('\n{flags} {pattern}'.format(
+          flags=regex.flags, pattern=regex.pattern).encode('utf-8'))
+    self.__classifier_version = digest.hexdigest()
+
+  def make_key(self, git_dir, base_commit_id=None, allow_no_baseline_tag=True):
+    """Returns the key for summarizing git_dir as it is now.
+
+    Args:
+      git_dir: [path] The repository being summarized.
+      base_commit_id: [string] The base commit the summary is relative to.
+      allow_no_baseline_tag: [bool] The --git_allow_no_baseline_tag
+         that the summary is computed with.
+
+    Returns:
+      None if the key could not be determined without running git.
+    """
+    refs = read_git_refs(git_dir)
+    head = read_git_head(git_dir, refs) if refs is not None else None
+    if head is None:
+      return None
+
+    # The summary depends on the version tags and the branches used
+    # to decide which of them are relevant.
+    relevant = sorted(
+        (name, object_id) for name, object_id in refs.items()
+        if (name.startswith('refs/tags/version-')
+            or name.startswith('refs/remotes/')
+            or name == 'refs/heads/master'))
+    digest = hashlib.sha1()
+    for name, object_id in relevant:
+      digest.update('{0} {1}\n'.format(object_id, name).encode('utf-8'))
+    return hashlib.sha1('\n'.join([
+        head, base_commit_id or '', str(bool(allow_no_baseline_tag)),
+        digest.hexdigest(), self.__classifier_version]).encode('utf-8')).hexdigest()
+
+  def __path(self, key):
+    return os.path.join(self.__cache_dir, key[:2], key + '.json')
+
+  def lookup(self, key, name=None):
+    """Returns the summary dictionary stored under key, or None."""
+    path = self.__path(key)
+    data = None
+    if os.path.exists(path):
+      try:
+        with open(path, 'r') as stream:
+          data = json.load(stream)
+      except (IOError, ValueError) as ex:
+        logging.warning('Ignoring unreadable summary cache entry %s: %s',
+                        path, ex)
+
+    labels = {'repository': name or '', 'result': 'hit' if data else 'miss'}
+    MetricsManager.singleton().inc_counter('RepositorySummaryCache', labels)
+    return data
+
+  def store(self, key, data):
+    """Stores the summary dictionary under key.
+
+    Concurrent commands may store the same entry. Since entries with the
+    same key are identical, it does not matter which is written last.
+    """
+    path = self.__path(key)
+    ensure_dir_exists(os.path.dirname(path))
+    tmp_path = '{path}.{pid}.{thread}.tmp'.format(
+        path=path, pid=os.getpid(), thread=threading.current_thread().ident)
+    with open(tmp_path, 'w') as stream:
+      json.dump(data, stream, separators=(',', ':'))
+    os.rename(tmp_path, path)
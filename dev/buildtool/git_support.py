@@ -18,17 +18,18 @@
 
 # pylint: disable=logging-format-interpolation
 
+import atexit
 import collections
 import logging
 import os
 import re
 import tempfile
+import threading
 import time
 
 # pylint: disable=no-name-in-module
 # pylint: disable=import-error
 from distutils.version import LooseVersion
-import yaml
 
 from buildtool import (
     add_parser_argument,
@@ -37,10 +38,20 @@ from buildtool import (
     ensure_dir_exists,
     log_embedded_output,
     run_subprocess,
+    start_subprocess,
     raise_and_log_error,
     ConfigError,
     ExecutionError,
     UnexpectedError)
+from buildtool.git_graph_support import CommitGraphIndex
+from buildtool.git_mirror_support import GitMirrorCache
+from buildtool.git_query_support import (
+    GitCommandQueries,
+    GitQuerySession,
+    read_shallow_commits)
+from buildtool.git_summary_support import RepositorySummaryCache
+from buildtool.metrics import MetricsManager
+from buildtool.serialization_support import dump_yaml
 
 
 class GitRepositorySpec(object):
@@ -341,6 +352,16 @@ class CommitMessage(
                  re.MULTILINE)
   ]
 
+  # All the expressions that influence how commits are interpreted.
+  # Cached interpretations are only valid while these remain the same.
+  CLASSIFIER_REGEXS = (
+      [_MEDIUM_PRETTY_COMMIT_MATCHER, _EMBEDDED_COMMIT_MATCHER,
+       _EMBEDDED_SUMMARY_MATCHER]
+      + DEFAULT_PATCH_REGEXS + DEFAULT_MINOR_REGEXS + DEFAULT_MAJOR_REGEXS)
+
+  # The "git log" format read by iter_from_log_stream.
+  LOG_FIELDS_FORMAT = 'format:%H%x00%an <%ae>%x00%ad%x00%B'
+
   @staticmethod
   def make_list_from_result(response_text):
     """Returns a list of CommitMessage from the command response.
@@ -363,9 +384,29 @@ class CommitMessage(
           UnexpectedError('Unexpected commit entry {0}'.format(entry)))
 
     text = entry[match.end(3):]
+    return CommitMessage(match.group(1), match.group(2), match.group(3),
+                         CommitMessage._trim_message_lines(text.split('\n')))
+
+  @staticmethod
+  def make_from_fields(commit_id, author, date, body):
+    """Create a new CommitMessage from the raw fields of a commit.
+
+    The message is indented the way "git log --pretty=medium" shows it
+    so that these are the same as the ones created by make().
 
+    Args:
+      body: [string] The raw commit message (e.g. git's %B format).
+    """
+    lines = ['    ' + line for line in body.split('\n')]
+    return CommitMessage(commit_id, author, date,
+                         CommitMessage._trim_message_lines(lines))
+
+  @staticmethod
+  def _trim_message_lines(lines):
+    """Joins message lines without trailing spaces or surrounding blank lines.
+    """
     # strip trailing spaces on each line
-    lines = [line.rstrip() for line in text.split('\n')]
+    lines = [line.rstrip() for line in lines]
 
     # remove blank lines from beginning and end of text
     while lines and not lines[0]:
@@ -374,9 +415,36 @@ class CommitMessage(
       del lines[-1]
 
     # new string may have initial spacing but no leading/trailing blank lines.
-    text = '\n'.join(lines)
+    return '\n'.join(lines)
 
-    return CommitMessage(match.group(1), match.group(2), match.group(3), text)
+  @staticmethod
+  def iter_from_log_stream(stream, chunk_size=64 * 1024):
+    """Yields CommitMessage as they are read from a "git log" output stream.
+
+    Only one chunk and the commit being parsed are held in memory at a time.
+
+    Args:
+      stream: [binary file] The output of "git log -z" with the
+         LOG_FIELDS_FORMAT pretty format.
+    """
+    num_fields = 4
+    fields = []
+    remainder = b''
+    while True:
+      chunk = stream.read(chunk_size)
+      tokens = (remainder + chunk).split(b'\0')
+      remainder = tokens.pop() if chunk else b''
+      for token in tokens:
+        fields.append(token.decode('utf-8'))
+        if len(fields) == num_fields:
+          yield CommitMessage.make_from_fields(*fields)
+          fields = []
+      if not chunk:
+        break
+
+    if fields and fields != ['']:
+      raise_and_log_error(
+          UnexpectedError('Truncated commit log entry {0}'.format(fields)))
 
   @staticmethod
   def normalize_message_list(msg_list):
@@ -386,9 +454,13 @@ class CommitMessage(
     as indicated by a message that looks like multiple entires.
     This will break apart those compound commits into individual ones for
     the same commit id entry for easier processing.
+
+    Args:
+      msg_list: [iterable of CommitMessage] This is consumed one at a time
+         so can be a generator such as iter_from_log_stream.
     """
     msg_list = CommitMessage._unpack_embedded_commits(msg_list)
-    return CommitMessage._unpack_embedded_summaries(msg_list)
+    return list(CommitMessage._unpack_embedded_summaries(msg_list))
 
   @staticmethod
   def _unpack_embedded_commits(msg_list):
@@ -397,13 +469,13 @@ class CommitMessage(
     These are indicated by having an embedded commit within them.
     If found, unnest the indentation and run through as if these
     came directly from a git result to turn them into additional commits.
+    This is a generator over the transformed messages.
     """
-    result = []
     for commit_message in msg_list:
       text = commit_message.message
       found = CommitMessage._EMBEDDED_COMMIT_MATCHER.search(text)
       if not found:
-        result.append(commit_message)
+        yield commit_message
         continue
 
       text_before = text[:found.start(1)]
@@ -420,16 +492,16 @@ class CommitMessage(
               '"%s" looks like an composite commit, but not indented by %d.',
               text, offset)
           pruned_lines = []
-          result.append(commit_message)
+          yield commit_message
           break
 
       if pruned_lines:
         if text_before.strip():
           logging.info('Dropping commit message "%s" in favor of "%s"',
                        text_before, '\n'.join(pruned_lines))
-        result.extend(
-            CommitMessage.make_list_from_result('\n'.join(pruned_lines)))
-    return result
+        for embedded in CommitMessage.make_list_from_result(
+            '\n'.join(pruned_lines)):
+          yield embedded
 
   @staticmethod
   def _unpack_embedded_summaries(msg_list):
@@ -443,8 +515,8 @@ class CommitMessage(
 
     Note that embedded summaries all originated from an atomic commit, so
     all the resulting CommitMessages will have the same underlying commit id.
+    This is a generator over the transformed messages.
     """
-    result = []
     for commit_message in msg_list:
       commit_id = commit_message.commit_id
       author = commit_message.author
@@ -458,29 +530,36 @@ class CommitMessage(
                         line, prev)
           if prev >= 0:
             text = '\n'.join(lines[prev:index]).rstrip()
-            result.append(CommitMessage(commit_id, author, date, text))
+            yield CommitMessage(commit_id, author, date, text)
           prev = index
       if prev < 0:
         prev = 0
       text = '\n'.join(lines[prev:]).rstrip()
-      result.append(CommitMessage(commit_id, author, date, text))
-
-    return result
+      yield CommitMessage(commit_id, author, date, text)
 
   @staticmethod
   def determine_semver_implication_on_list(
       msg_list, major_regexs=None, minor_regexs=None, patch_regexs=None,
       default_semver_index=SemanticVersion.MINOR_INDEX):
-    """Determine the worst case semvar component that needs incremented."""
-    if not msg_list:
-      return None
-    msi = SemanticVersion.PATCH_INDEX + 1
+    """Determine the worst case semvar component that needs incremented.
+
+    Args:
+      msg_list: [iterable of CommitMessage] This is consumed one at a time
+         and only until a MAJOR change is found.
+
+    Returns:
+      None if there were no messages.
+    """
+    msi = None
     for commit_message in msg_list:
-      msi = min(msi, commit_message.determine_semver_implication(
+      implication = commit_message.determine_semver_implication(
           major_regexs=major_regexs,
           minor_regexs=minor_regexs,
           patch_regexs=patch_regexs,
-          default_semver_index=default_semver_index))
+          default_semver_index=default_semver_index)
+      msi = implication if msi is None else min(msi, implication)
+      if msi == SemanticVersion.MAJOR_INDEX:
+        break  # Nothing can be worse.
     return msi
 
   def determine_semver_implication(
@@ -536,7 +615,7 @@ class CommitMessage(
   def to_yaml(self):
     """Convert the summary to a yaml string."""
     data = dict(self._asdict())
-    return yaml.safe_dump(data, default_flow_style=False)
+    return dump_yaml(data, default_flow_style=False)
 
   def _asdict(self):
     """Override broken method in some Python3
@@ -591,16 +670,20 @@ class RepositorySummary(collections.namedtuple(
                   prev=self.prev_version, current=self.version)))
     return True
 
-  def to_yaml(self, with_commit_messages=True):
-    """Convert the summary to a yaml string."""
+  def to_dict(self, with_commit_messages=True):
+    """Convert the summary to the dictionary that from_dict expects."""
     data = dict(self._asdict())
     if with_commit_messages:
       data['commit_messages'] = [dict(m._asdict())
                                  for m in data['commit_messages']]
     else:
       del data['commit_messages']
+    return data
 
-    return yaml.safe_dump(data, default_flow_style=False)
+  def to_yaml(self, with_commit_messages=True):
+    """Convert the summary to a yaml string."""
+    return dump_yaml(self.to_dict(with_commit_messages=with_commit_messages),
+                     default_flow_style=False)
 
   def _asdict(self):
     """Override broken method in some Python3
@@ -621,6 +704,37 @@ class GitRunner(object):
 
   __GITHUB_TOKEN = None
 
+  # Query sessions are shared by all the runners, keyed by git_dir.
+  __QUERY_SESSIONS = {}
+  __QUERY_SESSIONS_LOCK = threading.Lock()
+
+  # Commit graph indexes are shared the same way as the query sessions
+  # they are built on.
+  __COMMIT_GRAPHS = {}
+
+  # Additional "git clone" arguments for each --git_clone_mode.
+  CLONE_MODE_ARGS = {
+      'full': '',
+      'blobless': ' --filter=blob:none',
+      'treeless': ' --filter=tree:0',
+      'shallow': ' --depth {depth} --no-single-branch'
+  }
+
+  # How many times to deepen a shallow repository looking for history
+  # before giving up and fetching all of it.
+  MAX_DEEPEN_ATTEMPTS = 5
+
+  # When fetching history as old as a commit, also fetch this much older
+  # to allow for clock skew between committers.
+  SHALLOW_SINCE_MARGIN_SECS = 7 * 24 * 60 * 60
+
+  # Git commands that do not modify refs in the repository they run in.
+  # Anything else invalidates the refs known to the repository's query session.
+  __READ_ONLY_COMMANDS = frozenset([
+      'cat-file', 'config', 'count-objects', 'describe', 'diff',
+      'for-each-ref', 'log', 'ls-remote', 'merge-base', 'rev-list',
+      'rev-parse', 'show', 'show-ref', 'status'])
+
   @staticmethod
   def add_parser_args(parser, defaults):
     """Add standard parser options used by GitRunner."""
@@ -655,6 +769,45 @@ class GitRunner(object):
         help='If True then do not require a baseline tag when searching back'
              ' from a commit to the previous version. Normally this would not'
              ' be allowed.')
+    add_parser_argument(
+        parser, 'git_use_query_session', defaults, True, type=bool,
+        help='If True then answer read-only queries about a repository from'
+             ' long lived git processes rather than running a git command'
+             ' for each question.')
+    add_parser_argument(
+        parser, 'git_use_commit_graph', defaults, True, type=bool,
+        help='If True (and git_use_query_session) then answer commit graph'
+             ' queries, such as the newest tag reachable from a commit,'
+             ' from an index of each repository\'s commits.')
+    add_parser_argument(
+        parser, 'git_commit_graph_dir', defaults, None,
+        help='The directory to keep commit graph indexes in so they can be'
+             ' reused by later commands. The default is a "commit_graph"'
+             ' subdirectory of the --input_dir.')
+    add_parser_argument(
+        parser, 'git_use_summary_cache', defaults, True, type=bool,
+        help='If True then reuse repository summaries computed by earlier'
+             ' commands for the same commit and version tags.')
+    add_parser_argument(
+        parser, 'git_summary_cache_dir', defaults, None,
+        help='The directory to keep repository summaries in. The default is'
+             ' a "summary_cache" subdirectory of the --input_dir.')
+    add_parser_argument(
+        parser, 'git_clone_mode', defaults, 'full',
+        choices=sorted(GitRunner.CLONE_MODE_ARGS.keys()),
+        help='How much of the repository to clone.'
+             ' "full" clones everything.'
+             ' "blobless" and "treeless" clone all the commits but download'
+             ' file contents (and directory listings) only when needed.'
+             ' "shallow" clones only the most recent --git_clone_depth commits'
+             ' of each branch and fetches more history when determining'
+             ' versions needs it.')
+    add_parser_argument(
+        parser, 'git_clone_depth', defaults, 50, type=int,
+        help='The number of commits in a "shallow" --git_clone_mode clone.'
+             ' This is also the initial number of commits to fetch when'
+             ' more history is needed, doubling each time.')
+    GitMirrorCache.add_parser_args(parser, defaults)
 
   @staticmethod
   def add_publishing_parser_args(parser, defaults):
@@ -706,6 +859,16 @@ class GitRunner(object):
     normalized_second = GitRunner.normalize_repo_url(second)
     return normalized_first == normalized_second
 
+  @staticmethod
+  def close_query_sessions():
+    """Terminate the processes of all the known query sessions."""
+    with GitRunner.__QUERY_SESSIONS_LOCK:
+      sessions = list(GitRunner.__QUERY_SESSIONS.values())
+      GitRunner.__QUERY_SESSIONS.clear()
+      GitRunner.__COMMIT_GRAPHS.clear()
+    for session in sessions:
+      session.close()
+
   @staticmethod
   def stash_and_clear_auth_env_vars():
     """Remove git auth variables from global environment; keep internally."""
@@ -735,6 +898,18 @@ class GitRunner(object):
     self.__auth_env = {}
     if GitRunner.__GITHUB_TOKEN:
       self.__auth_env['GITHUB_TOKEN'] = GitRunner.__GITHUB_TOKEN
+    self.__mirror_cache = (GitMirrorCache(options, self)
+                           if getattr(options, 'git_mirror_dir', None)
+                           else None)
+
+    self.__summary_cache = None
+    if getattr(options, 'git_use_summary_cache', True):
+      summary_dir = getattr(options, 'git_summary_cache_dir', None)
+      if not summary_dir and getattr(options, 'input_dir', None):
+        summary_dir = os.path.join(options.input_dir, 'summary_cache')
+      if summary_dir:
+        self.__summary_cache = RepositorySummaryCache(
+            summary_dir, CommitMessage.CLASSIFIER_REGEXS)
 
   def __inject_auth(self, keyword_args_to_modify):
     """Inject the configured git authentication environment variables.
@@ -751,19 +926,79 @@ class GitRunner(object):
     new_env.update(self.__auth_env)
     keyword_args_to_modify['env'] = new_env
 
+  def query_session(self, git_dir):
+    """Returns the GitQuerySession for the given repository."""
+    key = os.path.abspath(git_dir)
+    with GitRunner.__QUERY_SESSIONS_LOCK:
+      session = GitRunner.__QUERY_SESSIONS.get(key)
+      if session is None:
+        session = GitQuerySession(key)
+        GitRunner.__QUERY_SESSIONS[key] = session
+    return session
+
+  def commit_graph(self, git_dir):
+    """Returns the CommitGraphIndex for the given repository."""
+    session = self.query_session(git_dir)
+    key = session.git_dir
+    with GitRunner.__QUERY_SESSIONS_LOCK:
+      index = GitRunner.__COMMIT_GRAPHS.get(key)
+      if index is None:
+        graph_dir = getattr(self.__options, 'git_commit_graph_dir', None)
+        input_dir = getattr(self.__options, 'input_dir', None)
+        if not graph_dir and input_dir:
+          graph_dir = os.path.join(input_dir, 'commit_graph')
+        path = (os.path.join(graph_dir, os.path.basename(key) + '.json')
+                if graph_dir else None)
+        index = CommitGraphIndex(session, path)
+        GitRunner.__COMMIT_GRAPHS[key] = index
+    return index
+
+  def __make_queries(self, git_dir):
+    """Returns the implementation to use for read-only repository queries."""
+    if getattr(self.__options, 'git_use_query_session', True):
+      if getattr(self.__options, 'git_use_commit_graph', True):
+        return self.commit_graph(git_dir)
+      return self.query_session(git_dir)
+    return GitCommandQueries(self, git_dir)
+
+  def __note_command(self, git_dir, command):
+    """Invalidate cached refs if the command might have modified them."""
+    program = command.split(' ', 1)[0]
+    if program in GitRunner.__READ_ONLY_COMMANDS:
+      return
+    key = os.path.abspath(git_dir)
+    session = GitRunner.__QUERY_SESSIONS.get(key)
+    if not session:
+      return
+    if program in ('fetch', 'pull') and (session.shallow_commits
+                                         or read_shallow_commits(key)):
+      # The shallow boundary may have moved, changing the known history.
+      with GitRunner.__QUERY_SESSIONS_LOCK:
+        GitRunner.__QUERY_SESSIONS.pop(key, None)
+        GitRunner.__COMMIT_GRAPHS.pop(key, None)
+      session.close()
+    else:
+      session.invalidate_refs()
+
   def run_git(self, git_dir, command, **kwargs):
     """Wrapper around run_subprocess."""
     self.__inject_auth(kwargs)
-    return run_subprocess(
-        'git -C "{dir}" {command}'.format(dir=git_dir, command=command),
-        **kwargs)
+    try:
+      return run_subprocess(
+          'git -C "{dir}" {command}'.format(dir=git_dir, command=command),
+          **kwargs)
+    finally:
+      self.__note_command(git_dir, command)
 
   def check_run(self, git_dir, command, **kwargs):
     """Wrapper around check_subprocess."""
     self.__inject_auth(kwargs)
-    return check_subprocess(
-        'git -C "{dir}" {command}'.format(dir=git_dir, command=command),
-        **kwargs)
+    try:
+      return check_subprocess(
+          'git -C "{dir}" {command}'.format(dir=git_dir, command=command),
+          **kwargs)
+    finally:
+      self.__note_command(git_dir, command)
 
   def check_run_sequence(self, git_dir, commands):
     """Check a sequence of git commands.
@@ -788,6 +1023,75 @@ class GitRunner(object):
       raise_and_log_error(ExecutionError('git failed.'))
     return stdout
 
+  def __deepen_until(self, git_dir, have_history_func):
+    """Fetch more history into a shallow repository until it is sufficient.
+
+    Args:
+      have_history_func: [callable] Returns True once the repository has
+         the history that is needed. This may raise an exception if it
+         refers to commits that have not been fetched yet.
+    """
+    def have_history():
+      try:
+        return have_history_func()
+      except Exception:  # pylint: disable=broad-except
+        return False
+
+    depth = self.__options.git_clone_depth
+    for _ in range(GitRunner.MAX_DEEPEN_ATTEMPTS):
+      if not read_shallow_commits(git_dir) or have_history():
+        return
+      logging.info('Deepening %s by %d commits', git_dir, depth)
+      self.__timed_deepen(git_dir, '--deepen={0}'.format(depth))
+      depth *= 2
+
+    if read_shallow_commits(git_dir) and not have_history():
+      logging.info('Fetching the remaining history of %s', git_dir)
+      self.__timed_deepen(git_dir, '--unshallow')
+
+  def __timed_deepen(self, git_dir, how):
+    """Fetch more history into a shallow repository."""
+    labels = {'repository': os.path.basename(git_dir),
+              'how': how.split('=')[0][2:]}
+    metrics = MetricsManager.singleton()
+    metrics.time_call(
+        'GitDeepen', labels, metrics.default_determine_outcome_labels,
+        self.check_run, git_dir, 'fetch -q --tags {how} origin'.format(how=how))
+
+  def __deepen_for_version_history(self, git_dir, commit_id, commit_tags):
+    """Make sure a shallow repository has the history to determine versions.
+
+    That is the history back to the newest tag in commit_id's history,
+    then back to where the newer tags and master diverge from commit_id.
+    """
+    self.__deepen_until(
+        git_dir,
+        lambda: self.__make_queries(git_dir).newest_ancestor_tag(
+            commit_id) is not None)
+
+    queries = self.__make_queries(git_dir)
+    start_tag = queries.newest_ancestor_tag(commit_id)
+    if start_tag is None:
+      return  # There is no tag in the entire history.
+
+    # Other branches only need history as old as the tag we are starting from,
+    # which is much less than deepening every branch until they meet.
+    timestamp = int(self.check_run(git_dir, 'log -1 --format=%ct ' + start_tag))
+    if read_shallow_commits(git_dir):
+      self.__timed_deepen(git_dir, '--shallow-since={0}'.format(
+          timestamp - GitRunner.SHALLOW_SINCE_MARGIN_SECS))
+
+    start_version = LooseVersion(start_tag)
+    related = [tag_entry.commit_id for tag_entry in commit_tags
+               if LooseVersion(tag_entry.tag) > start_version]
+    def have_history():
+      queries = self.__make_queries(git_dir)
+      master_commit = (queries.lookup_ref('refs/remotes/origin/master')
+                       or queries.lookup_ref('refs/heads/master'))
+      return all(queries.merge_base(commit_id, other) is not None
+                 for other in related + [master_commit] if other)
+    self.__deepen_until(git_dir, have_history)
+
   def find_newest_tag_and_common_commit_from_id(
       self, git_dir, commit_id, commit_tags):
     """Returns most recent tag and common commit to a given commit_id.
@@ -809,18 +1113,21 @@ class GitRunner(object):
       base_commit_id [string]: If base_commit_id is provided then rather than
           use it ias the base commit id for determining recent commits.
     """
+    if read_shallow_commits(git_dir):
+      self.__deepen_for_version_history(git_dir, commit_id, commit_tags)
+    queries = self.__make_queries(git_dir)
+
     # Find the starting commit, which is most recent tag in our direct history.
     # For the example in the function docs, this would be tag 0.1.0
-    retcode, most_recent_ancestor_tag = self.run_git(
-        git_dir, 'describe --abbrev=0 --tags --match version-* ' + commit_id)
-    if retcode != 0:
+    most_recent_ancestor_tag = queries.newest_ancestor_tag(commit_id)
+    if most_recent_ancestor_tag is None:
       start_tag = 'version-0.0.0'
       logging.warning('No baseline tag for "%s", assuming this is first one.',
                       git_dir)
       start_commit = self.check_run(git_dir, 'rev-list --max-parents=0 HEAD')
     else:
       start_tag = most_recent_ancestor_tag
-      start_commit = self.check_run(git_dir, 'rev-list -n 1 ' + start_tag)
+      start_commit = queries.resolve_commit(start_tag)
 
     if start_commit == commit_id:
       logging.debug(
@@ -830,19 +1137,23 @@ class GitRunner(object):
     # Get the master commit so we can use it in the merge-base call below.
     # If we checked out some branch other than master, we might not have
     # the actual branch so cannot use the symbolic name.
-    master_commit = self.check_run(git_dir, 'show-ref origin/master').split(' ')[0]
+    # Repositories without an origin (e.g. in tests) only have the local one.
+    master_commit = (queries.lookup_ref('refs/remotes/origin/master')
+                     or queries.lookup_ref('refs/heads/master'))
+    if master_commit is None:
+      raise_and_log_error(
+          ExecutionError('{dir} has no master branch'.format(dir=git_dir),
+                         program='git'))
     logging.debug('  master_commit=%s may be used to locate the branch.', master_commit)
 
     # Find branch our commit is on. There could be multiple branches.
     # We'll remember them all. These should be the same in practice, but
     # could be different if a branch spawned another for some reason.
-    # We use -r here because the branches arent known to the original git clone.
-    remote_commit_branches = self.check_run(
-        git_dir, 'branch -r --contains {id}'.format(id=commit_id))
+    # We use remote branches because they arent known to the original git clone.
+    remote_commit_branches = queries.remote_branches_containing(commit_id)
 
     commit_branch_nodes = set([])
-    for remote_commit_branch in remote_commit_branches.split('\n'):
-      remote_commit_branch = remote_commit_branch.strip()
+    for remote_commit_branch in remote_commit_branches:
       if not remote_commit_branch.startswith('origin/release-'):
         logging.debug('   skipping non-release branch %r', remote_commit_branch)
         continue
@@ -850,9 +1161,7 @@ class GitRunner(object):
       # Find place our branch diverges from master. We'll be using this to
       # detect if a tag we consider was after our branch. We'll do this by
       # checking if the common point between us is it is here.
-      node = self.check_run(
-          git_dir, 'merge-base {branch} {master}'.format(
-              branch=remote_commit_branch, master=master_commit))
+      node = queries.merge_base(remote_commit_branch, master_commit)
       commit_branch_nodes.add(node)
       logging.debug('   adding branching node=%r', node)
 
@@ -869,8 +1178,7 @@ class GitRunner(object):
         break
 
       # Find where in our commit history the branch this tag is on intersects
-      tag_intersect = self.check_run(git_dir, 'merge-base {id} {tag}'.format(
-          id=commit_id, tag=tag))
+      tag_intersect = queries.merge_base(commit_id, tag_entry.commit_id)
       if tag_intersect in commit_branch_nodes:
         logging.debug('tag %s intersects branch at %s', tag, tag_intersect)
         continue
@@ -888,13 +1196,50 @@ class GitRunner(object):
         git_dir, commit_id, commit_tags)
 
     base_commit = base_commit_id or found_commit
-    commit_history = self.check_run(
-        git_dir,
-        'log --pretty=medium {base_commit}..{id}'.format(
-            base_commit=base_commit, id=commit_id))
-    messages = CommitMessage.make_list_from_result(commit_history)
+    if base_commit_id and read_shallow_commits(git_dir):
+      self.__deepen_until(
+          git_dir,
+          lambda: self.__make_queries(git_dir).merge_base(
+              base_commit_id, commit_id) is not None)
+    messages = list(self.iter_commit_messages(
+        git_dir, '{base_commit}..{id}'.format(
+            base_commit=base_commit, id=commit_id)))
     return tag, messages
 
+  def iter_commit_messages(self, git_dir, revision_range):
+    """Yields the CommitMessage for each commit in the range, newest first.
+
+    The messages are parsed as "git log" produces them rather than
+    collecting the entire log first, which can be large.
+    """
+    kwargs = {}
+    self.__inject_auth(kwargs)
+    command = 'git -C "{dir}" log -z --pretty="{format}" {range}'.format(
+        dir=git_dir, format=CommitMessage.LOG_FIELDS_FORMAT,
+        range=revision_range)
+    with tempfile.TemporaryFile() as stderr:
+      process = start_subprocess(command, stderr=stderr, **kwargs)
+      try:
+        for message in CommitMessage.iter_from_log_stream(process.stdout):
+          yield message
+        process.wait()
+      finally:
+        if process.returncode is None:
+          # The caller stopped early.
+          process.kill()
+          process.wait()
+        process.stdout.close()
+
+      if process.returncode != 0:
+        stderr.seek(0)
+        error = stderr.read().decode('utf-8')
+        log_embedded_output(logging.ERROR, 'command output', error)
+        raise_and_log_error(
+            ExecutionError('git log failed in {dir}'.format(dir=git_dir),
+                           program='git'),
+            '{command} failed with:\n{error}'.format(
+                command=command, error=error))
+
   def query_commit_at_tag(self, git_dir, tag):
     """Return the commit for the given tag, or None if tag is not known."""
     retcode, stdout = self.run_git(git_dir, 'show-ref -- ' + tag)
@@ -908,6 +1253,10 @@ class GitRunner(object):
 
   def query_local_repository_commit_id(self, git_dir):
     """Returns the current commit for the repository at git_dir."""
+    if getattr(self.__options, 'git_use_query_session', True):
+      result = self.query_session(git_dir).resolve_commit('HEAD')
+      if result:
+        return result
     result = self.check_run(git_dir, 'rev-parse HEAD')
     return result
 
@@ -1005,6 +1354,13 @@ class GitRunner(object):
                   repository=repository.name))
       return
 
+    if self.__mirror_cache:
+      # Freshen the shared mirror first so the fetch below only needs to
+      # negotiate refs rather than download objects other commands already have.
+      url = (repository.origin if remote_name == 'origin'
+             else repository.upstream)
+      self.__mirror_cache.attach(git_dir, self.determine_pull_url(url))
+
     logging.debug('Refreshing %s from %s',
                   git_dir, remote_name)
     command = 'fetch {remote_name} --tags'.format(
@@ -1092,7 +1448,18 @@ class GitRunner(object):
     parent_dir = os.path.dirname(git_dir)
     ensure_dir_exists(parent_dir)
 
-    clone_command = 'clone ' + pull_url
+    clone_mode = getattr(self.__options, 'git_clone_mode', 'full') or 'full'
+    clone_url = pull_url
+    if clone_mode != 'full' and not isinstance(
+        self.normalize_repo_url(pull_url), tuple):
+      # Git ignores --depth and --filter for plain local paths.
+      clone_url = 'file://' + os.path.abspath(pull_url)
+
+    clone_command = 'clone ' + clone_url
+    clone_command += GitRunner.CLONE_MODE_ARGS[clone_mode].format(
+        depth=getattr(self.__options, 'git_clone_depth', 50))
+    if self.__mirror_cache:
+      clone_command += self.__mirror_cache.reference_args(pull_url)
     if branch:
       branches = [branch]
       if default_branch:
@@ -1101,6 +1468,11 @@ class GitRunner(object):
     else:
       self.check_run(parent_dir, clone_command)
     logging.info('Cloned %s into %s', pull_url, parent_dir)
+    if clone_url != pull_url:
+      self.check_run(git_dir, 'remote set-url origin ' + pull_url)
+    if self.__mirror_cache:
+      self.__mirror_cache.record_clone_savings(
+          repository.name, git_dir, pull_url)
 
     if commit:
       self.checkout(repository, commit)
@@ -1139,13 +1511,18 @@ class GitRunner(object):
 
       Returns: list of CommitTag sorted most recent first.
     """
-    retcode, stdout = self.run_git(git_dir, 'show-ref --tags')
-    if retcode and stdout:
-      raise_and_log_error(
-          ExecutionError('git failed in %s' % git_dir, program='git'),
-          'git -C "%s" show-ref --tags: %s' % (git_dir, stdout))
+    if getattr(self.__options, 'git_use_query_session', True):
+      ref_lines = ['{id} {ref}'.format(id=entry[0], ref=ref)
+                   for ref, entry in self.query_session(git_dir).refs().items()
+                   if ref.startswith('refs/tags/')]
+    else:
+      retcode, stdout = self.run_git(git_dir, 'show-ref --tags')
+      if retcode and stdout:
+        raise_and_log_error(
+            ExecutionError('git failed in %s' % git_dir, program='git'),
+            'git -C "%s" show-ref --tags: %s' % (git_dir, stdout))
+      ref_lines = stdout.split('\n')
 
-    ref_lines = stdout.split('\n')
     commit_tags = [CommitTag.make(line) for line in ref_lines if line]
     matcher = re.compile(tag_pattern)
     filtered = [ct for ct in commit_tags if matcher.match(ct.tag)]
@@ -1169,6 +1546,26 @@ class GitRunner(object):
 
   def collect_repository_summary(self, git_dir, base_commit_id=None):
     """Collects RepsitorySummary from local repository directory."""
+    cache_key = None
+    if self.__summary_cache:
+      cache_key = self.__summary_cache.make_key(
+          git_dir, base_commit_id,
+          allow_no_baseline_tag=getattr(
+              self.__options, 'git_allow_no_baseline_tag', True))
+    if cache_key:
+      data = self.__summary_cache.lookup(
+          cache_key, name=os.path.basename(git_dir))
+      if data:
+        logging.debug('Using cached summary of %s', git_dir)
+        return RepositorySummary.from_dict(data)
+
+    summary = self.__compute_repository_summary(git_dir, base_commit_id)
+    if cache_key:
+      self.__summary_cache.store(cache_key, summary.to_dict())
+    return summary
+
+  def __compute_repository_summary(self, git_dir, base_commit_id):
+    """Implements collect_repository_summary by querying the repository."""
     start_time = time.time()
     logging.debug('Begin analyzing %s', git_dir)
     all_tags = self.query_tag_commits(
@@ -1275,3 +1672,6 @@ class GitRunner(object):
     finally:
       if message_path:
         os.remove(message_path)
+
+
+atexit.register(GitRunner.close_query_sessions)
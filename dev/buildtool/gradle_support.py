@@ -37,6 +37,13 @@ from buildtool import (
     exception_to_message,
     ConfigError,
     ResponseError)
+from buildtool.artifact_index_support import (
+    DEBIAN,
+    ArtifactExistenceIndex,
+    list_bintray_package_versions)
+from buildtool.resource_support import (
+    BINTRAY_HTTP,
+    limit_resource)
 
 
 class GradleMetricsUpdater(object):
@@ -49,23 +56,35 @@ class GradleMetricsUpdater(object):
     self.__context = gradle_context_name
 
   def __call__(self, retcode, output):
-    """Update metrics considering the final return code and process output."""
+    """Update metrics considering the final return code and process output.
+
+    Args:
+      retcode: [int] The gradle exit code.
+      output: [string or OutputCapture] The gradle output. An OutputCapture
+         is only scanned if the build failed.
+    """
     labels = self.determine_labels(retcode, output)
     return self.__metrics.inc_counter('GradleOutcome', labels)
 
+  @staticmethod
+  def __iter_lines(output):
+    """Yields the lines of the output without holding it all in memory."""
+    if hasattr(output, 'iter_lines'):
+      return output.iter_lines()
+    return iter(output.split('\n'))
+
   def __extract_task_failure(self, output):
     """Extract the task failure, if any."""
-    summary_match = re.search(
-        "Execution failed for task '(.+)'.*\n", output, re.MULTILINE)
-    if not summary_match:
-      return None, None
-
-    failed_task = summary_match.group(1)
-    remainder = output[summary_match.end(0):]
-    first_line = remainder[:remainder.find('\n')]
-    logging.debug('Instrumenting failure after stdout[%d..%d]: first_line="%s"',
-                  summary_match.start(0), summary_match.end(0), first_line)
-    return failed_task, first_line
+    lines = self.__iter_lines(output)
+    for line in lines:
+      summary_match = re.search("Execution failed for task '(.+)'", line)
+      if summary_match:
+        failed_task = summary_match.group(1)
+        first_line = next(lines, '')
+        logging.debug('Instrumenting failure after "%s": first_line="%s"',
+                      line, first_line)
+        return failed_task, first_line
+    return None, None
 
   def extract_failure_summary(self, retcode, output):
     """Determine the top level failure message from gradle."""
@@ -74,9 +93,9 @@ class GradleMetricsUpdater(object):
     task, first_line = self.__extract_task_failure(output)
     if task is not None:
       return task, first_line
-    errno_match = re.search("error=", output)
-    if errno_match:
-      return 'unknown-task', errno_match.group(0)
+    for line in self.__iter_lines(output):
+      if line.find('error=') >= 0:
+        return 'unknown-task', 'error='
     return 'unknown-task', 'unknown-error'
 
   def determine_labels(self, retcode, output):
@@ -191,11 +210,46 @@ class GradleRunner(object):
     """Return bound source code manager."""
     return self.__scm
 
+  @property
+  def artifact_index(self):
+    """Return the ArtifactExistenceIndex of the bintray packages."""
+    return self.__artifact_index
+
   def __init__(self, options, scm, metrics):
     self.__options = options
     self.__metrics = metrics
     self.__git = GitRunner(options)
     self.__scm = scm
+    self.__artifact_index = ArtifactExistenceIndex()
+
+  def bintray_package_name(self, bintray_repo, repository):
+    """Return the name of the repository's package in the bintray repo."""
+    package_name = repository.name
+    if bintray_repo == self.__options.bintray_debian_repository:
+      if package_name == 'spinnaker-monitoring':
+        package_name = 'spinnaker-monitoring-daemon'
+      elif not package_name.startswith('spinnaker'):
+        package_name = 'spinnaker-' + package_name
+    return package_name
+
+  def index_debians_on_bintray(self, repositories, pool=None):
+    """List the debian versions of the repositories on bintray up front.
+
+    This lets consider_debian_on_bintray answer from memory rather than
+    querying for each repository.
+    """
+    options = self.__options
+    bintray_repo = options.bintray_debian_repository
+    package_names = [self.bintray_package_name(bintray_repo, repository)
+                     for repository in repositories]
+    self.__artifact_index.add_loader(
+        DEBIAN,
+        lambda: list_bintray_package_versions(
+            '{org}/{repo}'.format(org=options.bintray_org, repo=bintray_repo),
+            package_names, pool=pool,
+            user=os.environ.get('BINTRAY_USER'),
+            password=os.environ.get('BINTRAY_KEY')))
+    self.__artifact_index.refresh(DEBIAN)
 
   def __to_bintray_url(self, repo, package_name, repository, build_version):
     """Return the url for the desired versioned repository in bintray repo."""
@@ -215,13 +269,20 @@ class GradleRunner(object):
   def bintray_repo_has_version(self, repo, package_name, repository,
                                build_version):
     """See if the given bintray repository has the package version to build."""
+    if repo == self.__options.bintray_debian_repository:
+      exists = self.__artifact_index.has_artifact(
+          DEBIAN, package_name, build_version)
+      if exists is not None:
+        return exists
+
     try:
       bintray_url = self.__to_bintray_url(repo, package_name, repository,
                                           build_version)
       logging.debug('Checking for %s', bintray_url)
       request = Request(url=bintray_url)
       self.__add_bintray_auth_header(request)
-      urlopen(request)
+      with limit_resource(BINTRAY_HTTP):
+        urlopen(request)
       return True
     except HTTPError as ex:
       if ex.code == 404:
@@ -245,12 +306,7 @@ class GradleRunner(object):
     # let's not worry about this for now.
     for bintray_repo in [options.bintray_debian_repository]:#,
 #                         options.bintray_jar_repository]:
-      package_name = repository.name
-      if bintray_repo == options.bintray_debian_repository:
-        if package_name == 'spinnaker-monitoring':
-          package_name = 'spinnaker-monitoring-daemon'
-        elif not package_name.startswith('spinnaker'):
-          package_name = 'spinnaker-' + package_name
+      package_name = self.bintray_package_name(bintray_repo, repository)
       if self.bintray_repo_has_version(
           bintray_repo, package_name, repository, build_version):
         exists.append(bintray_repo)
@@ -295,8 +351,9 @@ class GradleRunner(object):
           'repository': repository.name,
           'artifact': 'debian'
       }
-      self.__metrics.count_call(
-          'DeleteArtifact', labels, urlopen, request)
+      with limit_resource(BINTRAY_HTTP):
+        self.__metrics.count_call(
+            'DeleteArtifact', labels, urlopen, request)
       return True
     except HTTPError as ex:
       if ex.code == 404:
@@ -463,7 +520,8 @@ class GradleCommandFactory(RepositoryCommandFactory):
 
     self.add_argument(
         parser, 'max_local_builds', defaults, None, type=int,
-        help='Maximum build concurrency.')
+        help='Maximum local build concurrency. This is the same as'
+             ' --resource_limits=local-cpu=<count>.')
 
     self.add_argument(
         parser, 'run_unit_tests', defaults, False, type=bool,
@@ -27,22 +27,198 @@ that custom or test builds do not show up in the production repositories
 unless the builds explicitly asked for the production repositories.
 """
 
+import collections
+import json
 import logging
 import os
-import yaml
+import select
+import socket
+import threading
+import time
 
 try:
   from urllib2 import urlopen, HTTPError
+  from urllib import quote, urlencode
+  from httplib import HTTPConnection, HTTPException
 except ImportError:
   from urllib.request import urlopen
   from urllib.error import HTTPError
+  from urllib.parse import quote, urlencode
+  from http.client import HTTPConnection, HTTPException
 
 from buildtool import (
     add_parser_argument,
     check_subprocess,
     raise_and_log_error,
     ConfigError,
-    ResponseError)
+    ResponseError,
+    TimeoutError)
+from buildtool.serialization_support import load_yaml
+
+
+class HalyardUnavailableError(Exception):
+  """The halyard daemon could not service a REST request.
+
+  This means the caller should fall back to the hal CLI. It is only
+  raised when the daemon cannot have acted on the request, never for
+  requests that were sent but then failed.
+  """
+  pass
+
+
+class HalyardClient(object):
+  """Calls the halyard daemon REST API directly.
+
+  The hal CLI is a JVM that starts up for every call only to make these
+  same requests. This reuses keep-alive connections to the daemon instead.
+
+  Most halyard requests return a task that runs in the daemon. These are
+  polled until they finish and the task's response body is returned.
+  """
+
+  # The task states in which the task is finished.
+  TERMINAL_TASK_STATES = ['SUCCEEDED', 'FAILED', 'INTERRUPTED', 'TIMED_OUT']
+
+  def __init__(self, daemon, poll_secs=0.25, timeout_secs=600):
+    """Constructor.
+
+    Args:
+      daemon: [string] The host:port of the halyard daemon.
+      poll_secs: [float] How often to poll running tasks.
+      timeout_secs: [int] How long to wait for a task to finish.
+    """
+    self.__daemon = daemon
+    self.__poll_secs = poll_secs
+    self.__timeout_secs = timeout_secs
+    self.__idle_connections = collections.deque()
+    self.__lock = threading.Lock()
+
+  def __take_connection(self):
+    while True:
+      with self.__lock:
+        if not self.__idle_connections:
+          break
+        connection = self.__idle_connections.pop()
+      # An idle connection is readable once the daemon has closed it.
+      if (connection.sock is not None
+          and not select.select([connection.sock], [], [], 0)[0]):
+        return connection, True
+      connection.close()
+    return HTTPConnection(self.__daemon, timeout=self.__timeout_secs), False
+
+  def __return_connection(self, connection):
+    with self.__lock:
+      self.__idle_connections.append(connection)
+
+  def close(self):
+    """Close the idle connections."""
+    with self.__lock:
+      while self.__idle_connections:
+        self.__idle_connections.pop().close()
+
+  def request(self, method, path, params=None, body=None):
+    """Make a request to the daemon and return the decoded JSON response.
+
+    Raises:
+      HalyardUnavailableError if the daemon could not be reached or does
+         not support the request.
+      ResponseError if the daemon rejected the request or the request
+         was sent but no response was received.
+    """
+    url = path
+    if params:
+      url += '?' + urlencode(sorted(params.items()))
+    headers = {'Accept': 'application/json'}
+    payload = None
+    if body is not None:
+      payload = json.dumps(body).encode('utf-8')
+      headers['Content-Type'] = 'application/json'
+
+    while True:
+      connection, reused = self.__take_connection()
+      try:
+        connection.request(method, url, body=payload, headers=headers)
+      except (HTTPException, socket.error) as ex:
+        connection.close()
+        if reused:
+          # The daemon may have closed the idle connection so try a new one.
+          continue
+        raise HalyardUnavailableError(
+            '{method} {url}: {ex}'.format(method=method, url=url, ex=ex))
+
+      try:
+        response = connection.getresponse()
+        content = response.read()
+        break
+      except (HTTPException, socket.error) as ex:
+        connection.close()
+        if reused and method == 'GET':
+          # Only GETs are safe to repeat once the daemon may have seen them.
+          continue
+        raise_and_log_error(
+            ResponseError(
+                '{method} {url} was sent but failed: {ex}'.format(
+                    method=method, url=url, ex=ex),
+                server='halyard'))
+
+    if response.getheader('Connection', '').lower() == 'close':
+      connection.close()
+    else:
+      self.__return_connection(connection)
+
+    text = content.decode('utf-8')
+    if response.status in (404, 405):
+      raise HalyardUnavailableError(
+          '{method} {url}: {code}'.format(
+              method=method, url=url, code=response.status))
+    if response.status >= 400:
+      raise_and_log_error(
+          ResponseError(
+              '{method} {url}: {code}\n{body}'.format(
+                  method=method, url=url, code=response.status, body=text),
+              server='halyard'))
+    return json.JSONDecoder().decode(text) if text.strip() else None
+
+  def run_task(self, method, path, params=None, body=None):
+    """Make a request that starts a task and return the task's response.
+
+    Raises:
+      HalyardUnavailableError if the task could not be started.
+      ResponseError or TimeoutError if the task was started but did not
+         succeed, including when it could no longer be polled.
+    """
+    task = self.request(method, path, params=params, body=body)
+    deadline = time.time() + self.__timeout_secs
+    while task.get('state') not in self.TERMINAL_TASK_STATES:
+      if time.time() > deadline:
+        raise_and_log_error(
+            TimeoutError('Halyard task {uuid} for {path} did not finish'
+                         ' within {secs} seconds.'.format(
+                             uuid=task['uuid'], path=path,
+                             secs=self.__timeout_secs),
+                         cause='halyard'))
+      time.sleep(self.__poll_secs)
+      try:
+        task = self.request(
+            'GET', '/v1/tasks/{uuid}/'.format(uuid=task['uuid']))
+      except HalyardUnavailableError as ex:
+        # The task is running so the CLI must not be used to run it again.
+        raise_and_log_error(
+            ResponseError(
+                'Lost halyard task {uuid} for {path}: {ex}'.format(
+                    uuid=task['uuid'], path=path, ex=ex),
+                server='halyard'))
+
+    response = task.get('response') or {}
+    if task['state'] != 'SUCCEEDED':
+      raise_and_log_error(
+          ResponseError(
+              'Halyard task {uuid} for {path} {state}: {problems}'.format(
+                  uuid=task['uuid'], path=path, state=task['state'],
+                  problems=json.dumps(response.get('problemSet')
+                                      or task.get('fatalError'))),
+              server='halyard'))
+    return response.get('responseBody')
 
 
 class HalRunner(object):
@@ -60,6 +236,11 @@ class HalRunner(object):
     add_parser_argument(
         parser, 'halyard_daemon', defaults, 'localhost:8064',
         help='Network location for halyard server.')
+    add_parser_argument(
+        parser, 'hal_use_rest_api', defaults, True, type=bool,
+        help='Call the halyard server directly rather than running the'
+             ' "hal" CLI for each request. The CLI is still used if the'
+             ' server cannot handle the request directly.')
 
   @property
   def options(self):
@@ -85,6 +266,9 @@ class HalRunner(object):
   def __init__(self, options):
     self.__options = options
     self.__hal_path = options.hal_path
+    self.__client = None
+    if getattr(options, 'hal_use_rest_api', False):
+      self.__client = HalyardClient(options.halyard_daemon)
 
     logging.debug('Retrieving halyard runtime configuration.')
     url = 'http://' + options.halyard_daemon + '/resolvedEnv'
@@ -96,7 +280,7 @@ class HalRunner(object):
               '{url}: {code}\n{body}'.format(
                   url=url, code=error.code, body=error.read()),
               server='halyard'))
-    self.__halyard_runtime_config = yaml.safe_load(response)
+    self.__halyard_runtime_config = load_yaml(response)
 
   def check_writer_enabled(self):
     """Ensure halyard has writerEnabled true."""
@@ -108,34 +292,66 @@ class HalRunner(object):
         daemon=self.__options.halyard_daemon)
     return check_subprocess(self.__hal_path + args + command_line)
 
+  def run_task_or_cli(self, method, path, command_line, params=None,
+                      body=None):
+    """Run a halyard task through the REST API, falling back to check_run.
+
+    Returns:
+      The task's response body, or the CLI output if it fell back.
+    """
+    if self.__client:
+      try:
+        return self.__client.run_task(method, path, params=params, body=body)
+      except HalyardUnavailableError as ex:
+        logging.warning('Using hal CLI because the halyard server'
+                        ' could not handle the request directly: %s', ex)
+        self.__client = None
+    return self.check_run(command_line)
+
   def publish_profile(self, component, profile_path, bom_path):
     """Publish the profile for the given component for the given bom."""
     logging.info('Publishing %s profile=%s for bom=%s',
                  component, profile_path, bom_path)
-    self.check_run('admin publish profile ' + component
-                   + ' --bom-path ' + bom_path
-                   + ' --profile-path ' + profile_path)
+    self.run_task_or_cli(
+        'PUT', '/v1/admin/publishProfile/{name}/'.format(name=quote(component)),
+        'admin publish profile ' + component
+        + ' --bom-path ' + bom_path
+        + ' --profile-path ' + profile_path,
+        params={'bomPath': bom_path}, body=profile_path)
 
   def publish_bom_path(self, path):
     """Publish a bom path via halyard."""
     logging.info('Publishing bom from %s', path)
-    self.check_run('admin publish bom --bom-path ' + os.path.abspath(path))
+    self.run_task_or_cli(
+        'PUT', '/v1/admin/publishBom/',
+        'admin publish bom --bom-path ' + os.path.abspath(path),
+        params={'bomPath': os.path.abspath(path)}, body='')
 
   def retrieve_bom_version(self, version):
     """Retrieve the specified BOM version as a dict."""
     logging.info('Getting bom version %s', version)
-    content = self.check_run('version bom ' + version + ' --quiet')
-    return yaml.safe_load(content)
+    content = self.run_task_or_cli(
+        'GET', '/v1/versions/bom/{version}/'.format(version=quote(version)),
+        'version bom ' + version + ' --quiet')
+    if isinstance(content, dict):
+      return content
+    return load_yaml(content)
 
   def publish_halyard_release(self, release_version):
     """Make release_version available as the latest version."""
     logging.info('Publishing latest halyard version "%s"', release_version)
-    self.check_run('admin publish latest-halyard ' + release_version)
+    self.run_task_or_cli(
+        'PUT', '/v1/admin/publishLatestHalyard/',
+        'admin publish latest-halyard ' + release_version,
+        body=release_version)
 
   def deprecate_spinnaker_release(self, release_version):
     """Deprecate release_version."""
     logging.info('Deprecating Spinnaker version "%s"', release_version)
-    self.check_run('admin deprecate version --version ' + release_version)
+    self.run_task_or_cli(
+        'PUT', '/v1/admin/deprecateVersion/',
+        'admin deprecate version --version ' + release_version,
+        body={'version': release_version})
 
   def publish_spinnaker_release(
       self, release_version, alias_name, changelog_uri, min_halyard_version,
@@ -143,14 +359,21 @@ class HalRunner(object):
     """Release spinnaker version to halyard repository."""
     logging.info('Publishing spinnaker version "%s" to halyard',
                  release_version)
-    self.check_run('admin publish version --version "{version}"'
-                   ' --alias "{alias}" --changelog {changelog}'
-                   ' --minimum-halyard-version {halyard_version}'
-                   .format(version=release_version, alias=alias_name,
-                           changelog=changelog_uri,
-                           halyard_version=min_halyard_version))
+    self.run_task_or_cli(
+        'PUT', '/v1/admin/publishVersion/',
+        'admin publish version --version "{version}"'
+        ' --alias "{alias}" --changelog {changelog}'
+        ' --minimum-halyard-version {halyard_version}'
+        .format(version=release_version, alias=alias_name,
+                changelog=changelog_uri,
+                halyard_version=min_halyard_version),
+        body={'version': release_version, 'alias': alias_name,
+              'changelog': changelog_uri,
+              'minimumHalyardVersion': min_halyard_version})
     if latest:
       logging.info(
           'Publishing spinnaker version "%s" as latest', release_version)
-      self.check_run('admin publish latest "{version}"'.format(
-          version=release_version))
+      self.run_task_or_cli(
+          'PUT', '/v1/admin/publishLatest/',
+          'admin publish latest "{version}"'.format(version=release_version),
+          body=release_version)
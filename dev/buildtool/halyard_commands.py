@@ -24,7 +24,6 @@ import re
 import shutil
 import subprocess
 import textwrap
-import yaml
 
 from buildtool import (
     DEFAULT_BUILD_NUMBER,
@@ -50,6 +49,10 @@ from buildtool import (
     write_to_path,
     ConfigError,
     ExecutionError)
+from buildtool.cloud_build_support import (
+    CloudBuildOrchestrator,
+    run_cloud_build)
+from buildtool.serialization_support import load_yaml
 
 
 def build_halyard_docs(command, repository):
@@ -207,8 +210,8 @@ class BuildHalyardCommand(GradleCommandProcessor):
     logfile = self.get_logfile_path(command['name'])
     self.metrics.time_call(
         'GcrBuild', {}, self.metrics.default_determine_outcome_labels,
-        check_subprocesses_to_logfile,
-        command['name'], logfile, [command['command']],
+        run_cloud_build, self.options,
+        command['name'], logfile, command['command'],
         cwd=command['git_dir'])
 
   def load_halyard_version_commits(self):
@@ -276,7 +279,9 @@ class BuildHalyardFactory(GradleCommandFactory):
     super(BuildHalyardFactory, self).__init__(
         'build_halyard', BuildHalyardCommand,
         'Build halyard from the local git repository.',
-        BranchSourceCodeManager)
+        BranchSourceCodeManager,
+        # The rebuild plan only names BOM services.
+        use_rebuild_plan=False)
 
   def init_argparser(self, parser, defaults):
     """Adds command-specific arguments."""
@@ -310,6 +315,7 @@ class BuildHalyardFactory(GradleCommandFactory):
     self.add_argument(
         parser, 'gcb_service_account', defaults, None,
         help='Google Service Account when using the GCP Container Builder.')
+    CloudBuildOrchestrator.add_parser_args(parser, defaults)
     self.add_argument(
         parser, 'artifact_registry', defaults, None,
         help='Artifact registry to push the container images to.')
@@ -444,7 +450,7 @@ class PublishHalyardCommand(CommandProcessor):
                      if line[0].isdigit()]
       version_data = "\n".join(valid_lines)
 
-    commit = yaml.safe_load(version_data).get(options.halyard_version)
+    commit = load_yaml(version_data).get(options.halyard_version)
     if commit is None:
       raise_and_log_error(
           ConfigError('Unknown halyard version "{version}" in "{url}"'.format(
@@ -39,6 +39,10 @@ from buildtool import (
     raise_and_log_error,
     ConfigError,
     UnexpectedError)
+from buildtool.artifact_index_support import (
+    GCE_IMAGE,
+    ArtifactExistenceIndex,
+    list_gce_images)
 
 
 # TODO(ewiseblatt): 20180203
@@ -80,6 +84,16 @@ class BuildGceComponentImages(RepositoryCommandProcessor):
     if not self.__image_project:
       raise_and_log_error(
           ConfigError('BOM has no artifactSources.googleImageProject'))
+    self.__artifact_index = ArtifactExistenceIndex()
+
+  def _do_preprocess(self):
+    """Lists the existing images once rather than for each repository."""
+    self.__artifact_index.add_loader(
+        GCE_IMAGE,
+        lambda: list_gce_images(
+            self.__image_project,
+            account=self.options.build_gce_service_account))
+    self.__artifact_index.refresh()
 
   def __determine_repo_install_args(self, repository):
     """Determine --spinnaker_dev-github_[owner|user] args for install script."""
@@ -124,8 +138,10 @@ class BuildGceComponentImages(RepositoryCommandProcessor):
                       '--project', self.__image_project,
                       '--quiet', '--format=json']
     logging.debug('Checking for existing image for "%s"', repository.name)
-    got = check_subprocess(' '.join(lookup_command))
-    if got.strip() == '[]':
+    exists = self.__artifact_index.has_artifact(GCE_IMAGE, image_name)
+    if exists is None:
+      exists = check_subprocess(' '.join(lookup_command)).strip() != '[]'
+    if not exists:
       return False
     labels = {'repository': repository.name, 'artifact': 'gce-image'}
     if self.options.skip_existing:
@@ -20,7 +20,11 @@
 
    This will produce files of things to prune.
    The should be reviewed. Those remove those that you wish to keep.
-   Then to remove each of the artifacts:
+   Then to remove all the artifacts in batches:
+
+   4) buildtool.sh prune_artifacts [--dry_run true]
+
+   Or to remove each of the artifacts individually:
 
       for url in $(cat prune_jars.txt); do
          curl -s -u$BINTRAY_USER:$BINTRAY_KEY -X DELETE $url &
@@ -46,15 +50,17 @@
       done
 """
 
-from threading import current_thread
+from threading import current_thread, Lock
 from multiprocessing.pool import ThreadPool
 
 import base64
+import datetime
 import json
 import logging
 import os
 import re
 import sys
+import time
 import yaml
 
 try:
@@ -71,13 +77,36 @@ from buildtool import (
     check_options_set,
     check_path_exists,
     check_subprocess,
+    check_subprocesses,
     exception_to_message,
     maybe_log_exception,
     raise_and_log_error,
+    run_subprocess,
     write_to_path,
     ConfigError,
+    ExecutionError,
     UnexpectedError,
     ResponseError)
+from buildtool.artifact_inventory_support import (
+    CONFIG,
+    CONTAINER,
+    DEBIAN,
+    GCE_IMAGE,
+    JAR,
+    ArtifactInventory)
+from buildtool.audit_index_support import (
+    BuildnumPrefixIndex,
+    VersionIndex)
+from buildtool.bom_store_support import BomStore
+from buildtool.resource_support import (
+    BINTRAY_HTTP,
+    GCLOUD_API,
+    GCS,
+    ResourceLimits,
+    limit_resource)
+from buildtool.serialization_support import (
+    dump_yaml,
+    load_yaml)
 
 
 def my_unicode_representer(self, data):
@@ -102,14 +131,18 @@ class CollectBomVersions(CommandProcessor):
   released boms and the other unreleased boms. Unreleased boms are not
   necessarily obsolete.
 
+  The boms and the services in them are recorded into the ArtifactInventory.
+
   Emits files:
      bom_list.txt: A list of all the boms, released and unreleased
      bad_boms.txt: A list of malformed boms with what makes it malformed.
      all_bom_sevice_map.yml: The inverse service version mapping of all the boms
+        (only with --export_inventory_yaml)
      released_bom_service_map.yml: The subset of all_bom_service_map for boms
-        that were released.
+        that were released (only with --export_inventory_yaml).
      unreleased_bom_service_map.yml: The subset of all_bom_service_map for
-        service versions that only appear in unreleased boms.
+        service versions that only appear in unreleased boms
+        (only with --export_inventory_yaml).
      nonstandard_boms.txt: A list of boms whose artifactSources do not match
        the values specified via options. Unspecified options match anything.
      config.yml: The configuration values used to determine standard compliance.
@@ -133,6 +166,10 @@ class CollectBomVersions(CommandProcessor):
                       ' and "bintray_debian_repository" should be specified'))
     self.__bad_files = {}
     self.__non_standard_boms = {}
+    self.__bom_store = None
+    if options.bom_store_dir:
+      self.__bom_store = BomStore(options.bom_store_dir,
+                                  options.halyard_bom_bucket)
 
     # We're going to have a bunch of threads each writing into different keys
     # in order to deconflict with one another lockless. Then we'll aggregate
@@ -152,9 +189,16 @@ class CollectBomVersions(CommandProcessor):
   def load_bom_from_url(self, url):
     """Returns the bom specification dict from a gcs url."""
     logging.debug('Loading %s', url)
+    if self.__bom_store:
+      name = self.url_to_bom_name(url)
+      bom = self.__bom_store.load_bom(name)
+      if bom is None:
+        self.__bad_files[name] = self.__bom_store.get_error(name)
+        logging.warning('Skipping %s: %s', url, self.__bad_files[name])
+      return bom
     try:
       text = check_subprocess('gsutil cat ' + url)
-      return yaml.safe_load(text)
+      return load_yaml(text)
     except Exception as ex:
       self.__bad_files[self.url_to_bom_name(url)] = exception_to_message(ex)
       maybe_log_exception('load_from_from_url', ex,
@@ -296,7 +340,9 @@ class CollectBomVersions(CommandProcessor):
 
   def ingest_bom_list(self, bom_list):
     """Ingest each of the boms."""
-    max_threads = 1 if self.options.one_at_a_time else 4
+    # The boms are read from gcs so use as many threads as it allows.
+    max_threads = (1 if self.options.one_at_a_time
+                   else ResourceLimits.limiter(GCS).max_limit)
     pool = ThreadPool(min(max_threads, len(bom_list)))
     pool.map(self.ingest_bom, bom_list)
     pool.close()
@@ -318,29 +364,44 @@ class CollectBomVersions(CommandProcessor):
     url_prefix = 'gs://%s/bom/' % options.halyard_bom_bucket
     if options.version_name_prefix:
       url_prefix += options.version_name_prefix
-    logging.debug('Listing BOM urls')
-    results = self.list_bom_urls(url_prefix)
+    if self.__bom_store:
+      # Only the new or changed boms need to be fetched.
+      self.__bom_store.sync(options.version_name_prefix or '')
+      results = [self.__bom_store.url_for(name)
+                 for name in self.__bom_store.list_boms(
+                     options.version_name_prefix or '')]
+    else:
+      logging.debug('Listing BOM urls')
+      results = self.list_bom_urls(url_prefix)
     write_to_path('\n'.join(sorted(results)),
                   os.path.join(self.get_output_dir(), 'bom_list.txt'))
     result_map = self.ingest_bom_list(results)
 
-    path = os.path.join(self.get_output_dir(), 'all_bom_service_map.yml')
-    logging.info('Writing bom analysis to %s', path)
-    write_to_path(yaml.safe_dump(result_map, default_flow_style=False), path)
+    inventory = ArtifactInventory(ArtifactInventory.path_from_options(options))
+    try:
+      inventory.replace_boms(result_map,
+                             self.RELEASED_VERSION_MATCHER.match)
+    finally:
+      inventory.close()
 
-    partition_names = ['released', 'unreleased']
-    partitions = self.partition_service_map(result_map)
-    for index, data in enumerate(partitions):
-      path = os.path.join(self.get_output_dir(),
-                          partition_names[index] + '_bom_service_map.yml')
+    if options.export_inventory_yaml:
+      path = os.path.join(self.get_output_dir(), 'all_bom_service_map.yml')
       logging.info('Writing bom analysis to %s', path)
-      write_to_path(yaml.safe_dump(data, default_flow_style=False), path)
+      write_to_path(dump_yaml(result_map, default_flow_style=False), path)
+
+      partition_names = ['released', 'unreleased']
+      partitions = self.partition_service_map(result_map)
+      for index, data in enumerate(partitions):
+        path = os.path.join(self.get_output_dir(),
+                            partition_names[index] + '_bom_service_map.yml')
+        logging.info('Writing bom analysis to %s', path)
+        write_to_path(dump_yaml(data, default_flow_style=False), path)
 
     if self.__bad_files:
       path = os.path.join(self.get_output_dir(), 'bad_boms.txt')
       logging.warning('Writing %d bad URLs to %s', len(self.__bad_files), path)
       write_to_path(
-          yaml.safe_dump(self.__bad_files, default_flow_style=False),
+          dump_yaml(self.__bad_files, default_flow_style=False),
           path)
 
     if self.__non_standard_boms:
@@ -348,7 +409,7 @@ class CollectBomVersions(CommandProcessor):
       logging.warning('Writing %d nonstandard boms to %s',
                       len(self.__non_standard_boms), path)
       write_to_path(
-          yaml.safe_dump(self.__non_standard_boms, default_flow_style=False),
+          dump_yaml(self.__non_standard_boms, default_flow_style=False),
           path)
 
     config = {
@@ -356,7 +417,7 @@ class CollectBomVersions(CommandProcessor):
     }
     path = os.path.join(self.get_output_dir(), 'config.yml')
     logging.info('Writing to %s', path)
-    write_to_path(yaml.safe_dump(config, default_flow_style=False), path)
+    write_to_path(dump_yaml(config, default_flow_style=False), path)
 
   def partition_service_map(self, result_map):
     def partition_info_list(info_list):
@@ -432,6 +493,8 @@ class CollectBomVersionsFactory(CommandFactory):
     self.add_argument(
         parser, 'halyard_bom_bucket', defaults, 'halconfig',
         help='The bucket managing halyard BOMs and config profiles.')
+    BomStore.add_parser_args(parser, defaults)
+    ArtifactInventory.add_parser_args(parser, defaults)
     self.add_argument(
         parser, 'docker_registry', defaults, None,
         help='The expected docker registry in boms.')
@@ -450,11 +513,19 @@ class CollectArtifactVersions(CommandProcessor):
   builds for each service of a given type. It also looks for consistency
   between the bintray jar and debian builds.
 
+  The versions of each type are collected concurrently and recorded into
+  the ArtifactInventory. With --incremental_collect, the container and
+  gce image versions are only listed if they were created since the last
+  collection, then merged with the versions already in the inventory.
+
   Emits files:
      <debian_repository>__versions.yml: All the debian build versions
      <jar_repository>__versions.yml: All the jar build versions
      <docker_registry>__versions.yml: All the container build versions
      <config_bucket>__versions.yml: All the service-specific config build versions
+        (The __versions.yml files are only written with --export_inventory_yaml)
+     versions_diff.yml: The versions of each type that were added or removed
+        since the artifacts were last collected into the inventory.
      missing_jars.yml: Bintray debian versions without a corresponding jar
      missing_debians.yml: Bintray jar versions witout a corresponding debian
      config.yml: The configuration values used to collect the artifacts
@@ -471,19 +542,78 @@ class CollectArtifactVersions(CommandProcessor):
     password = os.environ.get('BINTRAY_KEY')
     if user and password:
       user_password = '{user}:{password}'.format(user=user, password=password)
-      encoded_auth = base64.b64encode(user_password)
+      encoded_auth = base64.b64encode(user_password.encode('utf-8'))
       self.__basic_auth = 'Basic %s' % encoded_auth.decode()
     else:
       self.__basic_auth = None
+    self.__inventory = ArtifactInventory(
+        ArtifactInventory.path_from_options(options))
+    self.__diffs = {}
+
+  @staticmethod
+  def utc_timestamp():
+    """Returns the current time as recorded in the inventory."""
+    return '{:%Y-%m-%dT%H:%M:%SZ}'.format(datetime.datetime.utcnow())
+
+  def get_incremental_baseline(self, kind, source):
+    """Returns the previously collected versions to add new ones to.
+
+    Returns:
+      (timestamp, version_map) of the last collection from the source, or
+      (None, None) if this collection should list everything.
+    """
+    if not self.options.incremental_collect:
+      return None, None
+    timestamp = self.__inventory.last_collected(kind, source)
+    if timestamp is None:
+      logging.info('Collecting all %s versions from %s', kind, source)
+      return None, None
+
+    # Back up a bit to allow for the clock skew between here and the backend.
+    since = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ')
+    since -= datetime.timedelta(hours=1)
+    logging.info('Collecting %s versions from %s created since %s',
+                 kind, source, since)
+    return ('{:%Y-%m-%dT%H:%M:%SZ}'.format(since),
+            self.__inventory.artifact_versions(kind))
+
+  def record_versions(self, kind, source, version_map, filename,
+                      collected_at=None):
+    """Records the collected versions into the inventory.
+
+    Args:
+      kind: [string] The kind of artifact in the ArtifactInventory.
+      source: [string] Where the versions were collected from.
+      version_map: [dict] The list of versions keyed by artifact name.
+      filename: [string] The file to export the versions to if requested.
+      collected_at: [string] When the collection started.
+    """
+    diff = self.__inventory.diff_artifacts(kind, version_map)
+    if diff is not None:
+      self.__diffs[kind] = diff
+      for change in ['added', 'removed']:
+        self.metrics.inc_counter(
+            'CollectedVersionChanges', {'kind': kind, 'change': change},
+            amount=sum(len(versions) for versions in diff[change].values()))
+    self.__inventory.replace_artifacts(kind, source, version_map,
+                                       collected_at=collected_at)
+    if not self.options.export_inventory_yaml:
+      return
+    path = os.path.join(self.get_output_dir(), filename)
+    logging.info('Writing %s versions to %s', source, path)
+    write_to_path(dump_yaml(version_map,
+                            allow_unicode=True,
+                            default_flow_style=False), path)
 
   def fetch_bintray_url(self, bintray_url):
     request = Request(bintray_url)
     if self.__basic_auth:
       request.add_header('Authorization', self.__basic_auth)
     try:
-      response = urlopen(request)
-      headers = response.info()
-      payload = response.read()
+      with limit_resource(BINTRAY_HTTP):
+        response = urlopen(request)
+        headers = response.info()
+        payload = response.read()
       content = json.JSONDecoder().decode(payload.decode())
     except HTTPError as ex:
       raise_and_log_error(
@@ -494,20 +624,21 @@ class CollectArtifactVersions(CommandProcessor):
       raise
     return headers, content
 
-  def list_bintray_packages(self, subject_repo):
+  def list_bintray_packages(self, subject_repo, pool):
     path = 'repos/%s/packages' % subject_repo
     base_url = 'https://api.bintray.com/' + path
-    result = []
-    while True:
-      url = base_url + '?start_pos=%d' % len(result)
-      headers, content = self.fetch_bintray_url(url)
-      # logging.debug('Bintray responded with headers\n%s', headers)
-      total = headers.get('X-RangeLimit-Total', 0)
-      result.extend(['%s/%s' % (subject_repo, entry['name'])
-                     for entry in content])
-      if len(result) >= total:
-        break
-    return result
+    headers, content = self.fetch_bintray_url(base_url + '?start_pos=0')
+    # logging.debug('Bintray responded with headers\n%s', headers)
+    total = int(headers.get('X-RangeLimit-Total', 0))
+    pages = [content]
+    if content and len(content) < total:
+      # The first page tells us the page size, so get the rest at once.
+      pages.extend(pool.map(
+          lambda start: self.fetch_bintray_url(
+              base_url + '?start_pos=%d' % start)[1],
+          range(len(content), total, len(content))))
+    return ['%s/%s' % (subject_repo, entry['name'])
+            for page in pages for entry in page]
 
   def query_bintray_package_versions(self, package_path):
     path = 'packages/' + package_path
@@ -517,13 +648,6 @@ class CollectArtifactVersions(CommandProcessor):
     package_name = package_path[package_path.rfind('/') + 1:]
     return (package_name, content['versions'])
 
-  def difference(self, versions, target):
-    missing = []
-    for version in versions:
-      if not version in target:
-        missing.append(version)
-    return missing
-
   def find_missing_jar_versions(self, jar_map, debian_map):
     missing_jars = {}
     prefix = 'spinnaker-'
@@ -538,7 +662,7 @@ class CollectArtifactVersions(CommandProcessor):
           if key == 'spinnaker-monitoring-third-party':
             continue
           continue
-      missing = self.difference(versions, jar_map.get(key))
+      missing = self.__inventory.missing_versions(DEBIAN, package, JAR, key)
       if missing:
         missing_jars[key] = missing
 
@@ -556,7 +680,7 @@ class CollectArtifactVersions(CommandProcessor):
           else:
             raise ValueError('Unknown DEBIAN "%s"' % package)
 
-      missing = self.difference(versions, debian_map.get(key))
+      missing = self.__inventory.missing_versions(JAR, package, DEBIAN, key)
       if missing:
         missing_debians[key] = missing
 
@@ -564,45 +688,42 @@ class CollectArtifactVersions(CommandProcessor):
 
   def collect_bintray_versions(self, pool):
     options = self.options
-    repos = [('jar', options.bintray_jar_repository),
-             ('debian', options.bintray_debian_repository)]
+    repos = [(JAR, options.bintray_jar_repository),
+             (DEBIAN, options.bintray_debian_repository)]
     results = []
     for repo_type, bintray_repo in repos:
       subject_repo = '%s/%s' % (options.bintray_org, bintray_repo)
-      packages = self.list_bintray_packages(subject_repo)
+      collected_at = self.utc_timestamp()
+      packages = self.list_bintray_packages(subject_repo, pool)
       package_versions = pool.map(self.query_bintray_package_versions, packages)
 
       package_map = {}
       for name, versions in package_versions:
         package_map[name] = versions
       results.append(package_map)
-
-      path = os.path.join(
-          self.get_output_dir(),
-          '%s__%s_versions.yml' % (bintray_repo, repo_type))
-      logging.info('Writing %s versions to %s', bintray_repo, path)
-      write_to_path(yaml.safe_dump(package_map,
-                                   allow_unicode=True,
-                                   default_flow_style=False), path)
+      self.record_versions(repo_type, subject_repo, package_map,
+                           '%s__%s_versions.yml' % (bintray_repo, repo_type),
+                           collected_at=collected_at)
     return results[0], results[1]
 
-  def query_gcr_image_versions(self, image):
-    options = self.options
+  def gcr_image_versions_command(self, image, since=None):
     command_parts = ['gcloud',
                      '--format=json',
                      'container images list-tags',
                      image, '--limit 10000']
-    if options.gcb_service_account:
-      command_parts.extend(['--account', options.gcb_service_account])
-    response = check_subprocess(' '.join(command_parts), stderr=open(os.devnull, 'w'))
-    result = []
-    for version in json.JSONDecoder().decode(response):
-      result.extend(version['tags'])
-    return (image[image.rfind('/') + 1:], result)
-
-  def collect_gcb_versions(self, pool):
+    if since:
+      command_parts.append('"--filter=timestamp.datetime>=\'{since}\'"'.format(
+          since=since))
+    if self.options.gcb_service_account:
+      command_parts.extend(['--account', self.options.gcb_service_account])
+    return ' '.join(command_parts)
+
+  def collect_gcb_versions(self):
     options = self.options
     logging.debug('Collecting GCB versions from %s', options.docker_registry)
+    collected_at = self.utc_timestamp()
+    since, baseline = self.get_incremental_baseline(
+        CONTAINER, options.docker_registry)
     command_parts = ['gcloud',
                      '--format=json',
                      'container images list',
@@ -614,28 +735,41 @@ class CollectArtifactVersions(CommandProcessor):
     response = check_subprocess(' '.join(command_parts), stderr=open(os.devnull, 'w'))
     images = [entry['name']
               for entry in json.JSONDecoder().decode(response)]
-    image_versions = pool.map(self.query_gcr_image_versions, images)
+    # There is a query per image so run them together rather than a thread
+    # for each.
+    responses = check_subprocesses(
+        [self.gcr_image_versions_command(image, since) for image in images],
+        stderr=open(os.devnull, 'w'))
 
     image_map = {}
-    for name, versions in image_versions:
+    for image, response in zip(images, responses):
+      name = image[image.rfind('/') + 1:]
+      versions = list((baseline or {}).get(name, []))
+      known = set(versions)
+      for version in json.JSONDecoder().decode(response):
+        versions.extend(tag for tag in version['tags'] if tag not in known)
+        known.update(version['tags'])
       image_map[name] = versions
 
-    path = os.path.join(
-        self.get_output_dir(),
-        options.docker_registry.replace('/', '__') + '__gcb_versions.yml')
-    logging.info('Writing %s versions to %s', options.docker_registry, path)
-    write_to_path(yaml.safe_dump(image_map,
-                                 allow_unicode=True,
-                                 default_flow_style=False), path)
+    self.record_versions(
+        CONTAINER, options.docker_registry, image_map,
+        options.docker_registry.replace('/', '__') + '__gcb_versions.yml',
+        collected_at=collected_at)
     return image_map
 
   def collect_gce_image_versions(self):
     options = self.options
     project = options.publish_gce_image_project
     logging.debug('Collecting GCE image versions from %s', project)
+    collected_at = self.utc_timestamp()
+    since, baseline = self.get_incremental_baseline(GCE_IMAGE, project)
+    image_filter = 'spinnaker-'
+    if since:
+      image_filter = '"spinnaker- AND creationTimestamp>=\'{since}\'"'.format(
+          since=since)
     command_parts = ['gcloud', '--format=json',
                      'compute images list', '--project', project,
-                     '--filter spinnaker-']
+                     '--filter', image_filter]
     if options.build_gce_service_account:
       logging.debug('Using account %s', options.build_gce_service_account)
       command_parts.extend(['--account', options.build_gce_service_account])
@@ -643,7 +777,10 @@ class CollectArtifactVersions(CommandProcessor):
     response = check_subprocess(' '.join(command_parts), stderr=open(os.devnull, 'w'))
     images = [entry['name']
               for entry in json.JSONDecoder().decode(response)]
-    image_map = {}
+    image_map = {name: list(versions)
+                 for name, versions in (baseline or {}).items()}
+    known = set((module, version) for module, versions in image_map.items()
+                for version in versions)
     for name in images:
       parts = name.split('-', 2)
       if len(parts) != 3:
@@ -654,16 +791,14 @@ class CollectArtifactVersions(CommandProcessor):
       if len(parts) != 4:
         logging.warning('Skipping malformed %s', name)
         continue
-      version_list = image_map.get(module, [])
-      version_list.append('{}.{}.{}-{}'.format(*parts))
-      image_map[module] = version_list
-
-    path = os.path.join(
-        self.get_output_dir(), project + '__gce_image_versions.yml')
-    logging.info('Writing gce image versions to %s', path)
-    write_to_path(yaml.safe_dump(image_map,
-                                 allow_unicode=True,
-                                 default_flow_style=False), path)
+      version = '{}.{}.{}-{}'.format(*parts)
+      if (module, version) not in known:
+        known.add((module, version))
+        image_map.setdefault(module, []).append(version)
+
+    self.record_versions(GCE_IMAGE, project, image_map,
+                         project + '__gce_image_versions.yml',
+                         collected_at=collected_at)
     return image_map
 
   def collect_config_bucket_versions(self):
@@ -671,25 +806,29 @@ class CollectArtifactVersions(CommandProcessor):
     bucket = options.halyard_bom_bucket
     logging.debug("Collecting configs from bucket %s", bucket)
     full_bucket_prefix = 'gs://{}/'.format(bucket)
+    collected_at = self.utc_timestamp()
     command_parts = ['gsutil', 'ls', full_bucket_prefix]
 
     response = check_subprocess(' '.join(command_parts))
-    config_map = {}
+    subdir_prefixes = []
     for subdir_prefix in response.splitlines():
       if not subdir_prefix.endswith('/'):
         continue
 
       # Sample input line: gs://halconfig/clouddriver/
       service_name = subdir_prefix.replace(full_bucket_prefix, "", 1).rstrip('/')
-      if service_name == 'bom':
-        continue
-
-      command_parts = ['gsutil', 'ls', subdir_prefix]
+      if service_name != 'bom':
+        subdir_prefixes.append(subdir_prefix)
 
-      logging.debug("Collecting configs from {}".format(subdir_prefix))
-
-      versions = check_subprocess(' '.join(command_parts))
+    # There is a listing per service so run them together.
+    logging.debug('Collecting configs from %d services in %s',
+                  len(subdir_prefixes), bucket)
+    responses = check_subprocesses(
+        ['gsutil ls ' + subdir_prefix for subdir_prefix in subdir_prefixes])
 
+    config_map = {}
+    for subdir_prefix, versions in zip(subdir_prefixes, responses):
+      service_name = subdir_prefix.replace(full_bucket_prefix, "", 1).rstrip('/')
       service_config_versions_list = []
       for version_line in versions.splitlines():
         version = version_line.replace(subdir_prefix, "", 1).rstrip('/')
@@ -699,26 +838,41 @@ class CollectArtifactVersions(CommandProcessor):
 
       config_map[service_name] = service_config_versions_list
 
-    path = os.path.join(
-      self.get_output_dir(), bucket + '__config_versions.yml')
-    logging.info('Writing config versions to %s', path)
-    write_to_path(yaml.safe_dump(config_map,
-                                 allow_unicode=True,
-                                 default_flow_style=False), path)
+    self.record_versions(CONFIG, full_bucket_prefix, config_map,
+                         bucket + '__config_versions.yml',
+                         collected_at=collected_at)
 
   def _do_command(self):
-    pool = ThreadPool(16)
-    bintray_jars, bintray_debians = self.collect_bintray_versions(pool)
-    self.collect_gcb_versions(pool)
-    self.collect_gce_image_versions()
-    self.collect_config_bucket_versions()
-    pool.close()
-    pool.join()
-
-    missing_jars = self.find_missing_jar_versions(
-        bintray_jars, bintray_debians)
-    missing_debians = self.find_missing_debian_versions(
-        bintray_jars, bintray_debians)
+    pool = ThreadPool(ResourceLimits.limiter(BINTRAY_HTTP).max_limit)
+    collectors = [lambda: self.collect_bintray_versions(pool),
+                  self.collect_gcb_versions,
+                  self.collect_gce_image_versions,
+                  self.collect_config_bucket_versions]
+    collector_pool = ThreadPool(len(collectors))
+    try:
+      # The collectors use different backends so run them all at once.
+      results = [collector_pool.apply_async(collector)
+                 for collector in collectors]
+      bintray_jars, bintray_debians = results[0].get()
+      for result in results[1:]:
+        result.get()
+
+      missing_jars = self.find_missing_jar_versions(
+          bintray_jars, bintray_debians)
+      missing_debians = self.find_missing_debian_versions(
+          bintray_jars, bintray_debians)
+    finally:
+      collector_pool.close()
+      collector_pool.join()
+      pool.close()
+      pool.join()
+      self.__inventory.close()
+
+    if self.__diffs:
+      path = os.path.join(self.get_output_dir(), 'versions_diff.yml')
+      logging.info('Writing changes since the last collection to %s', path)
+      write_to_path(dump_yaml(self.__diffs, allow_unicode=True,
+                              default_flow_style=False), path)
 
     options = self.options
     for which in [(options.bintray_jar_repository, missing_jars),
@@ -729,8 +883,8 @@ class CollectArtifactVersions(CommandProcessor):
       path = os.path.join(self.get_output_dir(), 'missing_%s.yml' % which[0])
       logging.info('Writing to %s', path)
       write_to_path(
-          yaml.safe_dump(which[1], allow_unicode=True,
-                         default_flow_style=False),
+          dump_yaml(which[1], allow_unicode=True,
+                    default_flow_style=False),
           path)
 
     config = {
@@ -742,7 +896,7 @@ class CollectArtifactVersions(CommandProcessor):
     }
     path = os.path.join(self.get_output_dir(), 'config.yml')
     logging.info('Writing to %s', path)
-    write_to_path(yaml.safe_dump(config, default_flow_style=False), path)
+    write_to_path(dump_yaml(config, default_flow_style=False), path)
 
 
 class CollectArtifactVersionsFactory(CommandFactory):
@@ -781,6 +935,13 @@ class CollectArtifactVersionsFactory(CommandFactory):
     self.add_argument(
         parser, 'halyard_bom_bucket', defaults, None,
         help='The bucket to inspect for versioned configs.')
+    self.add_argument(
+        parser, 'incremental_collect', defaults, False, type=bool,
+        help='Only list the container and gce image versions created since'
+             ' they were last collected into the inventory, adding them to'
+             ' the versions already there. Deletions are not noticed until'
+             ' the next full collection.')
+    ArtifactInventory.add_parser_args(parser, defaults)
 
 
 class AuditArtifactVersions(CommandProcessor):
@@ -793,6 +954,9 @@ class AuditArtifactVersions(CommandProcessor):
   in use by the boms suggested for pruning are not included in the prune list.
   They will be nominated in the next round.
 
+  The boms and artifacts are read from the ArtifactInventory that the
+  collect_bom_versions and collect_artifact_versions commands wrote.
+
   Emits files:
      audit_confirmed_boms.yml: All the boms that have been verified intact.
      audit_found_<type>.yml: All the artifacts of <type> that were referenced
@@ -810,48 +974,19 @@ class AuditArtifactVersions(CommandProcessor):
          could be unanticipated uses of these artifacts.
   """
 
-  def __init_bintray_versions_helper(self, base_path):
-    artifact_data_dir = os.path.join(base_path, 'collect_artifact_versions')
-    debian_paths = []
-    jar_paths = []
-    gcr_paths = []
-    image_paths = []
-    config_paths = []
-    for filename in os.listdir(artifact_data_dir):
-      path = os.path.join(artifact_data_dir, filename)
-      if filename.endswith('__gcb_versions.yml'):
-        gcr_paths.append(path)
-      elif filename.endswith('__jar_versions.yml'):
-        jar_paths.append(path)
-      elif filename.endswith('__debian_versions.yml'):
-        debian_paths.append(path)
-      elif filename.endswith('__gce_image_versions.yml'):
-        image_paths.append(path)
-      elif filename.endswith('__config_versions.yml'):
-        config_paths.append(path)
-
-    for name, found in [('jar', jar_paths),
-                        ('debian', debian_paths),
-                        ('gce image', image_paths),
-                        ('gcr image', gcr_paths),
-                        ('config', config_paths)]:
-      if len(found) != 1:
-        raise_and_log_error(
-            ConfigError(
-                'Expected 1 %s version files in "%s": %s' % (
-                    name, artifact_data_dir, found)))
-
-    logging.debug('Loading container image versions from "%s"', gcr_paths[0])
-    with open(gcr_paths[0], 'r') as stream:
-      self.__container_versions = yaml.safe_load(stream.read())
-    with open(jar_paths[0], 'r') as stream:
-      self.__jar_versions = yaml.safe_load(stream.read())
-    with open(debian_paths[0], 'r') as stream:
-      self.__debian_versions = yaml.safe_load(stream.read())
-    with open(image_paths[0], 'r') as stream:
-      self.__gce_image_versions = yaml.safe_load(stream.read())
-    with open(config_paths[0], 'r') as stream:
-      self.__config_versions = yaml.safe_load(stream.read())
+  def __init_artifact_versions_helper(self, inventory):
+    logging.debug('Loading artifact versions from "%s"', inventory.path)
+    self.__container_versions = inventory.artifact_versions(CONTAINER)
+    self.__jar_versions = inventory.artifact_versions(JAR)
+    self.__debian_versions = inventory.artifact_versions(DEBIAN)
+    self.__gce_image_versions = inventory.artifact_versions(GCE_IMAGE)
+    self.__config_versions = inventory.artifact_versions(CONFIG)
+
+    self.__container_index = VersionIndex(self.__container_versions)
+    self.__jar_index = VersionIndex(self.__jar_versions)
+    self.__debian_index = VersionIndex(self.__debian_versions)
+    self.__gce_image_index = VersionIndex(self.__gce_image_versions)
+    self.__config_index = VersionIndex(self.__config_versions)
 
   def __extract_all_bom_versions(self, bom_map):
     result = set([])
@@ -914,8 +1049,15 @@ class AuditArtifactVersions(CommandProcessor):
       options.prune_min_buildnum_prefix = str(options.prune_min_buildnum_prefix)
 
     super(AuditArtifactVersions, self).__init__(factory, options, **kwargs)
-    base_path = os.path.dirname(self.get_output_dir())
-    self.__init_bintray_versions_helper(base_path)
+    path = ArtifactInventory.path_from_options(options)
+    check_path_exists(path, 'artifact inventory')
+    inventory = ArtifactInventory(path)
+    try:
+      self.__init_artifact_versions_helper(inventory)
+      released_boms = inventory.service_map(released=True)
+      self.__unreleased_boms = inventory.service_map(released=False)
+    finally:
+      inventory.close()
 
     min_version = options.min_audit_bom_version or '0.0.0'
     min_parts = min_version.split('.')
@@ -923,29 +1065,20 @@ class AuditArtifactVersions(CommandProcessor):
       min_version += '.0' * (3 - len(min_parts))
     self.__min_semver = SemanticVersion.make('ignored-' + min_version)
 
-    bom_data_dir = os.path.join(base_path, 'collect_bom_versions')
-    path = os.path.join(bom_data_dir, 'released_bom_service_map.yml')
-    check_path_exists(path, 'released bom analysis')
-    with open(path, 'r') as stream:
-      self.__all_released_boms = {}      # forever
-      self.__current_released_boms = {}  # since min_version to audit
-      for service, versions in yaml.safe_load(stream.read()).items():
-        if not versions:
-          # e.g. this service has not yet been released.
-          logging.info('No versions for service=%s', service)
-          continue
-
-        self.__all_released_boms[service] = versions
-        self.__current_released_boms[service] = versions
-        stripped_versions = self.__remove_old_bom_versions(
-            self.__min_semver, versions)
-        if stripped_versions:
-          self.__current_released_boms[service] = stripped_versions
-
-    path = os.path.join(bom_data_dir, 'unreleased_bom_service_map.yml')
-    check_path_exists(path, 'unreleased bom analysis')
-    with open(path, 'r') as stream:
-      self.__unreleased_boms = yaml.safe_load(stream.read())
+    self.__all_released_boms = {}      # forever
+    self.__current_released_boms = {}  # since min_version to audit
+    for service, versions in released_boms.items():
+      self.__all_released_boms[service] = versions
+      self.__current_released_boms[service] = versions
+      stripped_versions = self.__remove_old_bom_versions(
+          self.__min_semver, versions)
+      if stripped_versions:
+        self.__current_released_boms[service] = stripped_versions
+
+    self.__released_buildnum_index = BuildnumPrefixIndex(
+        self.__all_released_boms)
+    self.__unreleased_buildnum_index = BuildnumPrefixIndex(
+        self.__unreleased_boms)
 
     self.__only_bad_and_invalid_boms = False
     self.__all_bom_versions = self.__extract_all_bom_versions(
@@ -1000,7 +1133,7 @@ class AuditArtifactVersions(CommandProcessor):
       path = os.path.join(self.get_output_dir(), 'audit_' + what + '.yml')
       logging.info('Writing %s', path)
       write_to_path(
-          yaml.safe_dump(data, allow_unicode=True, default_flow_style=False),
+          dump_yaml(data, allow_unicode=True, default_flow_style=False),
           path)
 
     confirmed_boms = self.__all_bom_versions - set(self.__invalid_boms.keys())
@@ -1083,7 +1216,7 @@ class AuditArtifactVersions(CommandProcessor):
     service_list = set(self.__found_debians.keys())
     service_list.update(set(self.__found_containers.keys()))
     for name in service_list:
-      skip_versions = self.__invalid_versions.get(name, [])
+      skip_versions = set(self.__invalid_versions.get(name, []))
       for unused_map, prune_map in [
           (self.__unused_jars, self.__prune_jars),
           (self.__unused_debians, self.__prune_debians),
@@ -1112,11 +1245,11 @@ class AuditArtifactVersions(CommandProcessor):
     path = os.path.join(os.path.dirname(self.get_output_dir()),
                         'collect_bom_versions', 'config.yml')
     with open(path, 'r') as stream:
-      bom_config = yaml.safe_load(stream.read())
+      bom_config = load_yaml(stream.read())
     path = os.path.join(os.path.dirname(self.get_output_dir()),
                         'collect_artifact_versions', 'config.yml')
     with open(path, 'r') as stream:
-      art_config = yaml.safe_load(stream.read())
+      art_config = load_yaml(stream.read())
 
     if self.__prune_boms:
       path = os.path.join(self.get_output_dir(), 'prune_boms.txt')
@@ -1169,12 +1302,7 @@ class AuditArtifactVersions(CommandProcessor):
     if service in ['spinnaker', 'monitoring-third-party']:
       return True  # not applicable
 
-    if service in self.__container_versions:
-      versions = self.__container_versions[service]
-    elif service in ['monitoring-daemon']:
-      versions = self.__container_versions.get('monitoring-daemon', [])
-    else:
-      versions = []
+    versions = self.__container_index.get(service)
 
     if build_version in versions:
       holder = self.__found_containers.get(service, {})
@@ -1193,7 +1321,7 @@ class AuditArtifactVersions(CommandProcessor):
                    'monitoring-third-party', 'monitoring-daemon']:
       return True  # not applicable
 
-    versions = self.__gce_image_versions.get(service, [])
+    versions = self.__gce_image_index.get(service)
     if build_version in versions:
       holder = self.__found_images.get(service, {})
       holder[build_version] = entries
@@ -1216,12 +1344,11 @@ class AuditArtifactVersions(CommandProcessor):
     return False
 
   def audit_jar(self, service, build_version, entries):
-    if service in self.__jar_versions:
-      versions = self.__jar_versions[service]
-    elif service in ['monitoring-daemon', 'monitoring-third-party']:
-      versions = self.__jar_versions.get('spinnaker-monitoring', [])
+    if service in ['monitoring-daemon', 'monitoring-third-party']:
+      versions = self.__jar_index.get(
+          service, default_name='spinnaker-monitoring')
     else:
-      versions = []
+      versions = self.__jar_index.get(service)
 
     if build_version in versions:
       holder = self.__found_jars.get(service, {})
@@ -1236,14 +1363,8 @@ class AuditArtifactVersions(CommandProcessor):
     return False
 
   def audit_debian(self, service, build_version, info_list):
-    versions = []
-    if service in self.__debian_versions:
-      key = service
-      versions = self.__debian_versions[service]
-    else:
-      key = 'spinnaker-' + service
-      if key in self.__debian_versions:
-        versions = self.__debian_versions[key]
+    key = service if service in self.__debian_index else 'spinnaker-' + service
+    versions = self.__debian_index.get(key)
 
     if build_version in versions:
       holder = self.__found_debians.get(service, {})
@@ -1263,11 +1384,11 @@ class AuditArtifactVersions(CommandProcessor):
     if service == 'spinnaker':
       return True
 
-    versions = []
-    if service in self.__config_versions:
-      versions = self.__config_versions[service]
-    elif service in ['monitoring-third-party']:
-      versions = self.__config_versions.get('monitoring-daemon', [])
+    if service in ['monitoring-third-party']:
+      versions = self.__config_index.get(
+          service, default_name='monitoring-daemon')
+    else:
+      versions = self.__config_index.get(service)
 
     if build_version in versions:
       holder = self.__found_configs.get(service, {})
@@ -1281,18 +1402,8 @@ class AuditArtifactVersions(CommandProcessor):
     logging.warning('Missing %s configs %s', service, build_version)
     return False
 
-  def package_in_bom_map(self, service, version, buildnum, service_map):
-    version_map = service_map.get(service)
-    if version_map is None:
-      return False
-    commit_map = version_map.get(version)
-    if commit_map is None:
-      return False
-    for _, buildnums in commit_map.items():
-      for bom_build_num in buildnums:
-        if bom_build_num.startswith(buildnum):
-          return True
-    return False
+  def package_in_bom_map(self, service, version, buildnum, buildnum_index):
+    return buildnum_index.has_prefix(service, version, buildnum)
 
   def audit_package_helper(self, package, version, buildnum, which):
     if package in self.__all_released_boms or package in self.__unreleased_boms:
@@ -1303,9 +1414,9 @@ class AuditArtifactVersions(CommandProcessor):
       return False
 
     is_released = self.package_in_bom_map(
-        name, version, buildnum, self.__all_released_boms)
+        name, version, buildnum, self.__released_buildnum_index)
     is_unreleased = self.package_in_bom_map(
-        name, version, buildnum, self.__unreleased_boms)
+        name, version, buildnum, self.__unreleased_buildnum_index)
     if is_released or is_unreleased:
       return True
 
@@ -1393,8 +1504,280 @@ class AuditArtifactVersionsFactory(CommandFactory):
         parser, 'prune_min_buildnum_prefix', defaults, None,
         help='Only suggest pruning artifacts with a smaller build number.'
         ' This is actually just a string, not a number so is a string compare.')
+    ArtifactInventory.add_parser_args(parser, defaults)
+
+class PruneArtifacts(CommandProcessor):
+  """Delete the artifacts that audit_artifact_versions suggested pruning.
+
+  The prune_<type>.txt files are deleted in batches where the backend
+  allows many artifacts in one call (containers, images and gcs objects)
+  with the batches running as the resource limits permit. Bintray has no
+  bulk delete so its versions are deleted one request at a time.
+
+  Each artifact deleted (or found to already be gone) is appended to the
+  pruned.txt checkpoint as its batch completes. Running the command again
+  skips those, so an interrupted or partially failed prune can be resumed.
+
+  Emits files:
+     pruned.txt: The urls of the artifacts that were deleted.
+     prune_failures.yml: The urls that could not be deleted, with why.
+     prune_plan.yml: With --dry_run, how many artifacts of each type would
+        be deleted and how many calls doing so would take.
+  """
+
+  BOM = 'bom'
+  PRUNE_TYPES = [JAR, DEBIAN, CONTAINER, GCE_IMAGE, CONFIG, BOM]
+  CHECKPOINT_FILENAME = 'pruned.txt'
+
+  # Deleting something that is not there is as good as deleting it.
+  ALREADY_GONE_REGEX = re.compile(
+      r'NOT_FOUND|[Nn]ot [Ff]ound|No URLs matched|was not found'
+      r'|does not exist')
+
+  def __init__(self, factory, options, **kwargs):
+    super(PruneArtifacts, self).__init__(factory, options, **kwargs)
+    if options.prune_batch_size < 1:
+      raise_and_log_error(ConfigError('--prune_batch_size must be positive.'))
+    self.__input_dir = (options.prune_input_dir
+                        or self.get_output_dir('audit_artifact_versions'))
+    self.__checkpoint_path = os.path.join(self.get_output_dir(),
+                                          self.CHECKPOINT_FILENAME)
+    self.__lock = Lock()
+    self.__failures = {}
+
+    user = os.environ.get('BINTRAY_USER')
+    password = os.environ.get('BINTRAY_KEY')
+    if user and password:
+      user_password = '{user}:{password}'.format(user=user, password=password)
+      encoded_auth = base64.b64encode(user_password.encode('utf-8'))
+      self.__basic_auth = 'Basic %s' % encoded_auth.decode()
+    else:
+      self.__basic_auth = None
+
+  def load_prune_urls(self, prune_type):
+    """Returns the urls listed in the prune file for the given type."""
+    path = os.path.join(self.__input_dir, 'prune_%ss.txt' % prune_type)
+    if not os.path.exists(path):
+      return []
+    with open(path, 'r') as stream:
+      return [line.strip() for line in stream.read().split('\n')
+              if line.strip()]
+
+  def load_checkpoint(self):
+    """Returns the set of urls that were already pruned."""
+    if not os.path.exists(self.__checkpoint_path):
+      return set([])
+    with open(self.__checkpoint_path, 'r') as stream:
+      return set(line for line in stream.read().split('\n') if line)
+
+  def __checkpoint(self, urls):
+    with self.__lock:
+      with open(self.__checkpoint_path, 'a') as stream:
+        stream.write(''.join(url + '\n' for url in urls))
+
+  def make_delete_command(self, prune_type, urls):
+    """Returns the command line to delete a batch of artifacts, or None.
+
+    None means the artifacts are deleted through HTTP instead.
+    """
+    options = self.options
+    if prune_type == CONTAINER:
+      parts = ['gcloud', 'container', 'images', 'delete',
+               '--force-delete-tags', '--quiet']
+      if options.gcb_service_account:
+        parts.extend(['--account', options.gcb_service_account])
+    elif prune_type == GCE_IMAGE:
+      parts = ['gcloud', 'compute', 'images', 'delete',
+               '--project', options.publish_gce_image_project, '--quiet']
+      if options.build_gce_service_account:
+        parts.extend(['--account', options.build_gce_service_account])
+    elif prune_type in (CONFIG, self.BOM):
+      parts = ['gsutil', '-m', 'rm']
+    else:
+      return None
+    return ' '.join(parts + urls)
+
+  def resource_class(self, prune_type):
+    """Returns the resource class limiting deletes of the given type."""
+    if prune_type in (JAR, DEBIAN):
+      return BINTRAY_HTTP
+    if prune_type in (CONFIG, self.BOM):
+      return GCS
+    return GCLOUD_API
+
+  def make_batches(self, prune_type, urls):
+    batch_size = (1 if self.resource_class(prune_type) == BINTRAY_HTTP
+                  else self.options.prune_batch_size)
+    return [urls[index:index + batch_size]
+            for index in range(0, len(urls), batch_size)]
+
+  def delete_bintray_version(self, url):
+    """Deletes a bintray package version.
+
+    Returns:
+      (retcode, error) where retcode is 0 if it no longer exists.
+    """
+    request = Request(url)
+    request.get_method = lambda: 'DELETE'
+    if self.__basic_auth:
+      request.add_header('Authorization', self.__basic_auth)
+    try:
+      with limit_resource(BINTRAY_HTTP):
+        urlopen(request).read()
+      return 0, None
+    except HTTPError as ex:
+      if ex.code == 404:
+        return 0, None
+      return -1, 'HTTP {code}: {error}'.format(code=ex.code,
+                                               error=exception_to_message(ex))
+    except Exception as ex:
+      return -1, exception_to_message(ex)
+
+  def __run_batch(self, prune_type, urls):
+    command = self.make_delete_command(prune_type, urls)
+    if command is None:
+      return self.delete_bintray_version(urls[0])
+    retcode, stdout = run_subprocess(command)
+    if (retcode != 0 and len(urls) == 1
+        and self.ALREADY_GONE_REGEX.search(stdout or '')):
+      return 0, None
+    return retcode, stdout
+
+  def delete_batch(self, prune_type, urls):
+    """Deletes a batch of artifacts, recording the outcome.
+
+    If a batch fails then its artifacts are retried one at a time so
+    a single bad artifact does not keep the others from being deleted.
+    """
+    start = time.time()
+    retcode, error = self.__run_batch(prune_type, urls)
+    self.metrics.observe_timer('PruneBatch', {'type': prune_type},
+                               time.time() - start)
+    if retcode == 0:
+      self.__checkpoint(urls)
+      self.metrics.inc_counter('PrunedArtifacts',
+                               {'type': prune_type, 'outcome': 'deleted'},
+                               amount=len(urls))
+      return len(urls)
+    if len(urls) > 1:
+      logging.warning('Failed to delete a batch of %d %ss.'
+                      ' Trying each individually.', len(urls), prune_type)
+      return sum(self.delete_batch(prune_type, [url]) for url in urls)
+
+    logging.error('Could not delete %s: %s', urls[0], error)
+    with self.__lock:
+      self.__failures.setdefault(prune_type, {})[urls[0]] = error
+    self.metrics.inc_counter('PrunedArtifacts',
+                             {'type': prune_type, 'outcome': 'failed'})
+    return 0
+
+  def prune_artifacts_of_type(self, prune_type, urls):
+    """Deletes all the artifacts of the given type."""
+    if prune_type == GCE_IMAGE:
+      check_options_set(self.options, ['publish_gce_image_project'])
+    batches = self.make_batches(prune_type, urls)
+    num_threads = min(len(batches), ResourceLimits.limiter(
+        self.resource_class(prune_type)).max_limit)
+    logging.info('Deleting %d %ss in %d batches using %d threads.',
+                 len(urls), prune_type, len(batches), num_threads)
+
+    start = time.time()
+    pool = ThreadPool(num_threads)
+    try:
+      deleted = sum(pool.map(lambda batch: self.delete_batch(prune_type, batch),
+                             batches))
+    finally:
+      pool.close()
+      pool.join()
+    secs = time.time() - start
+    self.metrics.set('PruneThroughput', {'type': prune_type},
+                     deleted / secs if secs else deleted)
+    logging.info('Deleted %d of %d %ss in %.1f secs.',
+                 deleted, len(urls), prune_type, secs)
+
+  def _do_command(self):
+    options = self.options
+    prune_types = (options.prune_types.split(',')
+                   if options.prune_types else self.PRUNE_TYPES)
+    unknown = [name for name in prune_types if name not in self.PRUNE_TYPES]
+    if unknown:
+      raise_and_log_error(ConfigError(
+          'Unknown --prune_types {unknown}. Expected {expect}.'.format(
+              unknown=unknown, expect=self.PRUNE_TYPES)))
+
+    pruned = self.load_checkpoint()
+    plan = {}
+    for prune_type in prune_types:
+      urls = self.load_prune_urls(prune_type)
+      remaining = [url for url in urls if url not in pruned]
+      if urls:
+        plan[prune_type] = {
+            'artifacts': len(remaining),
+            'already_pruned': len(urls) - len(remaining),
+            'calls': len(self.make_batches(prune_type, remaining)),
+            'unbatched_calls': len(remaining)}
+      if remaining and not options.dry_run:
+        self.prune_artifacts_of_type(prune_type, remaining)
+
+    if options.dry_run:
+      path = os.path.join(self.get_output_dir(), 'prune_plan.yml')
+      logging.info('Writing prune plan to %s', path)
+      write_to_path(dump_yaml(plan, default_flow_style=False), path)
+      for prune_type, entry in sorted(plan.items()):
+        logging.info('Would delete %d %ss in %d calls (rather than %d).',
+                     entry['artifacts'], prune_type,
+                     entry['calls'], entry['unbatched_calls'])
+      return
+
+    if self.__failures:
+      path = os.path.join(self.get_output_dir(), 'prune_failures.yml')
+      write_to_path(
+          dump_yaml(self.__failures, default_flow_style=False), path)
+      count = sum(len(entry) for entry in self.__failures.values())
+      raise_and_log_error(
+          ExecutionError('Could not delete {count} artifacts.'.format(
+              count=count)),
+          'Could not delete {count} artifacts. See "{path}".'
+          ' Rerun to retry them.'.format(count=count, path=path))
+
+
+class PruneArtifactsFactory(CommandFactory):
+  def __init__(self, **kwargs):
+    super(PruneArtifactsFactory, self).__init__(
+        'prune_artifacts', PruneArtifacts,
+        'Delete the artifacts audit_artifact_versions suggested pruning.',
+        **kwargs)
+
+  def init_argparser(self, parser, defaults):
+    super(PruneArtifactsFactory, self).init_argparser(parser, defaults)
+    self.add_argument(
+        parser, 'prune_input_dir', defaults, None,
+        help='The directory containing the prune_<type>.txt files.'
+             ' The default is the audit_artifact_versions output directory.')
+    self.add_argument(
+        parser, 'prune_types', defaults, None,
+        help='A comma-separated list of the types to prune. The default is'
+             ' all of {types}.'.format(types=','.join(
+                 PruneArtifacts.PRUNE_TYPES)))
+    self.add_argument(
+        parser, 'prune_batch_size', defaults, 50, type=int,
+        help='The most artifacts to delete in one gcloud or gsutil call.')
+    self.add_argument(
+        parser, 'dry_run', defaults, False, type=bool,
+        help='Only write a prune_plan.yml of what would be deleted.')
+    self.add_argument(
+        parser, 'gcb_service_account', defaults, None,
+        help='The service account to use when deleting gcr images.')
+    self.add_argument(
+        parser, 'build_gce_service_account', defaults, None,
+        help='The service account to use when deleting gce images.')
+    self.add_argument(
+        parser, 'publish_gce_image_project', defaults, None,
+        help='The GCE project to delete images from.')
+
 
 def register_commands(registry, subparsers, defaults):
   CollectBomVersionsFactory().register(registry, subparsers, defaults)
   CollectArtifactVersionsFactory().register(registry, subparsers, defaults)
   AuditArtifactVersionsFactory().register(registry, subparsers, defaults)
+  PruneArtifactsFactory().register(registry, subparsers, defaults)
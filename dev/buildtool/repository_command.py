@@ -15,12 +15,19 @@
 """Abstract CommandProcessor classes for commands on repositories and boms."""
 
 import logging
+import time
 
 # pylint: disable=relative-import
 from buildtool import (
     CommandProcessor,
     CommandFactory,
+    SpinnakerSourceCodeManager,
     maybe_log_exception)
+from buildtool.bom_delta_support import (
+    filter_planned_repositories,
+    load_rebuild_plan)
+from buildtool.context_support import bind_context_labels
+from buildtool.schedule_support import RepositoryScheduler
 
 
 def _do_call_do_repository(repository, command):
@@ -33,10 +40,12 @@ def _do_call_do_repository(repository, command):
   try:
     metric_labels = command.determine_metric_labels()
     metric_labels['repository'] = repository.name
-    result = command.metrics.track_and_time_call(
-        'RunRepositoryCommand',
-        metric_labels, command.metrics.default_determine_outcome_labels,
-        command._do_repository_wrapper, repository)
+    with bind_context_labels(command=command.name,
+                             repository=repository.name):
+      result = command.metrics.track_and_time_call(
+          'RunRepositoryCommand',
+          metric_labels, command.metrics.default_determine_outcome_labels,
+          command._do_repository_wrapper, repository)
     logging.info('%s finished %s', command.name, repository.name)
     return result
   except Exception as ex:
@@ -79,6 +88,7 @@ class RepositoryCommandProcessor(CommandProcessor):
 
   def __init__(self, factory, options, **kwargs):
     source_repo_names = kwargs.pop('source_repository_names', None)
+    self.__use_rebuild_plan = kwargs.pop('use_rebuild_plan', True)
     max_threads = kwargs.pop('max_threads', 64)
     if options.one_at_a_time:
       logging.debug('Limiting %s to one thread.', factory.name)
@@ -86,8 +96,14 @@ class RepositoryCommandProcessor(CommandProcessor):
 
     super(RepositoryCommandProcessor, self).__init__(
         factory, options, **kwargs)
+    keep_going = (getattr(options, 'repository_failure_policy', None)
+                  == 'keep_going')
     self.__scm = factory.make_scm(options, self.get_input_dir(),
-                                  max_threads=max_threads)
+                                  max_threads=max_threads,
+                                  keep_going=keep_going)
+    self.__max_threads = max_threads
+    self.__scheduler = RepositoryScheduler(options, factory.name)
+    self.__repository_listeners = []
 
     self.__source_repositories = None
     if source_repo_names:
@@ -105,6 +121,16 @@ class RepositoryCommandProcessor(CommandProcessor):
            for name in source_repo_names
            if name in only_names and name not in exclude_names])
 
+  def add_repository_listener(self, listener):
+    """Register a function to call as each repository finishes.
+
+    Args:
+      listener: [callable] Called with the repository name and the result
+         of _do_repository after _do_postprocess_one has seen it. This is
+         called from the command's thread.
+    """
+    self.__repository_listeners.append(listener)
+
   def ensure_local_repository(self, repository):
     """Prepare the repository.git_dir."""
     self.__scm.ensure_local_repository(repository)
@@ -112,6 +138,11 @@ class RepositoryCommandProcessor(CommandProcessor):
   def filter_repositories(self, source_repositories):
     """Filter a list of source_repositories using option constraints."""
     # pylint: disable=unused-argument
+    rebuild_plan_path = getattr(self.options, 'rebuild_plan_path', None)
+    if rebuild_plan_path and self.__use_rebuild_plan:
+      source_repositories = filter_planned_repositories(
+          load_rebuild_plan(rebuild_plan_path), source_repositories)
+
     if not (self.options.only_repositories
             or self.options.exclude_repositories):
       return source_repositories
@@ -140,16 +171,41 @@ class RepositoryCommandProcessor(CommandProcessor):
 
     They can also implement _do_preprocess or _do_postprocess to inject
     behavior before processing any repositories or after processing all them.
+    _do_postprocess_one is called with each repository's result as it
+    finishes, so work can overlap the repositories still being processed.
     """
     self._do_preprocess()
-    result_dict = self.__scm.foreach_source_repository(
-        self.source_repositories, _do_call_do_repository, self)
+    repositories = self.__scheduler.order(self.source_repositories)
+    result_dict = {}
+    finish_secs = {}
+    start_time = time.time()
+    for name, result in self.__scm.iter_source_repositories(
+        repositories, _do_call_do_repository, self):
+      finish_secs[name] = time.time() - start_time
+      result_dict[name] = result
+      self._do_postprocess_one(name, result)
+      for listener in self.__repository_listeners:
+        listener(name, result)
+    self.__scheduler.log_makespan(
+        repositories, min(self.__max_threads, len(repositories)), finish_secs)
     return self._do_postprocess(result_dict)
 
   def _do_preprocess(self):
     """Prepares the command with any pre-requisites that can be factored out."""
     pass
 
+  def _do_postprocess_one(self, name, result):
+    """Perform any post-processing of an individual repository's result.
+
+    This is called from the command's thread (not the repository workers)
+    as each repository finishes, in the order that they finish.
+
+    Args:
+      name: [string] The name of the repository.
+      result: The value returned by _do_repository.
+    """
+    pass
+
   def _do_postprocess(self, result_dict):
     """Perform any post-process after all the repos have been processed.
 
@@ -213,3 +269,14 @@ class RepositoryCommandFactory(CommandFactory):
         help='Do not apply the command to the specified repositories.'
         ' This is a list of comma-separated repository names.'
         ' This flag is intended for temporary use to bypass broken repos.')
+    self.add_argument(
+        parser, 'rebuild_plan_path', defaults, None,
+        help='Only apply the command to the repositories that need rebuilding'
+        ' according to this plan from plan_bom_delta or build_bom.')
+    self.add_argument(
+        parser, 'repository_failure_policy', defaults, 'fail_fast',
+        choices=SpinnakerSourceCodeManager.FAILURE_POLICIES,
+        help='What to do when the command fails on a repository.'
+        ' "fail_fast" stops as soon as any repository fails.'
+        ' "keep_going" finishes the other repositories before failing.')
+    RepositoryScheduler.add_parser_args(parser, defaults)
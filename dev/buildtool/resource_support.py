@@ -0,0 +1,468 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Limits how many concurrent operations use each kind of backend resource.
+
+Commands run many repositories or artifacts in parallel threads, but what
+actually needs limiting is the load placed on each backend (the git server,
+the gcloud API, bintray, the local cpus, etc). Rather than each command
+guessing a thread count, the operations that talk to a backend acquire a
+token from the limiter for its resource class around the actual I/O.
+
+Subprocesses are classified by the program they run, so anything going
+through run_subprocess is limited automatically. HTTP helpers acquire their
+class explicitly with limit_resource.
+
+With --adaptive_resource_limits the network bound classes adjust their
+limit with an AimdController. The limit grows while calls are succeeding
+without slowing down and is cut in half when a backend indicates it is
+overloaded (HTTP 429 or 5xx, "remote end hung up", timeouts, etc).
+"""
+
+import collections
+import contextlib
+import logging
+import multiprocessing
+import os
+import re
+import shlex
+import socket
+import threading
+import time
+
+try:
+  from urllib2 import HTTPError, URLError
+except ImportError:
+  from urllib.error import HTTPError, URLError
+
+from buildtool import (
+    add_parser_argument,
+    raise_and_log_error,
+    ConfigError)
+from buildtool.metrics import MetricsManager
+
+
+GIT_NETWORK = 'git-network'
+GCLOUD_API = 'gcloud-api'
+GCS = 'gcs'
+BINTRAY_HTTP = 'bintray-http'
+LOCAL_CPU = 'local-cpu'
+CLOUD_BUILD_SLOTS = 'cloud-build-slots'
+
+# The default number of concurrent operations for each resource class.
+DEFAULT_RESOURCE_LIMITS = {
+    GIT_NETWORK: 16,
+    GCLOUD_API: 8,
+    GCS: 16,
+    BINTRAY_HTTP: 8,
+    LOCAL_CPU: multiprocessing.cpu_count(),
+    CLOUD_BUILD_SLOTS: 10
+}
+
+# The resource classes whose limits adapt to the backend's health
+# when using --adaptive_resource_limits.
+ADAPTIVE_RESOURCE_CLASSES = [
+    GIT_NETWORK, GCLOUD_API, GCS, BINTRAY_HTTP, CLOUD_BUILD_SLOTS]
+
+# Adaptive limits can grow up to this multiple of their configured limit.
+ADAPTIVE_MAX_LIMIT_FACTOR = 4
+
+# Command output indicating that the backend was overloaded or unavailable
+# rather than the command itself being wrong. The status codes only count
+# where they are reported as such, not as any number in the output.
+OVERLOAD_OUTPUT_REGEX = re.compile(
+    r'\b(?:http\w*(?:/[0-9.]+)?|code|status|error)[\s:=(\[\'"]*'
+    r'(?:429|500|502|503|504)\b'
+    r'|too many requests|rate[ _-]?limit|quota exceeded|resource_exhausted'
+    r'|backenderror|service unavailable|internal server error'
+    r'|remote end hung up|early eof|connection reset|timed out'
+    r'|could not resolve host',
+    re.IGNORECASE)
+
+# The git commands that talk to the origin.
+GIT_NETWORK_COMMANDS = ['clone', 'fetch', 'ls-remote', 'pull', 'push']
+
+# Programs that consume local cpu for their duration.
+LOCAL_CPU_PROGRAMS = ['debuild', 'gradle', 'gradlew', 'npm', 'yarn']
+
+
+def _git_subcommand(args):
+  """Returns the git subcommand in the arguments following "git"."""
+  index = 0
+  while index < len(args) and args[index].startswith('-'):
+    # These options take a separate value.
+    index += 2 if args[index] in ('-C', '-c') else 1
+  return args[index] if index < len(args) else None
+
+
+def classify_command(cmd):
+  """Returns the resource class a command line uses, or None.
+
+  Args:
+    cmd: [string] The command line as passed to run_subprocess.
+  """
+  try:
+    args = shlex.split(cmd)
+  except ValueError:
+    return None
+  if not args:
+    return None
+
+  program = os.path.basename(args[0])
+  if program == 'git':
+    if _git_subcommand(args[1:]) in GIT_NETWORK_COMMANDS:
+      return GIT_NETWORK
+    return None
+  if program == 'gcloud':
+    if args[1:3] == ['builds', 'submit']:
+      return CLOUD_BUILD_SLOTS
+    return GCLOUD_API
+  if program == 'gsutil':
+    return GCS
+  if program in LOCAL_CPU_PROGRAMS:
+    return LOCAL_CPU
+  if program == 'docker' and 'build' in args[1:2]:
+    return LOCAL_CPU
+  return None
+
+
+def is_overload_output(text):
+  """Returns True if failed command output indicates an overloaded backend."""
+  return bool(text) and OVERLOAD_OUTPUT_REGEX.search(text) is not None
+
+
+def is_overload_exception(ex):
+  """Returns True if the exception indicates an overloaded backend."""
+  if isinstance(ex, HTTPError):
+    return ex.code == 429 or ex.code >= 500
+  if isinstance(ex, URLError):
+    return isinstance(ex.reason, socket.timeout) or is_overload_output(
+        str(ex.reason))
+  return isinstance(ex, socket.timeout)
+
+
+class AimdController(object):
+  """Adjusts a concurrency limit by additive-increase/multiplicative-decrease.
+
+  Each success increases the limit by 1/limit so a full window of
+  successes adds one. Successes only count while the average latency
+  stays within latency_tolerance of the best average seen, since growing
+  further past that point only adds queueing at the backend. An overload
+  multiplies the limit by backoff_factor. Overloads within backoff_secs of
+  the previous backoff are from calls already in flight so are ignored.
+  """
+
+  # How much each latency observation contributes to the average.
+  LATENCY_SMOOTHING = 0.2
+
+  # Throughput is measured over this many recent seconds.
+  THROUGHPUT_WINDOW_SECS = 60
+
+  @property
+  def limit(self):
+    """The current limit."""
+    return int(self.__limit)
+
+  @property
+  def max_limit(self):
+    """The largest the limit can grow to."""
+    return self.__max_limit
+
+  def __init__(self, initial, min_limit=1, max_limit=None,
+               backoff_factor=0.5, backoff_secs=5, latency_tolerance=2.0,
+               clock=time.time):
+    self.__min_limit = min_limit
+    self.__max_limit = max_limit or initial
+    self.__limit = float(max(min_limit, min(initial, self.__max_limit)))
+    self.__backoff_factor = backoff_factor
+    self.__backoff_secs = backoff_secs
+    self.__latency_tolerance = latency_tolerance
+    self.__clock = clock
+    self.__lock = threading.Lock()
+    self.__last_backoff = None
+    self.__average_latency = None
+    self.__best_latency = None
+    self.__completions = collections.deque()
+
+  def __record_completion(self, now):
+    self.__completions.append(now)
+    while self.__completions[0] < now - self.THROUGHPUT_WINDOW_SECS:
+      self.__completions.popleft()
+
+  def throughput(self):
+    """Returns the completions per second over the recent window."""
+    with self.__lock:
+      now = self.__clock()
+      recent = [when for when in self.__completions
+                if when >= now - self.THROUGHPUT_WINDOW_SECS]
+      return len(recent) / float(self.THROUGHPUT_WINDOW_SECS)
+
+  def on_success(self, latency_secs):
+    """Record a successful call taking latency_secs."""
+    with self.__lock:
+      self.__record_completion(self.__clock())
+      if self.__average_latency is None:
+        self.__average_latency = latency_secs
+      else:
+        self.__average_latency += self.LATENCY_SMOOTHING * (
+            latency_secs - self.__average_latency)
+      if (self.__best_latency is None
+          or self.__average_latency < self.__best_latency):
+        self.__best_latency = self.__average_latency
+
+      if self.__average_latency > (self.__best_latency
+                                   * self.__latency_tolerance):
+        return
+      self.__limit = min(self.__max_limit, self.__limit + 1.0 / self.__limit)
+
+  def on_overload(self):
+    """Record a call that failed because the backend was overloaded."""
+    with self.__lock:
+      now = self.__clock()
+      self.__record_completion(now)
+      if (self.__last_backoff is not None
+          and now - self.__last_backoff < self.__backoff_secs):
+        return
+      self.__last_backoff = now
+      self.__limit = max(self.__min_limit,
+                         self.__limit * self.__backoff_factor)
+      logging.debug('Backed off concurrency limit to %d', self.__limit)
+
+
+class ResourceToken(object):
+  """Held while using a resource.
+
+  The user calls mark_overloaded if the backend indicated it was
+  overloaded without raising an exception (e.g. a subprocess exit code).
+  """
+
+  @property
+  def overloaded(self):
+    """Whether the backend indicated that it was overloaded."""
+    return self.__overloaded
+
+  @property
+  def start_time(self):
+    """When the token was granted."""
+    return self.__start_time
+
+  def __init__(self):
+    self.__overloaded = False
+    self.__start_time = time.time()
+
+  def mark_overloaded(self):
+    """Report that the backend was overloaded."""
+    self.__overloaded = True
+
+
+class ResourceLimiter(object):
+  """Limits the number of concurrent users of a resource class."""
+
+  @property
+  def name(self):
+    """The resource class name."""
+    return self.__name
+
+  @property
+  def limit(self):
+    """The current maximum number of concurrent users."""
+    if self.__controller:
+      return self.__controller.limit
+    return self.__limit
+
+  @property
+  def max_limit(self):
+    """The largest the limit might become."""
+    if self.__controller:
+      return self.__controller.max_limit
+    return self.__limit
+
+  @property
+  def in_use(self):
+    """The number of tokens currently held."""
+    return self.__in_use
+
+  @property
+  def waiting(self):
+    """The number of threads waiting for a token."""
+    return self.__waiting
+
+  def __init__(self, name, limit):
+    self.__name = name
+    self.__limit = limit
+    self.__in_use = 0
+    self.__waiting = 0
+    self.__condition = threading.Condition()
+    self.__controller = None
+
+  def set_limit(self, limit, controller=None):
+    """Change the limit, waking waiters if it was raised.
+
+    Args:
+      limit: [int] The number of concurrent users.
+      controller: [AimdController] If provided then this decides the limit.
+    """
+    with self.__condition:
+      self.__limit = limit
+      self.__controller = controller
+      self.__condition.notify_all()
+
+  def __update_gauges(self):
+    metrics = MetricsManager.singleton()
+    labels = {'resource': self.__name}
+    metrics.set('ResourceInUse', labels, self.__in_use)
+    metrics.set('ResourceWaiting', labels, self.__waiting)
+    if self.__controller:
+      metrics.set('ResourceLimit', labels, self.__controller.limit)
+      metrics.set('ResourceThroughput', labels,
+                  self.__controller.throughput())
+
+  def take(self):
+    """Wait for and return a ResourceToken.
+
+    The caller must pass the token to release when finished with it.
+    """
+    start_time = time.time()
+    with self.__condition:
+      self.__waiting += 1
+      self.__update_gauges()
+      try:
+        while self.__in_use >= self.limit:
+          self.__condition.wait()
+      finally:
+        self.__waiting -= 1
+      self.__in_use += 1
+      self.__update_gauges()
+
+    wait_secs = time.time() - start_time
+    MetricsManager.singleton().observe_timer(
+        'ResourceWait', {'resource': self.__name}, wait_secs)
+    if wait_secs >= 1:
+      logging.debug('Waited %.1fs for %s', wait_secs, self.__name)
+    return ResourceToken()
+
+  def release(self, token):
+    """Return a token from take, reporting on how its use went."""
+    secs = time.time() - token.start_time
+    with self.__condition:
+      self.__in_use -= 1
+      if self.__controller:
+        if token.overloaded:
+          logging.warning('%s appears overloaded', self.__name)
+          self.__controller.on_overload()
+        else:
+          self.__controller.on_success(secs)
+      self.__update_gauges()
+      # The limit might have grown so wake everyone to check.
+      self.__condition.notify_all()
+
+  @contextlib.contextmanager
+  def acquire(self):
+    """Hold a ResourceToken for the duration of the context."""
+    token = self.take()
+    try:
+      yield token
+    except Exception as ex:
+      if is_overload_exception(ex):
+        token.mark_overloaded()
+      raise
+    finally:
+      self.release(token)
+
+
+class ResourceLimits(object):
+  """Holds the ResourceLimiter singleton for each resource class."""
+
+  __limiters = {name: ResourceLimiter(name, limit)
+                for name, limit in DEFAULT_RESOURCE_LIMITS.items()}
+
+  @staticmethod
+  def init_argument_parser(parser, defaults):
+    """Init argparser with resource limit options."""
+    add_parser_argument(
+        parser, 'resource_limits', defaults, None,
+        help='A comma-separated list of resource=count overriding the'
+             ' maximum concurrent operations on a resource class.'
+             ' The classes and their defaults are {defaults}.'
+             .format(defaults=', '.join(
+                 '{0}={1}'.format(name, limit) for name, limit
+                 in sorted(DEFAULT_RESOURCE_LIMITS.items()))))
+    add_parser_argument(
+        parser, 'adaptive_resource_limits', defaults, False, type=bool,
+        help='Adjust the limits of the network resource classes according'
+             ' to how the backend is responding. The limits grow up to'
+             ' {factor}x the configured limit and back off when the'
+             ' backend appears overloaded.'.format(
+                 factor=ADAPTIVE_MAX_LIMIT_FACTOR))
+
+  @staticmethod
+  def parse_limits(text):
+    """Returns a dictionary of the limits specified by --resource_limits."""
+    limits = {}
+    for entry in (text or '').split(','):
+      if not entry.strip():
+        continue
+      name, _, count = entry.partition('=')
+      name = name.strip()
+      if name not in DEFAULT_RESOURCE_LIMITS:
+        raise_and_log_error(ConfigError(
+            'Unknown --resource_limits class "{name}". Expected one of {all}.'
+            .format(name=name, all=sorted(DEFAULT_RESOURCE_LIMITS.keys()))))
+      try:
+        limits[name] = int(count)
+      except ValueError:
+        limits[name] = 0
+      if limits[name] < 1:
+        raise_and_log_error(ConfigError(
+            'Invalid --resource_limits entry "{entry}".'
+            ' Expected resource=count with a positive count.'
+            .format(entry=entry)))
+    return limits
+
+  @staticmethod
+  def configure(options):
+    """Apply the limits from the options."""
+    limits = dict(DEFAULT_RESOURCE_LIMITS)
+    if getattr(options, 'max_local_builds', None):
+      # The older option limiting gradle builds.
+      limits[LOCAL_CPU] = options.max_local_builds
+    limits.update(ResourceLimits.parse_limits(
+        getattr(options, 'resource_limits', None)))
+    adaptive = getattr(options, 'adaptive_resource_limits', False)
+    for name, limit in limits.items():
+      controller = None
+      if adaptive and name in ADAPTIVE_RESOURCE_CLASSES:
+        controller = AimdController(
+            limit, max_limit=limit * ADAPTIVE_MAX_LIMIT_FACTOR)
+      ResourceLimits.__limiters[name].set_limit(limit, controller=controller)
+    logging.debug('Resource limits are %s%s',
+                  limits, ' (adaptive)' if adaptive else '')
+
+  @staticmethod
+  def limiter(name):
+    """Returns the ResourceLimiter for the named resource class."""
+    return ResourceLimits.__limiters[name]
+
+
+@contextlib.contextmanager
+def limit_resource(name):
+  """Hold a ResourceToken for the named resource class within the context.
+
+  If the name is None then the context yields a token without limits.
+  """
+  if name is None:
+    yield ResourceToken()
+    return
+  with ResourceLimits.limiter(name).acquire() as token:
+    yield token
@@ -14,8 +14,6 @@
 
 """Implements rpm support commands for buildtool."""
 
-from threading import Semaphore
-
 from buildtool import (
     BomSourceCodeManager,
     GradleCommandProcessor,
@@ -23,18 +21,14 @@ from buildtool import (
 
 
 class BuildRpmCommand(GradleCommandProcessor):
-  def __init__(self, factory, options, **kwargs):
-    super(BuildRpmCommand, self).__init__(factory, options, **kwargs)
-    self.__semaphore = Semaphore(options.max_local_buildS)
-
   def _do_repository(self, repository):
     """Implements RepositoryCommandProcessor interface."""
     args = self.gradle.get_common_args()
     if self.options.gradle_cache_path:
       args.append('--gradle-user-home=' + self.options.gradle_cache_path)
 
-    with self.__semaphore:
-      self.gradle.check_run(args, self, repository, 'buildRpm', 'rpm-build')
+    # The gradle build is limited by the local-cpu resource class.
+    self.gradle.check_run(args, self, repository, 'buildRpm', 'rpm-build')
 
 
 def register_commands(registry, subparsers, defaults):
@@ -0,0 +1,218 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Orders the repositories a command works on so the slowest start first.
+
+Commands run their repositories on a limited number of threads. When a
+slow repository happens to start last, everything else waits on it.
+Starting the repositories from longest to shortest (the "LPT" rule) avoids
+this as long as we have a reasonable guess of how long each will take.
+
+The guesses come from the metrics files that earlier runs of the same
+command left in the --metrics_dir.
+"""
+
+import glob
+import heapq
+import json
+import logging
+import os
+
+from buildtool import (
+    add_parser_argument,
+    raise_and_log_error,
+    ConfigError)
+
+
+# The timers whose history predicts how long a repository takes.
+# The build timers are only part of the repository's work but are not
+# distorted by runs that skipped the repository because it was already built.
+HISTORY_TIMER_NAMES = ['RunRepositoryCommand_Outcome', 'GcrBuild', 'DebBuild']
+
+# The number of most recent metrics files to consider.
+MAX_HISTORY_FILES = 20
+
+
+def read_duration_history(metrics_dir, command, max_files=MAX_HISTORY_FILES):
+  """Returns the past durations of each repository the command worked on.
+
+  Only successful calls are considered.
+
+  Args:
+    metrics_dir: [path] The directory containing the metrics files.
+    command: [string] The name of the command to get the history for.
+    max_files: [int] The number of most recent metrics files to read.
+
+  Returns:
+    A dictionary keyed by repository name whose values are dictionaries of
+    timer name to the list of average seconds per run, oldest first.
+  """
+  pattern = os.path.join(
+      metrics_dir, 'metrics__{command}__*.json'.format(command=command))
+  paths = sorted(glob.glob(pattern), key=os.path.getmtime)[-max_files:]
+  history = {}
+  for path in paths:
+    try:
+      with open(path, 'r') as stream:
+        snapshot = json.load(stream)
+    except (IOError, ValueError) as ex:
+      logging.warning('Ignoring unreadable metrics file %s: %s', path, ex)
+      continue
+    if snapshot.get('pid') == os.getpid():
+      continue  # The current run.
+
+    timers = snapshot.get('timers', {})
+    for timer_name in HISTORY_TIMER_NAMES:
+      for collector in timers.get(timer_name, {}).get('collectors', []):
+        labels = collector.get('labels', {})
+        values = collector.get('values')
+        if not values or not labels.get('success'):
+          continue
+        name = labels.get('repository')
+        count = values[-1].get('count')
+        if name and count:
+          history.setdefault(name, {}).setdefault(timer_name, []).append(
+              values[-1]['totalSecs'] / float(count))
+  return history
+
+
+def predict_makespan(durations, num_workers):
+  """Returns how long the durations take when started in the given order.
+
+  Args:
+    durations: [list of float] The seconds each job takes in start order.
+    num_workers: [int] The number of jobs that run at the same time.
+  """
+  if not durations:
+    return 0
+  finish_times = [0] * max(1, num_workers)
+  for secs in durations:
+    # Each job starts on whichever worker becomes available first.
+    heapq.heapreplace(finish_times, finish_times[0] + secs)
+  return max(finish_times)
+
+
+class RepositoryScheduler(object):
+  """Decides the order that a command starts its repositories in."""
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add the parser arguments used by the scheduler."""
+    if hasattr(parser, 'added_repository_scheduler'):
+      return
+    parser.added_repository_scheduler = True
+    add_parser_argument(
+        parser, 'repository_schedule', defaults, 'longest_first',
+        choices=['given', 'longest_first'],
+        help='The order to start repositories in. "longest_first" starts'
+             ' the repositories that took longest in previous runs of the'
+             ' command (according to the --metrics_dir) first.')
+    add_parser_argument(
+        parser, 'repository_schedule_overrides', defaults, None,
+        help='A comma-separated list of name=seconds overriding the'
+             ' expected duration of individual repositories when using'
+             ' --repository_schedule=longest_first.'
+             ' Larger values start sooner.')
+
+  def __init__(self, options, command):
+    """Constructor.
+
+    Args:
+      options: [Namespace] The command options.
+      command: [string] The name of the command whose history to use.
+    """
+    self.__enabled = (getattr(options, 'repository_schedule', 'given')
+                      == 'longest_first')
+    self.__overrides = self.__parse_overrides(
+        getattr(options, 'repository_schedule_overrides', None))
+
+    self.__history = {}
+    metrics_dir = (getattr(options, 'metrics_dir', None)
+                   or os.path.join(getattr(options, 'output_dir', None) or '',
+                                   'metrics'))
+    if self.__enabled and os.path.isdir(metrics_dir):
+      self.__history = read_duration_history(metrics_dir, command)
+
+  @staticmethod
+  def __parse_overrides(text):
+    overrides = {}
+    for entry in (text or '').split(','):
+      if not entry.strip():
+        continue
+      name, _, secs = entry.partition('=')
+      try:
+        overrides[name.strip()] = float(secs)
+      except ValueError:
+        raise_and_log_error(ConfigError(
+            'Invalid --repository_schedule_overrides entry "{entry}".'
+            ' Expected name=seconds.'.format(entry=entry)))
+    return overrides
+
+  def predict(self, name):
+    """Returns the expected seconds for the repository or None if unknown."""
+    if name in self.__overrides:
+      return self.__overrides[name]
+
+    # Use the longest of the timers since they measure different parts.
+    predictions = []
+    for runs in self.__history.get(name, {}).values():
+      recent = runs[-5:]
+      predictions.append(sum(recent) / len(recent))
+    return max(predictions) if predictions else None
+
+  def __predictions(self, names):
+    """Returns the predicted seconds of each name.
+
+    Repositories without a prediction are assumed to be as slow as
+    the slowest one we know about so that they start early.
+    """
+    known = {name: self.predict(name) for name in names}
+    default = max([secs for secs in known.values() if secs is not None]
+                  or [0])
+    return {name: default if secs is None else secs
+            for name, secs in known.items()}
+
+  def order(self, repositories):
+    """Returns the repositories in the order they should be started."""
+    if not self.__enabled:
+      return repositories
+    predictions = self.__predictions([repo.name for repo in repositories])
+    # Sort is stable so ties remain in their given order.
+    result = sorted(repositories, key=lambda repo: -predictions[repo.name])
+    logging.debug('Scheduling repositories as %s',
+                  ['{0}={1:.1f}s'.format(repo.name, predictions[repo.name])
+                   for repo in result])
+    return result
+
+  def log_makespan(self, repositories, num_workers, finish_secs):
+    """Log how long the repositories were expected to take and did take.
+
+    Args:
+      repositories: [list of GitRepositorySpec] In the order they started.
+      num_workers: [int] The number of repositories run concurrently.
+      finish_secs: [dict] Seconds from the start until each repository
+         finished, keyed by repository name.
+    """
+    if not self.__enabled or not finish_secs:
+      return
+    predictions = self.__predictions([repo.name for repo in repositories])
+    predicted = predict_makespan(
+        [predictions[repo.name] for repo in repositories], num_workers)
+    for repo in repositories:
+      if repo.name in finish_secs:
+        logging.debug('%s predicted %.1fs, finished after %.1fs',
+                      repo.name, predictions[repo.name],
+                      finish_secs[repo.name])
+    logging.info('Repositories predicted to finish in %.1fs took %.1fs',
+                 predicted, max(finish_secs.values()))
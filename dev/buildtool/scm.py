@@ -23,7 +23,6 @@ from multiprocessing.pool import ThreadPool
 import collections
 import logging
 import os
-import yaml
 
 # pylint: disable=relative-import
 from buildtool import (
@@ -34,8 +33,9 @@ from buildtool import (
     add_parser_argument,
     check_kwargs_empty,
     raise_and_log_error,
-    write_to_path,
+    ExecutionError,
     UnexpectedError)
+from buildtool.serialization_support import DocumentCache
 
 
 class SourceInfo(
@@ -76,6 +76,9 @@ class SpinnakerSourceCodeManager(object):
 
   AUTO = '_auto_'
 
+  # Values for the --repository_failure_policy of repository commands.
+  FAILURE_POLICIES = ['fail_fast', 'keep_going']
+
   @staticmethod
   def add_parser_args(parser, defaults):
     """Add standard parser arguments used by SourceCodeManager."""
@@ -105,6 +108,7 @@ class SpinnakerSourceCodeManager(object):
 
   def __init__(self, options, root_source_dir, **kwargs):
     self.__max_threads = kwargs.pop('max_threads', 100)
+    self.__keep_going = kwargs.pop('keep_going', False)
     self.__add_upstream = kwargs.pop('attach_upstream', False)
     check_kwargs_empty(kwargs)
 
@@ -220,7 +224,7 @@ class SpinnakerSourceCodeManager(object):
     logging.debug(
         'Refreshing source info for %s and caching to %s for buildnum=%s',
         repository.name, cache_path, build_number)
-    write_to_path(info.summary.to_yaml(), cache_path)
+    DocumentCache.write(info.summary.to_dict(), cache_path)
     return info
 
   def lookup_source_info(self, repository):
@@ -228,10 +232,10 @@ class SpinnakerSourceCodeManager(object):
     filename = repository.name + '-meta.yml'
     dir_path = os.path.join(self.__options.output_dir, 'source_info')
     build_number = self.determine_build_number(repository)
-    with open(os.path.join(dir_path, filename), 'r') as stream:
-      return SourceInfo(
-          build_number,
-          RepositorySummary.from_dict(yaml.safe_load(stream.read())))
+    return SourceInfo(
+        build_number,
+        RepositorySummary.from_dict(
+            DocumentCache.load(os.path.join(dir_path, filename))))
 
   def check_source_info(self, repository):
     """Ensure cached source info is consistent with current repository."""
@@ -249,32 +253,73 @@ class SpinnakerSourceCodeManager(object):
 
   def foreach_source_repository(
       self, all_repos, call_function, *posargs, **kwargs):
-    """Call the function on each of the SourceRepository instances."""
+    """Call the function on each of the SourceRepository instances.
+
+    Returns:
+      A dictionary of repository name to the function's result.
+    """
+    return dict(self.iter_source_repositories(
+        all_repos, call_function, *posargs, **kwargs))
+
+  def iter_source_repositories(
+      self, all_repos, call_function, *posargs, **kwargs):
+    """Call the function on each of the SourceRepository instances.
+
+    This is a generator yielding (name, result) as each call finishes so
+    that callers can process results while other repositories are still
+    being worked on.
+
+    If the manager was constructed with keep_going then a failure does not
+    stop the remaining repositories. Their results are still yielded and an
+    ExecutionError naming the failed repositories is raised at the end.
+    Otherwise the first failure is raised as soon as it is seen and
+    repositories that have not started yet are abandoned.
+    """
     worker = RepositoryWorker(call_function, *posargs, **kwargs)
+
+    def call(repository):
+      try:
+        return repository.name, worker(repository)[1], None
+      except Exception as ex:  # pylint: disable=broad-except
+        return repository.name, None, ex
+
     num_threads = min(self.__max_threads, len(all_repos))
+    pool = None
     if num_threads > 1:
       pool = ThreadPool(num_threads)
       logging.info('Mapping %d/%s',
                    len(all_repos), [repo.name for repo in all_repos])
-      try:
-        raw_list = pool.map(worker, all_repos)
-        result = {name: value for name, value in raw_list}
-      except Exception:
-        logging.error('Map caught exception')
-        pool.close()
-        pool.join()
-        raise
-      logging.info('Finished mapping')
-      pool.close()
-      pool.join()
+      outcomes = pool.imap_unordered(call, all_repos)
     else:
       # If we have only one thread, skip the pool
       # this is primarily to make debugging easier.
-      result = {
-          repository.name: worker(repository)[1]
-          for repository in all_repos
-      }
-    return result
+      outcomes = (call(repository) for repository in all_repos)
+
+    failed = []
+    try:
+      for name, result, ex in outcomes:
+        if ex is None:
+          yield name, result
+          continue
+        if not self.__keep_going:
+          logging.error('Map caught exception')
+          raise ex
+        logging.error('%s failed; continuing with the other repositories.',
+                      name)
+        failed.append(name)
+    finally:
+      if pool:
+        # This abandons anything not yet started if we stopped early.
+        pool.terminate()
+        pool.join()
+
+    if failed:
+      raise_and_log_error(ExecutionError(
+          '{count} of {total} repositories failed: {names}'.format(
+              count=len(failed), total=len(all_repos),
+              names=', '.join(sorted(failed)))))
+    if pool:
+      logging.info('Finished mapping')
 
   def push_to_origin_if_not_upstream(self, repository, branch):
     """Push the local repository back to the origin, but not upstream."""
@@ -0,0 +1,208 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reads and writes the yaml documents that buildtool uses.
+
+Parsing uses libyaml when PyYAML was built with it, which is several
+times faster than the pure python parser.
+
+Files that people or other tools read, such as BOMs and the inspection
+reports, are emitted with the pure python emitter. libyaml folds some
+long quoted strings differently, so using it would change the published
+bytes. Documents that only buildtool reads back, such as the cached
+source_info, are emitted with libyaml. They can also have a json or
+msgpack sidecar, which is faster to read back than any yaml.
+"""
+
+import io
+import json
+import logging
+import os
+import pickle
+import threading
+import yaml
+
+try:
+  from yaml import CSafeLoader as _SafeLoader
+  from yaml import CSafeDumper as _MachineDumper
+  HAVE_LIBYAML = True
+except ImportError:
+  from yaml import SafeLoader as _SafeLoader
+  from yaml import SafeDumper as _MachineDumper
+  HAVE_LIBYAML = False
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+from buildtool import (
+    add_parser_argument,
+    raise_and_log_error,
+    write_to_path,
+    ConfigError)
+
+
+SIDECAR_FORMATS = ['json', 'msgpack']
+
+
+def load_yaml(text_or_stream):
+  """Parse a yaml document like yaml.safe_load."""
+  return yaml.load(text_or_stream, Loader=_SafeLoader)
+
+
+def dump_yaml(data, stream=None, **kwargs):
+  """Emit a yaml document byte for byte as yaml.safe_dump would."""
+  return yaml.dump(data, stream=stream, Dumper=yaml.SafeDumper, **kwargs)
+
+
+def dump_machine_yaml(data, stream=None, **kwargs):
+  """Emit a yaml document that only buildtool will read back.
+
+  This is faster than dump_yaml but not always byte identical to it.
+  """
+  if not isinstance(data, (dict, list)):
+    # libyaml ends top-level scalars differently. They are small anyway.
+    return dump_yaml(data, stream=stream, **kwargs)
+  return yaml.dump(data, stream=stream, Dumper=_MachineDumper, **kwargs)
+
+
+def _load_json(path):
+  with io.open(path, 'r', encoding='utf-8') as stream:
+    return json.load(stream)
+
+
+def _load_msgpack(path):
+  with open(path, 'rb') as stream:
+    return msgpack.unpackb(stream.read(), raw=False)
+
+
+def _load_yaml_path(path):
+  with io.open(path, 'r', encoding='utf-8') as stream:
+    return load_yaml(stream)
+
+
+class DocumentCache(object):
+  """Loads documents from files, remembering them within the process.
+
+  A flow runs many commands that read the same BOM, defaults and
+  source_info files. Documents are remembered by path and are parsed
+  again only when the file's modification time or size changes.
+  Each load returns its own copy so callers are free to modify it.
+
+  DocumentCache.write writes documents only buildtool reads. When
+  --document_sidecar_format is set it also writes a json or msgpack
+  sidecar next to the yaml which load prefers while it is up to date.
+  """
+
+  __sidecar_format = 'json'
+  __documents = {}
+  __lock = threading.Lock()
+
+  @staticmethod
+  def init_argument_parser(parser, defaults):
+    """Init argparser with document cache options."""
+    add_parser_argument(
+        parser, 'document_sidecar_format', defaults, 'json',
+        help='The format of the sidecar written next to yaml documents that'
+             ' only buildtool reads back, such as the cached source_info.'
+             ' One of {formats}, or "none" to only write yaml.'
+             ' msgpack requires the msgpack package.'.format(
+                 formats=', '.join(SIDECAR_FORMATS)))
+
+  @staticmethod
+  def configure(options):
+    """Set the sidecar format from the options."""
+    sidecar_format = getattr(options, 'document_sidecar_format', 'json')
+    if sidecar_format in (None, '', 'none'):
+      sidecar_format = None
+    elif sidecar_format not in SIDECAR_FORMATS:
+      raise_and_log_error(ConfigError(
+          'Unknown --document_sidecar_format "{format}".'
+          ' Expected one of {all} or "none".'.format(
+              format=sidecar_format, all=SIDECAR_FORMATS)))
+    elif sidecar_format == 'msgpack' and msgpack is None:
+      raise_and_log_error(ConfigError(
+          '--document_sidecar_format=msgpack requires the msgpack package.'))
+    DocumentCache.__sidecar_format = sidecar_format
+
+  @staticmethod
+  def clear():
+    """Forget the documents loaded so far."""
+    with DocumentCache.__lock:
+      DocumentCache.__documents = {}
+
+  @staticmethod
+  def __load_file(path, parser):
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size)
+    with DocumentCache.__lock:
+      entry = DocumentCache.__documents.get(path)
+    if entry is None or entry[0] != key:
+      # Keep the pickled document because unpickling a copy is much
+      # cheaper than parsing the file again or deep copying it.
+      entry = (key, pickle.dumps(parser(path), pickle.HIGHEST_PROTOCOL))
+      with DocumentCache.__lock:
+        DocumentCache.__documents[path] = entry
+    return pickle.loads(entry[1])
+
+  @staticmethod
+  def load(path):
+    """Returns the document in the yaml file at the given path.
+
+    This reads an up to date sidecar instead if there is one.
+    """
+    yaml_mtime = os.stat(path).st_mtime
+    for sidecar_format, parser in [('json', _load_json),
+                                   ('msgpack', _load_msgpack)]:
+      sidecar_path = path + '.' + sidecar_format
+      if parser == _load_msgpack and msgpack is None:
+        continue
+      try:
+        if os.stat(sidecar_path).st_mtime >= yaml_mtime:
+          return DocumentCache.__load_file(sidecar_path, parser)
+      except OSError:
+        continue
+      except ValueError as ex:
+        logging.warning('Ignoring unreadable sidecar %s: %s', sidecar_path, ex)
+    return DocumentCache.__load_file(path, _load_yaml_path)
+
+  @staticmethod
+  def write(data, path):
+    """Write a document that only buildtool reads back.
+
+    Any existing sidecars are removed so they cannot shadow the new yaml.
+    """
+    with DocumentCache.__lock:
+      for doc_path in [path] + [path + '.' + ext for ext in SIDECAR_FORMATS]:
+        DocumentCache.__documents.pop(doc_path, None)
+        if doc_path != path and os.path.exists(doc_path):
+          os.remove(doc_path)
+    write_to_path(dump_machine_yaml(data, default_flow_style=False), path)
+
+    sidecar_format = DocumentCache.__sidecar_format
+    if sidecar_format is None:
+      return
+    sidecar_path = path + '.' + sidecar_format
+    try:
+      if sidecar_format == 'json':
+        write_to_path(json.dumps(data, separators=(',', ':')), sidecar_path)
+      else:
+        content = msgpack.packb(data, use_bin_type=True)
+        with open(sidecar_path, 'wb') as stream:
+          stream.write(content)
+    except (TypeError, ValueError) as ex:
+      # Such as dates, which only yaml has a representation for.
+      logging.debug('Not writing %s sidecar for %s: %s',
+                    sidecar_format, path, ex)
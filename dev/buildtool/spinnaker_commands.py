@@ -18,7 +18,6 @@ import copy
 import logging
 import os
 import subprocess
-import yaml
 
 try:
   from urllib2 import urlopen, HTTPError
@@ -48,6 +47,9 @@ from buildtool import (
     ConfigError)
 
 from buildtool.changelog_commands import PublishChangelogFactory
+from buildtool.serialization_support import (
+    dump_yaml,
+    load_yaml)
 
 
 class InitiateReleaseBranchFactory(RepositoryCommandFactory):
@@ -61,6 +63,8 @@ class InitiateReleaseBranchFactory(RepositoryCommandFactory):
         'Create a new spinnaker release branch in each of the repos.',
         BranchSourceCodeManager,
         source_repository_names=repo_names,
+        # Every repository gets the release branch, changed or not.
+        use_rebuild_plan=False,
         **kwargs)
 
   def init_argparser(self, parser, defaults):
@@ -197,7 +201,7 @@ class GetNextPatchParametersCommand(CommandProcessor):
 
   def _get_versions(self):
    version_data = check_subprocess('gsutil cat gs://halconfig/versions.yml', stderr=subprocess.PIPE)
-   versions = yaml.safe_load(version_data).get('versions')
+   versions = load_yaml(version_data).get('versions')
    return versions
 
 class PublishSpinnakerCommand(CommandProcessor):
@@ -336,7 +340,7 @@ class PublishSpinnakerCommand(CommandProcessor):
     bom = self.__hal.retrieve_bom_version(self.options.bom_version)
     bom['version'] = spinnaker_version
     bom_path = os.path.join(self.get_output_dir(), spinnaker_version + '.yml')
-    write_to_path(yaml.safe_dump(bom, default_flow_style=False), bom_path)
+    write_to_path(dump_yaml(bom, default_flow_style=False), bom_path)
     self.__hal.publish_bom_path(bom_path)
     self.push_branches_and_tags(bom)
 
@@ -12,25 +12,49 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Support for running subprocess commands."""
+"""Support for running subprocess commands.
 
+The output of child processes is collected by a single SubprocessEngine
+thread that multiplexes all their pipes rather than each caller blocking
+on its own child's pipes. This reads stdout and stderr concurrently so a
+child cannot block writing to one while we wait on the other.
+"""
+
+import codecs
+import collections
 import io
 import datetime
+import hashlib
+import json
 import logging
 import os
+import re
+import selectors
 import shlex
+import shutil
 import subprocess
+import sys
+import threading
 import time
 
 from buildtool import (
+    add_parser_argument,
     ensure_dir_exists,
     log_embedded_output,
     log_timestring,
     raise_and_log_error,
     timedelta_string,
+    ConfigError,
     ExecutionError)
 
-from buildtool.base_metrics import BaseMetricsRegistry
+from buildtool.base_metrics import BaseMetricsRegistry, MetricFamily
+from buildtool.context_support import context_labels
+from buildtool.metrics import MetricsManager
+from buildtool.resource_support import (
+    ResourceLimits,
+    classify_command,
+    is_overload_output,
+    limit_resource)
 
 
 # Directory where error logfiles are copied to.
@@ -38,6 +62,31 @@ from buildtool.base_metrics import BaseMetricsRegistry
 # this module does not offer encapsulated configuration.
 ERROR_LOGFILE_DIR = 'errors'
 
+# The size of the blocks counted by ru_inblock and ru_oublock.
+RUSAGE_BLOCK_SIZE = 512
+
+# ru_maxrss is in kilobytes on Linux but in bytes on Darwin.
+RUSAGE_MAXRSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+# The most bytes read from a child's pipe at a time.
+READ_CHUNK_SIZE = 64 * 1024
+
+# How often to flush a stream while a child is writing to it.
+STREAM_FLUSH_SECS = 1.0
+
+# The number of final lines an OutputCapture keeps in memory by default.
+# Like ERROR_LOGFILE_DIR these can be configured externally.
+CAPTURE_TAIL_LINES = 200
+
+# The lines an OutputCapture keeps regardless of where they are.
+CAPTURE_INTERESTING_REGEX = (
+    r'FAILED|FAILURE|Execution failed|What went wrong|ERROR|[Ee]rror[:=]'
+    r'|Exception')
+
+# Bounds on the memory used by the lines an OutputCapture keeps.
+CAPTURE_MAX_INTERESTING_LINES = 500
+CAPTURE_MAX_LINE_CHARS = 4000
+
 def start_subprocess(cmd, stream=None, stdout=None, stderr=None, echo=False, **kwargs):
   """Starts a subprocess and returns handle to it."""
   split_cmd = shlex.split(cmd)
@@ -68,50 +117,377 @@ def start_subprocess(cmd, stream=None, stdout=None, stderr=None, echo=False, **k
   return process
 
 
-def wait_subprocess(process, stream=None, echo=False, postprocess_hook=None):
-  """Waits for subprocess to finish and returns (final status, stdout).
+class OutputCapture(object):
+  """A bounded view of a child's stdout that is also written to a logfile.
 
-  This will also consume the remaining output to return it.
+  Rather than the entire output, only the last lines and the "interesting"
+  lines matching a regex are kept in memory. iter_lines rereads the
+  complete output from the logfile when something needs to scan it.
+  """
 
-  Returns:
-    Process exit code, stdout remaining in process prior to this invocation.
-    Any previously read output from the process will not be included.
+  @property
+  def line_count(self):
+    """The number of lines seen."""
+    return self.__line_count
+
+  @property
+  def tail_lines(self):
+    """The final lines of the output."""
+    return list(self.__tail)
+
+  @property
+  def tail_text(self):
+    """The final lines of the output as a string."""
+    return u'\n'.join(self.__tail)
+
+  @property
+  def interesting_lines(self):
+    """A list of (line number, line) for the lines matching the regex."""
+    return list(self.__interesting)
+
+  def __init__(self, tail_lines=None, interesting_regex=None):
+    """Constructor.
+
+    Args:
+      tail_lines: [int] The number of final lines to keep.
+      interesting_regex: [string] Keep lines matching this too.
+    """
+    self.__tail = collections.deque(maxlen=tail_lines or CAPTURE_TAIL_LINES)
+    self.__interesting_re = re.compile(
+        interesting_regex or CAPTURE_INTERESTING_REGEX)
+    self.__interesting = []
+    self.__partial = u''
+    self.__line_count = 0
+    self.__path = None
+    self.__start_offset = None
+    self.__end_offset = None
+
+  def begin(self, stream):
+    """Note where the output starts in the logfile stream, if any."""
+    name = getattr(stream, 'name', None)
+    if not isinstance(name, str):
+      return
+    try:
+      self.__start_offset = stream.tell()
+      self.__path = name
+    except (IOError, ValueError):
+      pass
+
+  def add(self, text):
+    """Add the next decoded output."""
+    lines = (self.__partial + text).split(u'\n')
+    self.__partial = lines.pop()[-CAPTURE_MAX_LINE_CHARS:]
+    for line in lines:
+      self.__add_line(line)
+
+  def finish(self, stream):
+    """Note where the output ends once the child has finished."""
+    if self.__partial:
+      self.__add_line(self.__partial)
+      self.__partial = u''
+    if self.__path is not None:
+      self.__end_offset = stream.tell()
+
+  def __add_line(self, line):
+    self.__line_count += 1
+    line = line[:CAPTURE_MAX_LINE_CHARS]
+    self.__tail.append(line)
+    if (len(self.__interesting) < CAPTURE_MAX_INTERESTING_LINES
+        and self.__interesting_re.search(line)):
+      self.__interesting.append((self.__line_count, line))
+
+  def iter_lines(self):
+    """Yields each line of the output, reading it back from the logfile.
+
+    Without a logfile only the tail lines are available.
+    """
+    if self.__path is None or self.__end_offset is None:
+      for line in self.tail_lines:
+        yield line
+      return
+
+    remaining = self.__end_offset - self.__start_offset
+    with io.open(self.__path, 'rb') as stream:
+      stream.seek(self.__start_offset)
+      for raw_line in stream:
+        if remaining <= 0:
+          break
+        raw_line = raw_line[:remaining]
+        remaining -= len(raw_line)
+        yield raw_line.decode('utf-8', 'replace').rstrip(u'\n')
+
+  def summary(self):
+    """Returns the interesting lines followed by the tail as a string."""
+    tail_start = self.__line_count - len(self.__tail) + 1
+    lines = [u'{0}: {1}'.format(number, line)
+             for number, line in self.__interesting if number < tail_start]
+    if lines:
+      lines.append(u'...')
+    lines.extend(u'{0}: {1}'.format(tail_start + index, line)
+                 for index, line in enumerate(self.__tail))
+    return u'\n'.join(lines)
+
+
+def _output_text(stdout):
+  """Returns the text of stdout from run_subprocess as best we have it."""
+  if isinstance(stdout, OutputCapture):
+    return stdout.tail_text
+  return stdout
+
+
+def _decode_wait_status(status):
+  """Returns the Popen returncode for an os.wait status."""
+  if os.WIFSIGNALED(status):
+    return -os.WTERMSIG(status)
+  return os.WEXITSTATUS(status)
+
+
+class _ChildProcess(object):
+  """The state of a child process whose output the SubprocessEngine reads."""
+
+  def __init__(self, process, stream, echo, on_close, capture=None):
+    self.process = process
+    self.stream = stream
+    self.log_level = logging.INFO if echo else logging.DEBUG
+    self.on_close = on_close
+    self.capture = capture
+    self.stdout_chunks = []
+    self.stderr_partial = u''
+    self.open_pipes = 0
+    self.last_flush = time.time()
+    self.closed = threading.Event()
+    self.usage = None
+    self.__reap_lock = threading.Lock()
+
+  @property
+  def stdout(self):
+    """The stdout collected so far, or the OutputCapture if capturing."""
+    if self.capture is not None:
+      return self.capture
+    return u''.join(self.stdout_chunks)
+
+  def reap(self, block=True):
+    """Reap the child once it exits, collecting its resource usage.
+
+    Args:
+      block: [bool] If False then do not wait for the child to exit.
+
+    Returns:
+      The process returncode or None if it is still running.
+    """
+    with self.__reap_lock:
+      process = self.process
+      if process.returncode is not None:
+        return process.returncode
+      try:
+        pid, status, usage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+      except (AttributeError, OSError):
+        # No wait4 on this platform or someone else reaped the child.
+        return process.wait() if block else process.poll()
+      if pid:
+        self.usage = usage
+        process.returncode = _decode_wait_status(status)
+      return process.returncode
+
+  def wait(self):
+    """Wait for the child to exit and return its collected stdout."""
+    self.closed.wait()
+    self.reap()
+    return self.stdout
+
+
+_MAX_RSS_LOCK = threading.Lock()
+
+
+def _subprocess_program(process):
+  """Returns the name of the program the process is running."""
+  args = process.args
+  if not isinstance(args, (list, tuple)):
+    try:
+      args = shlex.split(args)
+    except ValueError:
+      args = args.split()
+  return os.path.basename(args[0]) if args else 'UNKNOWN'
+
+
+def _record_subprocess_usage(child):
+  """Record the resources used by the child as metrics.
+
+  These are labeled by the program along with the command and repository
+  that the calling thread is working on, if known.
+  """
+  usage = child.usage
+  if usage is None:
+    return
+
+  context = context_labels()
+  labels = {
+      'program': _subprocess_program(child.process),
+      'command': context.get('command', 'UNKNOWN'),
+      'repository': context.get('repository', 'NONE')
+  }
+  metrics = MetricsManager.singleton()
+  metrics.observe_timer('SubprocessUserCpu', labels, usage.ru_utime)
+  metrics.observe_timer('SubprocessSystemCpu', labels, usage.ru_stime)
+  metrics.inc_counter('SubprocessBytesRead', labels,
+                      amount=usage.ru_inblock * RUSAGE_BLOCK_SIZE)
+  metrics.inc_counter('SubprocessBytesWritten', labels,
+                      amount=usage.ru_oublock * RUSAGE_BLOCK_SIZE)
+  metrics.inc_counter('SubprocessVoluntaryContextSwitches', labels,
+                      amount=usage.ru_nvcsw)
+  metrics.inc_counter('SubprocessInvoluntaryContextSwitches', labels,
+                      amount=usage.ru_nivcsw)
+
+  max_rss = usage.ru_maxrss * RUSAGE_MAXRSS_SCALE
+  with _MAX_RSS_LOCK:
+    gauge = metrics.get_metric(
+        MetricFamily.GAUGE, 'SubprocessMaxRssBytes', labels)
+    if max_rss > gauge.value:
+      gauge.set(max_rss)
+
+
+class SubprocessEngine(object):
+  """Reads the output of all child processes from a single thread.
+
+  Pipes are read in large chunks as they become ready and decoded
+  incrementally. Streams are flushed periodically rather than per line.
   """
-  text_lines = []
-  if process.stdout is not None:
-    # stdout isnt going to another stream; collect it from the pipe.
-    for raw_line in iter(process.stdout.readline, ''):
-      if not raw_line:
-        break
-      decoded_line = raw_line.decode(encoding='utf-8')
-      text_lines.append(decoded_line)
-      if stream:
-        stream.write(decoded_line)
-        stream.flush()
-
-  if process.stderr is not None:
-    log_level = logging.INFO if echo else logging.DEBUG
-    # stderr isn't going to another file handle; log it
-    for raw_line in iter(process.stderr.readline, ''):
-      decoded_line = raw_line.decode(encoding='utf-8').rstrip('\n')
-      logging.log(log_level, 'PID %s wrote to stderr: %s', process.pid, decoded_line)
-
-   
-  process.wait()
-  if stream is None and process.stdout is not None:
-    # Close stdout pipe if we didnt give a stream.
-    # Otherwise caller owns the stream.
-    process.stdout.close()
 
+  __singleton = None
+  __singleton_lock = threading.Lock()
+
+  @staticmethod
+  def singleton():
+    """Returns the shared engine, starting it if needed."""
+    with SubprocessEngine.__singleton_lock:
+      if SubprocessEngine.__singleton is None:
+        SubprocessEngine.__singleton = SubprocessEngine()
+      return SubprocessEngine.__singleton
+
+  def __init__(self):
+    self.__selector = selectors.DefaultSelector()
+    self.__lock = threading.Lock()
+    self.__pending = []
+    self.__wakeup_read, self.__wakeup_write = os.pipe()
+    self.__selector.register(
+        self.__wakeup_read, selectors.EVENT_READ, None)
+    self.__thread = threading.Thread(
+        name='SubprocessEngine', target=self.__run)
+    self.__thread.daemon = True
+    self.__thread.start()
+
+  def attach(self, process, stream=None, echo=False, on_close=None,
+             capture=None):
+    """Start reading the output of a process from start_subprocess.
+
+    Args:
+      process: [Popen] The process to read from.
+      stream: [stream] If provided, write the stdout to this stream.
+      echo: [boolean] Log stderr at INFO rather than DEBUG.
+      on_close: [callable] If provided, called with the _ChildProcess from
+         the engine thread once all the process output has been read.
+      capture: [OutputCapture] If provided, keep the stdout here rather
+         than collecting all of it.
+
+    Returns:
+      The _ChildProcess tracking the process.
+    """
+    child = _ChildProcess(process, stream, echo, on_close, capture=capture)
+    with self.__lock:
+      self.__pending.append(child)
+    os.write(self.__wakeup_write, b'x')
+    return child
+
+  def __run(self):
+    while True:
+      for key, _ in self.__selector.select():
+        if key.data is None:
+          os.read(self.__wakeup_read, READ_CHUNK_SIZE)
+          continue
+        child, decoder, is_stdout = key.data
+        # pylint: disable=broad-except
+        try:
+          self.__read(key.fileobj, child, decoder, is_stdout)
+        except Exception as ex:
+          logging.error('Failed reading from pid %s: %s',
+                        child.process.pid, ex)
+          self.__close_pipe(key.fileobj, child)
+      self.__register_pending()
+
+  def __register_pending(self):
+    with self.__lock:
+      pending = self.__pending
+      self.__pending = []
+    for child in pending:
+      for pipe, is_stdout in [(child.process.stdout, True),
+                              (child.process.stderr, False)]:
+        if pipe is not None:
+          decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+          self.__selector.register(
+              pipe, selectors.EVENT_READ, (child, decoder, is_stdout))
+          child.open_pipes += 1
+      if not child.open_pipes:
+        self.__closed(child)
+
+  def __read(self, pipe, child, decoder, is_stdout):
+    data = os.read(pipe.fileno(), READ_CHUNK_SIZE)
+    text = decoder.decode(data, final=not data)
+    if is_stdout:
+      if text:
+        if child.capture is not None:
+          child.capture.add(text)
+        else:
+          child.stdout_chunks.append(text)
+        if child.stream:
+          child.stream.write(text)
+          if time.time() - child.last_flush >= STREAM_FLUSH_SECS:
+            child.stream.flush()
+            child.last_flush = time.time()
+    else:
+      lines = (child.stderr_partial + text).split(u'\n')
+      child.stderr_partial = lines.pop() if data else u''
+      for line in lines:
+        if line:
+          logging.log(child.log_level, 'PID %s wrote to stderr: %s',
+                      child.process.pid, line)
+    if not data:
+      self.__close_pipe(pipe, child)
+
+  def __close_pipe(self, pipe, child):
+    self.__selector.unregister(pipe)
+    pipe.close()
+    child.open_pipes -= 1
+    if not child.open_pipes:
+      self.__closed(child)
+
+  @staticmethod
+  def __closed(child):
+    # pylint: disable=broad-except
+    try:
+      if child.stream:
+        child.stream.flush()
+      if child.on_close:
+        child.on_close(child)
+    except Exception as ex:
+      logging.error('Failed finishing output of pid %s: %s',
+                    child.process.pid, ex)
+    child.closed.set()
+
+
+def _finish_subprocess(child, stream=None, echo=False, postprocess_hook=None):
+  """Returns (final status, stdout) once the child exited."""
+  process = child.process
+  stdout = child.wait()
+  if child.capture is not None:
+    child.capture.finish(stream)
+  _record_subprocess_usage(child)
+  end_date = datetime.datetime.now()
   if hasattr(process, 'start_date'):
-    end_date = datetime.datetime.now()
     delta_time_str = timedelta_string(end_date - process.start_date)
   else:
     delta_time_str = 'UNKNOWN'
 
   returncode = process.returncode
-  stdout = ''.join(text_lines)
-
   if stream:
     stream.write(
         u'\n\n----\n{time} Spawned process completed'
@@ -122,22 +498,425 @@ def wait_subprocess(process, stream=None, echo=False, postprocess_hook=None):
 
   if echo:
     logging.info('%s returned %d with output:\n%s',
-                 process.pid, returncode, stdout)
+                 process.pid, returncode, _output_text(stdout))
   logging.debug('Finished %s with returncode=%d in %s',
                 process.pid, returncode, delta_time_str)
 
   if postprocess_hook:
     postprocess_hook(returncode, stdout)
 
+  if child.capture is not None:
+    return returncode, stdout
   return returncode, stdout.strip()
 
 
+def wait_subprocess(process, stream=None, echo=False, postprocess_hook=None,
+                    capture=None):
+  """Waits for subprocess to finish and returns (final status, stdout).
+
+  This will also consume the remaining output to return it.
+
+  Args:
+    capture: [OutputCapture] If provided then this is returned and passed
+       to the postprocess_hook in place of the stdout string.
+
+  Returns:
+    Process exit code, stdout remaining in process prior to this invocation.
+    Any previously read output from the process will not be included.
+  """
+  if capture is not None:
+    capture.begin(stream)
+  child = SubprocessEngine.singleton().attach(
+      process, stream=stream, echo=echo, capture=capture)
+  return _finish_subprocess(child, stream=stream, echo=echo,
+                            postprocess_hook=postprocess_hook)
+
+
+# The kinds of read-only queries that the QueryCache can remember and
+# how many seconds their results are good for by default.
+QUERY_CACHE_DEFAULT_TTLS = {
+    'container-images': 300,
+    'compute-images': 300,
+    'gcs-objects': 300,
+    'git-refs': 60
+}
+
+# Environment variables that can change the result of a query.
+# Other variables are not considered part of the query.
+QUERY_CACHE_ENV_ALLOWLIST = [
+    'BOTO_CONFIG',
+    'CLOUDSDK_ACTIVE_CONFIG_NAME',
+    'CLOUDSDK_CONFIG',
+    'CLOUDSDK_CORE_ACCOUNT',
+    'CLOUDSDK_CORE_PROJECT',
+    'GOOGLE_APPLICATION_CREDENTIALS',
+    'HOME'
+]
+
+# (query class, program, words) for the commands that are queries.
+# The words must appear together somewhere in the command's arguments.
+_QUERY_COMMANDS = [
+    ('container-images', 'gcloud', ['container', 'images', 'list']),
+    ('container-images', 'gcloud', ['container', 'images', 'list-tags']),
+    ('container-images', 'gcloud', ['container', 'images', 'describe']),
+    ('container-images', 'gcloud', ['docker', 'images', 'list']),
+    ('container-images', 'gcloud', ['docker', 'images', 'describe']),
+    ('compute-images', 'gcloud', ['compute', 'images', 'list']),
+    ('compute-images', 'gcloud', ['compute', 'images', 'describe']),
+    ('gcs-objects', 'gsutil', ['ls']),
+    ('gcs-objects', 'gsutil', ['cat']),
+    ('gcs-objects', 'gsutil', ['stat']),
+    ('git-refs', 'git', ['ls-remote'])
+]
+
+# (query class, program, words) for the commands that change what the
+# queries in the class would return.
+_MUTATION_COMMANDS = [
+    ('container-images', 'gcloud', ['builds', 'submit']),
+    ('container-images', 'gcloud', ['container', 'images', 'add-tag']),
+    ('container-images', 'gcloud', ['container', 'images', 'untag']),
+    ('container-images', 'gcloud', ['container', 'images', 'delete']),
+    ('container-images', 'gcloud', ['docker', 'images', 'delete']),
+    ('container-images', 'gcloud', ['docker', 'tags']),
+    ('container-images', 'docker', ['push']),
+    ('compute-images', 'gcloud', ['builds', 'submit']),
+    ('compute-images', 'gcloud', ['compute', 'images', 'create']),
+    ('compute-images', 'gcloud', ['compute', 'images', 'delete']),
+    ('compute-images', 'gcloud', ['compute', 'images', 'deprecate']),
+    ('compute-images', 'packer', ['build']),
+    ('gcs-objects', 'gcloud', ['builds', 'submit']),
+    ('gcs-objects', 'gsutil', ['cp']),
+    ('gcs-objects', 'gsutil', ['mv']),
+    ('gcs-objects', 'gsutil', ['rm']),
+    ('gcs-objects', 'gsutil', ['rsync']),
+    ('gcs-objects', 'gsutil', ['compose']),
+    ('gcs-objects', 'gsutil', ['setmeta']),
+    ('git-refs', 'git', ['push'])
+]
+
+
+def _has_words(args, words):
+  """Determine if the words appear together within the args."""
+  count = len(words)
+  return any(args[index:index + count] == words
+             for index in range(len(args) - count + 1))
+
+
+def _match_commands(args, rules):
+  """Returns the classes of the rules that the command args match."""
+  if not args:
+    return []
+  program = os.path.basename(args[0])
+  return sorted(set(name for name, rule_program, words in rules
+                    if program == rule_program
+                    and _has_words(args[1:], words)))
+
+
+class QueryCache(object):
+  """An on-disk cache of the output of read-only queries.
+
+  Inspecting and skipping existing artifacts repeats the same gcloud,
+  gsutil and git queries within and across the commands in a flow.
+  When --query_cache_dir is given, run_subprocess remembers the output
+  of successful queries for the time-to-live of their query class.
+  Running a command that mutates a query class forgets its queries.
+
+  Entries are keyed by the command line, its working directory and the
+  QUERY_CACHE_ENV_ALLOWLIST environment, so they can be shared with
+  other buildtool processes using the same directory.
+  """
+
+  __cache_dir = None
+  __ttls = dict(QUERY_CACHE_DEFAULT_TTLS)
+
+  # Counts the invalidations of each query class within this process so
+  # queries racing with a mutation do not store stale results.
+  __generations = collections.Counter()
+  __lock = threading.Lock()
+
+  @staticmethod
+  def init_argument_parser(parser, defaults):
+    """Init argparser with query cache options."""
+    add_parser_argument(
+        parser, 'query_cache_dir', defaults, None,
+        help='If specified, remember the output of read-only queries'
+             ' (listing images, reading gcs objects, git ls-remote)'
+             ' in this directory so they can be reused.')
+    add_parser_argument(
+        parser, 'query_cache_ttls', defaults, None,
+        help='A comma-separated list of class=seconds overriding how long'
+             ' --query_cache_dir entries are used. The classes and their'
+             ' defaults are {defaults}. Zero disables the class.'
+             .format(defaults=', '.join(
+                 '{0}={1}'.format(name, secs) for name, secs
+                 in sorted(QUERY_CACHE_DEFAULT_TTLS.items()))))
+
+  @staticmethod
+  def parse_ttls(text):
+    """Returns a dictionary of the ttls specified by --query_cache_ttls."""
+    ttls = {}
+    for entry in (text or '').split(','):
+      if not entry.strip():
+        continue
+      name, _, secs = entry.partition('=')
+      name = name.strip()
+      if name not in QUERY_CACHE_DEFAULT_TTLS:
+        raise_and_log_error(ConfigError(
+            'Unknown --query_cache_ttls class "{name}". Expected one of {all}.'
+            .format(name=name, all=sorted(QUERY_CACHE_DEFAULT_TTLS.keys()))))
+      try:
+        ttls[name] = int(secs)
+      except ValueError:
+        ttls[name] = -1
+      if ttls[name] < 0:
+        raise_and_log_error(ConfigError(
+            'Invalid --query_cache_ttls entry "{entry}".'
+            ' Expected class=seconds with non-negative seconds.'
+            .format(entry=entry)))
+    return ttls
+
+  @staticmethod
+  def configure(options):
+    """Enable the cache if the options specify a directory."""
+    ttls = dict(QUERY_CACHE_DEFAULT_TTLS)
+    ttls.update(QueryCache.parse_ttls(
+        getattr(options, 'query_cache_ttls', None)))
+    QueryCache.__ttls = ttls
+    QueryCache.__cache_dir = getattr(options, 'query_cache_dir', None)
+    if QueryCache.__cache_dir:
+      logging.debug('Caching queries in %s with ttls %s',
+                    QueryCache.__cache_dir, ttls)
+
+  @staticmethod
+  def enabled():
+    """Determine if the cache was configured."""
+    return QueryCache.__cache_dir is not None
+
+  @staticmethod
+  def classify_query(cmd):
+    """Returns the query class of the command line or None if not a query."""
+    try:
+      args = shlex.split(cmd)
+    except ValueError:
+      return None
+    found = _match_commands(args, _QUERY_COMMANDS)
+    return found[0] if found else None
+
+  @staticmethod
+  def classify_mutation(cmd):
+    """Returns the list of query classes the command line invalidates."""
+    try:
+      args = shlex.split(cmd)
+    except ValueError:
+      return []
+    return _match_commands(args, _MUTATION_COMMANDS)
+
+  @staticmethod
+  def generation(query_class):
+    """Returns a marker to pass to store() for the query class."""
+    with QueryCache.__lock:
+      return QueryCache.__generations[query_class]
+
+  @staticmethod
+  def __entry_path(query_class, cmd, kwargs):
+    env = kwargs.get('env') or os.environ
+    key = json.dumps({
+        'args': shlex.split(cmd),
+        'cwd': os.path.abspath(kwargs.get('cwd') or os.getcwd()),
+        'env': {name: env.get(name) for name in QUERY_CACHE_ENV_ALLOWLIST},
+        'stderr': kwargs.get('stderr') is None
+    }, sort_keys=True)
+    return os.path.join(QueryCache.__cache_dir, query_class,
+                        hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+  @staticmethod
+  def lookup(query_class, cmd, kwargs):
+    """Returns the cached stdout of the command or None.
+
+    Args:
+      query_class: [string] The classify_query of the command.
+      cmd: [string] The command line.
+      kwargs: [dict] The keyword arguments the command is run with.
+    """
+    ttl = QueryCache.__ttls.get(query_class)
+    if not ttl:
+      return None
+    labels = {'query': query_class}
+    path = QueryCache.__entry_path(query_class, cmd, kwargs)
+    try:
+      with io.open(path, 'r', encoding='utf-8') as stream:
+        entry = json.load(stream)
+      if time.time() - entry['stored'] < ttl:
+        MetricsManager.singleton().inc_counter('QueryCacheHit', labels)
+        logging.debug('Using cached output of %r', cmd)
+        return entry['stdout']
+    except (IOError, OSError, ValueError, KeyError):
+      pass
+    MetricsManager.singleton().inc_counter('QueryCacheMiss', labels)
+    return None
+
+  @staticmethod
+  def store(query_class, generation, cmd, kwargs, stdout):
+    """Remember the stdout from a successful run of the command.
+
+    Args:
+      generation: [int] The generation() before running the command.
+         The output is not stored if the class was since invalidated.
+    """
+    if not QueryCache.__ttls.get(query_class):
+      return
+    with QueryCache.__lock:
+      if QueryCache.__generations[query_class] != generation:
+        return
+    path = QueryCache.__entry_path(query_class, cmd, kwargs)
+    ensure_dir_exists(os.path.dirname(path))
+    tmp_path = '{path}.{pid}.{thread}.tmp'.format(
+        path=path, pid=os.getpid(), thread=threading.current_thread().ident)
+    with io.open(tmp_path, 'w', encoding='utf-8') as stream:
+      stream.write(json.dumps({'command': cmd, 'stored': time.time(),
+                               'stdout': stdout}))
+    os.rename(tmp_path, path)
+
+  @staticmethod
+  def invalidate(query_classes):
+    """Forget the cached output of the queries in the query classes."""
+    for query_class in query_classes:
+      with QueryCache.__lock:
+        QueryCache.__generations[query_class] += 1
+      if QueryCache.__cache_dir:
+        logging.debug('Invalidating cached %s queries', query_class)
+        shutil.rmtree(os.path.join(QueryCache.__cache_dir, query_class),
+                      ignore_errors=True)
+        MetricsManager.singleton().inc_counter(
+            'QueryCacheInvalidate', {'query': query_class})
+
+
 def run_subprocess(cmd, stream=None, echo=False, **kwargs):
-  """Returns retcode, stdout."""
+  """Returns retcode, stdout.
+
+  The subprocess holds a token for its resource class while it runs.
+  The class is determined from the command unless a "resource_class"
+  keyword argument is given (None for no limit).
+
+  If a "capture" OutputCapture keyword argument is given then it is
+  returned in place of the stdout string.
+
+  If the QueryCache is enabled then queries whose output is only
+  returned (not streamed or captured) may return the cached output.
+  """
   postprocess_hook = kwargs.pop('postprocess_hook', None)
-  process = start_subprocess(cmd, stream=stream, echo=echo, **kwargs)
-  return wait_subprocess(process, stream=stream, echo=echo,
-                         postprocess_hook=postprocess_hook)
+  capture = kwargs.pop('capture', None)
+  resource_class = kwargs.pop('resource_class', classify_command(cmd))
+  query_class = None
+  mutations = []
+  if QueryCache.enabled():
+    if stream is None and capture is None and postprocess_hook is None:
+      query_class = QueryCache.classify_query(cmd)
+    mutations = QueryCache.classify_mutation(cmd)
+
+  if query_class:
+    stdout = QueryCache.lookup(query_class, cmd, kwargs)
+    if stdout is not None:
+      return 0, stdout
+    generation = QueryCache.generation(query_class)
+
+  QueryCache.invalidate(mutations)
+  try:
+    with limit_resource(resource_class) as token:
+      process = start_subprocess(cmd, stream=stream, echo=echo, **kwargs)
+      retcode, stdout = wait_subprocess(process, stream=stream, echo=echo,
+                                        postprocess_hook=postprocess_hook,
+                                        capture=capture)
+      if (retcode != 0 and resource_class
+          and is_overload_output(_output_text(stdout))):
+        token.mark_overloaded()
+  finally:
+    # Again in case queries ran while the mutation was in progress.
+    QueryCache.invalidate(mutations)
+
+  if query_class and retcode == 0:
+    QueryCache.store(query_class, generation, cmd, kwargs, stdout)
+  return retcode, stdout
+
+
+def _release_reaped(child, limiter, token):
+  """Release the child's resource token once it has exited."""
+  try:
+    if child.reap() and is_overload_output(child.stdout):
+      token.mark_overloaded()
+  finally:
+    limiter.release(token)
+
+
+def run_subprocesses(cmd_list, echo=False, **kwargs):
+  """Run many commands at once without a thread for each.
+
+  The commands are started as their resource class permits and their
+  output is read by the SubprocessEngine. Queries use the QueryCache
+  as with run_subprocess.
+
+  Returns:
+    A list of the (retcode, stdout) for each command, in order.
+  """
+  engine = SubprocessEngine.singleton()
+  resource_class = kwargs.pop('resource_class', None)
+  use_cache = QueryCache.enabled()
+  mutations = set()
+  results = []
+  pending = []
+  releasers = []
+  for cmd in cmd_list:
+    query_class = QueryCache.classify_query(cmd) if use_cache else None
+    if query_class:
+      stdout = QueryCache.lookup(query_class, cmd, kwargs)
+      if stdout is not None:
+        results.append((0, stdout))
+        continue
+    elif use_cache:
+      cmd_mutations = QueryCache.classify_mutation(cmd)
+      mutations.update(cmd_mutations)
+      QueryCache.invalidate(cmd_mutations)
+
+    name = resource_class or classify_command(cmd)
+    limiter = ResourceLimits.limiter(name) if name else None
+    token = limiter.take() if limiter else None
+
+    def on_close(child, limiter=limiter, token=token):
+      # The child is finished using the resource once its output is closed.
+      # The token is released once it exits, so its returncode is known.
+      # Later commands may be waiting on the token so this cannot wait for
+      # the finish loop below, nor block the engine for a child that lingers.
+      if limiter:
+        if child.reap(block=False) is not None:
+          _release_reaped(child, limiter, token)
+        else:
+          thread = threading.Thread(
+              name='ReleaseResource', target=_release_reaped,
+              args=[child, limiter, token])
+          thread.daemon = True
+          thread.start()
+          releasers.append(thread)
+
+    generation = QueryCache.generation(query_class) if query_class else None
+    try:
+      process = start_subprocess(cmd, echo=echo, **kwargs)
+    except Exception:
+      if limiter:
+        limiter.release(token)
+      raise
+    child = engine.attach(process, echo=echo, on_close=on_close)
+    pending.append((len(results), cmd, query_class, generation, child))
+    results.append(None)
+
+  for index, cmd, query_class, generation, child in pending:
+    results[index] = _finish_subprocess(child, echo=echo)
+    if query_class and results[index][0] == 0:
+      QueryCache.store(
+          query_class, generation, cmd, kwargs, results[index][1])
+  for thread in list(releasers):
+    thread.join()
+  QueryCache.invalidate(sorted(mutations))
+  return results
 
 
 def check_subprocess(cmd, stream=None, **kwargs):
@@ -163,6 +942,26 @@ def check_subprocess(cmd, stream=None, **kwargs):
   raise_and_log_error(ExecutionError(program + ' failed.', program=program))
 
 
+def check_subprocesses(cmd_list, **kwargs):
+  """Run_subprocesses and raise ExecutionError if any fail.
+
+  Returns:
+    A list of the stdout of each command, in order.
+  """
+  results = run_subprocesses(cmd_list, **kwargs)
+  failed = [(cmd, stdout) for cmd, (retcode, stdout) in zip(cmd_list, results)
+            if retcode != 0]
+  if not failed:
+    return [stdout for _, stdout in results]
+
+  for cmd, stdout in failed:
+    log_embedded_output(logging.ERROR, cmd, stdout)
+  logging.error('%d of %d commands failed. See embedded output above.',
+                len(failed), len(cmd_list))
+  program = os.path.basename(shlex.split(failed[0][0])[0])
+  raise_and_log_error(ExecutionError(program + ' failed.', program=program))
+
+
 def check_subprocess_sequence(cmd_list, stream=None, **kwargs):
   """Run multiple commands until one fails.
 
@@ -188,39 +987,54 @@ def run_subprocess_sequence(cmd_list, stream=None, **kwargs):
 
 
 def check_subprocesses_to_logfile(what, logfile, cmds, append=False, **kwargs):
-  """Wrapper around check_subprocess that logs output to a logfile.
+  """Wrapper around run_subprocess that logs output to a logfile.
+
+  The output is streamed to the logfile with only an OutputCapture of it
+  kept in memory, so the postprocess_hook (if any) is passed the capture.
 
   Args:
     what: [string] For logging purposes, what is the command for.
     logfile: [path] The logfile to write to.
     cmds: [list of string] A list of commands to run.
     append: [boolean] Open the log file as append if true, write new default.
-    kwargs: [kwargs] Additional keyword arguments to pass to check_subprocess.
+    kwargs: [kwargs] Additional keyword arguments to pass to run_subprocess.
+       This can also include "tail_lines" and "interesting_regex" to
+       configure the OutputCapture.
   """
   mode = 'a' if append else 'w'
   how = 'Appending' if append else 'Logging'
+  tail_lines = kwargs.pop('tail_lines', None)
+  interesting_regex = kwargs.pop('interesting_regex', None)
   logging.info('%s %s to %s', how, what, logfile)
   ensure_dir_exists(os.path.dirname(logfile))
+  capture = None
   with io.open(logfile, mode, encoding='utf-8') as stream:
     try:
-      check_subprocess_sequence(
-          cmds, stream=stream, embed_errors=False, **kwargs)
+      for cmd in cmds:
+        capture = OutputCapture(tail_lines=tail_lines,
+                                interesting_regex=interesting_regex)
+        retcode, _ = run_subprocess(
+            cmd, stream=stream, capture=capture, **kwargs)
+        if retcode != 0:
+          program = os.path.basename(shlex.split(cmd)[0])
+          raise_and_log_error(
+              ExecutionError(program + ' failed.', program=program))
     except Exception as ex:
-      logging.error('%s failed. Log file [%s] follows:', what, logfile)
-      import traceback
-      traceback.print_exc()
-
-      with io.open(logfile, 'r', encoding='utf-8') as readagain:
-        output = readagain.read()
-        log_embedded_output(logging.ERROR, logfile, output)
-      logging.error('Caught exception %s\n%s failed. See embedded logfile above',
-                    ex, what)
+      stream.flush()
+      if capture is not None and capture.line_count:
+        log_embedded_output(
+            logging.ERROR,
+            '{0} ({1} lines, showing the interesting and last ones)'.format(
+                logfile, capture.line_count),
+            capture.summary())
+      logging.error('Caught exception %s\n%s failed. See embedded logfile'
+                    ' excerpt above or %s', ex, what, logfile)
 
       ensure_dir_exists(ERROR_LOGFILE_DIR)
-      error_path = os.path.join('errors', os.path.basename(logfile))
+      error_path = os.path.join(ERROR_LOGFILE_DIR, os.path.basename(logfile))
       logging.info('Copying error log file to %s', error_path)
-      with io.open(error_path, 'w', encoding='utf-8') as f:
-        f.write(output);
+      shutil.copyfile(logfile, error_path)
+      with io.open(error_path, 'a', encoding='utf-8') as f:
         f.write(u'\n--------\n')
         f.write(u'Exeception caught in parent process:\n%s' % ex)
 
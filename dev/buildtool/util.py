@@ -15,6 +15,7 @@
 """Common helper functions across buildtool modules."""
 
 import datetime
+import fcntl
 import io
 import logging
 import os
@@ -115,3 +116,28 @@ def write_to_path(content, path):
   else:
     with io.open(path, 'w', encoding='utf-8') as f:
       f.write(content)
+
+
+class FileLock(object):
+  """An exclusive lock on a path shared between threads and processes.
+
+  This is intended for use as a context manager guarding files that
+  concurrent buildtool invocations share (e.g. caches under a common
+  directory). The lock file itself is left behind.
+  """
+  # pylint: disable=too-few-public-methods
+
+  def __init__(self, path):
+    self.__path = path
+    self.__stream = None
+
+  def __enter__(self):
+    ensure_dir_exists(os.path.dirname(os.path.abspath(self.__path)))
+    self.__stream = open(self.__path, 'a')
+    fcntl.flock(self.__stream.fileno(), fcntl.LOCK_EX)
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    fcntl.flock(self.__stream.fileno(), fcntl.LOCK_UN)
+    self.__stream.close()
+    self.__stream = None
@@ -0,0 +1,129 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from buildtool.artifact_index_support import (
+    DEBIAN,
+    GCE_IMAGE,
+    GCR_CONTAINER,
+    ArtifactExistenceIndex,
+    list_container_image_tags,
+    list_gce_images)
+
+from test_util import init_runtime
+
+
+# Reports the listings as the real gcloud would.
+FAKE_GCLOUD = """#!/bin/sh
+echo "$@" >> "{log}"
+case "$*" in
+  *"docker images list"*)
+    echo '[{{"package": "us-docker.pkg.dev/p/r/clouddriver",'
+    echo '  "tags": ["1.2.3-slim", "1.2.3-ubuntu"]}},'
+    echo ' {{"package": "us-docker.pkg.dev/p/r/gate", "tags": "4.5.6-slim"}},'
+    echo ' {{"package": "us-docker.pkg.dev/p/r/untagged"}}]'
+    ;;
+  *"compute images list"*)
+    echo '[{{"name": "spinnaker-clouddriver-1-2-3"}}]'
+    ;;
+  *)
+    exit 1
+esac
+"""
+
+
+class TestArtifactExistenceIndex(unittest.TestCase):
+  def test_index(self):
+    listing = {'spinnaker-gate': ['1.0.0', '1.1.0']}
+    index = ArtifactExistenceIndex()
+    index.add_loader(DEBIAN, lambda: listing)
+    self.assertIsNone(index.has_artifact(DEBIAN, 'spinnaker-gate', '1.0.0'))
+
+    index.refresh()
+    self.assertTrue(index.is_indexed(DEBIAN))
+    self.assertTrue(index.has_artifact(DEBIAN, 'spinnaker-gate', '1.0.0'))
+    self.assertTrue(index.has_artifact(DEBIAN, 'spinnaker-gate'))
+    self.assertFalse(index.has_artifact(DEBIAN, 'spinnaker-gate', '2.0.0'))
+    self.assertFalse(index.has_artifact(DEBIAN, 'spinnaker-deck', '1.0.0'))
+    self.assertIsNone(index.has_artifact(GCE_IMAGE, 'spinnaker-gate'))
+
+    index.record_artifact(DEBIAN, 'spinnaker-deck', '1.0.0')
+    self.assertTrue(index.has_artifact(DEBIAN, 'spinnaker-deck', '1.0.0'))
+
+    listing['spinnaker-gate'].append('2.0.0')
+    index.refresh(DEBIAN)
+    self.assertTrue(index.has_artifact(DEBIAN, 'spinnaker-gate', '2.0.0'))
+    self.assertFalse(index.has_artifact(DEBIAN, 'spinnaker-deck', '1.0.0'))
+
+  def test_failed_loader(self):
+    def fail():
+      raise ValueError('Injected Failure')
+
+    index = ArtifactExistenceIndex()
+    index.add_loader(DEBIAN, lambda: {'spinnaker-gate': ['1.0.0']})
+    index.add_loader(GCE_IMAGE, fail)
+    index.refresh()
+    self.assertTrue(index.has_artifact(DEBIAN, 'spinnaker-gate', '1.0.0'))
+    self.assertFalse(index.is_indexed(GCE_IMAGE))
+    self.assertIsNone(index.has_artifact(GCE_IMAGE, 'spinnaker-gate'))
+
+
+class TestArtifactListings(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='artifact_index_test')
+    self.log_path = os.path.join(self.test_dir, 'gcloud.log')
+    gcloud = os.path.join(self.test_dir, 'gcloud')
+    with open(gcloud, 'w') as stream:
+      stream.write(FAKE_GCLOUD.format(log=self.log_path))
+    os.chmod(gcloud, 0o755)
+    self.old_path = os.environ['PATH']
+    os.environ['PATH'] = self.test_dir + os.pathsep + self.old_path
+
+  def tearDown(self):
+    os.environ['PATH'] = self.old_path
+    shutil.rmtree(self.test_dir)
+
+  def test_list_container_image_tags(self):
+    index = ArtifactExistenceIndex()
+    index.add_loader(
+        GCR_CONTAINER,
+        lambda: list_container_image_tags('us-docker.pkg.dev/p/r',
+                                          account='test-account'))
+    index.refresh()
+    for tag in ['1.2.3-slim', '1.2.3-ubuntu']:
+      self.assertTrue(index.has_artifact(GCR_CONTAINER, 'clouddriver', tag))
+    self.assertTrue(index.has_artifact(GCR_CONTAINER, 'gate', '4.5.6-slim'))
+    self.assertFalse(index.has_artifact(GCR_CONTAINER, 'gate', '4.5.6-ubuntu'))
+    self.assertFalse(index.has_artifact(GCR_CONTAINER, 'untagged', '1.0.0'))
+
+    with open(self.log_path, 'r') as stream:
+      calls = stream.read().split('\n')
+    self.assertEqual(
+        'artifacts docker images list us-docker.pkg.dev/p/r'
+        ' --include-tags --format=json --account test-account', calls[0])
+
+  def test_list_gce_images(self):
+    self.assertEqual({'spinnaker-clouddriver-1-2-3': []},
+                     list_gce_images('test-project'))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,119 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from buildtool import ConfigError
+from buildtool.artifact_inventory_support import (
+    DEBIAN,
+    JAR,
+    ArtifactInventory)
+from buildtool.inspection_commands import CollectBomVersions
+
+from test_util import init_runtime
+
+
+def make_info(name, timestamp, **kwargs):
+  info = {'bom_version': name, 'bom_timestamp': timestamp}
+  info.update(kwargs)
+  return info
+
+
+class TestArtifactInventory(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='artifact_inventory_test')
+    self.path = os.path.join(self.test_dir, 'inventory', 'test.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.test_dir)
+
+  def test_service_map(self):
+    released_info = make_info('1.0.0', '2')
+    nightly_info = make_info('1.0.0-20180101', '1')
+    custom_info = make_info('1.1.0-20180102', '3',
+                            dockerRegistry='gcr.io/custom')
+    service_map = {
+        'gate': {
+            '4.0.0': {'abc': {'20180101': [nightly_info, released_info]}},
+            '4.1.0': {'def': {'20180102': [custom_info]}}},
+        'deck': {
+            '2.0.0': {'ghi': {'20180101': [nightly_info]}}}}
+
+    inventory = ArtifactInventory(self.path)
+    inventory.replace_boms(
+        service_map, CollectBomVersions.RELEASED_VERSION_MATCHER.match)
+    inventory.close()
+
+    inventory = ArtifactInventory(self.path)
+    self.assertEqual(['1.0.0', '1.0.0-20180101', '1.1.0-20180102'],
+                     inventory.bom_names())
+    self.assertEqual(
+        {'gate': {'4.0.0': {'abc': {'20180101': [released_info]}}}},
+        inventory.service_map(released=True))
+    # A build used by a released bom is not also unreleased.
+    self.assertEqual(
+        {'gate': {'4.1.0': {'def': {'20180102': [custom_info]}}},
+         'deck': {'2.0.0': {'ghi': {'20180101': [nightly_info]}}}},
+        inventory.service_map(released=False))
+
+    inventory.replace_boms({}, lambda name: True)
+    self.assertEqual([], inventory.bom_names())
+    inventory.close()
+
+  def test_artifact_versions(self):
+    inventory = ArtifactInventory(self.path)
+    with self.assertRaises(ConfigError):
+      inventory.artifact_versions(JAR)
+
+    inventory.replace_artifacts(
+        JAR, 'test/jars', {'gate': ['1.0.0-1', '1.1.0-1'], 'empty': None})
+    inventory.replace_artifacts(
+        DEBIAN, 'test/debians', {'spinnaker-gate': ['1.1.0-1', '1.0.0-1',
+                                                    '1.2.0-1']})
+    self.assertEqual({'gate': ['1.0.0-1', '1.1.0-1']},
+                     inventory.artifact_versions(JAR))
+    self.assertEqual(
+        ['1.2.0-1'],
+        inventory.missing_versions(DEBIAN, 'spinnaker-gate', JAR, 'gate'))
+    self.assertEqual(
+        [], inventory.missing_versions(JAR, 'gate', DEBIAN, 'spinnaker-gate'))
+
+    self.assertIsNone(inventory.diff_artifacts('config', {'gate': ['1']}))
+    self.assertEqual(
+        {'added': {'gate': ['1.2.0-1'], 'deck': ['1.0.0-1']},
+         'removed': {'gate': ['1.0.0-1']}},
+        inventory.diff_artifacts(JAR, {'gate': ['1.1.0-1', '1.2.0-1'],
+                                       'deck': ['1.0.0-1']}))
+
+    self.assertIsNone(inventory.last_collected(JAR, 'test/jars'))
+    inventory.replace_artifacts(JAR, 'test/jars', {},
+                                collected_at='2018-01-02T03:04:05Z')
+    self.assertEqual({}, inventory.artifact_versions(JAR))
+    self.assertEqual('2018-01-02T03:04:05Z',
+                     inventory.last_collected(JAR, 'test/jars'))
+    self.assertIsNone(inventory.last_collected(JAR, 'other/jars'))
+    self.assertEqual(
+        ['1.0.0-1', '1.1.0-1', '1.2.0-1'],
+        inventory.missing_versions(DEBIAN, 'spinnaker-gate', JAR, 'gate'))
+    inventory.close()
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,230 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares auditing artifacts by scanning lists against using indexes.
+
+This is not a test. It builds a synthetic inventory shaped like years of
+nightly builds (every service has builds of many versions, about half of
+which are referenced by a BOM) then times the lookups the audit makes
+by scanning the collected lists the way it used to, the same lookups
+through the audit indexes, and a whole audit_artifact_versions run over
+the inventory recorded as the collect commands would.
+
+Usage:
+  PYTHONPATH=dev python unittest/buildtool/audit_benchmark.py \
+      [--services N] [--versions N] [--builds N]
+"""
+
+# pylint: disable=missing-docstring
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from buildtool.artifact_inventory_support import (
+    CONFIG,
+    CONTAINER,
+    DEBIAN,
+    GCE_IMAGE,
+    JAR,
+    ArtifactInventory)
+from buildtool.audit_index_support import (
+    BuildnumPrefixIndex,
+    VersionIndex)
+from buildtool.inspection_commands import AuditArtifactVersionsFactory
+from test_util import init_runtime
+
+
+KINDS = [JAR, DEBIAN, CONTAINER, GCE_IMAGE, CONFIG]
+
+
+def make_inventory(services, versions, builds):
+  """Returns the artifact versions of each kind and the bom service maps."""
+  artifacts = {kind: {} for kind in KINDS}
+  released = {}
+  unreleased = {}
+  for service_index in range(services):
+    service = 'service%d' % service_index
+    build_versions = []
+    for version_index in range(versions):
+      version = '%d.%d.0' % (version_index // 10, version_index % 10)
+      for build in range(builds):
+        buildnum = '2018%02d%02d%06d' % (
+            1 + version_index % 12, 1 + build % 28,
+            service_index * builds + build)
+        build_versions.append('%s-%s' % (version, buildnum))
+        if build % 2:
+          continue
+        commit = 'c%d%d%d' % (service_index, version_index, build)
+        if build == 0:
+          bom_map = released
+          bom_version = '%d.%d.%d' % (version_index // 10, version_index % 10,
+                                      service_index)
+        else:
+          bom_map = unreleased
+          bom_version = '%s-%s' % (version, buildnum)
+        bom_map.setdefault(service, {}).setdefault(version, {})[commit] = {
+            buildnum: [{'bom_version': bom_version,
+                        'bom_timestamp': buildnum}]}
+    for kind in KINDS:
+      key = 'spinnaker-' + service if kind == DEBIAN else service
+      artifacts[kind][key] = list(build_versions)
+  return artifacts, released, unreleased
+
+
+def iterate_bom_builds(bom_maps):
+  for bom_map in bom_maps:
+    for service, versions in bom_map.items():
+      for version, commits in versions.items():
+        for buildnums in commits.values():
+          for buildnum in buildnums:
+            yield service, '%s-%s' % (version, buildnum)
+
+
+def iterate_artifacts(artifacts):
+  for kind in KINDS:
+    for package, build_versions in artifacts[kind].items():
+      name = package[len('spinnaker-'):] if kind == DEBIAN else package
+      for build_version in build_versions:
+        version, buildnum = build_version.split('-', 1)
+        yield kind, package, name, version, buildnum
+
+
+def linear_audit(artifacts, released, unreleased):
+  """Performs the audit lookups the way the audit used to."""
+  def in_bom_map(service, version, buildnum, service_map):
+    commit_map = service_map.get(service, {}).get(version, {})
+    for buildnums in commit_map.values():
+      for bom_build_num in buildnums:
+        if bom_build_num.startswith(buildnum):
+          return True
+    return False
+
+  found = 0
+  for service, build_version in iterate_bom_builds([released, unreleased]):
+    for kind in KINDS:
+      key = 'spinnaker-' + service if kind == DEBIAN else service
+      if build_version in artifacts[kind].get(key, []):
+        found += 1
+
+  used = 0
+  for _, _, name, version, buildnum in iterate_artifacts(artifacts):
+    if (in_bom_map(name, version, buildnum, released)
+        or in_bom_map(name, version, buildnum, unreleased)):
+      used += 1
+  return found, used
+
+
+def indexed_audit(artifacts, released, unreleased):
+  """Performs the audit lookups using the audit indexes."""
+  indexes = {kind: VersionIndex(artifacts[kind]) for kind in KINDS}
+  released_index = BuildnumPrefixIndex(released)
+  unreleased_index = BuildnumPrefixIndex(unreleased)
+
+  found = 0
+  for service, build_version in iterate_bom_builds([released, unreleased]):
+    for kind in KINDS:
+      key = 'spinnaker-' + service if kind == DEBIAN else service
+      if indexes[kind].has_version(key, build_version):
+        found += 1
+
+  used = 0
+  for _, _, name, version, buildnum in iterate_artifacts(artifacts):
+    if (released_index.has_prefix(name, version, buildnum)
+        or unreleased_index.has_prefix(name, version, buildnum)):
+      used += 1
+  return found, used
+
+
+def write_inventory(base_dir, artifacts, released, unreleased):
+  def write(command, filename, data):
+    path = os.path.join(base_dir, command, filename)
+    with open(path, 'w') as stream:
+      stream.write(data)
+
+  for command in ['collect_artifact_versions', 'collect_bom_versions']:
+    os.makedirs(os.path.join(base_dir, command))
+  write('collect_artifact_versions', 'config.yml',
+        'bintray_org: benchmark\n'
+        'bintray_jar_repository: jars\n'
+        'bintray_debian_repository: debians\n'
+        'docker_registry: gcr.io/benchmark\n')
+  write('collect_bom_versions', 'config.yml', 'halyard_bom_bucket: benchmark\n')
+  write('collect_bom_versions', 'bom_list.txt', '')
+
+  service_map = {}
+  for bom_map in [released, unreleased]:
+    for service, versions in bom_map.items():
+      service_map.setdefault(service, {}).update(versions)
+  inventory = ArtifactInventory(
+      os.path.join(base_dir, ArtifactInventory.DEFAULT_FILENAME))
+  inventory.replace_boms(service_map, lambda name: '-' not in name)
+  for kind in KINDS:
+    inventory.replace_artifacts(kind, 'benchmark', artifacts[kind])
+  inventory.close()
+
+
+def time_audit_command(base_dir):
+  class Options(object):
+    pass
+  options = Options()
+  options.command = 'audit_artifact_versions'
+  options.output_dir = base_dir
+  options.min_audit_bom_version = None
+  options.prune_min_buildnum_prefix = None
+  options.artifact_inventory_path = None
+
+  start = time.time()
+  command = AuditArtifactVersionsFactory().make_command(options)
+  command()
+  return time.time() - start
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--services', type=int, default=20)
+  parser.add_argument('--versions', type=int, default=50)
+  parser.add_argument('--builds', type=int, default=20)
+  options = parser.parse_args()
+
+  init_runtime()
+  logging.getLogger().setLevel(logging.ERROR)
+  artifacts, released, unreleased = make_inventory(
+      options.services, options.versions, options.builds)
+  print('{count} artifact versions of each kind'.format(
+      count=options.services * options.versions * options.builds))
+
+  results = []
+  for name, func in [('linear', linear_audit), ('indexed', indexed_audit)]:
+    start = time.time()
+    results.append(func(artifacts, released, unreleased))
+    print('{name:>12}: {secs:.2f}s'.format(name=name,
+                                           secs=time.time() - start))
+  if results[0] != results[1]:
+    raise ValueError('Lookups disagree: {0}'.format(results))
+
+  base_dir = tempfile.mkdtemp(prefix='audit_benchmark')
+  try:
+    write_inventory(base_dir, artifacts, released, unreleased)
+    print('{name:>12}: {secs:.2f}s'.format(
+        name='audit', secs=time_audit_command(base_dir)))
+  finally:
+    shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,73 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import unittest
+
+from buildtool.audit_index_support import (
+    BuildnumPrefixIndex,
+    VersionIndex)
+
+from test_util import init_runtime
+
+
+class TestVersionIndex(unittest.TestCase):
+  def test_lookup(self):
+    index = VersionIndex({'gate': ['1.0.0-20180101', '1.1.0-20180102'],
+                          'spinnaker-monitoring': ['0.1.0-20180101'],
+                          'unreleased': None})
+    self.assertIn('gate', index)
+    self.assertIn('unreleased', index)
+    self.assertNotIn('deck', index)
+    self.assertTrue(index.has_version('gate', '1.1.0-20180102'))
+    self.assertFalse(index.has_version('gate', '1.1.0-2018010'))
+    self.assertFalse(index.has_version('deck', '1.1.0-20180102'))
+    self.assertEqual(frozenset(), index.get('unreleased'))
+
+    self.assertEqual(
+        frozenset(['0.1.0-20180101']),
+        index.get('monitoring-daemon', default_name='spinnaker-monitoring'))
+    self.assertEqual(
+        frozenset(['1.0.0-20180101', '1.1.0-20180102']),
+        index.get('gate', default_name='spinnaker-monitoring'))
+
+
+class TestBuildnumPrefixIndex(unittest.TestCase):
+  def test_has_prefix(self):
+    info = [{'bom_version': '1.0.0'}]
+    index = BuildnumPrefixIndex({
+        'gate': {'1.0.0': {'abc': {'20180101123456': info},
+                           'def': {'20180103000000': info,
+                                   '20180102999999': info}},
+                 '1.1.0': {'ghi': {20180104000000: info}}},
+        'deck': None})
+
+    self.assertTrue(index.has_prefix('gate', '1.0.0', '20180101123456'))
+    self.assertTrue(index.has_prefix('gate', '1.0.0', '20180101'))
+    self.assertTrue(index.has_prefix('gate', '1.0.0', '20180102'))
+    self.assertTrue(index.has_prefix('gate', '1.0.0', '201801'))
+    self.assertTrue(index.has_prefix('gate', '1.0.0', ''))
+    self.assertFalse(index.has_prefix('gate', '1.0.0', '20180104'))
+    self.assertFalse(index.has_prefix('gate', '1.0.0', '201801011234567'))
+    self.assertFalse(index.has_prefix('gate', '1.0.0', '3'))
+    self.assertTrue(index.has_prefix('gate', '1.1.0', '20180104'))
+    self.assertFalse(index.has_prefix('gate', '2.0.0', '2018'))
+    self.assertFalse(index.has_prefix('deck', '1.0.0', '2018'))
+    self.assertFalse(index.has_prefix('clouddriver', '1.0.0', '2018'))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,154 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+from buildtool import ConfigError
+from buildtool.bom_commands import PlanBomDeltaFactory
+from buildtool.bom_delta_support import (
+    filter_planned_repositories,
+    load_rebuild_plan,
+    plan_bom_delta)
+from buildtool.serialization_support import (
+    DocumentCache,
+    dump_yaml,
+    load_yaml)
+
+from test_util import init_runtime
+
+
+BASE_BOM_PATH = os.path.join(os.path.dirname(__file__),
+                             'standard_test_bom.yml')
+
+
+class Repository(object):
+  def __init__(self, name):
+    self.name = name
+
+
+class Options(object):
+  pass
+
+
+class TestPlanBomDelta(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    with open(BASE_BOM_PATH, 'r') as stream:
+      cls.base_bom = load_yaml(stream)
+
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='bom_delta_support_test')
+    self.bom = copy.deepcopy(self.base_bom)
+    self.bom['version'] = 'master-20181122334466'
+
+  def tearDown(self):
+    shutil.rmtree(self.test_dir)
+
+  def test_unchanged(self):
+    self.bom['timestamp'] = '2018-12-12 00:00:00'
+    plan = plan_bom_delta(self.base_bom, self.bom)
+    self.assertEqual(
+        {'base_version': 'master-20181122334455',
+         'version': 'master-20181122334466',
+         'services': {},
+         'dependencies': [],
+         'artifactSources': [],
+         'rebuild_all': False,
+         'rebuild_repositories': []},
+        plan)
+
+  def test_service_changes(self):
+    services = self.bom['services']
+    services['gate']['commit'] = 'newcommitid'
+    services['gate']['version'] = '7.8.10-20181122334466'
+    services['monitoring-third-party']['version'] = '7.8.9-20181122334466'
+    services['deck'] = {'commit': 'deckcommitid',
+                        'version': '1.0.0-20181122334466'}
+    self.bom['dependencies']['redis'] = {'version': '4.0'}
+    self.bom['artifactSources']['gitPrefix'] = 'https://other-git-host/owner'
+
+    plan = plan_bom_delta(self.base_bom, self.bom)
+    self.assertEqual(
+        {'gate': {'reason': 'different commit',
+                  'from': '7.8.9-20180102030405',
+                  'to': '7.8.10-20181122334466'},
+         'deck': {'reason': 'added', 'from': None,
+                  'to': '1.0.0-20181122334466'},
+         'monitoring-third-party': {'reason': 'different version',
+                                    'from': '7.8.9-20180908070605',
+                                    'to': '7.8.9-20181122334466'}},
+        plan['services'])
+    self.assertEqual(['redis'], plan['dependencies'])
+    self.assertEqual(['gitPrefix'], plan['artifactSources'])
+    self.assertFalse(plan['rebuild_all'])
+    self.assertEqual(['deck', 'gate', 'spinnaker-monitoring'],
+                     plan['rebuild_repositories'])
+
+    del self.bom['services']['gate']
+    plan = plan_bom_delta(self.base_bom, self.bom)
+    self.assertEqual('removed', plan['services']['gate']['reason'])
+    self.assertNotIn('gate', plan['rebuild_repositories'])
+
+  def test_publishing_change_rebuilds_all(self):
+    self.bom['artifactSources']['dockerRegistry'] = 'gcr.io/other'
+    plan = plan_bom_delta(self.base_bom, self.bom)
+    self.assertTrue(plan['rebuild_all'])
+    self.assertEqual(['dockerRegistry'], plan['artifactSources'])
+
+    repositories = [Repository('gate'), Repository('deck')]
+    self.assertEqual(repositories,
+                     filter_planned_repositories(plan, repositories))
+    plan['rebuild_all'] = False
+    plan['rebuild_repositories'] = ['deck']
+    self.assertEqual(repositories[1:],
+                     filter_planned_repositories(plan, repositories))
+
+  def test_plan_bom_delta_command(self):
+    self.bom['services']['gate']['commit'] = 'newcommitid'
+    bom_path = os.path.join(self.test_dir, 'bom.yml')
+    with open(bom_path, 'w') as stream:
+      stream.write(dump_yaml(self.bom, default_flow_style=False))
+
+    options = Options()
+    options.command = 'plan_bom_delta'
+    options.output_dir = os.path.join(self.test_dir, 'output')
+    options.delta_base_bom_path = BASE_BOM_PATH
+    options.delta_base_bom_version = None
+    options.bom_path = bom_path
+    options.bom_version = None
+    options.rebuild_plan_path = None
+    plan = PlanBomDeltaFactory().make_command(options)()
+    self.assertEqual(['gate'], plan['rebuild_repositories'])
+
+    path = os.path.join(options.output_dir, 'plan_bom_delta',
+                        'rebuild_plan.yml')
+    self.assertEqual(plan, load_rebuild_plan(path))
+    DocumentCache.clear()
+    with open(path, 'r') as stream:
+      self.assertEqual(plan, load_yaml(stream))
+
+    options.bom_version = '1.2.3'
+    with self.assertRaises(ConfigError):
+      PlanBomDeltaFactory().make_command(options)
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
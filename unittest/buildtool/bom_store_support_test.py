@@ -0,0 +1,197 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import yaml
+
+from buildtool import ConfigError
+from buildtool.bom_store_support import (
+    BomStore,
+    retrieve_bom_version)
+
+from test_util import init_runtime
+
+
+# Serves "gs://test-bucket/" from the BUCKET_DIR directory where the
+# generation of each object is in a ".gen" file beside it. Reading an
+# object with a ".fail" file beside it fails.
+FAKE_GSUTIL = """#!{python}
+import fnmatch, os, sys
+root = os.environ['BUCKET_DIR']
+prefix = 'gs://test-bucket/'
+with open(os.environ['GSUTIL_LOG'], 'a') as log:
+  log.write(' '.join(sys.argv[1:]) + '\\n')
+
+if sys.argv[1:3] == ['ls', '-a']:
+  pattern = sys.argv[3][len(prefix):]
+  found = []
+  for dirpath, _, files in os.walk(root):
+    for name in files:
+      path = os.path.relpath(os.path.join(dirpath, name), root)
+      if (os.path.splitext(name)[1] not in ('.gen', '.fail')
+          and fnmatch.fnmatch(path, pattern)):
+        with open(os.path.join(root, path + '.gen')) as stream:
+          found.append('%s%s#%s' % (prefix, path, stream.read().strip()))
+  if not found:
+    sys.stderr.write('CommandException: One or more URLs matched no objects.')
+    sys.exit(1)
+  print('\\n'.join(sorted(found)))
+elif sys.argv[1] == 'cat':
+  path, generation = sys.argv[2][len(prefix):].split('#')
+  if os.path.exists(os.path.join(root, path + '.fail')):
+    sys.stderr.write('ServiceException: 503 Backend Error')
+    sys.exit(1)
+  with open(os.path.join(root, path + '.gen')) as stream:
+    assert stream.read().strip() == generation
+  with open(os.path.join(root, path)) as stream:
+    sys.stdout.write(stream.read())
+else:
+  sys.exit(2)
+"""
+
+
+class Options(object):
+  pass
+
+
+class TestBomStore(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='bom_store_test')
+    self.bucket_dir = os.path.join(self.test_dir, 'bucket')
+    self.store_dir = os.path.join(self.test_dir, 'store')
+    self.log_path = os.path.join(self.test_dir, 'gsutil.log')
+    os.makedirs(os.path.join(self.bucket_dir, 'bom'))
+    bin_dir = os.path.join(self.test_dir, 'bin')
+    os.mkdir(bin_dir)
+    gsutil = os.path.join(bin_dir, 'gsutil')
+    with open(gsutil, 'w') as stream:
+      stream.write(FAKE_GSUTIL.format(python=sys.executable))
+    os.chmod(gsutil, 0o755)
+
+    self.old_environ = dict(os.environ)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    os.environ['BUCKET_DIR'] = self.bucket_dir
+    os.environ['GSUTIL_LOG'] = self.log_path
+
+    for version in ['1.0.0', '1.1.0', '2.0.0']:
+      self.publish_bom(version, 1)
+
+  def tearDown(self):
+    os.environ.clear()
+    os.environ.update(self.old_environ)
+    shutil.rmtree(self.test_dir)
+
+  def publish_bom(self, version, generation, text=None):
+    path = os.path.join(self.bucket_dir, 'bom', version + '.yml')
+    with open(path, 'w') as stream:
+      stream.write(text or yaml.safe_dump(
+          {'version': version, 'timestamp': generation,
+           'services': {'gate': {'version': version + '-' + str(generation)}}}))
+    with open(path + '.gen', 'w') as stream:
+      stream.write(str(generation))
+
+  def get_calls(self):
+    with open(self.log_path, 'r') as stream:
+      calls = stream.read().split('\n')[:-1]
+    os.remove(self.log_path)
+    return calls
+
+  def make_store(self):
+    return BomStore(self.store_dir, 'test-bucket')
+
+  def test_incremental_sync(self):
+    store = self.make_store()
+    self.assertEqual(['1.0.0', '1.1.0', '2.0.0'], store.sync())
+    self.assertEqual(4, len(self.get_calls()))
+    self.assertEqual('1.1.0-1',
+                     store.load_bom('1.1.0')['services']['gate']['version'])
+
+    # A new store picks up from the manifest.
+    store = self.make_store()
+    self.assertEqual([], store.sync())
+    self.assertEqual(['ls -a gs://test-bucket/bom/*'], self.get_calls())
+
+    self.publish_bom('1.1.0', 2)
+    self.publish_bom('2.1.0', 1)
+    os.remove(os.path.join(self.bucket_dir, 'bom', '1.0.0.yml'))
+    os.remove(os.path.join(self.bucket_dir, 'bom', '1.0.0.yml.gen'))
+    self.assertEqual(['1.1.0', '2.1.0'], store.sync())
+    # The objects are fetched concurrently.
+    self.assertEqual(['cat gs://test-bucket/bom/1.1.0.yml#2',
+                      'cat gs://test-bucket/bom/2.1.0.yml#1',
+                      'ls -a gs://test-bucket/bom/*'],
+                     sorted(self.get_calls()))
+    self.assertEqual(['1.1.0', '2.0.0', '2.1.0'], store.list_boms())
+    self.assertEqual(['2.0.0', '2.1.0'], store.list_boms('2.'))
+    self.assertIsNone(store.load_bom('1.0.0'))
+    self.assertEqual('1.1.0-2',
+                     store.load_bom('1.1.0')['services']['gate']['version'])
+
+  def test_bad_bom(self):
+    self.publish_bom('3.0.0', 1, text='version: [')
+    store = self.make_store()
+    store.sync('3.')
+    self.assertIsNone(store.load_bom('3.0.0'))
+    self.assertIsNotNone(store.get_error('3.0.0'))
+    self.get_calls()
+
+    # It is not fetched again until it changes.
+    self.assertEqual([], store.sync('3.'))
+    self.publish_bom('3.0.0', 2)
+    self.assertEqual(['3.0.0'], store.sync('3.'))
+    self.assertIsNone(store.get_error('3.0.0'))
+    self.assertEqual('3.0.0', store.load_bom('3.0.0')['version'])
+
+  def test_fetch_failure(self):
+    failure_path = os.path.join(self.bucket_dir, 'bom', '2.0.0.yml.fail')
+    with open(failure_path, 'w'):
+      pass
+    store = self.make_store()
+    store.sync('2.')
+    self.assertIsNone(store.load_bom('2.0.0'))
+    self.assertIn('503', store.get_error('2.0.0'))
+
+    # Unlike a bad BOM it is fetched again even though it did not change.
+    os.remove(failure_path)
+    store = self.make_store()
+    self.assertEqual(['2.0.0'], store.sync('2.'))
+    self.assertIsNone(store.get_error('2.0.0'))
+    self.assertEqual('2.0.0', store.load_bom('2.0.0')['version'])
+
+  def test_retrieve_bom_version(self):
+    options = Options()
+    options.bom_store_dir = self.store_dir
+    options.halyard_bom_bucket = 'test-bucket'
+    self.assertEqual('2.0.0', retrieve_bom_version(options, '2.0.0')['version'])
+    self.assertEqual(['ls -a gs://test-bucket/bom/2.0.0.yml',
+                      'cat gs://test-bucket/bom/2.0.0.yml#1'],
+                     self.get_calls())
+
+    self.assertEqual('2.0.0', retrieve_bom_version(options, '2.0.0')['version'])
+    self.assertEqual(['ls -a gs://test-bucket/bom/2.0.0.yml'],
+                     self.get_calls())
+
+    with self.assertRaises(ConfigError):
+      retrieve_bom_version(options, '9.9.9')
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -27,6 +27,7 @@ from buildtool import (
     SemanticVersion,
     BranchSourceCodeManager,
     SpinnakerSourceCodeManager,
+    ExecutionError,
     UnexpectedError,
 
     check_subprocess_sequence)
@@ -189,6 +190,32 @@ class TestSourceCodeManager(unittest.TestCase):
         all_repos, _foreach_func, *pos_args, **kwargs)
     self.assertEqual(expect, got)
 
+  def test_foreach_repo_keep_going(self):
+    test_root = os.path.join(self.base_temp_dir, 'keep_going_test')
+    all_repos = [SpinnakerSourceCodeManager(self.options, test_root)
+                 .make_repository_spec(repo_name, origin=origin)
+                 for repo_name, origin in self.ORIGIN_URLS.items()]
+    failing_name = all_repos[0].name
+
+    def _foreach_func(repository):
+      if repository.name == failing_name:
+        raise ValueError('Injected Failure')
+      return repository.name
+
+    scm = SpinnakerSourceCodeManager(self.options, test_root)
+    with self.assertRaises(ValueError):
+      scm.foreach_source_repository(all_repos, _foreach_func)
+
+    scm = SpinnakerSourceCodeManager(self.options, test_root, keep_going=True)
+    got = {}
+    with self.assertRaises(ExecutionError):
+      for name, result in scm.iter_source_repositories(
+          all_repos, _foreach_func):
+        got[name] = result
+    self.assertEqual({repository.name: repository.name
+                      for repository in all_repos[1:]},
+                     got)
+
   def test_check_repository_branch(self):
     self.options.git_branch = UNTAGGED_BRANCH
     
@@ -0,0 +1,295 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from buildtool import (
+    ExecutionError,
+    run_subprocess)
+from buildtool.cloud_build_support import (
+    CloudBuildOrchestrator,
+    make_build_key,
+    run_cloud_build)
+from buildtool.resource_support import (
+    CLOUD_BUILD_SLOTS,
+    DEFAULT_RESOURCE_LIMITS,
+    ResourceLimits)
+from buildtool.serialization_support import DocumentCache
+
+from test_util import init_runtime
+
+
+# Pretends to be Cloud Build. Each build is WORKING for two polls, logging
+# a line for each, then finishes. Builds of "broken" fail and builds of
+# "garbled" do not get an id. Like gcloud it writes notices to stderr.
+FAKE_GCLOUD = """#!{python}
+import os, sys
+state_dir = os.environ['FAKE_GCB_DIR']
+args = sys.argv[1:]
+with open(os.path.join(state_dir, 'calls.log'), 'a') as log:
+  log.write(' '.join(args) + '\\n')
+
+def path(build_id, what):
+  return os.path.join(state_dir, build_id + '.' + what)
+
+if args[:2] == ['builds', 'submit']:
+  assert '--async' in args
+  sys.stderr.write('Uploading source from ' + os.getcwd() + '\\n')
+  if 'garbled' in ' '.join(args):
+    print('Created build.')
+    sys.exit(0)
+  number = 0
+  while True:
+    try:
+      os.close(os.open(os.path.join(state_dir, 'id-%d' % number),
+                       os.O_CREAT | os.O_EXCL))
+      break
+    except OSError:
+      number += 1
+  build_id = '00000000-0000-4000-8000-%012d' % number
+  with open(path(build_id, 'outcome'), 'w') as stream:
+    stream.write('FAILURE' if 'broken' in ' '.join(args) else 'SUCCESS')
+  with open(path(build_id, 'polls'), 'w') as stream:
+    stream.write('0')
+  print(build_id)
+  sys.stderr.write('Updates are available for some Cloud SDK components.\\n')
+elif args[:2] == ['builds', 'describe']:
+  with open(path(args[2], 'polls')) as stream:
+    polls = int(stream.read()) + 1
+  with open(path(args[2], 'polls'), 'w') as stream:
+    stream.write(str(polls))
+  if polls <= 2:
+    print('WORKING')
+  else:
+    with open(path(args[2], 'outcome')) as stream:
+      print(stream.read())
+elif args[:2] == ['builds', 'log']:
+  with open(path(args[2], 'polls')) as stream:
+    polls = int(stream.read())
+  for step in range(polls):
+    print('%s step %d' % (args[2], step))
+elif args[:2] == ['builds', 'cancel']:
+  print('Cancelled')
+else:
+  sys.exit(1)
+"""
+
+
+class Options(object):
+  pass
+
+
+class TestCloudBuildOrchestrator(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='cloud_build_support_test')
+    self.fake_dir = os.path.join(self.test_dir, 'fake_gcb')
+    bin_dir = os.path.join(self.test_dir, 'bin')
+    os.makedirs(self.fake_dir)
+    os.makedirs(bin_dir)
+    path = os.path.join(bin_dir, 'gcloud')
+    with open(path, 'w') as stream:
+      stream.write(FAKE_GCLOUD.format(python=sys.executable))
+    os.chmod(path, 0o755)
+    self.old_environ = dict(os.environ)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    os.environ['FAKE_GCB_DIR'] = self.fake_dir
+    # Failed synchronous builds copy their logs to errors/ in the cwd.
+    self.old_cwd = os.getcwd()
+    os.chdir(self.test_dir)
+
+    self.state_path = os.path.join(self.test_dir, 'cloud_builds.yml')
+    self.options = Options()
+    self.options.gcb_async = True
+    self.options.gcb_state_path = self.state_path
+    self.options.gcb_poll_secs = 0.01
+    self.options.gcb_max_poll_secs = 0.05
+    self.options.gcb_timeout_secs = 60
+    self.options.gcb_project = 'test-project'
+    self.options.gcb_service_account = 'builder@test'
+
+  def tearDown(self):
+    os.chdir(self.old_cwd)
+    os.environ.clear()
+    os.environ.update(self.old_environ)
+    ResourceLimits.limiter(CLOUD_BUILD_SLOTS).set_limit(
+        DEFAULT_RESOURCE_LIMITS[CLOUD_BUILD_SLOTS])
+    shutil.rmtree(self.test_dir)
+
+  def get_calls(self, verb):
+    with open(os.path.join(self.fake_dir, 'calls.log'), 'r') as stream:
+      return [line for line in stream.read().split('\n')
+              if line.startswith('builds ' + verb)]
+
+  def make_orchestrator(self, **kwargs):
+    return CloudBuildOrchestrator(self.state_path, poll_secs=0.01,
+                                  max_poll_secs=0.05, **kwargs)
+
+  def logfile(self, name):
+    return os.path.join(self.test_dir, 'logs', name + '.log')
+
+  def read_log(self, name):
+    with open(self.logfile(name), 'r') as stream:
+      return stream.read()
+
+  def run_builds(self, orchestrator, names):
+    """Run the builds concurrently and return the builds and errors."""
+    builds = {}
+    errors = []
+    def build(name):
+      try:
+        builds[name] = orchestrator.run(
+            name, self.logfile(name),
+            'gcloud builds submit --config=%s.yml .' % name,
+            cwd=self.test_dir, project='test-project')
+      except Exception as ex:  # pylint: disable=broad-except
+        errors.append((name, ex))
+
+    threads = [threading.Thread(target=build, args=[name]) for name in names]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join(30)
+    return builds, errors
+
+  def test_concurrent_builds(self):
+    builds, errors = self.run_builds(self.make_orchestrator(),
+                                     ['gate', 'deck', 'broken'])
+    self.assertEqual(['broken'], [name for name, _ in errors])
+    self.assertTrue(isinstance(errors[0][1], ExecutionError))
+    self.assertEqual(3, len(self.get_calls('submit')))
+    self.assertTrue(all('--project=test-project' in call
+                        for call in self.get_calls('describe')))
+
+    for name in ['gate', 'deck']:
+      log = self.read_log(name).split('\n')
+      build_id = builds[name].build_id
+      self.assertIn('Updates are available for some Cloud SDK components.',
+                    log[:-3])
+      self.assertEqual(
+          ['{0} step {1}'.format(build_id, step) for step in range(3)],
+          log[-3:])
+      # Logs are only fetched when the build goes WORKING then SUCCESS.
+      self.assertEqual(
+          2, len([call for call in self.get_calls('log') if build_id in call]))
+
+    DocumentCache.clear()
+    state = DocumentCache.load(self.state_path)
+    self.assertEqual(['FAILURE', 'SUCCESS', 'SUCCESS'],
+                     sorted(record['status'] for record in state.values()))
+
+  def test_resume(self):
+    # What an earlier buildtool recorded before it was restarted.
+    command = 'gcloud builds submit --config=gate.yml .'
+    retcode, stdout = run_subprocess(command + ' --async', cwd=self.test_dir,
+                                     stderr=subprocess.PIPE)
+    self.assertEqual(0, retcode)
+    build_id = stdout.strip()
+    DocumentCache.write(
+        {make_build_key(command, self.test_dir): {
+            'id': build_id, 'what': 'gate', 'logfile': self.logfile('gate'),
+            'gcloud_flags': '', 'status': 'WORKING', 'log_length': 0}},
+        self.state_path)
+
+    orchestrator = self.make_orchestrator()
+    resumed = orchestrator.run('gate', self.logfile('gate'), command,
+                               cwd=self.test_dir)
+    self.assertEqual(build_id, resumed.build_id)
+    self.assertEqual('SUCCESS', resumed.status)
+
+    # Finished builds are not built again.
+    DocumentCache.clear()
+    self.make_orchestrator().run('gate', self.logfile('gate'), command,
+                                 cwd=self.test_dir)
+    self.assertEqual(1, len(self.get_calls('submit')))
+    self.assertIn(build_id + ' step 2', self.read_log('gate'))
+
+  def test_lost_build(self):
+    # A stale state file records an id that Cloud Build does not know.
+    command = 'gcloud builds submit --config=gate.yml .'
+    DocumentCache.write(
+        {make_build_key(command, self.test_dir): {
+            'id': 'unknown', 'what': 'gate', 'logfile': self.logfile('gate'),
+            'gcloud_flags': '', 'status': 'WORKING', 'log_length': 0}},
+        self.state_path)
+    orchestrator = self.make_orchestrator(max_poll_failures=3)
+    build = orchestrator.submit('gate', self.logfile('gate'), command,
+                                cwd=self.test_dir)
+    with self.assertRaises(ExecutionError):
+      orchestrator.wait(build)
+    self.assertEqual('LOST', build.status)
+    self.assertEqual(3, len(self.get_calls('describe')))
+
+  def test_deadline(self):
+    orchestrator = self.make_orchestrator(timeout_secs=0)
+    with self.assertRaises(ExecutionError):
+      orchestrator.run('gate', self.logfile('gate'),
+                       'gcloud builds submit --config=gate.yml .',
+                       cwd=self.test_dir)
+    self.assertEqual(1, len(self.get_calls('cancel')))
+
+  def test_bad_build_id(self):
+    with self.assertRaises(ExecutionError):
+      self.make_orchestrator().run(
+          'garbled', self.logfile('garbled'),
+          'gcloud builds submit --config=garbled.yml .', cwd=self.test_dir)
+    self.assertEqual([], self.get_calls('describe'))
+    self.assertEqual(0, ResourceLimits.limiter(CLOUD_BUILD_SLOTS).in_use)
+
+  def test_slots_held_until_resolved(self):
+    limiter = ResourceLimits.limiter(CLOUD_BUILD_SLOTS)
+    limiter.set_limit(1)
+    builds, errors = self.run_builds(self.make_orchestrator(),
+                                     ['gate', 'deck'])
+    self.assertEqual([], errors)
+    self.assertEqual(0, limiter.in_use)
+
+    # The second build was only submitted once the first finished.
+    with open(os.path.join(self.fake_dir, 'calls.log'), 'r') as stream:
+      calls = stream.read().split('\n')
+    first, second = [index for index, call in enumerate(calls)
+                     if call.startswith('builds submit')]
+    first_id = min(build.build_id for build in builds.values())
+    self.assertEqual(
+        3, len([call for call in calls[first:second]
+                if call.startswith('builds describe ' + first_id)]))
+
+  def test_run_cloud_build(self):
+    run_cloud_build(self.options, 'deck', self.logfile('deck'),
+                    'gcloud builds submit --config=deck.yml .',
+                    cwd=self.test_dir)
+    self.assertEqual(
+        ['builds describe 00000000-0000-4000-8000-000000000000'
+         ' --project=test-project --account=builder@test'
+         ' --format=value(status)'],
+        self.get_calls('describe')[:1])
+
+    self.options.gcb_async = False
+    with self.assertRaises(ExecutionError):
+      # The fake insists on --async.
+      run_cloud_build(self.options, 'deck', self.logfile('sync-deck'),
+                      'gcloud builds submit --config=deck.yml .',
+                      cwd=self.test_dir)
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,220 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import yaml
+
+import buildtool.__main__
+import buildtool.flow_commands
+from buildtool import (
+    CommandFactory,
+    CommandProcessor,
+    ConfigError,
+    ExecutionError,
+    RepositoryCommandFactory,
+    RepositoryCommandProcessor,
+    SpinnakerSourceCodeManager)
+
+from test_util import init_runtime
+
+
+buildtool.__main__.CHECK_HOME_FOR_CONFIG = False
+
+FAST_REPO = 'fast'
+SLOW_REPO = 'slow'
+REPOSITORY_NAMES = [FAST_REPO, SLOW_REPO]
+
+# Records what the test commands did, in order.
+EVENTS = []
+EVENTS_LOCK = threading.Lock()
+
+# Set once the consumer has finished the fast repository.
+CONSUMED_FAST = threading.Event()
+
+
+def record(*event):
+  with EVENTS_LOCK:
+    EVENTS.append(event)
+
+
+class FakeSourceCodeManager(SpinnakerSourceCodeManager):
+  def determine_origin(self, name):
+    return 'https://test-githost/test-owner/' + name
+
+
+class ProduceCommand(RepositoryCommandProcessor):
+  def __init__(self, factory, options, **kwargs):
+    super(ProduceCommand, self).__init__(factory, options, **kwargs)
+    self.__finished = []
+
+  def ensure_local_repository(self, repository):
+    pass
+
+  def _do_repository(self, repository):
+    if repository.name == SLOW_REPO:
+      # Only finishes promptly if the flow started consuming the fast
+      # repository without waiting for this one.
+      record('produce', SLOW_REPO, CONSUMED_FAST.wait(5))
+    else:
+      record('produce', repository.name)
+    return repository.name
+
+  def _do_postprocess_one(self, name, result):
+    self.__finished.append(name)
+
+  def make_bom(self):
+    return {'services': sorted(self.__finished)}
+
+
+class ConsumeCommand(RepositoryCommandProcessor):
+  def ensure_local_repository(self, repository):
+    pass
+
+  def _do_repository(self, repository):
+    with open(self.options.bom_path, 'r') as stream:
+      bom = yaml.safe_load(stream)
+    record('consume', repository.name, repository.name in bom['services'])
+    if repository.name == FAST_REPO:
+      CONSUMED_FAST.set()
+    if self.options.test_fail_repository == repository.name:
+      raise ValueError('Injected Failure')
+
+
+class ConsumeFactory(RepositoryCommandFactory):
+  def __init__(self):
+    super(ConsumeFactory, self).__init__(
+        'test_consume', ConsumeCommand, 'Consumes a repository.',
+        FakeSourceCodeManager, source_repository_names=REPOSITORY_NAMES)
+
+  def init_argparser(self, parser, defaults):
+    super(ConsumeFactory, self).init_argparser(parser, defaults)
+    self.add_argument(parser, 'test_fail_repository', defaults, None)
+
+
+class ReportCommand(CommandProcessor):
+  def _do_command(self):
+    record('report', self.options.test_label)
+
+
+class ReportFactory(CommandFactory):
+  def __init__(self):
+    super(ReportFactory, self).__init__(
+        'test_report', ReportCommand, 'Reports that it ran.')
+
+  def init_argparser(self, parser, defaults):
+    super(ReportFactory, self).init_argparser(parser, defaults)
+    self.add_argument(parser, 'test_label', defaults, 'default label')
+
+
+def register_commands(registry, subparsers, defaults):
+  RepositoryCommandFactory(
+      'test_produce', ProduceCommand, 'Produces repositories.',
+      FakeSourceCodeManager, source_repository_names=REPOSITORY_NAMES
+  ).register(registry, subparsers, defaults)
+  ConsumeFactory().register(registry, subparsers, defaults)
+  ReportFactory().register(registry, subparsers, defaults)
+
+
+FLOW = {
+    'steps': {
+        'produce': {'command': 'test_produce', 'writes_bom': True},
+        'consume': {'command': 'test_consume', 'requires': ['produce'],
+                    'bom_from': 'produce', 'per_repository': True},
+        'report': {'command': 'test_report', 'requires': ['consume'],
+                   'options': {'test_label': 'custom label'}},
+        'independent': {'command': 'test_report'}
+    }
+}
+
+
+class TestRunFlow(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='flow_test')
+    del EVENTS[:]
+    CONSUMED_FAST.clear()
+
+  def tearDown(self):
+    shutil.rmtree(self.test_dir)
+
+  def make_command(self, flow, *args, **defaults):
+    flow_path = os.path.join(self.test_dir, 'flow.yml')
+    with open(flow_path, 'w') as stream:
+      yaml.safe_dump(flow, stream)
+    defaults_path = os.path.join(self.test_dir, 'defaults.yml')
+    with open(defaults_path, 'w') as stream:
+      yaml.safe_dump(defaults, stream)
+    options, registry = buildtool.__main__.init_options_and_registry(
+        ['--default_args_file', defaults_path,
+         '--input_dir', os.path.join(self.test_dir, 'input'),
+         '--output_dir', os.path.join(self.test_dir, 'output'),
+         'run_flow', '--flow_path', flow_path] + list(args),
+        [buildtool.flow_commands, sys.modules[__name__]])
+    return registry['run_flow'].make_command(options)
+
+  def test_pipelined_flow(self):
+    command = self.make_command(FLOW)
+    result = command()
+    self.assertEqual({'produce': 'succeeded', 'consume': 'succeeded',
+                      'report': 'succeeded', 'independent': 'succeeded'},
+                     result)
+
+    self.assertIn(('produce', SLOW_REPO, True), EVENTS)
+    self.assertIn(('consume', FAST_REPO, True), EVENTS)
+    self.assertIn(('consume', SLOW_REPO, True), EVENTS)
+    self.assertEqual(('report', 'custom label'),
+                     [event for event in EVENTS
+                      if event[1] == 'custom label'][0])
+    consumed = [event for event in EVENTS if event[0] == 'consume']
+    self.assertEqual(2, len(consumed))
+    self.assertGreater(EVENTS.index(('report', 'custom label')),
+                       max(EVENTS.index(event) for event in consumed))
+
+  def test_failed_step_blocks_dependents(self):
+    command = self.make_command(FLOW, test_fail_repository=FAST_REPO)
+    with self.assertRaises(ExecutionError):
+      command()
+    self.assertNotIn(('report', 'custom label'), EVENTS)
+    self.assertIn(('report', 'default label'), EVENTS)
+
+  def test_skip_step(self):
+    flow = {'steps': {'report': FLOW['steps']['report'],
+                      'consume': {'command': 'test_report'}}}
+    command = self.make_command(flow, '--flow_skip_steps', 'consume')
+    self.assertEqual({'report': 'succeeded', 'consume': 'skipped'}, command())
+    self.assertEqual([('report', 'custom label')], EVENTS)
+
+  def test_invalid_flows(self):
+    cycle = {'steps': {'a': {'command': 'test_report', 'requires': ['b']},
+                       'b': {'command': 'test_report', 'requires': ['a']}}}
+    unknown_step = {'steps': {'a': {'command': 'test_report',
+                                    'requires': ['b']}}}
+    unknown_command = {'steps': {'a': {'command': 'test_unknown'}}}
+    no_bom = {'steps': {'a': {'command': 'test_report'},
+                        'b': {'command': 'test_report', 'requires': ['a'],
+                              'bom_from': 'a'}}}
+    for flow in [cycle, unknown_step, unknown_command, no_bom]:
+      with self.assertRaises(ConfigError):
+        self.make_command(flow)
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
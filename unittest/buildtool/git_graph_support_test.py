@@ -0,0 +1,185 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from buildtool import (
+    GitRunner,
+    check_subprocess,
+    check_subprocess_sequence)
+from buildtool.git_graph_support import CommitGraphIndex
+from buildtool.git_query_support import (
+    GitCommandQueries,
+    GitQuerySession)
+
+from git_query_support_test import make_branchy_repo
+from test_util import init_runtime
+
+
+class TestCommitGraphIndex(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.base_temp_dir = tempfile.mkdtemp(prefix='git_graph_test')
+    cls.git_dir = os.path.join(cls.base_temp_dir, 'origin')
+    make_branchy_repo(cls.git_dir)
+    cls.clone_dir = os.path.join(cls.base_temp_dir, 'clone')
+    check_subprocess('git clone -q "{origin}" "{clone}"'.format(
+        origin=cls.git_dir, clone=cls.clone_dir))
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.base_temp_dir)
+
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(dir=self.base_temp_dir)
+    self.sessions = []
+    self.index = self.make_index(self.clone_dir)
+    self.baseline = GitCommandQueries(GitRunner(_Options()), self.clone_dir)
+
+  def tearDown(self):
+    for session in self.sessions:
+      session.close()
+
+  def make_index(self, git_dir, path=None):
+    session = GitQuerySession(git_dir)
+    self.sessions.append(session)
+    return CommitGraphIndex(session, path)
+
+  def all_revisions(self):
+    refs = check_subprocess(
+        'git -C "{dir}" for-each-ref --format=%(refname)'.format(
+            dir=self.clone_dir))
+    return [ref for ref in refs.split('\n') if ref] + ['HEAD', 'HEAD~2']
+
+  def test_merge_base_matches_git(self):
+    revisions = self.all_revisions()
+    for first in revisions:
+      for second in revisions:
+        self.assertEqual(
+            self.baseline.merge_base(first, second),
+            self.index.merge_base(first, second),
+            'merge-base {0} {1}'.format(first, second))
+
+  def test_remote_branches_containing(self):
+    for revision in self.all_revisions():
+      commit_id = self.index.resolve_commit(revision)
+      self.assertEqual(
+          sorted(name for name in self.baseline.remote_branches_containing(
+              commit_id) if not name.startswith('origin/HEAD')),
+          self.index.remote_branches_containing(commit_id))
+
+  def assert_describe_matches_git(self, git_dir, index):
+    baseline = GitCommandQueries(GitRunner(_Options()), git_dir)
+    refs = check_subprocess(
+        'git -C "{dir}" for-each-ref --format=%(refname)'.format(dir=git_dir))
+    revisions = [ref for ref in refs.split('\n') if ref]
+    revisions.extend(['HEAD~{0}'.format(count) for count in range(1, 4)])
+    for revision in revisions:
+      commit_id = index.resolve_commit(revision)
+      self.assertEqual(baseline.newest_ancestor_tag(commit_id),
+                       index.newest_ancestor_tag(commit_id),
+                       'describe {0}'.format(revision))
+
+  def test_newest_ancestor_tag_matches_git(self):
+    self.assert_describe_matches_git(self.clone_dir, self.index)
+
+    # Equal dates leave the order commits are found in to decide.
+    git_dir = os.path.join(self.test_dir, 'same_date')
+    env = dict(os.environ)
+    env['GIT_AUTHOR_DATE'] = env['GIT_COMMITTER_DATE'] = '1600000000 +0000'
+    make_branchy_repo(git_dir, env=env)
+    # Also annotated and non-semantic tags, which describe considers too.
+    check_subprocess_sequence([
+        'git -C "{dir}" tag -a -m annotated version-0.2.0-a version-0.2.0'
+        .format(dir=git_dir),
+        'git -C "{dir}" tag version-next release-0.3.x~1'.format(dir=git_dir),
+        'git -C "{dir}" tag other-9.0.0 HEAD~1'.format(dir=git_dir)],
+                              env=env)
+    self.assert_describe_matches_git(git_dir, self.make_index(git_dir))
+
+  def test_newest_ancestor_tag(self):
+    for tag in self.index.tag_commits().keys():
+      self.assertEqual(tag, self.index.newest_ancestor_tag(tag))
+
+    # The release-0.3.x branch was merged into master after 0.4.0 was tagged
+    # so like "git describe" its tag is the nearest rather than the highest.
+    self.assertEqual('version-0.3.1',
+                     self.index.newest_ancestor_tag('origin/master'))
+    self.assertEqual('version-0.2.1',
+                     self.index.newest_ancestor_tag('origin/release-0.2.x'))
+
+  def test_persisted_index_is_reused(self):
+    path = os.path.join(self.test_dir, 'clone.json')
+    self.make_index(self.clone_dir, path).update()
+    with open(path, 'r') as stream:
+      persisted = json.load(stream)['commits']
+
+    # Nothing more is learned from the repository when the refs are known.
+    index = self.make_index(self.clone_dir, path)
+    index.update()
+    self.assertEqual(len(persisted), index.commit_count)
+    self.assertEqual(1, index.session.spawn_count)
+    self.assertEqual(
+        self.baseline.merge_base('origin/master', 'origin/release-0.4.x'),
+        index.merge_base('origin/master', 'origin/release-0.4.x'))
+
+  def test_incremental_update(self):
+    git_dir = os.path.join(self.test_dir, 'incremental')
+    check_subprocess('git clone -q "{origin}" "{clone}"'.format(
+        origin=self.git_dir, clone=git_dir))
+    path = os.path.join(self.test_dir, 'incremental.json')
+    index = self.make_index(git_dir, path)
+    index.update()
+    count = index.commit_count
+
+    # The change is made behind the session's back.
+    check_subprocess_sequence([
+        'git -C "{dir}" commit -q --allow-empty -m "fix(test): new"'.format(
+            dir=git_dir),
+        'git -C "{dir}" tag version-9.0.0'.format(dir=git_dir)])
+    head = index.resolve_commit('HEAD')
+    self.assertEqual('version-9.0.0', index.newest_ancestor_tag(head))
+    self.assertEqual(count + 1, index.commit_count)
+    with open(path, 'r') as stream:
+      self.assertIn(head, json.load(stream)['commits'])
+
+  def test_shallow_index_not_persisted(self):
+    git_dir = os.path.join(self.test_dir, 'shallow')
+    check_subprocess(
+        'git clone -q --depth 2 --no-single-branch "file://{origin}" "{clone}"'
+        .format(origin=self.git_dir, clone=git_dir))
+    path = os.path.join(self.test_dir, 'shallow.json')
+    index = self.make_index(git_dir, path)
+    index.update()
+    self.assertFalse(os.path.exists(path))
+    self.assertEqual(
+        index.resolve_commit('origin/master'),
+        index.merge_base('origin/master', 'origin/master'))
+
+
+class _Options(object):
+  # pylint: disable=too-few-public-methods
+  git_mirror_dir = None
+  git_use_query_session = False
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
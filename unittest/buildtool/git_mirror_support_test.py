@@ -0,0 +1,141 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from buildtool import (
+    GitRepositorySpec,
+    GitRunner,
+    MetricsManager,
+    check_subprocess,
+    check_subprocess_sequence)
+
+from test_util import init_runtime
+
+
+TEST_REPO_NAME = 'mirrored_repository'
+
+
+def make_options(mirror_dir):
+  parser = argparse.ArgumentParser()
+  GitRunner.add_parser_args(parser, {'github_disable_upstream_push': True,
+                                     'git_mirror_dir': mirror_dir})
+  return parser.parse_args([])
+
+
+class TestGitMirrorCache(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.base_temp_dir = tempfile.mkdtemp(prefix='git_mirror_test')
+    cls.origin_dir = os.path.join(cls.base_temp_dir, 'origin', TEST_REPO_NAME)
+    os.makedirs(cls.origin_dir)
+    gitify = lambda args: 'git -C "{dir}" {args}'.format(
+        dir=cls.origin_dir, args=args)
+    check_subprocess_sequence([
+        gitify('init'),
+        'touch "{dir}/base_file"'.format(dir=cls.origin_dir),
+        gitify('add base_file'),
+        gitify('commit -a -m "feat(test): added file"'),
+        gitify('tag version-0.1.0 HEAD')])
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.base_temp_dir)
+
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(dir=self.base_temp_dir)
+    self.mirror_dir = os.path.join(self.test_dir, 'mirrors')
+    self.git = GitRunner(make_options(self.mirror_dir))
+
+  def clone(self, name):
+    git_dir = os.path.join(self.test_dir, name, TEST_REPO_NAME)
+    repository = GitRepositorySpec(
+        TEST_REPO_NAME, git_dir=git_dir, origin=self.origin_dir)
+    self.git.clone_repository_to_path(repository)
+    return git_dir
+
+  def mirror_path(self):
+    return os.path.join(self.mirror_dir, 'local',
+                        *(self.origin_dir.strip('/').split('/'))) + '.git'
+
+  def test_clone_uses_mirror(self):
+    git_dir = self.clone('first')
+    mirror_path = self.mirror_path()
+    self.assertTrue(os.path.exists(os.path.join(mirror_path, 'HEAD')))
+    self.assertFalse(os.path.exists(mirror_path + '.tmp'))
+
+    with open(os.path.join(git_dir, '.git', 'objects', 'info',
+                           'alternates')) as stream:
+      self.assertEqual(os.path.join(mirror_path, 'objects'),
+                       stream.read().strip())
+
+    # The mirror has branches and tags but not the origin's other refs.
+    self.assertEqual(
+        'refs/heads/master\nrefs/tags/version-0.1.0',
+        check_subprocess(
+            'git -C "{dir}" for-each-ref --format=%(refname)'.format(
+                dir=mirror_path)))
+
+    # The clone itself still refers to the real origin.
+    self.assertEqual(
+        self.origin_dir,
+        self.git.determine_git_repository_spec(git_dir).origin)
+
+    family = MetricsManager.singleton().lookup_family_or_none(
+        'GitMirrorBytesSaved')
+    self.assertIsNotNone(family)
+
+  def test_concurrent_clones_share_mirror(self):
+    pool = ThreadPool(4)
+    git_dirs = pool.map(self.clone, ['clone%d' % i for i in range(4)])
+    pool.close()
+    pool.join()
+
+    for git_dir in git_dirs:
+      self.assertTrue(os.path.exists(os.path.join(git_dir, 'base_file')))
+    self.assertEqual(['local'], os.listdir(self.mirror_dir))
+
+  def test_refresh_attaches_mirror(self):
+    git_dir = os.path.join(self.test_dir, 'direct', TEST_REPO_NAME)
+    check_subprocess('git clone "{origin}" "{dir}"'.format(
+        origin=self.origin_dir, dir=git_dir))
+    self.git.refresh_local_repository(git_dir, 'origin')
+    with open(os.path.join(git_dir, '.git', 'objects', 'info',
+                           'alternates')) as stream:
+      self.assertEqual(os.path.join(self.mirror_path(), 'objects'),
+                       stream.read().strip())
+
+    # Attaching again does not add a duplicate alternate.
+    self.git.refresh_local_repository(git_dir, 'origin')
+    with open(os.path.join(git_dir, '.git', 'objects', 'info',
+                           'alternates')) as stream:
+      self.assertEqual(1, len(stream.readlines()))
+
+  def test_unusable_mirror_falls_back(self):
+    with open(os.path.join(self.test_dir, 'mirrors'), 'w') as stream:
+      stream.write('not a directory')
+    git_dir = self.clone('fallback')
+    self.assertTrue(os.path.exists(os.path.join(git_dir, 'base_file')))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
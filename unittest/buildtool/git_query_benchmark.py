@@ -0,0 +1,141 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares repository summary collection using the different query methods.
+
+This is not a test. It builds a synthetic repository shaped like the
+spinnaker ones (a master branch with a release branch and patch tags per
+minor version) then times GitRunner.collect_repository_summary from the
+head of each release branch using per-command queries, query sessions,
+and commit graph indexes (both built from scratch and reloaded from disk).
+
+Usage:
+  PYTHONPATH=dev python unittest/buildtool/git_query_benchmark.py \
+      [--releases N] [--commits_per_release N]
+"""
+
+# pylint: disable=missing-docstring
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from buildtool import GitRunner
+from test_util import init_runtime
+
+
+def make_repository(git_dir, releases, commits_per_release):
+  os.makedirs(git_dir)
+  env = dict(os.environ)
+  env.update({'GIT_AUTHOR_NAME': 'benchmark',
+              'GIT_AUTHOR_EMAIL': 'benchmark@test',
+              'GIT_COMMITTER_NAME': 'benchmark',
+              'GIT_COMMITTER_EMAIL': 'benchmark@test'})
+
+  # Use fast-import so building a large history takes seconds.
+  lines = []
+  mark = [0]
+  def add_commit(branch, message, parent_mark):
+    mark[0] += 1
+    lines.extend(['commit refs/heads/' + branch,
+                  'mark :%d' % mark[0],
+                  'committer benchmark <benchmark@test> %d +0000'
+                  % (1500000000 + mark[0]),
+                  'data %d' % len(message), message])
+    if parent_mark:
+      lines.append('from :%d' % parent_mark)
+    lines.append('')
+    return mark[0]
+
+  def add_tag(name, commit_mark):
+    lines.extend(['reset refs/tags/' + name, 'from :%d' % commit_mark, ''])
+
+  head = add_commit('master', 'feat(base): initial', None)
+  add_tag('version-0.0.0', head)
+  for release in range(1, releases + 1):
+    for index in range(commits_per_release):
+      head = add_commit('master', 'fix(master): change %d.%d'
+                        % (release, index), head)
+    add_tag('version-0.%d.0' % release, head)
+    branch_head = head
+    for patch in range(1, 3):
+      branch_head = add_commit('release-0.%d.x' % release,
+                               'fix(patch): patch %d.%d' % (release, patch),
+                               branch_head)
+      add_tag('version-0.%d.%d' % (release, patch), branch_head)
+    add_commit('release-0.%d.x' % release,
+               'fix(patch): pending %d' % release, branch_head)
+  for index in range(commits_per_release):
+    head = add_commit('master', 'feat(master): pending %d' % index, head)
+
+  subprocess.check_call(['git', '-C', git_dir, 'init', '-q'], env=env)
+  process = subprocess.Popen(['git', '-C', git_dir, 'fast-import', '--quiet'],
+                             stdin=subprocess.PIPE, env=env)
+  process.communicate(('\n'.join(lines) + '\n').encode('utf-8'))
+  subprocess.check_call(['git', '-C', git_dir, 'checkout', '-q', 'master'])
+
+
+def time_summaries(git_dir, releases, **defaults):
+  parser = argparse.ArgumentParser()
+  GitRunner.add_parser_args(parser, defaults)
+  git = GitRunner(parser.parse_args([]))
+  GitRunner.close_query_sessions()
+
+  branches = ['origin/release-0.%d.x' % release
+              for release in range(1, releases + 1)] + ['origin/master']
+  start = time.time()
+  for branch in branches:
+    subprocess.check_call(['git', '-C', git_dir, 'checkout', '-q', branch])
+    git.collect_repository_summary(git_dir)
+  return time.time() - start, len(branches)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--releases', type=int, default=40)
+  parser.add_argument('--commits_per_release', type=int, default=25)
+  options = parser.parse_args()
+
+  init_runtime()
+  logging.getLogger().setLevel(logging.WARNING)
+  base_dir = tempfile.mkdtemp(prefix='git_query_benchmark')
+  try:
+    origin_dir = os.path.join(base_dir, 'origin')
+    clone_dir = os.path.join(base_dir, 'clone')
+    make_repository(origin_dir, options.releases, options.commits_per_release)
+    subprocess.check_call(['git', 'clone', '-q', origin_dir, clone_dir])
+
+    graph_dir = os.path.join(base_dir, 'commit_graph')
+    modes = [
+        ('per-command', {'git_use_query_session': False}),
+        ('session', {'git_use_commit_graph': False}),
+        ('index', {'git_commit_graph_dir': graph_dir}),
+        ('saved index', {'git_commit_graph_dir': graph_dir})]
+    for name, defaults in modes:
+      secs, count = time_summaries(clone_dir, options.releases, **defaults)
+      print('{name:>12}: {count} summaries in {secs:.2f}s'
+            ' ({each:.1f} ms each)'.format(
+                name=name, count=count, secs=secs,
+                each=1000 * secs / count))
+  finally:
+    GitRunner.close_query_sessions()
+    shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+  main()
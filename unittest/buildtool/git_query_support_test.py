@@ -0,0 +1,197 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from buildtool import (
+    GitRunner,
+    check_subprocess,
+    check_subprocess_sequence)
+from buildtool.git_query_support import (
+    GitCommandQueries,
+    GitQuerySession)
+
+from test_util import init_runtime
+
+
+def make_branchy_repo(git_dir, **kwargs):
+  """Create a repository with release branches, tags and merges."""
+  gitify = lambda args: 'git -C "{dir}" {args}'.format(dir=git_dir, args=args)
+  commit = lambda name: [
+      'touch "{dir}/{name}"'.format(dir=git_dir, name=name),
+      gitify('add {name}'.format(name=name)),
+      gitify('commit -q -m "feat(test): added {name}"'.format(name=name))]
+
+  os.makedirs(git_dir)
+  commands = [gitify('init -q')]
+  commands.extend(commit('base'))
+  commands.append(gitify('tag version-0.1.0'))
+  for release in range(1, 4):
+    commands.extend(commit('master_%d' % release))
+    commands.append(gitify('tag version-0.%d.0' % (release + 1)))
+    commands.append(gitify('checkout -q -b release-0.%d.x' % (release + 1)))
+    commands.extend(commit('patch_%d' % release))
+    commands.append(gitify('tag version-0.%d.1' % (release + 1)))
+    commands.append(gitify('checkout -q master'))
+  commands.append(gitify('checkout -q -b feature'))
+  commands.extend(commit('feature_a'))
+  commands.append(gitify('checkout -q master'))
+  commands.extend(commit('master_after_feature'))
+  commands.append(gitify('merge -q --no-edit feature'))
+  commands.append(gitify('merge -q --no-edit release-0.3.x'))
+  commands.extend(commit('master_last'))
+  check_subprocess_sequence(commands, **kwargs)
+
+
+class TestGitQuerySession(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.base_temp_dir = tempfile.mkdtemp(prefix='git_query_test')
+    cls.git_dir = os.path.join(cls.base_temp_dir, 'origin')
+    make_branchy_repo(cls.git_dir)
+    cls.clone_dir = os.path.join(cls.base_temp_dir, 'clone')
+    check_subprocess('git clone -q "{origin}" "{clone}"'.format(
+        origin=cls.git_dir, clone=cls.clone_dir))
+
+  @classmethod
+  def tearDownClass(cls):
+    GitRunner.close_query_sessions()
+    shutil.rmtree(cls.base_temp_dir)
+
+  def setUp(self):
+    self.session = GitQuerySession(self.clone_dir)
+    self.baseline = GitCommandQueries(GitRunner(_Options()), self.clone_dir)
+
+  def tearDown(self):
+    self.session.close()
+
+  def all_revisions(self):
+    refs = check_subprocess(
+        'git -C "{dir}" for-each-ref --format=%(refname)'.format(
+            dir=self.clone_dir))
+    return [ref for ref in refs.split('\n') if ref] + ['HEAD', 'HEAD~2']
+
+  def test_resolve_commit(self):
+    for revision in self.all_revisions():
+      self.assertEqual(self.baseline.resolve_commit(revision),
+                       self.session.resolve_commit(revision))
+    self.assertIsNone(self.session.resolve_commit('bogus'))
+
+  def test_lookup_ref(self):
+    for ref in ['refs/remotes/origin/master', 'refs/tags/version-0.3.1',
+                'refs/heads/bogus']:
+      self.assertEqual(self.baseline.lookup_ref(ref),
+                       self.session.lookup_ref(ref))
+
+  def test_merge_base_matches_git(self):
+    revisions = self.all_revisions()
+    for first in revisions:
+      for second in revisions:
+        self.assertEqual(
+            self.baseline.merge_base(first, second),
+            self.session.merge_base(first, second),
+            'merge-base {0} {1}'.format(first, second))
+
+  def test_remote_branches_containing(self):
+    for revision in self.all_revisions():
+      commit_id = self.session.resolve_commit(revision)
+      self.assertEqual(
+          sorted(name for name in self.baseline.remote_branches_containing(
+              commit_id) if not name.startswith('origin/HEAD')),
+          self.session.remote_branches_containing(commit_id))
+
+  def test_bounded_processes(self):
+    for revision in self.all_revisions():
+      self.session.remote_branches_containing(
+          self.session.resolve_commit(revision))
+    self.assertEqual(3, self.session.spawn_count)
+
+  def test_invalidate_refs(self):
+    git = GitRunner(_Options())
+    session = git.query_session(self.clone_dir)
+    self.assertIsNone(session.lookup_ref('refs/tags/new-tag'))
+    git.check_run(self.clone_dir, 'tag new-tag HEAD')
+    try:
+      self.assertIsNotNone(session.lookup_ref('refs/tags/new-tag'))
+    finally:
+      git.check_run(self.clone_dir, 'tag -d new-tag')
+
+  def test_merge_base_with_equal_dates(self):
+    git_dir = os.path.join(self.base_temp_dir, 'same_date')
+    # Fix the commit ids too since they decide the order of equal dates.
+    env = dict(os.environ)
+    env['GIT_AUTHOR_DATE'] = env['GIT_COMMITTER_DATE'] = '1600000000 +0000'
+    env['GIT_AUTHOR_NAME'] = env['GIT_COMMITTER_NAME'] = 't'
+    env['GIT_AUTHOR_EMAIL'] = env['GIT_COMMITTER_EMAIL'] = 't@t'
+    make_branchy_repo(git_dir, env=env)
+    session = GitQuerySession(git_dir)
+    try:
+      baseline = GitCommandQueries(GitRunner(_Options()), git_dir)
+      revisions = ['refs/heads/master', 'refs/heads/feature',
+                   'refs/heads/release-0.3.x', 'HEAD~1', 'HEAD~2']
+      for first in revisions:
+        for second in revisions:
+          self.assertEqual(
+              baseline.merge_base(first, second),
+              session.merge_base(first, second),
+              'merge-base {0} {1}'.format(first, second))
+    finally:
+      session.close()
+
+  def test_merge_base_with_clock_skew(self):
+    # "newer" is an ancestor of "older" through "skewed" but has a later
+    # committer date than both, so it is painted as a common ancestor first.
+    git_dir = os.path.join(self.base_temp_dir, 'skewed')
+    os.makedirs(git_dir)
+    check_subprocess('git -C "{dir}" init -q'.format(dir=git_dir))
+    tree = check_subprocess(
+        'git -C "{dir}" write-tree'.format(dir=git_dir))
+    def commit(date, *parents):
+      env = dict(os.environ)
+      env['GIT_AUTHOR_DATE'] = env['GIT_COMMITTER_DATE'] = (
+          '{date} +0000'.format(date=date))
+      return check_subprocess(
+          'git -C "{dir}" commit-tree {tree} -m {date} {parents}'.format(
+              dir=git_dir, tree=tree, date=date,
+              parents=' '.join('-p ' + parent for parent in parents)),
+          env=env)
+    newer = commit(1600002000)
+    skewed = commit(1600000500, newer)
+    older = commit(1600001000, skewed)
+    first = commit(1600003000, older, newer)
+    second = commit(1600003001, newer, older)
+
+    session = GitQuerySession(git_dir)
+    try:
+      baseline = GitCommandQueries(GitRunner(_Options()), git_dir)
+      self.assertEqual(older, baseline.merge_base(first, second))
+      self.assertEqual(older, session.merge_base(first, second))
+    finally:
+      session.close()
+
+
+class _Options(object):
+  # pylint: disable=too-few-public-methods
+  git_mirror_dir = None
+  git_use_query_session = True
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,138 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from buildtool import (
+    GitRunner,
+    MetricsManager,
+    check_subprocess)
+import buildtool.git_support
+from buildtool.git_support import CommitMessage
+from buildtool.git_summary_support import (
+    RepositorySummaryCache,
+    read_git_refs)
+
+from git_query_support_test import make_branchy_repo
+from test_util import init_runtime
+
+
+def make_options(input_dir):
+  parser = argparse.ArgumentParser()
+  GitRunner.add_parser_args(parser, {})
+  options = parser.parse_args([])
+  options.input_dir = input_dir
+  return options
+
+
+def count_cache_results(result):
+  family = MetricsManager.singleton().lookup_family_or_none(
+      'RepositorySummaryCache')
+  if family is None:
+    return 0
+  return sum(counter.count for counter in family.instance_list
+             if counter.labels['result'] == result)
+
+
+class TestRepositorySummaryCache(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.base_temp_dir = tempfile.mkdtemp(prefix='git_summary_test')
+    cls.origin_dir = os.path.join(cls.base_temp_dir, 'origin')
+    make_branchy_repo(cls.origin_dir)
+
+  @classmethod
+  def tearDownClass(cls):
+    GitRunner.close_query_sessions()
+    shutil.rmtree(cls.base_temp_dir)
+
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(dir=self.base_temp_dir)
+    self.git_dir = os.path.join(self.test_dir, 'clone')
+    check_subprocess('git clone -q "{origin}" "{clone}"'.format(
+        origin=self.origin_dir, clone=self.git_dir))
+    self.git = GitRunner(make_options(self.test_dir))
+
+  def test_read_git_refs(self):
+    # The clone starts with packed refs, the new tag is loose.
+    check_subprocess('git -C "{dir}" tag version-8.0.0 HEAD~1'.format(
+        dir=self.git_dir))
+    expect = {}
+    for line in check_subprocess(
+        'git -C "{dir}" for-each-ref --format="%(refname) %(objectname)"'
+        .format(dir=self.git_dir)).split('\n'):
+      name, object_id = line.split(' ')
+      if name != 'refs/remotes/origin/HEAD':
+        expect[name] = object_id
+    self.assertEqual(expect, read_git_refs(self.git_dir))
+
+  def test_hit_skips_git(self):
+    misses = count_cache_results('miss')
+    hits = count_cache_results('hit')
+    summary = self.git.collect_repository_summary(self.git_dir)
+    self.assertEqual(misses + 1, count_cache_results('miss'))
+
+    def fail(*_pos_args, **_kwargs):
+      raise AssertionError('Unexpected subprocess')
+
+    saved = (buildtool.git_support.run_subprocess,
+             buildtool.git_support.check_subprocess)
+    buildtool.git_support.run_subprocess = fail
+    buildtool.git_support.check_subprocess = fail
+    try:
+      git = GitRunner(make_options(self.test_dir))
+      cached = git.collect_repository_summary(self.git_dir)
+    finally:
+      (buildtool.git_support.run_subprocess,
+       buildtool.git_support.check_subprocess) = saved
+    self.assertEqual(hits + 1, count_cache_results('hit'))
+    self.assertEqual(summary, cached)
+    self.assertTrue(summary.commit_messages)
+
+  def test_key_changes(self):
+    git = self.git
+    options = make_options(self.test_dir)
+    cache = RepositorySummaryCache(
+        os.path.join(self.test_dir, 'summary_cache'),
+        CommitMessage.CLASSIFIER_REGEXS)
+    original = cache.make_key(self.git_dir)
+    self.assertEqual(original, cache.make_key(self.git_dir))
+    self.assertNotEqual(original, cache.make_key(self.git_dir, 'base'))
+    self.assertNotEqual(
+        original, cache.make_key(self.git_dir, allow_no_baseline_tag=False))
+
+    git.check_run(self.git_dir, 'tag version-9.0.0 HEAD')
+    tagged = cache.make_key(self.git_dir)
+    self.assertNotEqual(original, tagged)
+
+    git.check_run(self.git_dir, 'tag other-tag HEAD')
+    self.assertEqual(tagged, cache.make_key(self.git_dir))
+
+    git.check_run(self.git_dir, 'checkout -q HEAD~1')
+    self.assertNotEqual(tagged, cache.make_key(self.git_dir))
+
+    options.git_use_summary_cache = False
+    summary = GitRunner(options).collect_repository_summary(self.git_dir)
+    self.assertEqual(summary, git.collect_repository_summary(self.git_dir))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -16,6 +16,7 @@
 
 import argparse
 import datetime
+import io
 import os
 import shutil
 import tempfile
@@ -638,6 +639,123 @@ class TestCommitMessage(unittest.TestCase):
               patch_regexs=CommitMessage.DEFAULT_PATCH_REGEXS))
 
 
+  def test_iter_commit_messages(self):
+    for branch in [self.MAJOR_BRANCH, self.MERGED_BRANCH,
+                   self.PATCH_MINOR_BRANCH]:
+      medium = self.run_git('log --pretty=medium ' + branch)
+      self.assertEqual(
+          CommitMessage.make_list_from_result(medium),
+          list(self.git.iter_commit_messages(self.git_dir, branch)))
+
+  def test_iter_from_log_stream_chunks(self):
+    raw = self.run_git('log -z --pretty="{format}" {branch}'.format(
+        format=CommitMessage.LOG_FIELDS_FORMAT, branch=self.MERGED_BRANCH))
+    expect = list(CommitMessage.iter_from_log_stream(
+        io.BytesIO(raw.encode('utf-8'))))
+    self.assertEqual(2, len(expect))
+    for chunk_size in [1, 7, 40]:
+      self.assertEqual(
+          expect,
+          list(CommitMessage.iter_from_log_stream(
+              io.BytesIO(raw.encode('utf-8')), chunk_size=chunk_size)))
+
+  def test_lazy_message_consumption(self):
+    consumed = []
+    def generate():
+      for text in ['fix(a): patch', 'feat(b): BREAKING CHANGE', 'fix(c): x']:
+        consumed.append(text)
+        yield CommitMessage('id', 'author', 'date', text)
+
+    self.assertEqual(
+        SemanticVersion.MAJOR_INDEX,
+        CommitMessage.determine_semver_implication_on_list(generate()))
+    self.assertEqual(2, len(consumed))
+    self.assertIsNone(
+        CommitMessage.determine_semver_implication_on_list(iter([])))
+    self.assertEqual(3, len(CommitMessage.normalize_message_list(generate())))
+
+
+class TestGitCloneModes(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.base_temp_dir = tempfile.mkdtemp(prefix='git_clone_mode_test')
+    cls.origin_dir = os.path.join(cls.base_temp_dir, 'origin', TEST_REPO_NAME)
+    os.makedirs(cls.origin_dir)
+    gitify = lambda args: 'git -C "{dir}" {args}'.format(
+        dir=cls.origin_dir, args=args)
+    commit = lambda name: [
+        'touch "{dir}/{name}"'.format(dir=cls.origin_dir, name=name),
+        gitify('add {name}'.format(name=name)),
+        gitify('commit -q -m "fix(test): added {name}"'.format(name=name))]
+
+    commands = [gitify('init -q'),
+                gitify('config uploadpack.allowFilter true')]
+    commands.extend(commit('base'))
+    commands.append(gitify('tag version-0.1.0'))
+    for index in range(6):
+      commands.extend(commit('master_%d' % index))
+    commands.append(gitify('tag version-0.2.0'))
+    commands.append(gitify('checkout -q -b release-0.2.x'))
+    for index in range(6):
+      commands.extend(commit('patch_%d' % index))
+    commands.append(gitify('tag version-0.2.1'))
+    commands.extend(commit('pending'))
+    commands.append(gitify('checkout -q master'))
+    for index in range(6):
+      commands.extend(commit('later_%d' % index))
+    commands.append(gitify('tag version-0.3.0'))
+    check_subprocess_sequence(commands)
+
+  @classmethod
+  def tearDownClass(cls):
+    GitRunner.close_query_sessions()
+    shutil.rmtree(cls.base_temp_dir)
+
+  def clone(self, mode, branch):
+    parser = argparse.ArgumentParser()
+    GitRunner.add_parser_args(
+        parser, {'git_clone_mode': mode, 'git_clone_depth': 2})
+    git = GitRunner(parser.parse_args([]))
+    git_dir = os.path.join(
+        tempfile.mkdtemp(prefix=mode, dir=self.base_temp_dir), TEST_REPO_NAME)
+    git.clone_repository_to_path(
+        GitRepositorySpec(TEST_REPO_NAME, git_dir=git_dir,
+                          origin=self.origin_dir),
+        branch=branch)
+    return git, git_dir
+
+  def test_clone_modes_summarize_the_same(self):
+    for branch in ['master', 'release-0.2.x']:
+      git, git_dir = self.clone('full', branch)
+      expect = git.collect_repository_summary(git_dir)
+      for mode in ['blobless', 'treeless', 'shallow']:
+        git, git_dir = self.clone(mode, branch)
+        self.assertEqual(
+            self.origin_dir,
+            git.determine_git_repository_spec(git_dir).origin)
+        self.assertEqual(expect, git.collect_repository_summary(git_dir),
+                         '{0} {1}'.format(mode, branch))
+
+  def test_shallow_clone_deepens_on_demand(self):
+    git, git_dir = self.clone('shallow', 'release-0.2.x')
+    count_commits = lambda: int(check_subprocess(
+        'git -C "{dir}" rev-list --count --all'.format(dir=git_dir)))
+    self.assertTrue(os.path.exists(os.path.join(git_dir, '.git', 'shallow')))
+    shallow_count = count_commits()
+
+    summary = git.collect_repository_summary(git_dir)
+    self.assertEqual('version-0.2.2', summary.tag)
+    self.assertGreater(count_commits(), shallow_count)
+
+    # The base commit history is fetched if it is needed.
+    git, git_dir = self.clone('shallow', 'release-0.2.x')
+    base_commit = check_subprocess(
+        'git -C "{dir}" rev-parse version-0.1.0'.format(dir=self.origin_dir))
+    summary = git.collect_repository_summary(git_dir,
+                                             base_commit_id=base_commit)
+    self.assertEqual(13, len(summary.commit_messages))
+
+
 class TestRepositorySummary(unittest.TestCase):
   def test_to_yaml(self):
     summary = RepositorySummary(
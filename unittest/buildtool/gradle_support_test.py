@@ -14,13 +14,18 @@
 
 # pylint: disable=missing-docstring
 
+import os
+import shutil
+import tempfile
 import textwrap
 import unittest
 
 from buildtool import (
     GitRepositorySpec,
-    MetricsManager)
+    MetricsManager,
+    check_subprocesses_to_logfile)
 
+from buildtool.base_metrics import MetricFamily
 from buildtool.gradle_support import GradleMetricsUpdater
 
 from test_util import init_runtime
@@ -76,6 +81,40 @@ class TestGradleMetricsUpdater(unittest.TestCase):
         'failed_reason': '409'
     }, counter.labels)
 
+  def test_bintray_error_from_logfile(self):
+    temp_dir = tempfile.mkdtemp(prefix='gradle_support_test')
+    try:
+      output_path = os.path.join(temp_dir, 'output.txt')
+      with open(output_path, 'w') as stream:
+        stream.write('noise\n' * 10000 + BINTRAY_ERROR_OUTPUT)
+      updater = GradleMetricsUpdater(self.metrics, REPOSITORY, 'TestLogfile')
+      captured = []
+      def hook(retcode, output):
+        captured.append(output)
+        updater(retcode, output)
+
+      with self.assertRaises(Exception):
+        check_subprocesses_to_logfile(
+            'test', os.path.join(temp_dir, 'test.log'),
+            ['/bin/sh -c "cat {0}; exit 1"'.format(output_path)],
+            postprocess_hook=hook, tail_lines=3)
+    finally:
+      shutil.rmtree(temp_dir)
+
+    # Only the tail and interesting lines were kept in memory.
+    self.assertEqual(3, len(captured[0].tail_lines))
+    self.assertEqual(10000 + BINTRAY_ERROR_OUTPUT.count('\n'),
+                     captured[0].line_count)
+    self.assertIn("Execution failed for task ':echo-core:bintrayUpload'.",
+                  [line for _, line in captured[0].interesting_lines])
+
+    counter = self.metrics.get_metric(
+        MetricFamily.COUNTER, 'GradleOutcome',
+        {'repository': 'testRepo', 'context': 'TestLogfile',
+         'success': False, 'failed_task': ':echo-core:bintrayUpload',
+         'failed_by': 'bintray', 'failed_reason': '409'})
+    self.assertEqual(1, counter.count)
+
 
 if __name__ == '__main__':
   init_runtime()
@@ -0,0 +1,196 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from buildtool import (
+    HalRunner,
+    ResponseError)
+
+from test_util import init_runtime
+
+
+TEST_BOM = {'version': '1.2.3', 'services': {'gate': {'version': '4.5.6'}}}
+
+# Stands in for the hal CLI by reporting how it was called.
+FAKE_HAL = """#!/bin/sh
+echo "version: cli"
+echo "args: $*"
+"""
+
+
+class FakeHalyardHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args):
+    pass
+
+  def send_json(self, code, content):
+    body = json.dumps(content).encode('utf-8')
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    self.server.connection_count += 1
+
+  def handle_request(self, method):
+    daemon = self.server
+    length = int(self.headers.get('Content-Length') or 0)
+    body = self.rfile.read(length).decode('utf-8') if length else None
+    daemon.requests.append((method, self.path, body))
+
+    if self.path == '/resolvedEnv':
+      self.send_json(
+          200, {'spinnaker.config.input.writerEnabled': 'true'})
+    elif self.path.startswith('/v1/tasks/lost/'):
+      # The daemon went away while the task was running.
+      self.close_connection = True
+    elif self.path.startswith('/v1/tasks/'):
+      uuid = self.path.split('/')[3]
+      daemon.polls[uuid] = daemon.polls.get(uuid, 0) + 1
+      self.send_json(200, daemon.tasks[uuid])
+    elif self.path.startswith('/v1/admin/publishLatest/'):
+      self.send_json(200, {'uuid': 'lost', 'state': 'RUNNING'})
+    elif self.path.startswith('/v1/admin/publishLatestHalyard/'):
+      # The connection drops after the daemon accepted the request.
+      self.close_connection = True
+    elif self.path.startswith('/v1/versions/bom/1.2.3/'):
+      daemon.tasks['bom'] = {
+          'uuid': 'bom', 'state': 'SUCCEEDED',
+          'response': {'responseBody': TEST_BOM}}
+      self.send_json(200, {'uuid': 'bom', 'state': 'RUNNING'})
+    elif self.path.startswith('/v1/versions/bom/'):
+      self.send_json(200, {
+          'uuid': 'bad', 'state': 'FAILED',
+          'response': {'problemSet': {'problems': ['Unknown version']}}})
+    elif self.path.startswith('/v1/admin/publishProfile/'):
+      self.send_json(200, {'uuid': 'profile', 'state': 'SUCCEEDED',
+                           'response': {}})
+    else:
+      self.send_json(404, {'message': 'Not Found'})
+
+  def do_GET(self):
+    self.handle_request('GET')
+
+  def do_PUT(self):
+    self.handle_request('PUT')
+
+
+class TestHalRunner(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='hal_support_test')
+    self.server = HTTPServer(('localhost', 0), FakeHalyardHandler)
+    self.server.connection_count = 0
+    self.server.requests = []
+    self.server.tasks = {}
+    self.server.polls = {}
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+    hal_path = os.path.join(self.test_dir, 'hal')
+    with open(hal_path, 'w') as stream:
+      stream.write(FAKE_HAL)
+    os.chmod(hal_path, 0o755)
+
+    class Options(object):
+      pass
+    self.options = Options()
+    self.options.hal_path = hal_path
+    self.options.halyard_daemon = 'localhost:{port}'.format(
+        port=self.server.server_address[1])
+    self.options.hal_use_rest_api = True
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.test_dir)
+
+  def test_retrieve_bom_version(self):
+    hal = HalRunner(self.options)
+    hal.check_writer_enabled()
+    connections = self.server.connection_count
+    self.assertEqual(TEST_BOM, hal.retrieve_bom_version('1.2.3'))
+    self.assertEqual(1, self.server.polls['bom'])
+    self.assertEqual(TEST_BOM, hal.retrieve_bom_version('1.2.3'))
+
+    # All the requests shared one connection.
+    self.assertEqual(connections + 1, self.server.connection_count)
+
+    with self.assertRaises(ResponseError):
+      hal.retrieve_bom_version('0.0.0')
+
+  def test_publish_profile(self):
+    hal = HalRunner(self.options)
+    hal.publish_profile('gate', '/profiles/gate.yml', '/boms/1.2.3.yml')
+    self.assertEqual(
+        ('PUT', '/v1/admin/publishProfile/gate/?bomPath=%2Fboms%2F1.2.3.yml',
+         '"/profiles/gate.yml"'),
+        self.server.requests[-1])
+
+  def test_cli_fallback(self):
+    hal = HalRunner(self.options)
+    count = len(self.server.requests)
+    self.assertEqual(
+        'cli',
+        hal.run_task_or_cli('PUT', '/v1/admin/unsupported/', 'version bom x')
+        .split('\n')[0].split(': ')[1])
+
+    # Once the REST call failed it does not keep trying it.
+    hal.publish_halyard_release('1.0.0')
+    self.assertEqual(count + 1, len(self.server.requests))
+
+  def test_no_cli_once_sent(self):
+    hal = HalRunner(self.options)
+    self.assertEqual(TEST_BOM, hal.retrieve_bom_version('1.2.3'))
+
+    # Neither the publish nor polling its task is repeated with the CLI.
+    with self.assertRaises(ResponseError):
+      hal.publish_halyard_release('1.0.0')
+    with self.assertRaises(ResponseError):
+      hal.run_task_or_cli('PUT', '/v1/admin/publishLatest/',
+                          'admin publish latest 1.0.0', body='1.0.0')
+    self.assertEqual(
+        ['/v1/admin/publishLatestHalyard/', '/v1/admin/publishLatest/'],
+        [path for method, path, _ in self.server.requests if method == 'PUT'])
+
+  def test_cli_only(self):
+    self.options.hal_use_rest_api = False
+    hal = HalRunner(self.options)
+    bom = hal.retrieve_bom_version('1.2.3')
+    self.assertEqual('cli', bom['version'])
+    self.assertIn('version bom 1.2.3 --quiet', bom['args'])
+    self.assertEqual(['/resolvedEnv'],
+                     [path for _, path, _ in self.server.requests])
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,302 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import yaml
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from buildtool import (
+    ExecutionError,
+    MetricsManager)
+from buildtool.artifact_inventory_support import (
+    CONFIG,
+    CONTAINER,
+    ArtifactInventory)
+from buildtool.base_metrics import MetricFamily
+from buildtool.inspection_commands import (
+    CollectArtifactVersionsFactory,
+    PruneArtifactsFactory)
+
+from test_util import init_runtime
+
+
+# Logs each call then fails when asked to delete something "denied"
+# and reports something "gone" as not found.
+FAKE_CLI = """#!/bin/sh
+echo "$(basename $0) $*" >> "{log}"
+case "$*" in
+  *denied*) echo "ERROR: Permission denied"; exit 1;;
+  *gone*) echo "ERROR: NOT_FOUND: gone"; exit 1;;
+esac
+"""
+
+
+# Lists a registry and bucket for collect_artifact_versions. Container
+# tags created since the filter time are in NEW_TAGS.
+FAKE_LISTING_CLI = """#!{python}
+import json, os, sys
+args = ' '.join(sys.argv[1:])
+with open(os.environ['CALL_LOG'], 'a') as log:
+  log.write(os.path.basename(sys.argv[0]) + ' ' + args + '\\n')
+tags = {{'gate': ['1.0.0-1', '1.1.0-1'], 'deck': ['2.0.0-1']}}
+new_tags = {{'gate': os.environ.get('NEW_TAGS', '').split()}}
+if 'container images list-tags' in args:
+  image = sys.argv[sys.argv.index('list-tags') + 1].split('/')[-1]
+  found = new_tags.get(image, []) if '--filter' in args else tags[image]
+  print(json.dumps([{{'tags': [tag]}} for tag in found]))
+elif 'container images list' in args:
+  print(json.dumps([{{'name': 'gcr.io/test/gate'}},
+                    {{'name': 'gcr.io/test/deck'}}]))
+elif sys.argv[1:] == ['ls', 'gs://test-bucket/']:
+  print('gs://test-bucket/bom/\\ngs://test-bucket/gate/\\n'
+        'gs://test-bucket/deck/')
+elif sys.argv[1] == 'ls':
+  print(sys.argv[2] + '1.0.0-1/\\n' + sys.argv[2] + '1.1.0-1/')
+else:
+  sys.exit(1)
+"""
+
+
+class FakeBintrayHandler(BaseHTTPRequestHandler):
+  def log_message(self, format, *args):
+    pass
+
+  def do_DELETE(self):
+    self.server.deleted.append(self.path)
+    self.send_response(404 if 'gone' in self.path else 200)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+
+class Options(object):
+  pass
+
+
+class TestPruneArtifacts(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='inspection_commands_test')
+    self.input_dir = os.path.join(self.test_dir, 'audit')
+    self.log_path = os.path.join(self.test_dir, 'calls.log')
+    bin_dir = os.path.join(self.test_dir, 'bin')
+    os.makedirs(self.input_dir)
+    os.makedirs(bin_dir)
+    for program in ['gcloud', 'gsutil']:
+      path = os.path.join(bin_dir, program)
+      with open(path, 'w') as stream:
+        stream.write(FAKE_CLI.format(log=self.log_path))
+      os.chmod(path, 0o755)
+    self.old_path = os.environ['PATH']
+    os.environ['PATH'] = bin_dir + os.pathsep + self.old_path
+
+    self.server = HTTPServer(('localhost', 0), FakeBintrayHandler)
+    self.server.deleted = []
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    bintray_url = 'http://localhost:{port}/packages/org/jars/'.format(
+        port=self.server.server_address[1])
+
+    self.write_prune_list('containers', ['gcr.io/test/gate:1',
+                                         'gcr.io/test/gate:2',
+                                         'gcr.io/test/gate:denied',
+                                         'gcr.io/test/gate:gone',
+                                         'gcr.io/test/deck:1'])
+    self.write_prune_list('images', ['spinnaker-gate-1-0-0-1'])
+    self.write_prune_list('boms', ['gs://test/bom/1.0.0-1.yml',
+                                   'gs://test/bom/1.0.0-2.yml'])
+    self.write_prune_list('jars', [bintray_url + 'gate/versions/1.0.0-1',
+                                   bintray_url + 'gate/versions/gone'])
+
+    self.options = Options()
+    self.options.command = 'prune_artifacts'
+    self.options.output_dir = os.path.join(self.test_dir, 'output')
+    self.options.prune_input_dir = self.input_dir
+    self.options.prune_types = None
+    self.options.prune_batch_size = 2
+    self.options.dry_run = False
+    self.options.gcb_service_account = None
+    self.options.build_gce_service_account = None
+    self.options.publish_gce_image_project = 'test-project'
+
+  def tearDown(self):
+    os.environ['PATH'] = self.old_path
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.test_dir)
+
+  def write_prune_list(self, name, urls):
+    path = os.path.join(self.input_dir, 'prune_%s.txt' % name)
+    with open(path, 'w') as stream:
+      stream.write('\n'.join(urls))
+
+  def get_calls(self):
+    if not os.path.exists(self.log_path):
+      return []
+    with open(self.log_path, 'r') as stream:
+      calls = stream.read().split('\n')[:-1]
+    os.remove(self.log_path)
+    return sorted(calls)
+
+  def make_command(self):
+    return PruneArtifactsFactory().make_command(self.options)
+
+  def read_output(self, filename):
+    with open(os.path.join(self.options.output_dir, 'prune_artifacts',
+                           filename), 'r') as stream:
+      return stream.read()
+
+  def test_dry_run(self):
+    self.options.dry_run = True
+    self.make_command()()
+    self.assertEqual([], self.get_calls())
+    self.assertEqual([], self.server.deleted)
+    plan = yaml.safe_load(self.read_output('prune_plan.yml'))
+    self.assertEqual(
+        {'artifacts': 5, 'already_pruned': 0, 'calls': 3,
+         'unbatched_calls': 5},
+        plan['container'])
+    self.assertEqual(2, plan['jar']['calls'])
+    self.assertEqual(1, plan['bom']['calls'])
+
+  def test_prune_and_resume(self):
+    with self.assertRaises(ExecutionError):
+      self.make_command()()
+
+    container_delete = ('gcloud container images delete'
+                        ' --force-delete-tags --quiet ')
+    self.assertEqual(
+        sorted([
+            # The batch with the denied tag is retried one at a time.
+            container_delete + 'gcr.io/test/gate:1 gcr.io/test/gate:2',
+            container_delete + 'gcr.io/test/gate:denied gcr.io/test/gate:gone',
+            container_delete + 'gcr.io/test/gate:denied',
+            container_delete + 'gcr.io/test/gate:gone',
+            container_delete + 'gcr.io/test/deck:1',
+            'gcloud compute images delete --project test-project --quiet'
+            ' spinnaker-gate-1-0-0-1',
+            'gsutil -m rm gs://test/bom/1.0.0-1.yml gs://test/bom/1.0.0-2.yml'
+        ]),
+        self.get_calls())
+    self.assertEqual(2, len(self.server.deleted))
+
+    failures = yaml.safe_load(self.read_output('prune_failures.yml'))
+    self.assertEqual(['gcr.io/test/gate:denied'],
+                     list(failures['container'].keys()))
+    pruned = self.read_output('pruned.txt').split('\n')
+    self.assertIn('gcr.io/test/gate:gone', pruned)
+    self.assertEqual(9, len(pruned) - 1)
+
+    counter = MetricsManager.singleton().get_metric(
+        MetricFamily.COUNTER, 'PrunedArtifacts',
+        {'type': 'container', 'outcome': 'failed'})
+    self.assertEqual(1, counter.count)
+
+    # Once it is allowed, rerunning only deletes what is left.
+    self.write_prune_list('containers', ['gcr.io/test/gate:1',
+                                         'gcr.io/test/gate:allowed'])
+    self.make_command()()
+    self.assertEqual([container_delete + 'gcr.io/test/gate:allowed'],
+                     self.get_calls())
+    self.assertEqual(2, len(self.server.deleted))
+
+
+class TestCollectArtifactVersions(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='inspection_commands_test')
+    self.log_path = os.path.join(self.test_dir, 'calls.log')
+    bin_dir = os.path.join(self.test_dir, 'bin')
+    os.makedirs(bin_dir)
+    for program in ['gcloud', 'gsutil']:
+      path = os.path.join(bin_dir, program)
+      with open(path, 'w') as stream:
+        stream.write(FAKE_LISTING_CLI.format(python=sys.executable))
+      os.chmod(path, 0o755)
+    self.old_environ = dict(os.environ)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    os.environ['CALL_LOG'] = self.log_path
+
+    self.options = Options()
+    self.options.command = 'collect_artifact_versions'
+    self.options.output_dir = os.path.join(self.test_dir, 'output')
+    self.options.artifact_inventory_path = None
+    self.options.export_inventory_yaml = False
+    self.options.incremental_collect = True
+    self.options.docker_registry = 'gcr.io/test'
+    self.options.gcb_service_account = None
+    self.options.halyard_bom_bucket = 'test-bucket'
+    self.options.bintray_org = 'test-org'
+    self.options.bintray_jar_repository = 'jars'
+    self.options.bintray_debian_repository = 'debians'
+
+  def tearDown(self):
+    os.environ.clear()
+    os.environ.update(self.old_environ)
+    shutil.rmtree(self.test_dir)
+
+  def get_calls(self):
+    with open(self.log_path, 'r') as stream:
+      calls = stream.read().split('\n')[:-1]
+    os.remove(self.log_path)
+    return calls
+
+  def get_inventory_versions(self, kind):
+    inventory = ArtifactInventory(
+        ArtifactInventory.path_from_options(self.options))
+    try:
+      return inventory.artifact_versions(kind)
+    finally:
+      inventory.close()
+
+  def test_incremental_container_versions(self):
+    command = CollectArtifactVersionsFactory().make_command(self.options)
+    command.collect_gcb_versions()
+    self.assertFalse([call for call in self.get_calls() if '--filter' in call])
+
+    os.environ['NEW_TAGS'] = '1.2.0-1'
+    command = CollectArtifactVersionsFactory().make_command(self.options)
+    image_map = command.collect_gcb_versions()
+    self.assertEqual(['1.0.0-1', '1.1.0-1', '1.2.0-1'], image_map['gate'])
+    self.assertEqual(['2.0.0-1'], image_map['deck'])
+    list_tags = [call for call in self.get_calls() if 'list-tags' in call]
+    self.assertEqual(2, len(list_tags))
+    self.assertTrue(all("--filter=timestamp.datetime>='" in call
+                        for call in list_tags))
+    self.assertEqual(image_map, self.get_inventory_versions(CONTAINER))
+
+  def test_config_versions(self):
+    command = CollectArtifactVersionsFactory().make_command(self.options)
+    command.collect_config_bucket_versions()
+    self.assertEqual({'gate': ['1.0.0-1', '1.1.0-1'],
+                      'deck': ['1.0.0-1', '1.1.0-1']},
+                     self.get_inventory_versions(CONFIG))
+    self.assertEqual(['gsutil ls gs://test-bucket/',
+                      'gsutil ls gs://test-bucket/deck/',
+                      'gsutil ls gs://test-bucket/gate/'],
+                     sorted(self.get_calls()))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -20,9 +20,11 @@ import unittest
 
 
 from buildtool import (
+    ExecutionError,
     RepositoryCommandProcessor,
     RepositoryCommandFactory,
     BranchSourceCodeManager)
+from buildtool.serialization_support import DocumentCache
 
 import custom_test_command
 
@@ -42,10 +44,12 @@ class TestRepositoryCommand(RepositoryCommandProcessor):
   def __init__(self, factory, options, pos_arg,
                source_repository_names=None, **kwargs):
     super(TestRepositoryCommand, self).__init__(
-        factory, options, source_repository_names=source_repository_names)
+        factory, options, source_repository_names=source_repository_names,
+        use_rebuild_plan=kwargs.pop('use_rebuild_plan', True))
     self.test_init_args = (factory, options, pos_arg, kwargs)
     self.preprocessed = False
     self.postprocess_dict = None
+    self.postprocessed_one = {}
     self.ensured = set([])
     self.repositories = set([])
     self.test_repo_threadid = []
@@ -61,9 +65,17 @@ class TestRepositoryCommand(RepositoryCommandProcessor):
     assert(not self.preprocessed)
     self.preprocessed = True
 
+  def _do_postprocess_one(self, name, result):
+    assert(self.preprocessed)
+    assert(not self.postprocess_dict)
+    assert(name in self.repositories)
+    assert(name not in self.postprocessed_one)
+    self.postprocessed_one[name] = result
+
   def _do_postprocess(self, result_dict):
     assert(self.preprocessed)
     assert(not self.postprocess_dict)
+    assert(self.postprocessed_one == result_dict)
     self.postprocess_dict = result_dict
     return {'foo': 'bar'}
 
@@ -123,6 +135,28 @@ class RepositoryCommandProcessorTest(BaseGitRepoTestFixture):
       expected_repo_names,
       [repository.name for repository in command.source_repositories])
 
+    plan_path = os.path.join(self.test_root, 'rebuild_plan.yml')
+    DocumentCache.write({'rebuild_all': False,
+                         'rebuild_repositories': [OUTLIER_REPO]}, plan_path)
+    expected_repo_names = [OUTLIER_REPO]
+    options.only_repositories=None
+    options.rebuild_plan_path=plan_path
+    command = factory.make_command(options)
+    self.assertEqual(
+      expected_repo_names,
+      [repository.name for repository in command.source_repositories])
+
+    factory = RepositoryCommandFactory(
+        'test_filter', TestRepositoryCommand, 'A test command.',
+        BranchSourceCodeManager, 123,
+        source_repository_names=ALL_STANDARD_TEST_BOM_REPO_NAMES,
+        use_rebuild_plan=False)
+    expected_repo_names = list(ALL_STANDARD_TEST_BOM_REPO_NAMES)
+    command = factory.make_command(options)
+    self.assertEqual(
+      expected_repo_names,
+      [repository.name for repository in command.source_repositories])
+
   def do_test_command(self, options, command_name):
     init_dict = {'a': 'A', 'b': 'B'}
     factory = RepositoryCommandFactory(
@@ -151,6 +185,7 @@ class RepositoryCommandProcessorTest(BaseGitRepoTestFixture):
       with self.assertRaises(ValueError):
         command()
       self.assertIsNone(command.postprocess_dict)
+      self.assertEqual({}, command.postprocessed_one)
     else:
       self.assertEqual({'foo': 'bar'}, command())
       self.assertEqual(command.postprocess_dict,
@@ -245,6 +280,24 @@ class RepositoryCommandProcessorTest(BaseGitRepoTestFixture):
         self.assertEqual(False, metric.labels.get('success'))
       self.assertTrue(found)
 
+  def test_keep_going_command(self):
+    test_command_name = FAILURE_COMMAND_NAME
+    options = self.options
+    options.command = test_command_name
+    options.repository_failure_policy = 'keep_going'
+    factory = RepositoryCommandFactory(
+        test_command_name, TestRepositoryCommand, 'A test command.',
+        BranchSourceCodeManager, 123,
+        source_repository_names=ALL_STANDARD_TEST_BOM_REPO_NAMES)
+    command = factory.make_command(options)
+    with self.assertRaises(ExecutionError) as context:
+      command()
+    for name in ALL_STANDARD_TEST_BOM_REPO_NAMES:
+      self.assertIn(name, str(context.exception))
+    self.assertIsNone(command.postprocess_dict)
+    self.assertEqual(set(ALL_STANDARD_TEST_BOM_REPO_NAMES),
+                     command.repositories)
+
 
 if __name__ == '__main__':
   init_runtime()
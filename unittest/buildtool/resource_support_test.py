@@ -0,0 +1,253 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import socket
+import threading
+import time
+import unittest
+
+try:
+  from urllib2 import HTTPError, URLError
+except ImportError:
+  from urllib.error import HTTPError, URLError
+
+from buildtool import (
+    ConfigError,
+    MetricsManager,
+    check_subprocess,
+    run_subprocess)
+from buildtool.base_metrics import MetricFamily
+from buildtool.resource_support import (
+    ADAPTIVE_MAX_LIMIT_FACTOR,
+    CLOUD_BUILD_SLOTS,
+    DEFAULT_RESOURCE_LIMITS,
+    GCLOUD_API,
+    GCS,
+    GIT_NETWORK,
+    LOCAL_CPU,
+    AimdController,
+    ResourceLimiter,
+    ResourceLimits,
+    classify_command,
+    is_overload_exception,
+    is_overload_output,
+    limit_resource)
+
+from test_util import init_runtime
+
+
+class Options(object):
+  pass
+
+
+class TestResourceSupport(unittest.TestCase):
+  def tearDown(self):
+    ResourceLimits.configure(Options())
+
+  def test_classify_command(self):
+    tests = [
+        ('git -C "/my dir" fetch origin', GIT_NETWORK),
+        ('git clone https://github.com/spinnaker/gate', GIT_NETWORK),
+        ('git -c credential.helper= ls-remote origin', GIT_NETWORK),
+        ('git -C /my/dir log --pretty=oneline', None),
+        ('gcloud builds submit --config=debs.yml .', CLOUD_BUILD_SLOTS),
+        ('gcloud compute images list', GCLOUD_API),
+        ('gsutil cat gs://bucket/bom.yml', GCS),
+        ('./gradlew -PbintrayPackageBuildNumber=1 candidate', LOCAL_CPU),
+        ('docker build -t image .', LOCAL_CPU),
+        ('docker push image', None),
+        ('echo "unbalanced', None)
+    ]
+    for cmd, expect in tests:
+      self.assertEqual(expect, classify_command(cmd), cmd)
+
+  def test_configure(self):
+    options = Options()
+    options.resource_limits = 'gcs=3, git-network=2'
+    options.max_local_builds = 5
+    ResourceLimits.configure(options)
+    self.assertEqual(3, ResourceLimits.limiter(GCS).limit)
+    self.assertEqual(2, ResourceLimits.limiter(GIT_NETWORK).limit)
+    self.assertEqual(5, ResourceLimits.limiter(LOCAL_CPU).limit)
+    self.assertEqual(DEFAULT_RESOURCE_LIMITS[GCLOUD_API],
+                     ResourceLimits.limiter(GCLOUD_API).limit)
+
+    for text in ['unknown=1', 'gcs', 'gcs=0', 'gcs=x']:
+      options.resource_limits = text
+      with self.assertRaises(ConfigError):
+        ResourceLimits.configure(options)
+
+  def test_limiter(self):
+    limiter = ResourceLimiter('test-resource', 2)
+    lock = threading.Lock()
+    concurrent = []
+    active = [0]
+
+    def run():
+      with limiter.acquire():
+        with lock:
+          active[0] += 1
+          concurrent.append(active[0])
+        time.sleep(0.05)
+        with lock:
+          active[0] -= 1
+
+    threads = [threading.Thread(target=run) for _ in range(6)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(6, len(concurrent))
+    self.assertEqual(2, max(concurrent))
+    self.assertEqual(0, limiter.in_use)
+    self.assertEqual(0, limiter.waiting)
+
+    metrics = MetricsManager.singleton()
+    labels = {'resource': 'test-resource'}
+    self.assertEqual(0, metrics.get_metric(
+        MetricFamily.GAUGE, 'ResourceInUse', labels).value)
+    self.assertEqual(6, metrics.get_metric(
+        MetricFamily.TIMER, 'ResourceWait', labels).count)
+
+  def test_subprocess_holds_resource(self):
+    options = Options()
+    options.resource_limits = 'gcs=1'
+    ResourceLimits.configure(options)
+    limiter = ResourceLimits.limiter(GCS)
+
+    observed = []
+    def run():
+      observed.append(check_subprocess('echo hello', resource_class=GCS))
+
+    with limit_resource(GCS):
+      thread = threading.Thread(target=run)
+      thread.start()
+      time.sleep(0.1)
+      self.assertEqual([], observed)
+      self.assertEqual(1, limiter.waiting)
+    thread.join()
+    self.assertEqual(1, len(observed))
+    self.assertEqual(0, limiter.in_use)
+
+  def test_adaptive_limiter(self):
+    options = Options()
+    options.resource_limits = 'git-network=2'
+    options.adaptive_resource_limits = True
+    ResourceLimits.configure(options)
+    limiter = ResourceLimits.limiter(GIT_NETWORK)
+    self.assertEqual(2, limiter.limit)
+    self.assertEqual(2 * ADAPTIVE_MAX_LIMIT_FACTOR, limiter.max_limit)
+    self.assertEqual(DEFAULT_RESOURCE_LIMITS[LOCAL_CPU],
+                     ResourceLimits.limiter(LOCAL_CPU).max_limit)
+
+    # Each success adds 1/limit.
+    for _ in range(11):
+      with limit_resource(GIT_NETWORK):
+        pass
+    self.assertEqual(5, limiter.limit)
+
+    retcode, _ = run_subprocess(
+        'sh -c "echo fatal: The remote end hung up unexpectedly; exit 128"',
+        resource_class=GIT_NETWORK)
+    self.assertEqual(128, retcode)
+    self.assertEqual(2, limiter.limit)
+
+    metrics = MetricsManager.singleton()
+    labels = {'resource': GIT_NETWORK}
+    self.assertEqual(2, metrics.get_metric(
+        MetricFamily.GAUGE, 'ResourceLimit', labels).value)
+
+
+class FakeClock(object):
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+
+class TestAimdController(unittest.TestCase):
+  def test_increase_and_backoff(self):
+    clock = FakeClock()
+    controller = AimdController(4, max_limit=6, backoff_secs=5, clock=clock)
+    for _ in range(5):
+      controller.on_success(1)
+    self.assertEqual(5, controller.limit)
+    for _ in range(20):
+      controller.on_success(1)
+    self.assertEqual(6, controller.limit)
+
+    controller.on_overload()
+    self.assertEqual(3, controller.limit)
+    controller.on_overload()  # Already backed off for these calls.
+    self.assertEqual(3, controller.limit)
+
+    clock.now += 10
+    controller.on_overload()
+    controller.on_overload()
+    clock.now += 10
+    controller.on_overload()
+    self.assertEqual(1, controller.limit)
+
+  def test_slow_calls_do_not_increase(self):
+    controller = AimdController(4, max_limit=10, clock=FakeClock())
+    controller.on_success(1)
+    for _ in range(20):
+      controller.on_success(10)
+    self.assertEqual(4, controller.limit)
+
+  def test_throughput(self):
+    clock = FakeClock()
+    controller = AimdController(4, clock=clock)
+    for _ in range(30):
+      controller.on_success(1)
+    controller.on_overload()
+    self.assertEqual(31 / 60.0, controller.throughput())
+    clock.now += AimdController.THROUGHPUT_WINDOW_SECS + 1
+    self.assertEqual(0, controller.throughput())
+
+  def test_overload_classification(self):
+    self.assertTrue(is_overload_output(
+        'fatal: The remote end hung up unexpectedly'))
+    self.assertTrue(is_overload_output(
+        'ERROR: (gcloud.container.images.list) HTTP 503 Service Unavailable'))
+    self.assertTrue(is_overload_output('Error 429: Too Many Requests'))
+    self.assertTrue(is_overload_output(
+        'fatal: unable to access: The requested URL returned error: 502'))
+    self.assertTrue(is_overload_output('ResponseError: code=500, message=x'))
+    self.assertTrue(is_overload_output('HTTP/1.1 504 Gateway Timeout'))
+    self.assertTrue(is_overload_output('Rate Limit Exceeded'))
+    self.assertFalse(is_overload_output(
+        "fatal: couldn't find remote ref refs/heads/unknown"))
+    self.assertFalse(is_overload_output(
+        'main.c:503: error: expected declaration, wrote 429 bytes'))
+    self.assertFalse(is_overload_output('ERROR: build 500 of 504 failed'))
+    self.assertFalse(is_overload_output(''))
+
+    def http_error(code):
+      return HTTPError('https://api.bintray.com', code, 'test', {}, None)
+    self.assertTrue(is_overload_exception(http_error(429)))
+    self.assertTrue(is_overload_exception(http_error(502)))
+    self.assertFalse(is_overload_exception(http_error(404)))
+    self.assertTrue(is_overload_exception(socket.timeout()))
+    self.assertTrue(is_overload_exception(URLError(socket.timeout())))
+    self.assertFalse(is_overload_exception(ValueError('timed out')))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,133 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from buildtool import (
+    ConfigError,
+    GitRepositorySpec)
+from buildtool.schedule_support import (
+    RepositoryScheduler,
+    predict_makespan,
+    read_duration_history)
+
+from test_util import init_runtime
+
+
+def make_timer(name, secs_list, success=True):
+  """Returns a snapshot timer collector in the form metrics files use."""
+  values = []
+  total = 0
+  for index, secs in enumerate(secs_list):
+    total += secs
+    values.append({'time': '', 'count': index + 1, 'totalSecs': total})
+  return {'labels': {'repository': name, 'success': success},
+          'values': values}
+
+
+def write_metrics_file(metrics_dir, command, pid, timers):
+  path = os.path.join(metrics_dir, 'metrics__{command}__{pid}.json'.format(
+      command=command, pid=pid))
+  with open(path, 'w') as stream:
+    json.dump({'pid': pid, 'timers': {
+        name: {'collectors': collectors}
+        for name, collectors in timers.items()}}, stream)
+
+
+class TestRepositoryScheduler(unittest.TestCase):
+  def setUp(self):
+    self.metrics_dir = tempfile.mkdtemp(prefix='schedule_test')
+    write_metrics_file(self.metrics_dir, 'build_container', 1, {
+        'RunRepositoryCommand_Outcome': [
+            make_timer('clouddriver', [600]),
+            make_timer('deck', [10]),  # skipped because already built
+            make_timer('echo', [100]),
+            make_timer('gate', [5000], success=False)],
+        'GcrBuild': [make_timer('deck', [400])]})
+    write_metrics_file(self.metrics_dir, 'build_container', 2, {
+        'RunRepositoryCommand_Outcome': [
+            make_timer('clouddriver', [400]),
+            make_timer('gate', [200])]})
+    write_metrics_file(self.metrics_dir, 'build_debs', 3, {
+        'DebBuild': [make_timer('echo', [9000])]})
+
+  def tearDown(self):
+    shutil.rmtree(self.metrics_dir)
+
+  def make_scheduler(self, **kwargs):
+    parser = argparse.ArgumentParser()
+    RepositoryScheduler.add_parser_args(parser, {})
+    options = parser.parse_args([])
+    options.metrics_dir = self.metrics_dir
+    for key, value in kwargs.items():
+      setattr(options, key, value)
+    return RepositoryScheduler(options, 'build_container')
+
+  def test_read_duration_history(self):
+    history = read_duration_history(self.metrics_dir, 'build_container')
+    self.assertEqual(
+        {'clouddriver': {'RunRepositoryCommand_Outcome': [600, 400]},
+         'deck': {'RunRepositoryCommand_Outcome': [10],
+                  'GcrBuild': [400]},
+         'echo': {'RunRepositoryCommand_Outcome': [100]},
+         'gate': {'RunRepositoryCommand_Outcome': [200]}},
+        history)
+
+  def test_longest_first(self):
+    scheduler = self.make_scheduler()
+    self.assertEqual(500, scheduler.predict('clouddriver'))
+    self.assertEqual(400, scheduler.predict('deck'))
+    self.assertIsNone(scheduler.predict('unknown'))
+
+    names = ['echo', 'gate', 'deck', 'unknown', 'clouddriver']
+    ordered = scheduler.order([GitRepositorySpec(name) for name in names])
+    self.assertEqual(['unknown', 'clouddriver', 'deck', 'gate', 'echo'],
+                     [repository.name for repository in ordered])
+
+  def test_overrides(self):
+    scheduler = self.make_scheduler(
+        repository_schedule_overrides='echo=1000,unknown=1')
+    names = ['echo', 'gate', 'deck', 'unknown', 'clouddriver']
+    ordered = scheduler.order([GitRepositorySpec(name) for name in names])
+    self.assertEqual(['echo', 'clouddriver', 'deck', 'gate', 'unknown'],
+                     [repository.name for repository in ordered])
+
+    with self.assertRaises(ConfigError):
+      self.make_scheduler(repository_schedule_overrides='echo')
+
+  def test_given_order(self):
+    scheduler = self.make_scheduler(repository_schedule='given')
+    names = ['echo', 'gate', 'deck', 'clouddriver']
+    ordered = scheduler.order([GitRepositorySpec(name) for name in names])
+    self.assertEqual(names, [repository.name for repository in ordered])
+
+  def test_predict_makespan(self):
+    self.assertEqual(0, predict_makespan([], 2))
+    self.assertEqual(10, predict_makespan([1, 2, 3, 4], 1))
+    self.assertEqual(8, predict_makespan([5, 4, 3, 2, 1], 2))
+    self.assertEqual(9, predict_makespan([1, 2, 3, 4, 5], 2))
+    self.assertEqual(5, predict_makespan([1, 1, 4], 2))
+    self.assertEqual(4, predict_makespan([4, 1, 1], 2))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
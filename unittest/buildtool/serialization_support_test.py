@@ -0,0 +1,130 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+
+from buildtool import ConfigError
+from buildtool.serialization_support import (
+    DocumentCache,
+    dump_machine_yaml,
+    dump_yaml,
+    load_yaml)
+
+from test_util import init_runtime
+
+
+DOCUMENT = {
+    'version': '1.2.3-20180101',
+    'timestamp': '2018-01-01 12:34:56',
+    'services': {
+        'gate': {'commit': 'abc123', 'version': '4.0.0-20180101'},
+        'deck': {'commit': 'def456', 'version': '2.0.0-20180101'}},
+    'message': 'A subject line\n\nand "a body" with\ttabs, #hashes: and'
+               ' long lines that go on for long enough to need folding.\n',
+    'unicode': u'café',
+    'numbers': [1, 2.5, True, None, '007', 'yes']
+}
+
+
+class Options(object):
+  def __init__(self, sidecar_format):
+    self.document_sidecar_format = sidecar_format
+
+
+class TestSerialization(unittest.TestCase):
+  def test_dump_yaml_matches_safe_dump(self):
+    for kwargs in [{}, {'default_flow_style': False},
+                   {'default_flow_style': False, 'allow_unicode': True}]:
+      self.assertEqual(yaml.safe_dump(DOCUMENT, **kwargs),
+                       dump_yaml(DOCUMENT, **kwargs))
+    self.assertEqual(yaml.safe_dump('scalar'), dump_yaml('scalar'))
+
+  def test_round_trip(self):
+    text = dump_yaml(DOCUMENT, default_flow_style=False)
+    self.assertEqual(DOCUMENT, load_yaml(text))
+    self.assertEqual(yaml.safe_load(text), load_yaml(text))
+    self.assertEqual(DOCUMENT, load_yaml(
+        dump_machine_yaml(DOCUMENT, default_flow_style=False)))
+    self.assertEqual('scalar', load_yaml(dump_machine_yaml('scalar')))
+
+
+class TestDocumentCache(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='serialization_test')
+    self.path = os.path.join(self.test_dir, 'doc.yml')
+    DocumentCache.clear()
+
+  def tearDown(self):
+    DocumentCache.configure(Options('json'))
+    DocumentCache.clear()
+    shutil.rmtree(self.test_dir)
+
+  def test_load_remembers_until_changed(self):
+    with open(self.path, 'w') as stream:
+      stream.write('a: 1\n')
+    doc = DocumentCache.load(self.path)
+    self.assertEqual({'a': 1}, doc)
+
+    # Callers get their own copy.
+    doc['a'] = 2
+    self.assertEqual({'a': 1}, DocumentCache.load(self.path))
+
+    with open(self.path, 'w') as stream:
+      stream.write('a: 10\n')
+    stat = os.stat(self.path)
+    os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+    self.assertEqual({'a': 10}, DocumentCache.load(self.path))
+
+  def test_write_with_sidecar(self):
+    DocumentCache.configure(Options('json'))
+    DocumentCache.write(DOCUMENT, self.path)
+    self.assertTrue(os.path.exists(self.path + '.json'))
+    with open(self.path, 'r') as stream:
+      self.assertEqual(DOCUMENT, yaml.safe_load(stream))
+    self.assertEqual(DOCUMENT, DocumentCache.load(self.path))
+
+    # The sidecar is ignored once the yaml is newer.
+    with open(self.path, 'w') as stream:
+      stream.write('a: 1\n')
+    stat = os.stat(self.path)
+    os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+    self.assertEqual({'a': 1}, DocumentCache.load(self.path))
+
+    # Documents json cannot represent only get yaml.
+    dated = {'date': datetime.date(2018, 1, 2)}
+    DocumentCache.write(dated, self.path)
+    self.assertFalse(os.path.exists(self.path + '.json'))
+    self.assertEqual(dated, DocumentCache.load(self.path))
+
+  def test_write_without_sidecar(self):
+    DocumentCache.configure(Options('none'))
+    DocumentCache.write(DOCUMENT, self.path)
+    self.assertFalse(os.path.exists(self.path + '.json'))
+    self.assertEqual(DOCUMENT, DocumentCache.load(self.path))
+
+  def test_configure(self):
+    with self.assertRaises(ConfigError):
+      DocumentCache.configure(Options('xml'))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -18,14 +18,24 @@ import io
 import logging
 import os
 import shutil
+import subprocess
+import sys
 import tempfile
 import unittest
 
 from buildtool import (
+    MetricsManager,
     check_subprocess,
+    check_subprocesses,
     check_subprocesses_to_logfile,
     run_subprocess,
+    run_subprocesses,
+    ConfigError,
     ExecutionError)
+from buildtool.base_metrics import MetricFamily
+from buildtool.context_support import bind_context_labels
+from buildtool.resource_support import GCS, ResourceLimits
+from buildtool.subprocess_support import QueryCache
 
 from test_util import init_runtime
 
@@ -126,6 +136,69 @@ class TestRunner(unittest.TestCase):
     expect = "/bin/ls: cannot access '/abc/def': No such file or directory"
     self.assertEqual(expect, body)
 
+  def test_run_subprocess_large_stderr(self):
+    # The child fills the stderr pipe before writing stdout.
+    cmd = ('{python} -c "import sys; sys.stderr.write(\'x\' * 1000000);'
+           ' sys.stdout.buffer.write(b\'\\xc3\\xa9\' * 100000)"'
+           .format(python=sys.executable))
+    code, output = run_subprocess(cmd, stderr=subprocess.PIPE)
+    self.assertEqual(0, code)
+    self.assertEqual(u'\u00e9' * 100000, output)
+
+  def test_run_subprocesses(self):
+    cmds = ['/bin/sh -c "sleep 0.{n}; echo {n}"'.format(n=n)
+            for n in [3, 1, 2]]
+    cmds.append('/bin/ls /abc/def')
+    results = run_subprocesses(cmds)
+    self.assertEqual([(0, '3'), (0, '1'), (0, '2')], results[:3])
+    self.assertNotEqual(0, results[3][0])
+    self.assertTrue(results[3][1].find('No such file or directory') >= 0)
+    self.assertEqual(
+        [3, -9], [retcode for retcode, _ in run_subprocesses(
+            ['/bin/sh -c "exit 3"', '/bin/sh -c "kill -9 $$"'])])
+
+    self.assertEqual(['1', '2'],
+                     check_subprocesses(['/bin/echo 1', '/bin/echo 2']))
+    with self.assertRaises(ExecutionError):
+      check_subprocesses(['/bin/echo 1', '/bin/ls /abc/def'])
+
+  def test_run_subprocesses_overload(self):
+    # The children close their output well before they exit.
+    cmds = ['/bin/sh -c "echo HTTP 503; exec >&- 2>&-; sleep 0.2"',
+            '/bin/sh -c "echo HTTP 503; exec >&- 2>&-; sleep 0.3; exit 1"',
+            '/bin/sh -c "echo HTTP 503; exit 1"']
+    limiter = ResourceLimits.limiter(GCS)
+    released = []
+    original_release = limiter.release
+    def release(token):
+      released.append(token.overloaded)
+      original_release(token)
+    limiter.release = release
+    try:
+      results = run_subprocesses(cmds, resource_class=GCS)
+    finally:
+      del limiter.release
+    self.assertEqual([0, 1, 1], [retcode for retcode, _ in results])
+    self.assertEqual([False, True, True], sorted(released))
+
+  def test_subprocess_usage_metrics(self):
+    cmd = ('{python} -c "x = [0] * 10000000; sum(range(3000000))"'
+           .format(python=sys.executable))
+    with bind_context_labels(command='test_usage', repository='test_repo'):
+      check_subprocess(cmd)
+      check_subprocesses([cmd])
+
+    metrics = MetricsManager.singleton()
+    labels = {'program': os.path.basename(sys.executable),
+              'command': 'test_usage', 'repository': 'test_repo'}
+    user_cpu = metrics.get_metric(
+        MetricFamily.TIMER, 'SubprocessUserCpu', labels)
+    self.assertEqual(2, user_cpu.count)
+    self.assertGreater(user_cpu.total_seconds, 0)
+    self.assertGreater(metrics.get_metric(
+        MetricFamily.GAUGE, 'SubprocessMaxRssBytes', labels).value,
+                       10000000 * 8)
+
   def test_run_subprocess_get_pid(self):
     # See if we can run a job by looking up our job
     # This is also testing parsing command lines.
@@ -140,6 +213,99 @@ class TestRunner(unittest.TestCase):
     self.assertTrue(candidates[0].find(' python ') > 0)
 
 
+# Counts how many times it was called in the file named by FAKE_GSUTIL_LOG.
+FAKE_GSUTIL = """#!/bin/sh
+echo "$@" >> "$FAKE_GSUTIL_LOG"
+wc -l < "$FAKE_GSUTIL_LOG"
+"""
+
+
+class Options(object):
+  pass
+
+
+class TestQueryCache(unittest.TestCase):
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp(prefix='buildtool.query_cache_test')
+    bin_dir = os.path.join(self.test_dir, 'bin')
+    os.mkdir(bin_dir)
+    gsutil = os.path.join(bin_dir, 'gsutil')
+    with open(gsutil, 'w') as stream:
+      stream.write(FAKE_GSUTIL)
+    os.chmod(gsutil, 0o755)
+    self.log_path = os.path.join(self.test_dir, 'gsutil.log')
+    self.env = dict(os.environ)
+    self.env['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    self.env['FAKE_GSUTIL_LOG'] = self.log_path
+
+    self.options = Options()
+    self.options.query_cache_dir = os.path.join(self.test_dir, 'cache')
+    QueryCache.configure(self.options)
+
+  def tearDown(self):
+    QueryCache.configure(Options())
+    shutil.rmtree(self.test_dir)
+
+  def gsutil(self, args):
+    return check_subprocess('gsutil ' + args, env=self.env)
+
+  def test_classify(self):
+    tests = [
+        ('gcloud --format=json container images list-tags gcr.io/x/y',
+         'container-images', []),
+        ('gcloud --account a compute images list --filter spinnaker-',
+         'compute-images', []),
+        ('gsutil cat gs://halconfig/versions.yml', 'gcs-objects', []),
+        ('git ls-remote https://github.com/spinnaker/gate master',
+         'git-refs', []),
+        ('gsutil cp versions.yml gs://halconfig/versions.yml',
+         None, ['gcs-objects']),
+        ('gcloud builds submit --config=containers.yml .',
+         None, ['compute-images', 'container-images', 'gcs-objects']),
+        ('git push origin master', None, ['git-refs']),
+        ('git log --oneline', None, [])
+    ]
+    for cmd, query, mutations in tests:
+      self.assertEqual(query, QueryCache.classify_query(cmd), cmd)
+      self.assertEqual(mutations, QueryCache.classify_mutation(cmd), cmd)
+
+  def test_cache_and_invalidate(self):
+    self.assertEqual('1', self.gsutil('cat gs://bucket/file'))
+    self.assertEqual('1', self.gsutil('cat gs://bucket/file'))
+    self.assertEqual('2', self.gsutil('ls gs://bucket'))
+    self.assertEqual(['1', '2', '3'], check_subprocesses(
+        ['gsutil cat gs://bucket/file', 'gsutil ls gs://bucket',
+         'gsutil cat gs://bucket/other'], env=self.env))
+
+    metrics = MetricsManager.singleton()
+    labels = {'query': 'gcs-objects'}
+    hits = metrics.get_metric(MetricFamily.COUNTER, 'QueryCacheHit', labels)
+    hit_count = hits.count
+
+    # The copy is a mutation so is not cached and invalidates the queries.
+    self.assertEqual('4', self.gsutil('cp file gs://bucket/file'))
+    self.assertEqual('5', self.gsutil('cat gs://bucket/file'))
+    self.assertEqual('5', self.gsutil('cat gs://bucket/file'))
+    self.assertEqual(hit_count + 1, hits.count)
+
+    # Other working directories and environments are different queries.
+    self.assertEqual('6', check_subprocess(
+        'gsutil cat gs://bucket/file', env=self.env, cwd=self.test_dir))
+    self.env['BOTO_CONFIG'] = 'test'
+    self.assertEqual('7', self.gsutil('cat gs://bucket/file'))
+
+  def test_ttl(self):
+    self.options.query_cache_ttls = 'gcs-objects=0'
+    QueryCache.configure(self.options)
+    self.assertEqual('1', self.gsutil('cat gs://bucket/file'))
+    self.assertEqual('2', self.gsutil('cat gs://bucket/file'))
+
+    for text in ['unknown=1', 'gcs-objects=-1', 'gcs-objects=x']:
+      self.options.query_cache_ttls = text
+      with self.assertRaises(ConfigError):
+        QueryCache.configure(self.options)
+
+
 if __name__ == '__main__':
   init_runtime()
   unittest.main(verbosity=2)